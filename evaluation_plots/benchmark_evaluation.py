@@ -0,0 +1,419 @@
+import os
+import sys
+import json
+import time
+import shutil
+import subprocess
+import argparse
+import tempfile
+import platform
+import traceback
+
+import warnings; warnings.simplefilter('ignore')
+
+import matplotlib
+matplotlib.use('Agg')
+
+import xarray as xr
+
+import evaluation as evl
+
+# Benchmark of the read in and plotting functions of the evaluation library, with synthetic data.
+# The benchmark creates synthetic preprocessed files (see evaluation.synthetic) for several data sizes,
+# times the main read in functions, the mask and the map and distribution plots, and compares the
+# results with a stored baseline.
+
+# The benchmark also checks the time to import the evaluation package: it has to stay below a budget
+# (--import-budget) and must not import the plotting and mapping libraries (they are imported on first use).
+# If the bias maps are drawn as mesh and as raster (cases plot_bias and plot_bias_raster), both plots are compared
+# pixel by pixel: the fraction of different pixels has to stay below --max-pixel-difference. The bias map written
+# by the background writer (case plot_bias_background_writer) has to be identical to the one saved directly.
+
+# Usage:
+#   python benchmark_evaluation.py                    # run the benchmark and compare with the baseline
+#   python benchmark_evaluation.py --save-baseline    # run the benchmark and store the results as new baseline
+#   python benchmark_evaluation.py --sizes 0.1 0.25 --gcms 2 --years 10 --cases apply_mask plot_bias
+
+
+# Parameters
+parser = argparse.ArgumentParser(description='Benchmark of the evaluation library with synthetic data.')
+parser.add_argument('--sizes', type=float, nargs='+', default=[0.1, 0.25, 0.5],
+                    help='data sizes: fraction of the latitudes and longitudes of the grid (default: 0.1 0.25 0.5)')
+parser.add_argument('--grid', default='awap', choices=sorted(evl.synthetic.GRIDS.keys()),
+                    help='grid of the synthetic data (default: awap, 0.05 degree)')
+parser.add_argument('--years', type=int, default=30, help='number of years (default: 30)')
+parser.add_argument('--gcms', type=int, default=4, help='number of GCMs (default: 4)')
+parser.add_argument('--variables', nargs='+', default=['rain_day'],
+                    help='variables (default: rain_day), variable names of the GCM data are taken from config.json')
+parser.add_argument('--repeat', type=int, default=3, help='number of repetitions of each case, the fastest is used (default: 3)')
+parser.add_argument('--cases', nargs='+', default=None, help='cases to run (default: all)')
+parser.add_argument('--baseline', default=os.path.join('benchmarks', 'baseline.json'),
+                    help='file name of the baseline (default: benchmarks/baseline.json)')
+parser.add_argument('--save-baseline', action='store_true', help='store the results as new baseline')
+parser.add_argument('--output', default=None, help='file name for the results (JSON)')
+parser.add_argument('--import-budget', type=float, default=2.0,
+                    help='maximum time to import the evaluation package in seconds (default: 2.0)')
+parser.add_argument('--max-pixel-difference', type=float, default=0.02,
+                    help='maximum fraction of pixels that differ between the bias maps drawn as mesh and as raster (default: 0.02)')
+parser.add_argument('--work-dir', default=None, help='folder for the synthetic data (default: temporary folder, deleted at the end)')
+
+sim_vars = evl.config.load_config()['sim_vars'] if os.path.exists('config.json') else dict()
+
+name_ref = 'awap'
+name_sim_prefix = 'isimip'
+statistic = 'mean'
+year_end = 2005
+
+
+# Benchmark cases: each case prepares its inputs (not timed) and returns the function that is timed
+def case_read_in_xarray_data_for_one_gcm(context):
+    return lambda: evl.read_in.read_in_xarray_data_for_one_gcm(gcm=context['gcms'][0], name_sim=context['name_sim'],
+        var=context['var'], statistic=statistic, mask=context['mask'], var_sim=context['var_sim'],
+        read_in_bias_types=['bias_abs', 'bias_rel'], time_scales=['annual', 'seasonal'], verbose=False,
+        **context['kwargs'])
+
+
+def case_prepare_dataframes_for_all_gcms_and_statistics(context):
+    return lambda: evl.read_in.prepare_dataframes_for_all_gcms_and_statistics(gcms=context['gcms'], var=context['var'],
+        name_sim_prefix=name_sim_prefix, statistics=[statistic], mask=context['mask'], var_sim=context['var_sim'],
+        **context['kwargs'])
+
+
+def case_prepare_box_statistics_for_all_gcms_and_statistics(context):
+    return lambda: evl.summaries.prepare_box_statistics_for_all_gcms_and_statistics(gcms=context['gcms'], var=context['var'],
+        name_sim_prefix=name_sim_prefix, statistics=[statistic], mask=context['mask'], var_sim=context['var_sim'],
+        **context['kwargs'])
+
+
+def case_prepare_climatologies_for_all_gcms_and_statistics(context):
+    var = context['var']
+    return lambda: evl.read_in.prepare_climatologies_for_all_gcms_and_statistics(gcms=context['gcms'], variables=[var],
+        name_sim_prefix=name_sim_prefix, statistics=[statistic], mask=context['mask'],
+        ref_vars={var: var}, sim_vars={var: context['var_sim']}, ref_vars_in_nc={var: var},
+        sim_vars_in_nc={var: context['var_sim']}, **context['kwargs'])
+
+
+def case_prepare_timeseries_for_all_gcms_and_statistics(context):
+    return lambda: evl.read_in.prepare_timeseries_for_all_gcms_and_statistics(gcms=context['gcms'], var=context['var'],
+        name_sim_prefix=name_sim_prefix, statistics=[statistic], mask=context['mask'], var_sim=context['var_sim'],
+        **context['kwargs'])
+
+
+def case_prepare_mean_field_for_all_gcms_and_statistics(context):
+    return lambda: evl.read_in.prepare_mean_field_for_all_gcms_and_statistics(gcms=context['gcms'], var=context['var'],
+        name_sim_prefix=name_sim_prefix, statistics=[statistic], mask=context['mask'], var_sim=context['var_sim'],
+        **context['kwargs'])
+
+
+def case_prepare_spatiotemporal_data_for_all_gcms_and_statistics(context):
+    return lambda: evl.read_in.prepare_spatiotemporal_data_for_all_gcms_and_statistics(gcms=context['gcms'],
+        var=context['var'], name_sim_prefix=name_sim_prefix, statistics=[statistic], mask=context['mask'],
+        var_sim=context['var_sim'], **context['kwargs'])
+
+
+def case_get_metrics_table(context):
+    ensemble = evl.read_in.read_in_ensemble_mean_fields(gcms=context['gcms'], var=context['var'],
+        name_sim_prefix=name_sim_prefix, statistic=statistic, mask=context['mask'], var_sim=context['var_sim'],
+        **context['kwargs'])
+    return lambda: evl.metrics.get_metrics_table(ensemble, name_ref, context['var'], statistic)
+
+
+def case_get_bias_p_values(context):
+    return lambda: evl.significance.get_bias_p_values(gcm=context['gcms'][0], name_sim=context['name_sim'],
+        var=context['var'], statistic=statistic, mask=context['mask'], var_sim=context['var_sim'],
+        **context['kwargs'])
+
+
+def case_get_trend_fields(context):
+    kwargs = context['kwargs']
+    return lambda: evl.trends.get_trend_fields(kwargs['data_path_sim'], context['name_sim'], context['var'], statistic,
+        kwargs['year_start'], kwargs['year_end'], gcm=context['gcms'][0], mask=context['mask'],
+        var_file=context['var_sim'])
+
+
+def case_get_autocorrelation_fields(context):
+    kwargs = context['kwargs']
+    return lambda: evl.autocorrelation.get_autocorrelation_fields(kwargs['data_path_sim'], context['name_sim'],
+        context['var'], statistic, kwargs['year_start'], kwargs['year_end'], gcm=context['gcms'][0], mask=context['mask'],
+        var_file=context['var_sim'])
+
+
+def get_gev_fields_function(context, method):
+    # the synthetic annual time series of the benchmark statistic stand in for the annual maxima
+    kwargs = context['kwargs']
+    return lambda: evl.extremes.get_gev_fields(kwargs['data_path_sim'], context['name_sim'], context['var'], statistic,
+        kwargs['year_start'], kwargs['year_end'], gcm=context['gcms'][0], mask=context['mask'],
+        var_file=context['var_sim'], method=method)
+
+
+def case_get_gev_fields(context):
+    return get_gev_fields_function(context, 'lmoments')
+
+
+def case_get_gev_fields_mle(context):
+    return get_gev_fields_function(context, 'mle')
+
+
+def case_get_eof_fields(context):
+    return lambda: evl.eofs.get_eof_fields(gcms=context['gcms'], var=context['var'], name_sim_prefix=name_sim_prefix,
+        statistic=statistic, mask=context['mask'], var_sim=context['var_sim'], **context['kwargs'])
+
+
+def get_daily_reference_files(context):
+    # daily files of the reference data from the year before the first year (created once per benchmark size)
+    kwargs = context['kwargs']
+    path_daily = os.path.join(context['plot_path'], '..', 'daily')
+    if not os.path.exists(os.path.join(path_daily, 'ref')):
+        variables = {context['var']: dict(var_ref=context['var'], var_sim=context['var_sim'])}
+        size = len(context['mask']['lat']) / float(len(evl.synthetic.get_grid(args.grid)[0]))
+        evl.synthetic.create_daily_files(os.path.join(path_daily, 'ref'), os.path.join(path_daily, 'sim'), [], variables,
+                                         kwargs['year_start'] - 1, kwargs['year_end'], grid=args.grid, size=size)
+    files = evl.read_in.get_daily_files(os.path.join(path_daily, 'ref'), None, [], context['var'], None,
+                                        kwargs['year_start'] - 1, kwargs['year_end'])['ref']
+    return path_daily, files
+
+
+def case_calculate_indices(context):
+    kwargs = context['kwargs']
+    path_daily, files = get_daily_reference_files(context)
+    return lambda: evl.indices.calculate_indices(files, context['var'], ['rx1day', 'rx5day', 'r10mm', 'cdd'],
+        kwargs['year_start'], kwargs['year_end'], os.path.join(path_daily, 'indices'), name_ref, context['var'],
+        verbose=False)
+
+
+def case_get_band_power_fields(context):
+    kwargs = context['kwargs']
+    path_daily, files = get_daily_reference_files(context)
+    return lambda: evl.spectral.get_band_power_fields(files[1:], context['var'], kwargs['year_start'], kwargs['year_end'],
+        mask=context['mask'])
+
+
+def case_apply_mask(context):
+    fn = evl.read_in.get_statistic_file_name(context['kwargs']['data_path_ref'], name_ref, context['var'], 'monthly',
+                                             statistic, context['kwargs']['year_start'], year_end, 'merged')
+    ds = xr.open_dataset(fn).load()
+    return lambda: evl.helpers.apply_mask(ds, context['mask'])
+
+
+def get_plot_bias_function(context, map_render_mode):
+    datasets = case_read_in_xarray_data_for_one_gcm(context)()
+    kwargs = dict(datasets=datasets, name_ref=name_ref, name_sim=context['name_sim'],
+        var=context['var'], statistic=statistic, year_start=context['kwargs']['year_start'], year_end=year_end,
+        fn_plot=os.path.join(context['plot_path'], 'bias_%s.png' % map_render_mode), map_render_mode=map_render_mode)
+    function = lambda: evl.plotting.plot_bias(**kwargs)
+    function.kwargs = kwargs
+    return function
+
+
+def case_plot_bias(context):
+    return get_plot_bias_function(context, 'mesh')
+
+
+def case_plot_bias_raster(context):
+    return get_plot_bias_function(context, 'raster')
+
+
+def case_plot_bias_background_writer(context):
+    # the plot file is written in the background: the time is the time until the next plot can be started
+    kwargs = dict(get_plot_bias_function(context, 'mesh').kwargs,
+                  fn_plot=os.path.join(context['plot_path'], 'bias_background_writer.png'))
+    evl.output_writer.configure(n_threads=2)
+    return lambda: evl.plotting.plot_bias(**kwargs)
+
+
+def get_distribution_data(context):
+    df = case_prepare_mean_field_for_all_gcms_and_statistics(context)()
+    df['statistic'] = statistic
+    return df
+
+
+def case_plot_distribution(context):
+    df = get_distribution_data(context)
+    return lambda: evl.plotting.plot_distribution(dataframe=df, x=context['var'], var=context['var'], statistic=statistic,
+        name_sim_prefix=name_sim_prefix, name_ref=name_ref, fn_plot=os.path.join(context['plot_path'], 'pdf.png'))
+
+
+def case_plot_ecdf(context):
+    df = get_distribution_data(context)
+    return lambda: evl.plotting.plot_ecdf(dataframe=df, x=context['var'], var=context['var'], statistic=statistic,
+        name_sim_prefix=name_sim_prefix, name_ref=name_ref, fn_plot=os.path.join(context['plot_path'], 'cdf.png'))
+
+
+cases = [('read_in_xarray_data_for_one_gcm', case_read_in_xarray_data_for_one_gcm),
+         ('prepare_dataframes_for_all_gcms_and_statistics', case_prepare_dataframes_for_all_gcms_and_statistics),
+         ('prepare_box_statistics_for_all_gcms_and_statistics', case_prepare_box_statistics_for_all_gcms_and_statistics),
+         ('prepare_climatologies_for_all_gcms_and_statistics', case_prepare_climatologies_for_all_gcms_and_statistics),
+         ('prepare_timeseries_for_all_gcms_and_statistics', case_prepare_timeseries_for_all_gcms_and_statistics),
+         ('prepare_mean_field_for_all_gcms_and_statistics', case_prepare_mean_field_for_all_gcms_and_statistics),
+         ('prepare_spatiotemporal_data_for_all_gcms_and_statistics', case_prepare_spatiotemporal_data_for_all_gcms_and_statistics),
+         ('get_metrics_table', case_get_metrics_table),
+         ('get_bias_p_values', case_get_bias_p_values),
+         ('get_trend_fields', case_get_trend_fields),
+         ('get_autocorrelation_fields', case_get_autocorrelation_fields),
+         ('get_eof_fields', case_get_eof_fields),
+         ('get_gev_fields', case_get_gev_fields),
+         ('get_gev_fields_mle', case_get_gev_fields_mle),
+         ('calculate_indices', case_calculate_indices),
+         ('get_band_power_fields', case_get_band_power_fields),
+         ('apply_mask', case_apply_mask),
+         ('plot_bias', case_plot_bias),
+         ('plot_bias_raster', case_plot_bias_raster),
+         ('plot_bias_background_writer', case_plot_bias_background_writer),
+         ('plot_distribution', case_plot_distribution),
+         ('plot_ecdf', case_plot_ecdf)]
+
+
+def run_case(case_function, context, repeat):
+    """
+    Prepares and runs one benchmark case, and returns the fastest of the repetitions (in seconds).
+    Plot files that are written in the background are waited for after each repetition (not timed).
+    """
+    try:
+        function = case_function(context)
+        durations = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+            evl.parallel._close_figures()
+            failed = evl.output_writer.flush()
+            if len(failed) > 0:
+                raise IOError(failed[0]['error'])
+    finally:
+        evl.output_writer.configure(n_threads=0)
+    return min(durations)
+
+
+# libraries that must not be imported by 'import evaluation' (only when plots are created)
+plotting_modules = ['matplotlib.pyplot', 'seaborn', 'plotnine', 'mpl_toolkits.basemap', 'cartopy', 'matplotlib.animation']
+
+
+def check_import_time(repeat):
+    """
+    Imports the evaluation package in a new interpreter and returns the fastest import time (in seconds)
+    and the plotting libraries that were imported with it.
+    """
+    code = ('import sys, time; start = time.perf_counter(); import evaluation; duration = time.perf_counter() - start; '
+            'print(duration); print(\',\'.join([x for x in %r if x in sys.modules]))' % plotting_modules)
+    durations = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        lines = output.decode().strip().split('\n')
+        durations.append(float(lines[0]))
+        imported = [x for x in lines[1].split(',') if x != ''] if len(lines) > 1 else []
+    return min(durations), imported
+
+
+def get_pixel_difference(fn_plot1, fn_plot2, tolerance=0.1):
+    """
+    Returns the fraction of pixels that differ between two plots (by more than tolerance in one of the colour channels).
+    """
+    import matplotlib.image
+    image1 = matplotlib.image.imread(fn_plot1)[:, :, :3]
+    image2 = matplotlib.image.imread(fn_plot2)[:, :, :3]
+    if image1.shape != image2.shape:
+        return 1.
+    return float((abs(image1 - image2).max(axis=-1) > tolerance).mean())
+
+
+def get_key(name, size):
+    return '%s[size=%s]' % (name, size)
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='evaluation_benchmark_')
+    year_start = year_end - args.years + 1
+    gcms = ['GCM%s' % (i + 1) for i in range(args.gcms)]
+    variables = dict([(var, dict(var_ref=var, var_sim=sim_vars.get(var, var))) for var in args.variables])
+    cases_to_run = [x for x in cases if args.cases is None or x[0] in args.cases]
+
+    results = dict(date=time.strftime('%Y-%m-%d %H:%M:%S'), machine=platform.node(), python=platform.python_version(),
+                   grid=args.grid, years=args.years, gcms=args.gcms, variables=args.variables, timings=dict())
+
+    # time to import the evaluation package
+    checks_failed = []
+    if args.cases is None or 'import_evaluation' in args.cases:
+        results['timings']['import_evaluation'], imported = check_import_time(args.repeat)
+        print('%-80s %8.3fs' % ('import_evaluation', results['timings']['import_evaluation']))
+        if results['timings']['import_evaluation'] > args.import_budget:
+            checks_failed.append('importing the evaluation package takes longer than %ss' % args.import_budget)
+        if len(imported) > 0:
+            checks_failed.append('importing the evaluation package imports the plotting libraries: %s' % ', '.join(imported))
+
+    try:
+        for size in args.sizes:
+
+            # create the synthetic data for this data size
+            data_path = os.path.join(work_dir, 'size_%s' % size)
+            data_path_ref = os.path.join(data_path, name_ref)
+            data_path_sim = os.path.join(data_path, name_sim_prefix)
+            lat, lon = evl.synthetic.get_grid(args.grid, size)
+            print('Creating synthetic data: size %s (%s x %s grid cells), %s years, %s GCMs' % (size, len(lat), len(lon), args.years, len(gcms)))
+            fn_mask = evl.synthetic.create_statistic_files(data_path_ref, data_path_sim, gcms, variables, name_ref,
+                                                           name_sim_prefix, [statistic], year_start, year_end,
+                                                           grid=args.grid, size=size)
+            mask = xr.open_dataset(fn_mask)['mask'] == 1
+
+            for var, names in variables.items():
+                context = dict(var=var, var_sim=names['var_sim'], gcms=gcms, mask=mask,
+                               name_sim='%s_%s' % (name_sim_prefix, gcms[0]),
+                               plot_path=os.path.join(data_path, 'plots'),
+                               kwargs=dict(data_path_ref=data_path_ref, data_path_sim=data_path_sim, name_ref=name_ref,
+                                           year_start=year_start, year_end=year_end))
+
+                for name, case_function in cases_to_run:
+                    key = get_key(name, size) if len(variables) == 1 else get_key('%s:%s' % (name, var), size)
+                    try:
+                        results['timings'][key] = run_case(case_function, context, args.repeat)
+                        print('%-80s %8.3fs' % (key, results['timings'][key]))
+                    except Exception:
+                        results['timings'][key] = None
+                        print('%-80s   failed' % key)
+                        print(traceback.format_exc())
+
+                # compare the bias maps drawn as mesh and as raster, and saved directly and in the background
+                for name, max_pixel_difference in [('raster', args.max_pixel_difference), ('background_writer', 0.)]:
+                    fn_plots = [os.path.join(context['plot_path'], 'bias_%s.png' % x) for x in ['mesh', name]]
+                    if os.path.exists(fn_plots[0]) and os.path.exists(fn_plots[1]):
+                        key = get_key('pixel_difference_mesh_%s' % name, size)
+                        results.setdefault('pixel_difference', dict())[key] = get_pixel_difference(fn_plots[0], fn_plots[1])
+                        print('%-80s %8.4f' % (key, results['pixel_difference'][key]))
+                        if results['pixel_difference'][key] > max_pixel_difference:
+                            checks_failed.append('%s: %.4f of the pixels differ (maximum: %s)' % (key, results['pixel_difference'][key],
+                                                                                                max_pixel_difference))
+
+            if args.work_dir is None:
+                shutil.rmtree(data_path)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # compare with the baseline
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        print('##### Comparison with baseline: %s (%s, %s)' % (args.baseline, baseline.get('date'), baseline.get('machine')))
+        for key, duration in results['timings'].items():
+            duration_baseline = baseline['timings'].get(key, None)
+            if duration is None or duration_baseline is None:
+                continue
+            print('%-80s %8.3fs (baseline: %8.3fs, speed-up: %5.2fx)' % (key, duration, duration_baseline, duration_baseline / duration))
+
+    # store the results
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=1)
+    if args.save_baseline:
+        if os.path.dirname(args.baseline) != '' and not os.path.exists(os.path.dirname(args.baseline)):
+            os.makedirs(os.path.dirname(args.baseline))
+        with open(args.baseline, 'w') as fp:
+            json.dump(results, fp, indent=1)
+        print('Baseline stored: %s' % args.baseline)
+
+    if len(checks_failed) > 0:
+        for message in checks_failed:
+            print('FAILED: %s' % message)
+        sys.exit(1)
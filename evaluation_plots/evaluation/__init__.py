@@ -1,3 +1,22 @@
 import evaluation.read_in
 import evaluation.plotting
 import evaluation.config
+import evaluation.parallel
+import evaluation.planner
+import evaluation.instrumentation
+import evaluation.synthetic
+import evaluation.maps
+import evaluation.output_writer
+import evaluation.distributions
+import evaluation.spatial_correlation
+import evaluation.spectral
+import evaluation.animations
+import evaluation.summaries
+import evaluation.ensemble
+import evaluation.metrics
+import evaluation.significance
+import evaluation.trends
+import evaluation.indices
+import evaluation.autocorrelation
+import evaluation.eofs
+import evaluation.extremes
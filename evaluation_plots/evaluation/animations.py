@@ -0,0 +1,183 @@
+# Animations of gridded time series for the evaluation library.
+
+# An animation shows one map per time step (e.g. a year of daily AWAP grids). Instead of drawing a new artist
+# for every frame and keeping all frames in memory until the animation is saved, the frames are rendered in
+# chunks of consecutive time steps: each chunk is rendered with one map template (see evaluation.maps), in
+# which only the data and the title are replaced, and the frames are written in order to the stdin of an
+# ffmpeg process, which encodes the video (e.g. mp4) or GIF while the next frames are rendered. With more than
+# one worker, the chunks are rendered in parallel worker processes. At most 2 * n_workers chunks are rendered
+# or waiting to be written at any time, so that memory does not grow with the number of frames.
+
+# Import libraries
+import os
+import subprocess
+import multiprocessing
+import numpy as np
+
+from evaluation import maps
+from evaluation import parallel
+from evaluation import output_writer
+from evaluation.helpers import lazy_import
+
+mpl = lazy_import('matplotlib')
+
+
+# Function definitions
+def get_frame_chunks(n_frames, chunk_size):
+    """
+    This function returns the (start, stop) indices of the chunks of consecutive frames.
+    """
+    return [(start, min(start + chunk_size, n_frames)) for start in range(0, n_frames, chunk_size)]
+
+
+def render_frames(da, titles, coordinates, vmin, vmax, cmap='Blues', suptitle='', legend_title='',
+                  figsize=(10, 6), dpi=100, backend='cartopy', mode='raster'):
+    """
+    This function renders the maps of a data array (dimensions time, lat and lon) with one map template, in
+    which only the data and the title are replaced for each frame. Returns a list with one RGB array
+    (rows x columns x 3) per time step.
+    """
+
+    template = maps.get_map_template(coordinates, 1, 1, figsize, backend)
+    frames = []
+    for i in range(da.sizes['time']):
+        template.draw_panel(0, 0, da.isel(time=i), vmin=vmin, vmax=vmax, cmap=cmap, title=titles[i],
+                            legend_title=legend_title, mode=mode)
+        template.set_suptitle(suptitle, adjust=0.9)
+        image = output_writer.render_figure(template.fig, dpi=dpi)
+        if image is None:
+            raise RuntimeError('The size of the rendered frame cannot be determined')
+        frames.append(np.ascontiguousarray(image[:, :, :3]))
+
+    return frames
+
+
+def _render_chunk(kwargs):
+    """
+    This function renders one chunk of frames in a worker process (see render_frames).
+    """
+    return render_frames(**kwargs)
+
+
+def get_encoder_command(fn_anim, width, height, fps):
+    """
+    This function returns the ffmpeg command that reads raw RGB frames of width x height pixels from stdin
+    and writes the animation. GIFs get one palette per frame, so that the frames are encoded as they arrive.
+    Videos are encoded with H.264 (the frame size is padded to even numbers, as required by yuv420p).
+    """
+
+    command = [mpl.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-']
+    if fn_anim.lower().endswith('.gif'):
+        command += ['-vf', 'split[a][b];[a]palettegen=stats_mode=single[p];[b][p]paletteuse=new=1']
+    else:
+        command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-vcodec', 'libx264', '-pix_fmt', 'yuv420p']
+
+    return command + [fn_anim]
+
+
+class FrameEncoder(object):
+    """
+    Encoder process (ffmpeg) for the frames of one animation. The encoder is started with the first frame
+    (which sets the frame size), and the frames are written to its stdin in order. The animation is finished
+    with close, or discarded with abort (e.g. if a frame cannot be rendered).
+    """
+
+    def __init__(self, fn_anim, fps):
+        self.fn_anim = fn_anim
+        self.fps = fps
+        self.process = None
+        self.shape = None
+        self.n_frames = 0
+
+    def write(self, frame):
+        if self.process is None:
+            self.shape = frame.shape
+            command = get_encoder_command(self.fn_anim, frame.shape[1], frame.shape[0], self.fps)
+            try:
+                self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+            except OSError:
+                raise RuntimeError('The animation cannot be encoded, ffmpeg was not found (%s). Install ffmpeg or '
+                                   'set matplotlib.rcParams["animation.ffmpeg_path"]' % command[0])
+        if frame.shape != self.shape:
+            raise ValueError('Frame %d has the size %s instead of %s' % (self.n_frames, frame.shape, self.shape))
+        try:
+            self.process.stdin.write(frame.tobytes())
+        except (IOError, OSError):
+            raise RuntimeError('ffmpeg stopped while encoding %s (exit code %s)' % (self.fn_anim, self.process.poll()))
+        self.n_frames += 1
+
+    def close(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError('ffmpeg failed to encode %s (exit code %d)' % (self.fn_anim, self.process.returncode))
+
+    def abort(self):
+        """
+        This method stops the encoder without raising an error and removes the incomplete animation.
+        """
+        if self.process is None:
+            return
+        self.process.kill()
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+        if os.path.exists(self.fn_anim):
+            os.remove(self.fn_anim)
+
+
+def iterate_chunks(chunk_kwargs, n_workers=1):
+    """
+    This function renders the chunks of frames (an iterable of keyword arguments of render_frames) and yields the
+    frames of each chunk in order. With more than one worker, the chunks are rendered in a pool of worker
+    processes, with at most 2 * n_workers chunks rendered or waiting at any time.
+    """
+
+    # worker processes of the plot tasks (daemon processes) cannot start a pool of their own
+    if n_workers <= 1 or multiprocessing.current_process().daemon:
+        for kwargs in chunk_kwargs:
+            yield render_frames(**kwargs)
+        return
+
+    pool = multiprocessing.Pool(processes=n_workers, initializer=parallel._init_worker)
+    try:
+        pending = []
+        for kwargs in chunk_kwargs:
+            if len(pending) >= 2 * n_workers:
+                yield pending.pop(0).get()
+            pending.append(pool.apply_async(_render_chunk, (kwargs,)))
+        while len(pending) > 0:
+            yield pending.pop(0).get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write_animation(da, fn_anim, coordinates, titles, vmin, vmax, fps=6, n_workers=1, chunk_size=24, **kwargs):
+    """
+    This function renders the maps of a data array (dimensions time, lat and lon, one frame per time step, see
+    render_frames) in chunks of chunk_size frames with n_workers processes, and streams the frames to ffmpeg,
+    which writes the animation to fn_anim (e.g. .mp4 or .gif). Returns the number of frames. If a frame cannot
+    be rendered, the incomplete animation is removed and the error of the frame is raised.
+    """
+
+    chunk_kwargs = (dict(da=da.isel(time=slice(start, stop)).load(), titles=titles[start:stop],
+                         coordinates=coordinates, vmin=vmin, vmax=vmax, **kwargs)
+                    for start, stop in get_frame_chunks(da.sizes['time'], chunk_size))
+
+    encoder = FrameEncoder(fn_anim, fps)
+    try:
+        for frames in iterate_chunks(chunk_kwargs, n_workers=n_workers):
+            for frame in frames:
+                encoder.write(frame)
+    except BaseException:
+        # the encoder is stopped without closing its input, so that its error does not replace the original error
+        encoder.abort()
+        raise
+    encoder.close()
+
+    return encoder.n_frames
@@ -0,0 +1,201 @@
+# Autocorrelation for the evaluation library.
+
+# The preprocessing calculates the lag-1 correlation of the annual, seasonal and monthly time series (*_merged.nc) of
+# each grid cell with 'cdo timcor' between two shifted copies of the time series. This module calculates the
+# correlations of lags 1 to max_lag at once: the sums of the products of all lagged pairs are the autocovariance of
+# the time series, which is calculated with one real FFT (zero padded, so that the series does not wrap around), and
+# the sums and sums of squares of the shifted copies are differences of cumulative sums. Together they give the
+# Pearson correlation of both shifted copies for each lag (the same as 'cdo timcor' for lag 1).
+# The decorrelation time is the integral time scale 1 + 2 * sum(r_k), summed over the lags up to the first lag
+# without a positive correlation, in time steps (years, seasons or months).
+# The grid cells are processed in tiles, so that the memory is bounded (at most max_memory bytes per tile), in a
+# pool of worker processes (see evaluation.parallel.map_tiles).
+
+# Import libraries
+import re
+import numpy as np
+import xarray as xr
+
+from evaluation import read_in
+from evaluation import parallel
+from evaluation import instrumentation
+
+
+# Units of the decorrelation time (time steps of the time series)
+time_step_units = dict(annual='years', seasonal='seasons', monthly='months')
+
+
+# Function definitions
+def get_fft_length(n_time):
+    """
+    This function returns the length of the zero padded FFT of a time series of length n_time: the smallest power
+    of 2 that is at least 2 * n_time - 1, so that the lagged products do not wrap around.
+    """
+    return int(2 ** np.ceil(np.log2(max(2 * n_time - 1, 1))))
+
+
+def get_lagged_correlations(values, max_lag):
+    """
+    This function returns the correlation between each time series and the same time series shifted by 1 to
+    max_lag time steps (Pearson correlation of values[:-k] and values[k:]) for a tile of time series (values: array
+    time steps x grid cells, without missing values), as an array (lags x grid cells). Lags that leave less than
+    3 pairs of time steps are NaN.
+    """
+
+    n_time = len(values)
+    lags = np.arange(1, max_lag + 1)
+    n_pairs = (n_time - lags)[:, np.newaxis].astype('float64')
+
+    # the correlation does not depend on the mean, which is removed for the precision of the sums
+    x = values - values.mean(axis=0)
+    n_fft = get_fft_length(n_time)
+    spectrum = np.fft.rfft(x, n_fft, axis=0)
+    products = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, n_fft, axis=0)[1:max_lag + 1]
+    if len(products) < max_lag:
+        products = np.concatenate([products, np.zeros((max_lag - len(products), x.shape[1]))])
+
+    # sums and sums of squares of the first n - k (a) and the last n - k (b) time steps
+    sums = np.concatenate([np.zeros((1, x.shape[1])), np.cumsum(x, axis=0)])
+    squares = np.concatenate([np.zeros((1, x.shape[1])), np.cumsum(x ** 2, axis=0)])
+    valid_lags = np.minimum(lags, n_time)
+    sum_a = sums[n_time - valid_lags]
+    sum_b = sums[n_time] - sums[valid_lags]
+    square_a = squares[n_time - valid_lags]
+    square_b = squares[n_time] - squares[valid_lags]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = products - sum_a * sum_b / n_pairs
+        variance_a = square_a - sum_a ** 2 / n_pairs
+        variance_b = square_b - sum_b ** 2 / n_pairs
+        correlations = covariance / np.sqrt(variance_a * variance_b)
+    correlations[(n_pairs < 3).ravel()] = np.nan
+    return np.clip(correlations, -1, 1)
+
+
+def get_decorrelation_time(correlations):
+    """
+    This function returns the decorrelation time (integral time scale, in time steps) of each grid cell from the
+    correlations of lags 1 to max_lag (array: lags x grid cells): 1 + 2 * the sum of the correlations up to the
+    first lag without a positive correlation.
+    """
+    positive = np.cumprod(np.nan_to_num(correlations) > 0, axis=0)
+    return 1 + 2 * (np.nan_to_num(correlations) * positive).sum(axis=0)
+
+
+def _autocorrelation_tile(args):
+    """
+    This function calculates the lagged correlations of one tile of grid cells in a worker process (see
+    get_lagged_correlations).
+    """
+    values, max_lag = args
+    return get_lagged_correlations(values, max_lag)
+
+
+def get_tile_size(n_time, max_memory=2**28):
+    """
+    This function returns the number of grid cells per tile, so that the zero padded FFT and the sums of a tile
+    need at most max_memory bytes.
+    """
+    return max(1, int(max_memory // (8 * (4 * get_fft_length(n_time) + 4 * n_time))))
+
+
+def get_autocorrelation(values, max_lag=10, max_memory=2**28, n_workers=1):
+    """
+    This function calculates the correlations of lags 1 to max_lag (see get_lagged_correlations) of each grid cell
+    of an array (time steps x grid cells), in tiles (see get_tile_size) with a pool of n_workers processes.
+    Returns an array (lags x grid cells, NaN for grid cells with missing values).
+    """
+
+    values = np.asarray(values, dtype='float64')
+    valid = np.where(np.isfinite(values).all(axis=0))[0]
+    correlations = np.full((max_lag, values.shape[1]), np.nan)
+    if len(valid) == 0:
+        return correlations
+
+    tile_size = get_tile_size(len(values), max_memory)
+    tiles = [valid[start:start + tile_size] for start in range(0, len(valid), tile_size)]
+    args = ((values[:, idx], max_lag) for idx in tiles)
+
+    for idx, result in zip(tiles, parallel.map_tiles(_autocorrelation_tile, args, n_workers=min(n_workers, len(tiles)))):
+        correlations[:, idx] = result
+
+    return correlations
+
+
+@instrumentation.timed('aggregate')
+def get_autocorrelation_fields(data_path, name, var, statistic, year_start, year_end, gcm=None, mask=None,
+                               var_in_nc=None, var_file=None, time_scales=['annual', 'seasonal', 'monthly'],
+                               max_lag=10, max_memory=2**28, n_workers=1, verbose=False):
+    """
+    This function reads in the annual, seasonal and/or monthly time series (*_merged.nc) of one dataset (the
+    reference data if gcm is None, otherwise the simulation of this GCM), and calculates the correlations of lags 1
+    to max_lag (in time steps of each time series, as the lag-1 correlation of the preprocessing) and the
+    decorrelation time of each grid cell. Returns an xarray dataset with the variables correlation (dimensions
+    time_scale, lag, lat and lon) and decorrelation_time (dimensions time_scale, lat and lon).
+    """
+
+    is_ref = gcm is None
+    datasets = read_in.read_in_timeseries_for_one_gcm(
+        data_path_ref=data_path, data_path_sim=data_path, gcm=gcm, var=var, name_sim=None if is_ref else name,
+        name_ref=name if is_ref else None, statistic=statistic, year_start=year_start, year_end=year_end, mask=mask,
+        var_ref=var_file, var_sim=var_file, var_ref_in_nc=var_in_nc, var_sim_in_nc=var_in_nc,
+        time_scales=time_scales, verbose=verbose)
+
+    correlations = []
+    decorrelation_times = []
+    for time_scale in time_scales:
+        da = datasets[time_scale][name][var].transpose('time', 'lat', 'lon')
+        correlation = get_autocorrelation(da.values.reshape(da.shape[0], -1), max_lag=max_lag,
+                                          max_memory=max_memory, n_workers=n_workers)
+        decorrelation_time = np.where(np.isfinite(correlation[0]), get_decorrelation_time(correlation), np.nan)
+        correlations.append(correlation.reshape((max_lag,) + da.shape[1:]))
+        decorrelation_times.append(decorrelation_time.reshape(da.shape[1:]))
+
+    coords = dict(time_scale=list(time_scales), lag=np.arange(1, max_lag + 1), lat=da['lat'].values, lon=da['lon'].values)
+    autocorrelation = xr.Dataset(dict(correlation=(['time_scale', 'lag', 'lat', 'lon'], np.array(correlations)),
+                                      decorrelation_time=(['time_scale', 'lat', 'lon'], np.array(decorrelation_times))),
+                                 coords=coords)
+    autocorrelation['correlation'].attrs = dict(long_name='Lagged correlation')
+    autocorrelation['lag'].attrs = dict(long_name='Lag', units='time steps')
+    autocorrelation['decorrelation_time'].attrs = dict(long_name='Decorrelation time (integral time scale)',
+                                                       units='time steps')
+    return autocorrelation
+
+
+def get_correlation_field(autocorrelation, correlation_type, time_scale):
+    """
+    This function returns the field of one correlation type of a time scale from the autocorrelation of a dataset
+    (see get_autocorrelation_fields): 'lag<k>corr' (e.g. lag1corr, lag3corr) for the correlation of lag k, or
+    'decorrelation_time'.
+    """
+
+    if correlation_type == 'decorrelation_time':
+        return autocorrelation['decorrelation_time'].sel(time_scale=time_scale, drop=True)
+
+    match = re.match(r'^lag(\d+)corr$', correlation_type)
+    if match is None:
+        raise ValueError('Unknown correlation type: %s (lag<k>corr or decorrelation_time)' % correlation_type)
+    lag = int(match.group(1))
+    if lag not in autocorrelation['lag'].values:
+        raise ValueError('The autocorrelation was calculated for lags 1 to %s, not %s' % (
+            int(autocorrelation['lag'].max()), lag))
+    return autocorrelation['correlation'].sel(time_scale=time_scale, lag=lag, drop=True)
+
+
+def get_correlation_datasets(autocorrelations, name_ref, name_sim, var, correlation_type,
+                             time_scales=['annual', 'seasonal', 'monthly']):
+    """
+    This function returns the fields of one correlation type (see get_correlation_field) of the reference data and
+    the simulation, and the bias (simulated minus reference), in the layout of the datasets of the bias maps
+    (datasets[time_scale]['<name>_<correlation_type>'], xarray datasets with the variable var, see
+    evaluation.plotting.plot_bias_corr). autocorrelations is a dictionary with the autocorrelation of name_ref and
+    name_sim (see get_autocorrelation_fields).
+    """
+
+    datasets = dict()
+    for time_scale in time_scales:
+        fields = dict([(x, get_correlation_field(autocorrelations[x], correlation_type, time_scale))
+                       for x in [name_ref, name_sim]])
+        fields['bias'] = fields[name_sim] - fields[name_ref]
+        datasets[time_scale] = dict([('%s_%s' % (x, correlation_type), fields[x].to_dataset(name=var)) for x in fields])
+    return datasets
@@ -0,0 +1,230 @@
+# Distribution curves for the evaluation library.
+
+# The PDF plots (see evaluation.plotting.plot_distribution) show the distribution of hundreds of thousands of
+# values per panel (e.g. all grid cells of a region for each dataset and season). Instead of passing all values
+# to plotnine, the curves are computed here with NumPy and only the curves (a few hundred points each) are plotted.
+
+# Import libraries
+import numpy as np
+import pandas as pd
+
+
+# Function definitions
+def get_bandwidth(values):
+    """
+    This function returns the bandwidth of a Gaussian kernel density estimate with the rule of thumb
+    'normal_reference' of statsmodels (Scott's rule), the default of geom_density in the plotnine version of the
+    evaluation environment, with which the PDF plots were drawn before (newer plotnine versions use 'nrd0', which
+    is about 15% narrower): (4/3)^(1/5) * min(standard deviation, interquartile range / 1.349) * n^(-1/5).
+    """
+
+    std = np.std(values, ddof=1)
+    iqr = np.subtract(*np.percentile(values, [75, 25])) / 1.349
+    sigma = min(std, iqr) if iqr > 0 else std
+    if not sigma > 0:
+        sigma = abs(values[0]) or 1.
+
+    return (4. / 3) ** 0.2 * sigma * len(values) ** -0.2
+
+
+def get_group_indices(dataframe, columns):
+    """
+    This function returns the group number of each row of the data frame (groups: unique combinations of
+    the values in columns) and a data frame with the values of columns for each group (one row per group).
+    """
+
+    codes = np.zeros(len(dataframe), dtype='int64')
+    for column in columns:
+        column_codes, uniques = pd.factorize(dataframe[column])
+        codes = codes * (len(uniques) + 1) + column_codes + 1
+
+    first, group_idx = np.unique(codes, return_index=True, return_inverse=True)[1:]
+    keys = dataframe[columns].iloc[first].reset_index(drop=True)
+    return group_idx.ravel(), keys
+
+
+def get_density_curves(dataframe, x, facets, hue, n=512, adjust=1.):
+    """
+    This function returns the kernel density estimates (Gaussian kernel) of the column x, for each facet
+    (unique combination of the columns in facets, e.g. time scale and region) and each value of hue
+    (e.g. the dataset), as a data frame with the columns facets, hue, x and 'density' (n points per curve).
+    As in plotnine's geom_density, the bandwidth of each curve is calculated with a rule of thumb (see
+    get_bandwidth, multiplied with adjust), and the curves of a facet are evaluated over the range of the values in
+    the facet. Groups with less than two finite values have no curve.
+
+    The values are binned to the n points of the curves (linear binning) and the bins are convolved with the
+    kernel with a fast Fourier transform, for all curves at once. The difference to the exact estimate is far
+    below the line width of the plots. The sampled kernels are normalised to a sum of 1, so that each curve
+    integrates to 1 even if the bandwidth is smaller than the spacing of the points (e.g. a few outliers far away
+    from the other values): the curve is then the histogram of the values in bins of the spacing of the points.
+    """
+
+    data = dataframe.loc[np.isfinite(dataframe[x].values.astype('float64')), facets + [hue, x]]
+    values = data[x].values.astype('float64')
+    group_idx, keys = get_group_indices(data, facets + [hue])
+    group_facet = get_group_indices(keys, facets)[0]
+    facet_idx = group_facet[group_idx]
+    n_groups = len(keys)
+
+    # range of the values in each facet
+    lo = pd.Series(values).groupby(facet_idx).min().values
+    hi = pd.Series(values).groupby(facet_idx).max().values
+    span = np.where(hi > lo, hi - lo, 1.)
+    lo = lo - (span - (hi - lo)) / 2.
+    delta = span / (n - 1)
+
+    # number of values and bandwidth of each group (in units of the grid spacing)
+    order = np.argsort(group_idx, kind='mergesort')
+    n_values = np.bincount(group_idx, minlength=n_groups)
+    bandwidths = np.array([get_bandwidth(x) if len(x) > 1 else np.nan
+                           for x in np.split(values[order], np.cumsum(n_values)[:-1])]) * adjust
+    bandwidths = bandwidths / delta[group_facet]
+
+    # linear binning of the values of all groups
+    position = (values - lo[facet_idx]) / delta[facet_idx]
+    idx = np.clip(np.floor(position).astype('int64'), 0, n - 2)
+    weight = position - idx
+    counts = (np.bincount(group_idx * n + idx, weights=1 - weight, minlength=n_groups * n) +
+              np.bincount(group_idx * n + idx + 1, weights=weight, minlength=n_groups * n)).reshape(n_groups, n)
+
+    # convolution with the kernel (zero padded to 2 n, so that the curves do not wrap around)
+    offsets = np.fft.fftfreq(2 * n, 1. / (2 * n))
+    with np.errstate(invalid='ignore'):
+        kernels = np.exp(-0.5 * (offsets[np.newaxis, :] / bandwidths[:, np.newaxis]) ** 2)
+        kernels = kernels / kernels.sum(axis=1, keepdims=True)
+    density = np.fft.irfft(np.fft.rfft(counts, 2 * n, axis=1) * np.fft.rfft(kernels, axis=1), 2 * n, axis=1)[:, :n]
+    density = np.maximum(density, 0) / (n_values[:, np.newaxis] * delta[group_facet][:, np.newaxis])
+
+    # one row per point of each curve (groups with less than two values have no curve)
+    valid = np.isfinite(bandwidths)
+    curves = keys.loc[np.repeat(np.arange(n_groups)[valid], n)].reset_index(drop=True)
+    curves[x] = (lo[group_facet][valid, np.newaxis] + delta[group_facet][valid, np.newaxis] * np.arange(n)).ravel()
+    curves['density'] = density[valid].ravel()
+
+    return curves
+
+
+class QuantileSketch(object):
+    """
+    Mergeable summary of the distribution of a large number of values, to calculate quantiles without keeping
+    (and sorting) all values. The values are kept as at most 'size' weighted centroids (the weighted means of
+    neighbouring sorted values), plus the exact minimum and maximum. The error of the quantiles is below
+    1 / size in probability. Sketches can be updated with chunks of values and merged, e.g.:
+        sketch = QuantileSketch()
+        for chunk in chunks:
+            sketch.update(chunk)
+        sketch.merge(sketch_of_other_gcm)
+        quantiles = sketch.quantile(np.linspace(0, 1, 512))
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.values = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def _add(self, values, weights):
+        values = np.concatenate([self.values, values])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(values, kind='mergesort')
+        self.values, self.weights = values[order], weights[order]
+        if len(self.values) > self.size:
+            self._compress()
+
+    def _compress(self):
+        # centroids with (about) equal weight: the sorted values are grouped by their cumulative weight
+        cumulative = np.cumsum(self.weights) - self.weights / 2.
+        bins = np.minimum((cumulative / self.weights.sum() * self.size).astype('int64'), self.size - 1)
+        weights = np.bincount(bins, weights=self.weights, minlength=self.size)
+        values = np.bincount(bins, weights=self.values * self.weights, minlength=self.size)
+        valid = weights > 0
+        self.values, self.weights = values[valid] / weights[valid], weights[valid]
+
+    def update(self, values):
+        """
+        Adds values (NaN values are ignored) to the sketch.
+        """
+        values = np.asarray(values, dtype='float64').ravel()
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return self
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._add(values, np.ones(len(values)))
+        return self
+
+    def merge(self, other):
+        """
+        Adds the values of another sketch to this sketch.
+        """
+        if len(other.values) == 0:
+            return self
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._add(other.values, other.weights)
+        return self
+
+    def quantile(self, probabilities):
+        """
+        Returns the quantiles for the probabilities (between 0 and 1).
+        """
+        if len(self.values) == 0:
+            return np.full(len(probabilities), np.nan)
+        cumulative = np.cumsum(self.weights) - self.weights / 2.
+        positions = np.concatenate([[0.], cumulative, [self.weights.sum()]])
+        values = np.concatenate([[self.min], self.values, [self.max]])
+        return np.interp(np.asarray(probabilities) * self.weights.sum(), positions, values)
+
+
+def get_quantiles(values, probabilities, max_values=10 ** 7, chunk_size=10 ** 6):
+    """
+    This function returns the quantiles of values for the probabilities (between 0 and 1). If there are more than
+    max_values values, the quantiles are calculated with a quantile sketch (see QuantileSketch) in chunks of
+    chunk_size values, otherwise they are calculated exactly (np.quantile). Without values, the quantiles are NaN.
+    """
+    if len(values) == 0:
+        return np.full(len(probabilities), np.nan)
+    if len(values) <= max_values:
+        return np.quantile(values, probabilities)
+
+    sketch = QuantileSketch()
+    for i in range(0, len(values), chunk_size):
+        sketch.update(values[i:i + chunk_size])
+    return sketch.quantile(probabilities)
+
+
+def get_ecdf_curves(dataframe, x, facets, hue, n=2048, max_values=10 ** 7):
+    """
+    This function returns the empirical cumulative distribution functions (ECDF) of the column x, for each facet
+    (unique combination of the columns in facets, e.g. time scale and region) and each value of hue
+    (e.g. the dataset), as a data frame with the columns facets, hue, x and 'ecdf' (n points per curve).
+    The curves are the quantiles of the values for n probabilities between 0 and 1, so that only n points per
+    curve need to be plotted (as steps). Groups with more than max_values values are summarised with a
+    quantile sketch (see get_quantiles). Groups without finite values have no curve.
+    """
+
+    data = dataframe.loc[np.isfinite(dataframe[x].values.astype('float64')), facets + [hue, x]]
+    values = data[x].values.astype('float64')
+    group_idx, keys = get_group_indices(data, facets + [hue])
+    n_groups = len(keys)
+    if n_groups == 0:
+        return pd.DataFrame(columns=facets + [hue, x, 'ecdf'])
+
+    # values of each group
+    order = np.argsort(group_idx, kind='mergesort')
+    n_values = np.bincount(group_idx, minlength=n_groups)
+    probabilities = np.linspace(0, 1, n)
+    quantiles = np.array([get_quantiles(x, probabilities, max_values=max_values)
+                          for x in np.split(values[order], np.cumsum(n_values)[:-1])])
+
+    # one row per point of each curve
+    curves = keys.loc[np.repeat(np.arange(n_groups), n)].reset_index(drop=True)
+    curves[x] = quantiles.ravel()
+    curves['ecdf'] = np.tile(probabilities, n_groups)
+
+    return curves
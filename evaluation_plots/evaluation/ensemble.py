@@ -0,0 +1,93 @@
+# Ensemble statistics for the evaluation library.
+
+# With 'include_all_gcms_plot', the plots compare the reference data with all GCMs at once. Instead of converting
+# each GCM into a data frame and appending them, the fields of the reference data and all GCMs are read into one
+# array with a 'source' dimension (see evaluation.read_in.read_in_ensemble_mean_fields). The ensemble statistics
+# (mean, spread, minimum, maximum, bias and the agreement of the GCMs on the sign of the bias) are calculated along
+# this dimension for all grid cells and time scales at once, and the long data frame for the distribution plots
+# is created from the array in one step.
+
+# Import libraries
+import collections
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+# Function definitions
+def split_ensemble(ensemble, name_ref):
+    """
+    This function splits an ensemble array (dimension source, see evaluation.read_in.read_in_ensemble_mean_fields)
+    into the reference data (without the source dimension) and the GCMs (source dimension first).
+    """
+    sources = list(ensemble['source'].values)
+    ref = ensemble.sel(source=name_ref, drop=True)
+    sims = ensemble.sel(source=[x for x in sources if x != name_ref]).transpose('source', *ref.dims)
+    return ref, sims
+
+
+def get_ensemble_statistics(ensemble, name_ref):
+    """
+    This function calculates the ensemble statistics of the GCMs in an ensemble array (dimension source, see
+    evaluation.read_in.read_in_ensemble_mean_fields) for each grid cell and time scale, and returns them as
+    xarray dataset with the variables:
+    - reference: the reference data
+    - ensemble_mean, ensemble_spread (standard deviation), ensemble_min, ensemble_max: statistics of the GCMs
+    - ensemble_bias: the ensemble mean minus the reference
+    - sign_agreement: the fraction of GCMs whose bias has the same sign as the bias of the ensemble mean
+    - n_gcms: the number of GCMs with data
+    GCMs with missing values (NaN) in a grid cell are ignored in this grid cell.
+    """
+
+    ref, sims = split_ensemble(ensemble, name_ref)
+    values = sims.values
+    valid = np.isfinite(values)
+    n = valid.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, values, 0).sum(axis=0) / n
+        spread = np.sqrt(np.where(valid, (values - mean) ** 2, 0).sum(axis=0) / (n - 1))
+        minimum = np.where(valid, values, np.inf).min(axis=0)
+        maximum = np.where(valid, values, -np.inf).max(axis=0)
+        bias = mean - ref.values
+        sign = np.sign(bias)
+        agreement = (valid & (np.sign(values - ref.values) == sign)).sum(axis=0) / n
+
+    no_data = n == 0
+    statistics = collections.OrderedDict([
+        ('reference', ref.values),
+        ('ensemble_mean', mean),
+        ('ensemble_spread', np.where(n > 1, spread, np.nan)),
+        ('ensemble_min', np.where(no_data, np.nan, minimum)),
+        ('ensemble_max', np.where(no_data, np.nan, maximum)),
+        ('ensemble_bias', bias),
+        ('sign_agreement', np.where(np.isfinite(bias), agreement, np.nan)),
+        ('n_gcms', n)])
+
+    return xr.Dataset(dict([(name, (ref.dims, values)) for name, values in statistics.items()]), coords=ref.coords)
+
+
+def to_dataframe(ensemble, statistic, dropna=True):
+    """
+    This function converts an ensemble array (dimensions source, time_scale, lat and lon, see
+    evaluation.read_in.read_in_ensemble_mean_fields) into a long data frame with the columns
+    ['type', 'time_scale', 'statistic', 'lat', 'lon', var] (as prepare_mean_field_for_all_gcms_and_statistics), in
+    one step. Grid cells without data (e.g. outside the mask) are removed if dropna is True. The columns type and
+    time_scale are categorical, in the order of the ensemble.
+    """
+
+    ensemble = ensemble.transpose('source', 'time_scale', 'lat', 'lon')
+    shape = ensemble.shape
+    index = np.indices(shape).reshape(len(shape), -1)
+    values = ensemble.values.ravel()
+    if dropna:
+        keep = np.isfinite(values)
+        index, values = index[:, keep], values[keep]
+
+    return pd.DataFrame(collections.OrderedDict([
+        ('type', pd.Categorical.from_codes(index[0], categories=ensemble['source'].values)),
+        ('time_scale', pd.Categorical.from_codes(index[1], categories=ensemble['time_scale'].values)),
+        ('statistic', statistic),
+        ('lat', ensemble['lat'].values[index[2]]),
+        ('lon', ensemble['lon'].values[index[3]]),
+        (ensemble.name, values)]))
@@ -0,0 +1,202 @@
+# Empirical orthogonal functions (EOFs) for the evaluation library.
+
+# The PDFs and scatter plots of the spatial variability compare the values of the grid cells, but not the patterns
+# in which the grid cells vary together. This module calculates the leading EOFs (modes of spatial variability) of
+# the annual, seasonal or monthly time series (*_merged.nc) of the reference data and of each GCM: the anomalies
+# (the climatology of each season / month removed) of all land cells are gathered into one matrix (time steps x
+# land cells, without the ocean), weighted with the square root of the cosine of the latitude (the area of the
+# grid cells), and decomposed with a randomised singular value decomposition. Only a few modes are needed, so the
+# matrix is projected onto a small random subspace (a few matrix products, see get_randomised_svd) instead of
+# decomposing the whole matrix, which scales to the land cells of the 0.05 degree grid.
+# The modes of the GCMs are compared with the modes of the reference data by their explained variance, the pattern
+# correlation (congruence) with the mode of the reference data of the same rank, and the variance of the GCM that
+# is explained by the modes of the reference data (projection onto a common basis).
+
+# Import libraries
+import numpy as np
+import xarray as xr
+
+from evaluation import read_in
+from evaluation import instrumentation
+
+
+# Function definitions
+def get_randomised_svd(matrix, n_modes, n_oversamples=10, n_iterations=4, seed=0):
+    """
+    This function returns the leading n_modes singular values and vectors of a matrix (time steps x grid cells) with
+    a randomised singular value decomposition: the range of the matrix is found from its product with a random
+    matrix of n_modes + n_oversamples columns, refined with n_iterations power iterations (orthonormalised after
+    each product), and the small projected matrix is decomposed exactly. Returns u (time steps x modes), s (modes)
+    and vt (modes x grid cells).
+    """
+
+    rng = np.random.RandomState(seed)
+    n_components = min(n_modes + n_oversamples, min(matrix.shape))
+    omega = rng.standard_normal((matrix.shape[1], n_components)).astype(matrix.dtype)
+
+    q = np.linalg.qr(np.dot(matrix, omega))[0]
+    for i in range(n_iterations):
+        q = np.linalg.qr(np.dot(matrix.T, q.astype(matrix.dtype)))[0]
+        q = np.linalg.qr(np.dot(matrix, q.astype(matrix.dtype)))[0]
+
+    b = np.dot(q.T.astype(matrix.dtype), matrix).astype('float64')
+    u_b, s, vt = np.linalg.svd(b, full_matrices=False)
+    u = np.dot(q, u_b)
+    return u[:, :n_modes], s[:n_modes], vt[:n_modes]
+
+
+def get_anomaly_matrix(da, time_scale):
+    """
+    This function returns the anomalies of a time series (data array: time, lat, lon) as a matrix (time steps x land
+    cells, float32) weighted with the square root of the cosine of the latitude, the indices of the land cells (grid
+    cells without missing values) and the weights. The anomalies are the differences from the mean of each season
+    (seasonal) or month (monthly), or from the mean of all years (annual).
+    """
+
+    da = da.transpose('time', 'lat', 'lon')
+    values = da.values.reshape(da.shape[0], -1)
+    cells = np.where(np.isfinite(values).all(axis=0))[0]
+    matrix = values[:, cells].astype('float64')
+
+    if time_scale == 'seasonal':
+        groups = da['time.season'].values
+    elif time_scale == 'monthly':
+        groups = da['time.month'].values
+    else:
+        groups = np.zeros(da.shape[0])
+    for group in np.unique(groups):
+        matrix[groups == group] -= matrix[groups == group].mean(axis=0)
+
+    lat = np.repeat(da['lat'].values, da.shape[2])[cells]
+    weights = np.sqrt(np.clip(np.cos(np.deg2rad(lat)), 0, None))
+    return (matrix * weights).astype('float32'), cells, weights
+
+
+def get_modes(da, time_scale, n_modes=10, seed=0):
+    """
+    This function calculates the leading n_modes EOFs of a time series (data array: time, lat, lon, see
+    get_anomaly_matrix). Returns a dictionary with:
+    - eof: the patterns (modes x lat x lon, NaN outside of the land cells), in the unit of the variable: the
+      anomalies of a change of the principal component by one standard deviation
+    - vectors: the weighted EOFs (unit vectors, modes x land cells) and cells: the indices of the land cells
+    - explained_variance: the fraction of the variance explained by each mode, total_variance: the total variance
+    - matrix: the weighted anomalies
+    """
+
+    matrix, cells, weights = get_anomaly_matrix(da, time_scale)
+    n_time = matrix.shape[0]
+    n_modes_valid = min(n_modes, max(min(matrix.shape) - 1, 0))
+
+    total_variance = float((matrix.astype('float64') ** 2).sum()) / max(n_time - 1, 1)
+    eof = np.full((n_modes, da.sizes['lat'] * da.sizes['lon']), np.nan)
+    vectors = np.full((n_modes, len(cells)), np.nan)
+    explained_variance = np.full(n_modes, np.nan)
+
+    if n_modes_valid > 0 and total_variance > 0:
+        u, s, vt = get_randomised_svd(matrix, n_modes_valid, seed=seed)
+        # sign: the largest loading is positive
+        signs = np.sign(vt[np.arange(n_modes_valid), np.abs(vt).argmax(axis=1)])
+        vt = vt * signs[:, np.newaxis]
+        vectors[:n_modes_valid] = vt
+        eof[:n_modes_valid, cells] = vt * (s / np.sqrt(max(n_time - 1, 1)))[:, np.newaxis] / weights
+        explained_variance[:n_modes_valid] = s ** 2 / max(n_time - 1, 1) / total_variance
+
+    return dict(eof=eof.reshape((n_modes, da.sizes['lat'], da.sizes['lon'])), vectors=vectors, cells=cells,
+                explained_variance=explained_variance, total_variance=total_variance, matrix=matrix)
+
+
+def get_projected_variance(modes, modes_ref):
+    """
+    This function returns the fraction of the variance of a dataset (modes, see get_modes) that is explained by
+    each mode of the reference data (modes_ref), i.e. the variance of the projection of the anomalies onto the EOFs
+    of the reference data, on the land cells of both datasets.
+    """
+
+    common, idx, idx_ref = np.intersect1d(modes['cells'], modes_ref['cells'], return_indices=True)
+    projected = np.full(len(modes_ref['vectors']), np.nan)
+    if len(common) == 0 or modes['total_variance'] <= 0:
+        return projected
+    valid = np.isfinite(modes_ref['vectors'][:, 0])
+    vectors = modes_ref['vectors'][valid][:, idx_ref]
+    pcs = np.dot(modes['matrix'][:, idx].astype('float64'), vectors.T)
+    projected[valid] = (pcs ** 2).sum(axis=0) / max(len(pcs) - 1, 1) / modes['total_variance']
+    return projected
+
+
+def get_congruence(modes, modes_ref):
+    """
+    This function returns the congruence (uncentred pattern correlation of the weighted EOFs, on the land cells of
+    both datasets) of each mode of a dataset with the mode of the reference data of the same rank, and the signs
+    (1 or -1) that align the modes with the modes of the reference data.
+    """
+
+    common, idx, idx_ref = np.intersect1d(modes['cells'], modes_ref['cells'], return_indices=True)
+    a = modes['vectors'][:, idx]
+    b = modes_ref['vectors'][:, idx_ref]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        congruence = (a * b).sum(axis=1) / np.sqrt((a ** 2).sum(axis=1) * (b ** 2).sum(axis=1))
+    signs = np.where(congruence < 0, -1., 1.)
+    return np.abs(congruence), signs
+
+
+@instrumentation.timed('aggregate')
+def get_eof_fields(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref, statistic, year_start, year_end,
+                   mask=None, var_ref=None, var_sim=None, var_ref_in_nc=None, var_sim_in_nc=None,
+                   time_scales=['annual', 'monthly'], n_modes=10, seed=0, verbose=False):
+    """
+    This function reads in the time series (*_merged.nc) of the reference data and of each GCM (one after the
+    other) and calculates the leading n_modes EOFs of each time scale (see get_modes). The modes of the GCMs are
+    aligned in sign with the modes of the reference data. Returns an xarray dataset with the dimensions source
+    (the reference data and the GCMs), time_scale, mode, lat and lon and the variables:
+    - eof: the patterns (in the unit of the variable, see get_modes)
+    - explained_variance: the fraction of the variance explained by each mode
+    - congruence: the pattern correlation with the mode of the reference data of the same rank
+    - projected_variance: the fraction of the variance explained by the modes of the reference data
+    - total_variance: the total (area weighted) variance of the anomalies.
+    """
+
+    sources = [name_ref] + ['%s_%s' % (name_sim_prefix, gcm) for gcm in gcms]
+    modes_ref = dict()
+    results = []
+
+    for source, gcm in zip(sources, [None] + list(gcms)):
+        is_ref = gcm is None
+        datasets = read_in.read_in_timeseries_for_one_gcm(
+            data_path_ref=data_path_ref, data_path_sim=data_path_sim, gcm=gcm, var=var,
+            name_sim=None if is_ref else source, name_ref=source if is_ref else None, statistic=statistic,
+            year_start=year_start, year_end=year_end, mask=mask, var_ref=var_ref, var_sim=var_sim,
+            var_ref_in_nc=var_ref_in_nc, var_sim_in_nc=var_sim_in_nc, time_scales=time_scales, verbose=verbose)
+
+        fields = dict(eof=[], explained_variance=[], congruence=[], projected_variance=[], total_variance=[])
+        for time_scale in time_scales:
+            da = datasets[time_scale][source][var]
+            modes = get_modes(da, time_scale, n_modes=n_modes, seed=seed)
+            if is_ref:
+                modes_ref[time_scale] = modes
+                congruence = np.where(np.isfinite(modes['explained_variance']), 1., np.nan)
+                signs = np.ones(n_modes)
+            else:
+                congruence, signs = get_congruence(modes, modes_ref[time_scale])
+            fields['eof'].append((modes['eof'] * signs[:, np.newaxis, np.newaxis]).astype('float32'))
+            fields['explained_variance'].append(modes['explained_variance'])
+            fields['congruence'].append(congruence)
+            fields['projected_variance'].append(get_projected_variance(modes, modes_ref[time_scale]))
+            fields['total_variance'].append(modes['total_variance'])
+            del modes
+
+        coords = dict(source=[source], time_scale=list(time_scales), mode=np.arange(1, n_modes + 1),
+                      lat=da['lat'].values, lon=da['lon'].values)
+        results.append(xr.Dataset(dict(
+            eof=(['source', 'time_scale', 'mode', 'lat', 'lon'], np.array(fields['eof'])[np.newaxis]),
+            explained_variance=(['source', 'time_scale', 'mode'], np.array(fields['explained_variance'])[np.newaxis]),
+            congruence=(['source', 'time_scale', 'mode'], np.array(fields['congruence'])[np.newaxis]),
+            projected_variance=(['source', 'time_scale', 'mode'], np.array(fields['projected_variance'])[np.newaxis]),
+            total_variance=(['source', 'time_scale'], np.array(fields['total_variance'])[np.newaxis])), coords=coords))
+        del datasets
+
+    eofs = xr.concat(results, dim='source', join='outer')
+    eofs['eof'].attrs = dict(long_name='EOF (anomaly of one standard deviation of the principal component)')
+    eofs['explained_variance'].attrs = dict(long_name='Fraction of the variance explained by the mode')
+    eofs['congruence'].attrs = dict(long_name='Pattern correlation with the mode of the reference data')
+    eofs['projected_variance'].attrs = dict(long_name='Fraction of the variance explained by the mode of the reference data')
+    return eofs
@@ -0,0 +1,311 @@
+# Extreme value statistics for the evaluation library.
+
+# The percentiles of the preprocessing (e.g. pctl95) describe the tail of the daily values, but not the rare events
+# of e.g. flood relevant rainfall. This module fits a generalised extreme value (GEV) distribution to the annual
+# maxima (the annual time series of the statistic max, *_yearmax_*_merged.nc, or of an index such as rx1day) of
+# each grid cell and calculates the return levels, e.g. the 20, 50 and 100-year events.
+# The default estimator are the L-moments (Hosking 1990), which are calculated from the sorted annual maxima of all
+# grid cells of a tile at once. The maximum likelihood estimates (method mle) start from the L-moment estimates and
+# are refined with a Nelder-Mead search that runs for all grid cells of a tile at once (one simplex per grid cell);
+# the shape parameter is restricted to -0.5 < k < 0.5, as the likelihood of short records is unstable for larger
+# shapes. The grid cells are processed in tiles, so that the memory is bounded (at most max_memory bytes per tile),
+# in a pool of worker processes (see evaluation.parallel.map_tiles).
+# The shape parameter k follows Hosking: k > 0 is a bounded upper tail, k < 0 a heavy upper tail (Frechet type) and
+# k = 0 the Gumbel distribution.
+
+# Import libraries
+import math
+import numpy as np
+import xarray as xr
+
+from evaluation import read_in
+from evaluation import parallel
+from evaluation import instrumentation
+
+
+# Return periods (years) of the return levels
+return_periods = [20, 50, 100]
+
+# Euler-Mascheroni constant (mean of the standard Gumbel distribution)
+euler_gamma = 0.5772156649015329
+
+# Shapes closer to 0 are treated as the Gumbel distribution, and the maximum likelihood estimates are restricted to
+# shapes of less than max_shape (absolute value)
+min_shape = 1e-6
+max_shape = 0.5
+
+# Grid cells per tile of the maximum likelihood estimates, which take much longer than the L-moments, so that the
+# tiles are shared by the worker processes
+mle_tile_size = 2000
+
+
+# Function definitions
+def gamma(x):
+    """
+    This function returns the gamma function of each value of an array.
+    """
+    return np.vectorize(math.gamma, otypes=['float64'])(x)
+
+
+def get_l_moments(values):
+    """
+    This function returns the first three L-moments (l1, l2, l3) of each column of a tile of samples (values: array
+    samples x grid cells, without missing values), from the unbiased probability weighted moments of the sorted
+    samples.
+    """
+
+    n = len(values)
+    x = np.sort(values, axis=0)
+    j = np.arange(n, dtype='float64')[:, np.newaxis]
+
+    b0 = x.mean(axis=0)
+    b1 = (j / (n - 1) * x).sum(axis=0) / n
+    b2 = (j * (j - 1) / ((n - 1) * (n - 2)) * x).sum(axis=0) / n
+
+    return b0, 2 * b1 - b0, 6 * b2 - 6 * b1 + b0
+
+
+def get_gev_l_moments(values):
+    """
+    This function returns the location, scale and shape (k, Hosking) of the GEV distribution of each column of a
+    tile of annual maxima (values: array years x grid cells, without missing values), estimated from the L-moments
+    (with the approximation of the shape from the L-skewness of Hosking et al. 1985). Grid cells without variability
+    are NaN.
+    """
+
+    l1, l2, l3 = get_l_moments(values)
+    # without variability, l2 is not exactly 0 due to rounding errors
+    variable = values.max(axis=0) > values.min(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t3 = np.where(variable & (l2 > 0), l3 / l2, np.nan)
+        c = 2 / (3 + t3) - np.log(2) / np.log(3)
+        shape = np.clip(7.8590 * c + 2.9554 * c ** 2, -0.99, None)
+
+        gumbel = np.abs(shape) < min_shape
+        k = np.where(gumbel, 1., shape)
+        gamma_k = gamma(np.where(np.isfinite(k), 1 + k, 1.))
+        scale = np.where(gumbel, l2 / np.log(2), l2 * k / ((1 - 2 ** -k) * gamma_k))
+        location = np.where(gumbel, l1 - euler_gamma * scale, l1 - scale * (1 - gamma_k) / k)
+
+    return np.array([location, scale, np.where(gumbel, 0., shape)])
+
+
+def get_gev_negative_log_likelihood(values, parameters):
+    """
+    This function returns the negative log-likelihood of the GEV distribution of each column of a tile of annual
+    maxima (values: array years x grid cells) for the parameters of each grid cell (array: grid cells x 3 with the
+    location, the logarithm of the scale and the shape). Parameters outside of the support of the samples, or with
+    a shape of max_shape or more (absolute value), have an infinite negative log-likelihood.
+    """
+
+    location = parameters[:, 0]
+    log_scale = parameters[:, 1]
+    shape = parameters[:, 2]
+    n = len(values)
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        s = (values - location) / np.exp(log_scale)
+        gumbel = np.abs(shape) < min_shape
+        k = np.where(gumbel, 1., shape)
+        y = 1 - k * s
+        log_y = np.log(np.where(y > 0, y, np.nan))
+        nll = np.where(gumbel,
+                       n * log_scale + s.sum(axis=0) + np.exp(-s).sum(axis=0),
+                       n * log_scale + (1 - 1 / k) * log_y.sum(axis=0) + np.exp(log_y / k).sum(axis=0))
+
+    return np.where(np.isfinite(nll) & (np.abs(shape) < max_shape), nll, np.inf)
+
+
+def get_gev_mle(values, initial, n_iterations=400, tolerance=1e-8):
+    """
+    This function returns the maximum likelihood estimates of the location, scale and shape of the GEV distribution
+    of each column of a tile of annual maxima (values: array years x grid cells), starting from the initial
+    estimates (array: 3 x grid cells, e.g. get_gev_l_moments). The negative log-likelihood of all grid cells is
+    minimised at once with the Nelder-Mead method (one simplex per grid cell, at most n_iterations steps or until
+    the simplices of all grid cells have converged). Grid cells without a valid starting point keep the initial
+    estimates.
+    """
+
+    n_cells = values.shape[1]
+    start = np.array([initial[0], np.log(initial[1]), np.clip(initial[2], -0.9 * max_shape, 0.9 * max_shape)]).T
+    valid = np.isfinite(start).all(axis=1)
+    start[~valid] = 0.
+
+    # initial simplex: the starting point and one step in each parameter
+    steps = np.array([0.1 * initial[1], np.full(n_cells, 0.1), np.full(n_cells, 0.05)]).T
+    steps[~valid] = 1.
+    simplex = np.repeat(start[:, np.newaxis], 4, axis=1)
+    for i in range(3):
+        simplex[:, i + 1, i] += steps[:, i]
+    f = np.array([get_gev_negative_log_likelihood(values, simplex[:, i]) for i in range(4)]).T
+
+    # only the simplices that have not converged yet are updated
+    active = np.arange(n_cells)
+    for iteration in range(n_iterations):
+        order = np.argsort(f[active], axis=1)
+        simplex[active] = np.take_along_axis(simplex[active], order[:, :, np.newaxis], axis=1)
+        f[active] = np.take_along_axis(f[active], order, axis=1)
+
+        with np.errstate(invalid='ignore'):
+            converged = ~np.isfinite(f[active, 0]) | (f[active, -1] - f[active, 0] <= tolerance * (1 + np.abs(f[active, 0])))
+        active = active[~converged]
+        if len(active) == 0:
+            break
+
+        x = values[:, active]
+        fa = f[active]
+        worst = simplex[active, -1]
+        centroid = simplex[active, :-1].mean(axis=1)
+        candidates = dict(reflected=centroid + (centroid - worst), expanded=centroid + 2 * (centroid - worst),
+                          outside=centroid + 0.5 * (centroid - worst), inside=centroid - 0.5 * (centroid - worst))
+        f_candidates = dict([(c, get_gev_negative_log_likelihood(x, candidates[c])) for c in candidates])
+        fr = f_candidates['reflected']
+
+        # the point that replaces the worst point of each simplex (or shrink the simplex towards the best point)
+        use_expanded = (fr < fa[:, 0]) & (f_candidates['expanded'] < fr)
+        use_reflected = ~use_expanded & (fr < fa[:, -2])
+        use_outside = (fr >= fa[:, -2]) & (fr < fa[:, -1]) & (f_candidates['outside'] <= fr)
+        use_inside = (fr >= fa[:, -1]) & (f_candidates['inside'] < fa[:, -1])
+        shrink = ~(use_expanded | use_reflected | use_outside | use_inside)
+
+        for c, use in [('expanded', use_expanded), ('reflected', use_reflected), ('outside', use_outside),
+                       ('inside', use_inside)]:
+            simplex[active[use], -1] = candidates[c][use]
+            f[active[use], -1] = f_candidates[c][use]
+
+        if shrink.any():
+            idx = active[shrink]
+            simplex[idx, 1:] = simplex[idx, :1] + 0.5 * (simplex[idx, 1:] - simplex[idx, :1])
+            for i in range(1, 4):
+                f[idx, i] = get_gev_negative_log_likelihood(values[:, idx], simplex[idx, i])
+
+    best = simplex[np.arange(n_cells), np.argmin(f, axis=1)]
+    estimates = np.array([best[:, 0], np.exp(best[:, 1]), best[:, 2]])
+    keep = ~valid | ~np.isfinite(f.min(axis=1))
+    estimates[:, keep] = initial[:, keep]
+    return estimates
+
+
+def get_return_levels(parameters, return_periods=return_periods):
+    """
+    This function returns the return levels (the values that are exceeded on average once in each return period,
+    in years) of GEV distributions (parameters: array 3 x grid cells with the location, scale and shape) as an
+    array (return periods x grid cells).
+    """
+
+    location, scale, shape = [x[np.newaxis] for x in parameters]
+    y = -np.log(1 - 1. / np.asarray(return_periods, dtype='float64'))[:, np.newaxis]
+    gumbel = np.abs(shape) < min_shape
+    k = np.where(gumbel, 1., shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(gumbel, location - scale * np.log(y), location + scale / k * (1 - y ** k))
+
+
+def get_tile_gev(values, method='lmoments'):
+    """
+    This function returns the location, scale and shape of the GEV distribution (array: 3 x grid cells) of each
+    column of a tile of annual maxima (values: array years x grid cells, without missing values), estimated with
+    L-moments (method lmoments) or maximum likelihood (method mle, starting from the L-moment estimates).
+    """
+
+    parameters = get_gev_l_moments(values)
+    if method == 'mle':
+        parameters = get_gev_mle(values, parameters)
+    elif method != 'lmoments':
+        raise ValueError('Unknown GEV method: %s (lmoments or mle)' % method)
+    return parameters
+
+
+def _gev_tile(args):
+    """
+    This function fits the GEV distributions of one tile of grid cells in a worker process (see get_tile_gev).
+    """
+    values, method = args
+    return get_tile_gev(values, method)
+
+
+def get_tile_size(n_time, max_memory=2**28):
+    """
+    This function returns the number of grid cells per tile, so that the sorted samples and the likelihoods of the
+    candidates of the Nelder-Mead search of a tile need at most max_memory bytes.
+    """
+    return max(1, int(max_memory // (8 * (32 * n_time + 64))))
+
+
+def get_gev(values, method='lmoments', max_memory=2**28, n_workers=1):
+    """
+    This function fits a GEV distribution (see get_tile_gev) to the annual maxima of each grid cell of an array
+    (years x grid cells), in tiles (see get_tile_size) with a pool of n_workers processes. Returns an array (3 x
+    grid cells: location, scale and shape, NaN for grid cells with missing values or less than 3 years).
+    """
+
+    values = np.asarray(values, dtype='float64')
+    valid = np.where(np.isfinite(values).all(axis=0))[0]
+    parameters = np.full((3, values.shape[1]), np.nan)
+    if len(valid) == 0 or len(values) < 3:
+        return parameters
+
+    tile_size = get_tile_size(len(values), max_memory)
+    if method == 'mle':
+        tile_size = min(tile_size, mle_tile_size)
+    tiles = [valid[start:start + tile_size] for start in range(0, len(valid), tile_size)]
+    args = ((values[:, idx], method) for idx in tiles)
+
+    for idx, result in zip(tiles, parallel.map_tiles(_gev_tile, args, n_workers=min(n_workers, len(tiles)))):
+        parameters[:, idx] = result
+
+    return parameters
+
+
+@instrumentation.timed('aggregate')
+def get_gev_fields(data_path, name, var, statistic, year_start, year_end, gcm=None, mask=None, var_in_nc=None,
+                   var_file=None, return_periods=return_periods, method='lmoments', max_memory=2**28, n_workers=1,
+                   verbose=False):
+    """
+    This function reads in the annual time series (*_merged.nc) of the annual maxima (statistic, e.g. max or
+    rx1day) of one dataset (the reference data if gcm is None, otherwise the simulation of this GCM), fits a GEV
+    distribution to each grid cell (see get_gev) and calculates the return levels. Returns an xarray dataset with
+    the variables location, scale and shape (dimensions lat and lon) and return_level (dimensions return_period,
+    lat and lon).
+    """
+
+    is_ref = gcm is None
+    datasets = read_in.read_in_timeseries_for_one_gcm(
+        data_path_ref=data_path, data_path_sim=data_path, gcm=gcm, var=var, name_sim=None if is_ref else name,
+        name_ref=name if is_ref else None, statistic=statistic, year_start=year_start, year_end=year_end, mask=mask,
+        var_ref=var_file, var_sim=var_file, var_ref_in_nc=var_in_nc, var_sim_in_nc=var_in_nc,
+        time_scales=['annual'], verbose=verbose)
+
+    da = datasets['annual'][name][var].transpose('time', 'lat', 'lon')
+    parameters = get_gev(da.values.reshape(da.shape[0], -1), method=method, max_memory=max_memory,
+                         n_workers=n_workers)
+    return_levels = get_return_levels(parameters, return_periods)
+
+    coords = dict(return_period=list(return_periods), lat=da['lat'].values, lon=da['lon'].values)
+    fields = dict([(x, (['lat', 'lon'], parameters[i].reshape(da.shape[1:])))
+                   for i, x in enumerate(['location', 'scale', 'shape'])])
+    fields['return_level'] = (['return_period', 'lat', 'lon'], return_levels.reshape((len(return_periods),) + da.shape[1:]))
+    gev = xr.Dataset(fields, coords=coords)
+    gev['location'].attrs = dict(long_name='Location of the GEV distribution')
+    gev['scale'].attrs = dict(long_name='Scale of the GEV distribution')
+    gev['shape'].attrs = dict(long_name='Shape of the GEV distribution (k > 0: bounded upper tail)')
+    gev['return_level'].attrs = dict(long_name='Return level')
+    gev['return_period'].attrs = dict(long_name='Return period', units='years')
+    gev.attrs = dict(method=method, years='%s-%s' % (year_start, year_end))
+    return gev
+
+
+def get_return_level_bias(gev, gev_ref):
+    """
+    This function returns the bias of the return levels of a simulation (simulated minus reference) and the
+    relative bias (in %) on the grid cells of both datasets (see get_gev_fields), as an xarray dataset with the
+    variables return_level_bias and return_level_bias_rel (dimensions return_period, lat and lon).
+    """
+
+    return_level, return_level_ref = xr.align(gev['return_level'], gev_ref['return_level'], join='inner')
+    bias = xr.Dataset(dict(return_level_bias=return_level - return_level_ref,
+                           return_level_bias_rel=100 * (return_level - return_level_ref) /
+                                                 return_level_ref.where(return_level_ref != 0)))
+    bias['return_level_bias'].attrs = dict(long_name='Bias of the return level')
+    bias['return_level_bias_rel'].attrs = dict(long_name='Relative bias of the return level', units='%')
+    return bias
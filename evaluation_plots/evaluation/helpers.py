@@ -5,12 +5,45 @@
 
 # Import libraries
 import os
+import importlib
 import numpy as np
 import xarray as xr
 
+from evaluation import instrumentation
+
 
 
 # Function definitions
+class LazyModule(object):
+    """
+    Placeholder for a module that is only imported when one of its attributes is used for the first time
+    (see lazy_import).
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return '<lazy module %s%s>' % (self._name, '' if self._module is None else ' (imported)')
+
+
+def lazy_import(name):
+    """
+    This function returns a module that is imported when it is used for the first time, e.g.
+    plt = lazy_import('matplotlib.pyplot'). This is used for the plotting and mapping libraries, which take
+    several seconds to import, so that scripts and worker processes that only read in data start quickly.
+    """
+    return LazyModule(name)
+
+
 def standardise_dimension_names(ds):
     """
     This function renames the latitude / longitude coordinates into lat / lon, where applicable, so that
@@ -50,7 +83,8 @@ def apply_mask(ds, mask):
         mask = mask['mask'] == 1
 
     if mask is not None:
-        ds = ds.where(mask==1)
+        with instrumentation.step('mask'):
+            ds = ds.where(mask==1)
 
     return(ds)
 
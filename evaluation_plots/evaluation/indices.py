@@ -0,0 +1,422 @@
+# Daily extremes indices for the evaluation library.
+
+# The preprocessing scripts aggregate the daily data with CDO (e.g. annual sums or percentiles), but do not
+# calculate indices of daily extremes, such as the maximum 1-day or 5-day rainfall (rx1day, rx5day), the number of
+# days above a threshold (r10mm, r20mm), the longest dry or wet spell (cdd, cwd) or the percentage of days above
+# the 90th percentile of the reference data (tx90p). This module calculates these indices from the daily data of
+# the reference dataset or a GCM, and writes them in the layout of the preprocessed statistics (the index takes
+# the place of the statistic, e.g. awap_rain_day_yearcdd_1976_2005_merged.nc, see
+# evaluation.read_in.get_statistic_file_name), so that the bias maps and PDF plots can show them.
+# The daily data are read in one year at a time. The indices of each year are calculated for tiles of grid cells
+# at once (arrays: days x grid cells), with vectorised kernels: rolling sums from cumulative sums, spell lengths
+# from the last day that ends a spell, and the maximum / number of days of each year, season or month with
+# reduceat. Spells and rolling sums continue over the turn of the year (and seasons, e.g. DJF, over two years):
+# the last days and the current spell length of each grid cell are carried over from one year to the next, so
+# that the memory used is bounded by one year of daily data and the carried over values. The indices of the
+# completed years, seasons and months are written to temporary files after each year, and merged at the end.
+
+# Import libraries
+import os
+import shutil
+import collections
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from evaluation import read_in
+from evaluation import instrumentation
+from evaluation.helpers import standardise_dimension_names, standardise_latlon, create_containing_folder
+
+
+# Definitions of the indices:
+# - max: maximum of the sums over window days (window 1: maximum daily value)
+# - spell: maximum number of consecutive days with value [operator] threshold
+# - count: number of days with value [operator] threshold
+# - percent: percentage of days with value [operator] threshold
+# The threshold is a number (in the unit of the reference data) or a statistic of the reference data (e.g. pctl90:
+# the 30-year mean of the annual 90th percentile of each grid cell, see read_threshold_field).
+indices = collections.OrderedDict([
+    ('rx1day', dict(kind='max', window=1, long_name='Maximum 1-day value')),
+    ('rx5day', dict(kind='max', window=5, long_name='Maximum 5-day total')),
+    ('r10mm', dict(kind='count', operator='>=', threshold=10., long_name='Number of days with at least 10 mm', units='days')),
+    ('r20mm', dict(kind='count', operator='>=', threshold=20., long_name='Number of days with at least 20 mm', units='days')),
+    ('cdd', dict(kind='spell', operator='<', threshold=1., long_name='Maximum number of consecutive dry days (< 1 mm)', units='days')),
+    ('cwd', dict(kind='spell', operator='>=', threshold=1., long_name='Maximum number of consecutive wet days (>= 1 mm)', units='days')),
+    ('tx90p', dict(kind='percent', operator='>', threshold='pctl90', long_name='Percentage of days above the 90th percentile of the reference', units='%')),
+    ('tn10p', dict(kind='percent', operator='<', threshold='pctl10', long_name='Percentage of days below the 10th percentile of the reference', units='%')),
+])
+
+operators = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}
+
+# Months of the time steps of the indices (middle month of the year, each season or month, 15th day)
+TIME_STEP_MONTHS = dict(annual=[7], seasonal=[1, 4, 7, 10])
+
+
+# Function definitions
+def get_period_keys(times, time_scale):
+    """
+    This function returns the period (year, season or month) of each day as an integer key that increases with
+    time, and the year of the period. As in the preprocessing, December belongs to the DJF season of the next year.
+    """
+
+    year = np.asarray(times.year)
+    month = np.asarray(times.month)
+    if time_scale == 'annual':
+        return year, year
+    elif time_scale == 'seasonal':
+        season_year = year + (month == 12)
+        return season_year * 4 + (month % 12) // 3, season_year
+    elif time_scale == 'monthly':
+        return year * 12 + month - 1, year
+    raise ValueError('Unknown time scale: %s (annual, seasonal or monthly)' % time_scale)
+
+
+def get_period_time(key, time_scale):
+    """
+    This function returns the time step of a period (see get_period_keys): the 15th of the middle month of the
+    year or season, or the 15th of the month.
+    """
+    if time_scale == 'annual':
+        return pd.Timestamp(int(key), TIME_STEP_MONTHS['annual'][0], 15)
+    elif time_scale == 'seasonal':
+        return pd.Timestamp(int(key // 4), TIME_STEP_MONTHS['seasonal'][int(key % 4)], 15)
+    return pd.Timestamp(int(key // 12), int(key % 12) + 1, 15)
+
+
+def get_window_sums(values, carry, window):
+    """
+    This function returns the sums over the last window days of each day of a tile (values: days x grid cells),
+    using the last window - 1 days before the tile (carry, NaN if not available). A sum is NaN if one of its days
+    is missing. Returns the sums (days x grid cells) and the last window - 1 days for the next tile.
+    """
+
+    if window == 1:
+        return values, carry
+
+    values = np.concatenate([carry, values], axis=0)
+    valid = np.isfinite(values)
+    zeros = np.zeros((1, values.shape[1]))
+    sums = np.concatenate([zeros, np.cumsum(np.where(valid, values, 0.), axis=0)], axis=0)
+    n_missing = np.concatenate([zeros, np.cumsum(~valid, axis=0)], axis=0)
+
+    window_sums = sums[window:] - sums[:-window]
+    window_sums[(n_missing[window:] - n_missing[:-window]) > 0] = np.nan
+    return window_sums, values[-(window - 1):]
+
+
+def get_spell_lengths(condition, carry):
+    """
+    This function returns the length of the spell (number of consecutive days where condition is True) up to each
+    day of a tile (condition: days x grid cells), including the spell at the end of the days before the tile
+    (carry: spell length of each grid cell). Returns the spell lengths (days x grid cells) and the spell length of
+    the last day for the next tile.
+    """
+
+    days = np.arange(len(condition))[:, np.newaxis]
+    # last day before each day that ends a spell (day before the tile if the spell started before)
+    last_break = np.maximum.accumulate(np.where(condition, -1 - carry[np.newaxis, :], days), axis=0)
+    lengths = days - last_break
+    return lengths, lengths[-1]
+
+
+def reduce_periods(values, keys, how='max'):
+    """
+    This function returns the maximum (how='max', ignoring NaN values) or the sum (how='sum') of the days of each
+    period (values: days x grid cells, keys: period of each day, see get_period_keys), and the keys of the periods.
+    """
+
+    starts = np.concatenate([[0], np.where(np.diff(keys) != 0)[0] + 1])
+    if how == 'max':
+        return keys[starts], np.fmax.reduceat(values, starts, axis=0)
+    return keys[starts], np.add.reduceat(values, starts, axis=0)
+
+
+def get_tile_size(n_days, max_memory=2**28):
+    """
+    This function returns the number of grid cells per tile, so that the arrays of the kernels (days x grid
+    cells) of a tile need at most max_memory bytes.
+    """
+    return max(1, int(max_memory // (8 * 8 * (n_days + 10))))
+
+
+def read_threshold_field(data_path_ref, name_ref, var_ref, var_ref_in_nc, statistic, year_start, year_end):
+    """
+    This function reads in the threshold of an index from the preprocessed statistics of the reference data: the
+    30-year mean of the annual statistic (e.g. pctl90) of each grid cell, as data array (lat, lon).
+    """
+
+    fn = read_in.get_statistic_file_name(data_path_ref, name_ref, var_ref, 'annual', statistic, year_start, year_end, 'mean')
+    ds = standardise_latlon(standardise_dimension_names(read_in.open_dataset(fn)))
+    return ds[var_ref_in_nc].isel(time=0, drop=True)
+
+
+def get_daily_index_values(values, index, state, threshold=None):
+    """
+    This function returns the daily values of an index for a tile (values: days x grid cells) that are reduced to
+    the periods (how: max or sum, see reduce_periods), e.g. the 5-day sums of rx5day or the spell lengths of cdd.
+    state is a dictionary with the values carried over from the previous tile (of the previous year) for this
+    index, and is updated. threshold are the threshold values of the grid cells (default: the threshold of the
+    index definition).
+    """
+
+    definition = indices[index]
+    if definition['kind'] == 'max':
+        window = definition['window']
+        carry = state.get('carry', np.full((window - 1, values.shape[1]), np.nan))
+        daily, state['carry'] = get_window_sums(values, carry, window)
+        return daily, 'max'
+
+    if threshold is None:
+        threshold = definition['threshold']
+        if isinstance(threshold, str):
+            raise ValueError('The index %s needs the threshold field %s of the reference data' % (index, threshold))
+    with np.errstate(invalid='ignore'):
+        condition = operators[definition['operator']](values, threshold) & np.isfinite(values)
+    if definition['kind'] == 'spell':
+        carry = state.get('carry', np.zeros(values.shape[1], dtype='int64'))
+        daily, state['carry'] = get_spell_lengths(condition, carry)
+        return daily.astype('float64'), 'max'
+    return condition.astype('float64'), 'sum'
+
+
+def calculate_year(da, index_names, time_scales, states, thresholds, open_periods, max_memory=2**28):
+    """
+    This function calculates the indices of one year of daily data (da: time, lat, lon) for each time scale, and
+    combines them with the period that was still open at the end of the previous year (e.g. DJF, or a spell that
+    continues). Returns the completed periods of each index and time scale as a dictionary: (index, time scale) ->
+    (keys, values, number of valid days), with the values as array (periods x grid cells). The states (values
+    carried over for each index) and the open periods are updated.
+    """
+
+    values = da.values.reshape(da.shape[0], -1)
+    n_cells = values.shape[1]
+    keys = dict([(time_scale, get_period_keys(da['time'].to_index(), time_scale)[0]) for time_scale in time_scales])
+
+    # reduce the daily values of each tile to the periods of the year (the same tiles in all years, so that the
+    # states of the tiles are carried over)
+    tile_size = get_tile_size(366, max_memory)
+    results = dict()
+    for start in range(0, n_cells, tile_size):
+        tile = slice(start, min(start + tile_size, n_cells))
+        values_tile = values[:, tile].astype('float64')
+        valid_tile = np.isfinite(values_tile).astype('float64')
+
+        for index in index_names:
+            state = states.setdefault((index, tile.start), dict())
+            threshold = thresholds.get(index)
+            daily, how = get_daily_index_values(values_tile, index, state,
+                                                threshold=None if threshold is None else threshold[tile])
+            for time_scale in time_scales:
+                period_keys, reduced = reduce_periods(daily, keys[time_scale], how)
+                n_valid = reduce_periods(valid_tile, keys[time_scale], 'sum')[1]
+                if (index, time_scale) not in results:
+                    results[(index, time_scale)] = (period_keys, np.full((len(period_keys), n_cells), np.nan),
+                                                    np.zeros((len(period_keys), n_cells)), how)
+                results[(index, time_scale)][1][:, tile] = reduced
+                results[(index, time_scale)][2][:, tile] = n_valid
+
+    # combine the first period with the open period of the previous year, the last period stays open
+    completed = dict()
+    for key, (period_keys, reduced, n_valid, how) in results.items():
+        open_period = open_periods.pop(key, None)
+        done = []
+        if open_period is not None:
+            if open_period[0] == period_keys[0]:
+                combine = np.fmax if how == 'max' else np.add
+                reduced[0] = combine(open_period[1], reduced[0])
+                n_valid[0] = open_period[2] + n_valid[0]
+            else:
+                done.append(open_period)
+        done.extend([(period_keys[i], reduced[i], n_valid[i]) for i in range(len(period_keys) - 1)])
+        open_periods[key] = (period_keys[-1], reduced[-1], n_valid[-1])
+        completed[key] = done
+
+    return completed
+
+
+def finalise_periods(periods, index, time_scale, year_start, year_end, lat, lon, var_in_nc):
+    """
+    This function returns the completed periods (key, values, number of valid days) of an index within the years
+    year_start to year_end as data array (time, lat, lon), or None if there are none. Grid cells without valid
+    days are NaN, percentages are calculated from the number of valid days.
+    """
+
+    periods = [x for x in periods if year_start <= get_period_time(x[0], time_scale).year <= year_end]
+    if len(periods) == 0:
+        return None
+
+    values = np.array([x[1] for x in periods])
+    n_valid = np.array([x[2] for x in periods])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if indices[index]['kind'] == 'percent':
+            values = 100. * values / n_valid
+        values = np.where(n_valid > 0, values, np.nan)
+
+    times = pd.DatetimeIndex([get_period_time(x[0], time_scale) for x in periods])
+    return xr.DataArray(values.reshape(len(periods), len(lat), len(lon)).astype('float32'), dims=['time', 'lat', 'lon'],
+                        coords=dict(time=times, lat=lat, lon=lon), name=var_in_nc)
+
+
+def get_multi_year_statistics(merged, time_scale):
+    """
+    This function returns the mean and the standard deviation of the time series of an index over all years (as
+    'cdo timmean / yseasmean / ymonmean' and the standard deviation), with one time step (annual) or one time
+    step per season or month (the time step of the last year).
+    """
+
+    if time_scale == 'annual':
+        labels = np.zeros(merged.sizes['time'], dtype='int64')
+    elif time_scale == 'seasonal':
+        labels = (merged['time.month'].values % 12) // 3
+    else:
+        labels = merged['time.month'].values
+
+    means, stds, times = [], [], []
+    for label in sorted(set(labels), key=lambda x: np.where(labels == x)[0][-1]):
+        temp = merged.isel(time=np.where(labels == label)[0])
+        means.append(temp.mean('time'))
+        stds.append(temp.std('time'))
+        times.append(temp['time'].values[-1])
+    return (xr.concat(means, dim='time').assign_coords(time=times),
+            xr.concat(stds, dim='time').assign_coords(time=times))
+
+
+def write_index_files(temp_files, index, time_scale, data_path, name, var_file, var_in_nc, year_start, year_end, gcm=None):
+    """
+    This function merges the temporary files of the years of an index and writes the time series (_merged), the
+    mean and the standard deviation (_mean, _std) in the layout of the preprocessed statistics. Returns the file
+    names.
+    """
+
+    merged = xr.concat([read_in.open_dataset(fn)[var_in_nc] for fn in temp_files], dim='time').sortby('time')
+    mean, std = get_multi_year_statistics(merged, time_scale)
+
+    attrs = dict(long_name=indices[index]['long_name'])
+    if 'units' in indices[index]:
+        attrs['units'] = indices[index]['units']
+
+    fns = []
+    for suffix, da in [('merged', merged), ('mean', mean), ('std', std)]:
+        fn = read_in.get_statistic_file_name(data_path, name, var_file, time_scale, index, year_start, year_end,
+                                             suffix, gcm=gcm)
+        da = da.rename(var_in_nc)
+        da.attrs = attrs
+        create_containing_folder(fn)
+        da.to_dataset().to_netcdf(fn)
+        fns.append(fn)
+    return fns
+
+
+@instrumentation.timed('aggregate')
+def calculate_indices(files, var_in_nc, index_names, year_start, year_end, data_path, name, var_file, gcm=None,
+                      thresholds=None, time_scales=['annual', 'seasonal', 'monthly'], unit_conversion=(1., 0.),
+                      max_memory=2**28, verbose=True):
+    """
+    This function calculates the indices (index_names, see indices) of the daily data of one dataset and variable
+    (files: see evaluation.read_in.iterate_daily_data) for the years year_start to year_end, and writes them in the layout of the
+    preprocessed statistics of the dataset (data_path, name, var_file and gcm, see
+    evaluation.read_in.get_statistic_file_name). The year before year_start is read in as well (if available),
+    for the DJF season of the first year and the spells that start before the first year. thresholds is a
+    dictionary with the threshold field (lat, lon) of the indices with a threshold from the reference data (see
+    read_threshold_field). Returns the names of the files written.
+    """
+
+    if thresholds is None:
+        thresholds = dict()
+
+    temp_path = os.path.join(data_path if gcm is None else os.path.join(data_path, gcm),
+                             'temp_indices_%s_%s_%s_%s' % (name, var_file, year_start, year_end))
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+
+    states = dict()
+    open_periods = dict()
+    temp_files = collections.defaultdict(list)
+    threshold_values = None
+    lat = lon = None
+    years = list(range(year_start - 1, year_end + 1))
+
+    try:
+        for year, da in read_in.iterate_daily_data(files, var_in_nc, years, unit_conversion):
+            if verbose: print('- %s' % year)
+
+            if lat is None:
+                lat, lon = da['lat'].values, da['lon'].values
+                # thresholds on the grid of the dataset (nearest grid cell, as 'cdo remapnn')
+                threshold_values = dict([(index, thresholds[index].reindex(lat=lat, lon=lon, method='nearest').values.ravel())
+                                         for index in index_names if index in thresholds])
+            elif da.shape[1:] != (len(lat), len(lon)):
+                raise ValueError('The grid of %s %s differs from the grid of the first year' % (var_in_nc, year))
+
+            completed = calculate_year(da, index_names, time_scales, states, threshold_values, open_periods,
+                                       max_memory=max_memory)
+            del da
+
+            for (index, time_scale), periods in completed.items():
+                result = finalise_periods(periods, index, time_scale, year_start, year_end, lat, lon, var_in_nc)
+                if result is not None:
+                    fn = os.path.join(temp_path, '%s_%s_%s.nc' % (index, time_scale, year))
+                    result.to_dataset().to_netcdf(fn)
+                    temp_files[(index, time_scale)].append(fn)
+
+        if lat is None:
+            raise IOError('No daily data found for %s (%s-%s)' % (var_in_nc, year_start - 1, year_end))
+
+        # the periods that are still open at the end of the data are complete
+        for (index, time_scale), period in open_periods.items():
+            result = finalise_periods([period], index, time_scale, year_start, year_end, lat, lon, var_in_nc)
+            if result is not None:
+                fn = os.path.join(temp_path, '%s_%s_last.nc' % (index, time_scale))
+                result.to_dataset().to_netcdf(fn)
+                temp_files[(index, time_scale)].append(fn)
+
+        fns = []
+        for index in index_names:
+            for time_scale in time_scales:
+                if len(temp_files[(index, time_scale)]) > 0:
+                    fns.extend(write_index_files(temp_files[(index, time_scale)], index, time_scale, data_path, name,
+                                                 var_file, var_in_nc, year_start, year_end, gcm=gcm))
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+    return fns
+
+
+def write_index_biases(data_path_ref, data_path_sim, gcm, var, index, name_ref, name_sim, var_ref, var_sim,
+                       var_ref_in_nc, var_sim_in_nc, year_start, year_end, time_scales=['annual', 'seasonal', 'monthly']):
+    """
+    This function writes the absolute and relative bias of the mean of an index of one GCM (in the layout of the
+    preprocessing: bias_[name_ref]/bias_abs_..., see evaluation.read_in.get_bias_file_name). As in the
+    preprocessing, the files of the GCM are first regridded to the grid of the reference data (nearest grid cell).
+    Returns the names of the bias files.
+    """
+
+    fns = []
+    for time_scale in time_scales:
+        fn_ref = read_in.get_statistic_file_name(data_path_ref, name_ref, var_ref, time_scale, index, year_start, year_end, 'mean')
+        ref = standardise_latlon(standardise_dimension_names(read_in.open_dataset(fn_ref)))[var_ref_in_nc]
+
+        for suffix in ['merged', 'mean', 'std']:
+            fn_sim = read_in.get_statistic_file_name(data_path_sim, name_sim, var_sim, time_scale, index, year_start,
+                                                     year_end, suffix, gcm=gcm)
+            ds = standardise_latlon(standardise_dimension_names(read_in.open_dataset(fn_sim)))
+            if not (np.array_equal(ds['lat'].values, ref['lat'].values) and np.array_equal(ds['lon'].values, ref['lon'].values)):
+                ds = ds.reindex(lat=ref['lat'].values, lon=ref['lon'].values, method='nearest')
+                ds.to_netcdf(fn_sim + '.remapped')
+                os.rename(fn_sim + '.remapped', fn_sim)
+            if suffix == 'mean':
+                sim = ds[var_sim_in_nc]
+
+        bias_abs = (sim - ref.values).rename(var_ref_in_nc)
+        bias_abs.attrs = ref.attrs
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bias_rel = (bias_abs / ref.values).rename(var_ref_in_nc)
+
+        for bias_type, da in [('bias_abs', bias_abs), ('bias_rel', bias_rel)]:
+            fn = read_in.get_bias_file_name(data_path_sim, gcm, name_ref, bias_type, var, time_scale, index,
+                                            year_start, year_end)
+            create_containing_folder(fn)
+            da.to_dataset().to_netcdf(fn)
+            fns.append(fn)
+    return fns
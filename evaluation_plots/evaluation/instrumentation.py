@@ -0,0 +1,260 @@
+# Timing and memory instrumentation for the evaluation library.
+
+# Instrumentation is opt-in: it is switched on with 'instrumentation_path' in the config file (or the
+# environment variable EVALUATION_INSTRUMENTATION_PATH), which is the folder for the run reports.
+# When it is switched on, the steps of each plot task (read, mask, to_dataframe, aggregate, render, savefig)
+# are timed and the run report (JSON) is written at the end of the run (see evaluation.parallel).
+# When it is switched off, the steps only check a flag and add no measurable overhead.
+
+# Import libraries
+import os
+import sys
+import time
+import json
+import functools
+import contextlib
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+
+# Module state (set in the main process with configure, inherited by the worker processes)
+_report_path = None
+_records = []
+_stack = []
+
+
+# Function definitions
+def configure(parameters=None):
+    """
+    This function switches the instrumentation on if 'instrumentation_path' is set in the config file or
+    if the environment variable EVALUATION_INSTRUMENTATION_PATH is set (the environment variable takes precedence).
+    It needs to be called before the plot tasks are started, so that the worker processes inherit the setting.
+    """
+
+    global _report_path
+
+    report_path = None
+    if parameters is not None:
+        report_path = parameters.get('instrumentation_path', None)
+    report_path = os.environ.get('EVALUATION_INSTRUMENTATION_PATH', report_path)
+
+    _report_path = report_path if report_path else None
+
+
+def is_enabled():
+    """
+    Returns True if the instrumentation is switched on.
+    """
+    return _report_path is not None
+
+
+def _reset_peak_rss():
+    """
+    This function resets the peak memory usage (VmHWM) of the process, so that the peak can be measured for
+    each task separately in a worker process. This is only possible on Linux, otherwise nothing is done.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def _get_peak_rss():
+    """
+    This function returns the peak memory usage (resident set size) of the process in bytes.
+    """
+    try:
+        with open('/proc/self/status', 'r') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+    return None
+
+
+class _NoStep(object):
+    """
+    Context manager that does nothing, used for all steps when the instrumentation is switched off.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NO_STEP = _NoStep()
+
+
+def step(name, nbytes=0, label=None):
+    """
+    This function returns a context manager that records the wall time, CPU time and bytes read (nbytes)
+    of a step, e.g.:
+        with evaluation.instrumentation.step('read', nbytes=os.path.getsize(fn), label=fn):
+            ds = xr.open_dataset(fn).load()
+    The time of steps within a step (e.g. reading files during an aggregation) is only counted for the inner
+    step. If the instrumentation is switched off, a context manager that does nothing is returned.
+    """
+    if _report_path is None:
+        return _NO_STEP
+    return _step(name, nbytes, label)
+
+
+@contextlib.contextmanager
+def _step(name, nbytes, label):
+    record = dict(step=name, label=label, wall_time=0., cpu_time=0., bytes_read=nbytes)
+    _stack.append(record)
+    start_wall = time.time()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        wall_time = time.time() - start_wall
+        cpu_time = time.process_time() - start_cpu
+        _stack.pop()
+
+        # the time of this step is not counted for the enclosing step
+        if len(_stack) > 0:
+            _stack[-1]['wall_time'] = _stack[-1]['wall_time'] - wall_time
+            _stack[-1]['cpu_time'] = _stack[-1]['cpu_time'] - cpu_time
+
+        record['wall_time'] = record['wall_time'] + wall_time
+        record['cpu_time'] = record['cpu_time'] + cpu_time
+        record['peak_rss'] = _get_peak_rss()
+        _records.append(record)
+
+
+def timed(name):
+    """
+    Decorator that records every call of a function as a step (see the function step), e.g.:
+        @timed('render')
+        def plot_bias(...):
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _report_path is None:
+                return function(*args, **kwargs)
+            with _step(name, 0, function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def task():
+    """
+    Context manager for one plot task: it resets the recorded steps and the peak memory usage at the start
+    and yields a dictionary, which contains the recorded steps and the totals of the task at the end.
+    """
+
+    measurements = dict()
+    if _report_path is None:
+        yield measurements
+        return
+
+    del _records[:]
+    _reset_peak_rss()
+    start_wall = time.time()
+    start_cpu = time.process_time()
+    try:
+        yield measurements
+    finally:
+        measurements['wall_time'] = time.time() - start_wall
+        measurements['cpu_time'] = time.process_time() - start_cpu
+        measurements['bytes_read'] = sum([x['bytes_read'] for x in _records])
+        measurements['peak_rss'] = _get_peak_rss()
+        measurements['steps'] = list(_records)
+        del _records[:]
+
+
+def summarise_steps(steps):
+    """
+    This function sums up the wall time, CPU time and bytes read of a list of step records by step name,
+    and returns the maximum peak memory usage of each step name.
+    """
+
+    summary = dict()
+    for record in steps:
+        if record['step'] not in summary:
+            summary[record['step']] = dict(count=0, wall_time=0., cpu_time=0., bytes_read=0, peak_rss=0)
+        temp = summary[record['step']]
+        temp['count'] = temp['count'] + 1
+        temp['wall_time'] = temp['wall_time'] + record['wall_time']
+        temp['cpu_time'] = temp['cpu_time'] + record['cpu_time']
+        temp['bytes_read'] = temp['bytes_read'] + record['bytes_read']
+        temp['peak_rss'] = max(temp['peak_rss'], record['peak_rss'] or 0)
+
+    return summary
+
+
+def get_report_file_name():
+    """
+    This function returns the file name of the run report: the script name and the start time of the report
+    in the instrumentation folder.
+    """
+    script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'evaluation'
+    return os.path.join(_report_path, 'run_report_%s_%s_%s.json' % (script, time.strftime('%Y%m%d_%H%M%S'), os.getpid()))
+
+
+def write_report(results, duration=None, n_workers=None, n_top=10):
+    """
+    This function writes the run report (JSON) from the results of the plot tasks (see evaluation.parallel):
+    the totals per step, the measurements of each task and the top offenders (tasks with the longest wall time,
+    highest peak memory and most bytes read, and the slowest single steps). A short version of the top
+    offenders is printed. Returns the file name of the report.
+    """
+
+    tasks = []
+    all_steps = []
+    for result in results:
+        measurements = result.get('measurements', dict())
+        steps = measurements.get('steps', [])
+        all_steps = all_steps + [dict(x, fn_plot=result['fn_plot']) for x in steps]
+        tasks.append(dict(fn_plot=result['fn_plot'], status=result['status'],
+                          wall_time=measurements.get('wall_time', result['duration']),
+                          cpu_time=measurements.get('cpu_time', None),
+                          bytes_read=measurements.get('bytes_read', 0),
+                          peak_rss=measurements.get('peak_rss', None),
+                          steps=summarise_steps(steps)))
+
+    report = dict(script=os.path.basename(sys.argv[0]),
+                  date=time.strftime('%Y-%m-%d %H:%M:%S'),
+                  wall_time=duration,
+                  n_workers=n_workers,
+                  n_tasks=len(tasks),
+                  n_failed=len([x for x in tasks if x['status'] == 'failed']),
+                  peak_rss=max([x['peak_rss'] or 0 for x in tasks] + [0]),
+                  steps=summarise_steps(all_steps),
+                  top_offenders=dict(
+                      wall_time=sorted(tasks, key=lambda x: -x['wall_time'])[:n_top],
+                      peak_rss=sorted(tasks, key=lambda x: -(x['peak_rss'] or 0))[:n_top],
+                      bytes_read=sorted(tasks, key=lambda x: -x['bytes_read'])[:n_top],
+                      steps=sorted(all_steps, key=lambda x: -x['wall_time'])[:n_top]),
+                  tasks=tasks)
+
+    fn_report = get_report_file_name()
+    if not os.path.exists(_report_path):
+        os.makedirs(_report_path)
+    with open(fn_report, 'w') as fp:
+        json.dump(report, fp, indent=1)
+
+    print('##### Run report: %s' % fn_report)
+    print('- peak memory (per worker): %.1f MB' % (report['peak_rss'] / 1e6))
+    for name, temp in sorted(report['steps'].items(), key=lambda x: -x[1]['wall_time']):
+        print('- %s: %.1fs wall, %.1fs CPU, %.1f MB read (%s calls)' % (name, temp['wall_time'], temp['cpu_time'],
+                                                                        temp['bytes_read'] / 1e6, temp['count']))
+    for task in report['top_offenders']['wall_time'][:3]:
+        print('- slowest: %.1fs, %.1f MB peak: %s' % (task['wall_time'], (task['peak_rss'] or 0) / 1e6, task['fn_plot']))
+
+    return fn_report
@@ -0,0 +1,462 @@
+# Map panels for the bias maps of the evaluation library.
+
+# The bias maps (see plotting.plot_bias and plotting.plot_bias_corr) are created for many regions, GCMs,
+# variables and statistics, with the same layout for each region. Creating the figure, the axes and the map
+# layers (coastlines and states) is slower than drawing the data. This module keeps one figure ("template")
+# per region extent and layout in memory: the map layers and the mesh (or image) of each panel are created once, and for
+# each new plot only the data, colour limits, colour bars and titles are replaced.
+# The figures are not managed by pyplot, so they are not affected by plt.close and are only released when
+# the number of templates exceeds max_templates or with clear_map_templates. As a template is reused for the next
+# plot, the plotting functions only save it and never return it: a figure that is returned to the caller is
+# created as a new template, which is not kept (see get_map_template).
+
+# Two backends are available for the map layers:
+# - basemap: coastlines and states of mpl_toolkits.basemap (crude resolution)
+# - cartopy: coastlines and states of Natural Earth (via cartopy), clipped to the region extent. The clipped lines
+#   are cached in memory and on disk (cache_path), so that the shapefiles are only read once per region extent.
+#   Once the layout of a template is known, the lines are pre-rendered into one transparent image per panel size
+#   (the background, at the resolution of the saved plots), which is cached in memory and on disk as well and
+#   replaces the lines in all panels, so that the map layers are not drawn again for each panel and plot.
+# Both use the equirectangular projection (lat/lon, cartopy's PlateCarree), which is the projection of the data,
+# so the Natural Earth coordinates are used without reprojection.
+
+# Import libraries
+import os
+import hashlib
+import collections
+import numpy as np
+
+from evaluation.helpers import lazy_import
+
+mpl_figure = lazy_import('matplotlib.figure')
+mpl_colors = lazy_import('matplotlib.colors')
+mpl_collections = lazy_import('matplotlib.collections')
+mpl_image = lazy_import('matplotlib.image')
+backend_agg = lazy_import('matplotlib.backends.backend_agg')
+basemap = lazy_import('mpl_toolkits.basemap')
+shapereader = lazy_import('cartopy.io.shapereader')
+shapely_geometry = lazy_import('shapely.geometry')
+
+
+# Templates of this process (the least recently used template is released when there are more than max_templates)
+_templates = collections.OrderedDict()
+max_templates = 8
+
+# Map layers of the cartopy backend: Natural Earth data set (category, name) and line width
+map_layers = collections.OrderedDict([('coastline', dict(category='physical', name='coastline', linewidth=0.2)),
+                                      ('states', dict(category='cultural', name='admin_1_states_provinces_lines', linewidth=0.1))])
+map_resolution = '50m'
+
+# Resolution of the background of the cartopy backend (dots per inch, the resolution of the saved plots)
+background_dpi = 300
+
+# Folder for the clipped map layers of the cartopy backend, and cache in memory
+cache_path = os.environ.get('EVALUATION_MAP_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'evaluation', 'maps'))
+_map_lines = dict()
+_backgrounds = dict()
+
+
+# Function definitions
+def get_extent(coordinates):
+    """
+    This function returns the region extent (lon_min, lon_max, lat_min, lat_max) from the corner coordinates.
+    """
+    return (coordinates['llcrnrlon'], coordinates['urcrnrlon'], coordinates['llcrnrlat'], coordinates['urcrnrlat'])
+
+
+def clip_lines(geometries, extent):
+    """
+    This function clips (multi-)line geometries to the region extent and returns the lines as a list of arrays
+    with the lon / lat coordinates of the points.
+    """
+
+    region = shapely_geometry.box(extent[0], extent[2], extent[1], extent[3])
+
+    lines = []
+    for geometry in geometries:
+        if not geometry.intersects(region):
+            continue
+        geometry = geometry.intersection(region)
+        parts = getattr(geometry, 'geoms', [geometry])
+        for part in parts:
+            if part.geom_type == 'LineString' and len(part.coords) > 1:
+                lines.append(np.array(part.coords)[:, :2])
+            elif part.geom_type == 'Polygon':
+                lines.append(np.array(part.exterior.coords)[:, :2])
+
+    return lines
+
+
+def get_map_lines(layer, extent, resolution=None):
+    """
+    This function returns the lines of a map layer (see map_layers) within the region extent, as a list of arrays
+    with lon / lat coordinates. The lines are read from the Natural Earth shapefiles only the first time for each
+    region extent, then they are taken from the cache in memory or on disk (cache_path).
+    """
+
+    if resolution is None:
+        resolution = map_resolution
+
+    key = (layer, tuple(extent), resolution)
+    if key in _map_lines:
+        return _map_lines[key]
+
+    fn = get_cache_file_name('%s_%s' % (layer, resolution), extent, 'npz')
+    if os.path.exists(fn):
+        with np.load(fn) as temp:
+            lines = np.split(temp['points'], temp['offsets'])
+    else:
+        fn_shp = shapereader.natural_earth(resolution=resolution, category=map_layers[layer]['category'],
+                                           name=map_layers[layer]['name'])
+        lines = clip_lines(shapereader.Reader(fn_shp).geometries(), extent)
+
+        # store the lines as one array of points and the offsets of the lines
+        try:
+            if not os.path.exists(cache_path):
+                os.makedirs(cache_path)
+            points = np.concatenate(lines) if len(lines) > 0 else np.zeros((0, 2))
+            offsets = np.cumsum([len(x) for x in lines])[:-1]
+            np.savez(fn, points=points, offsets=offsets)
+        except (IOError, OSError):
+            pass # the cache folder is not writable: only cache in memory
+
+    _map_lines[key] = lines
+    return lines
+
+
+def get_cache_file_name(prefix, extent, suffix):
+    """
+    This function returns the name of a cache file (in cache_path) of a map layer or background of a region extent.
+    """
+    return os.path.join(cache_path, '%s_%s.%s' % (prefix, hashlib.md5(repr(tuple(extent)).encode()).hexdigest()[:12],
+                                                 suffix))
+
+
+def draw_map_lines(ax, extent):
+    """
+    This function draws the lines of all map layers (see map_layers) of the cartopy backend in an axis and returns
+    the line collections.
+    """
+    line_collections = []
+    for layer in map_layers.keys():
+        line_collections.append(ax.add_collection(mpl_collections.LineCollection(
+            get_map_lines(layer, extent), linewidths=map_layers[layer]['linewidth'], colors='k', zorder=3)))
+    return line_collections
+
+
+def get_background(extent, width, height, dpi=None):
+    """
+    This function returns the map layers of the cartopy backend within the region extent, pre-rendered as an
+    image (RGBA, transparent where there are no lines) of width x height pixels at dpi (default: background_dpi).
+    The image is only rendered the first time for each region extent and size, then it is taken from the cache
+    in memory or on disk (cache_path).
+    """
+
+    if dpi is None:
+        dpi = background_dpi
+
+    key = (tuple(extent), width, height, dpi, map_resolution)
+    if key in _backgrounds:
+        return _backgrounds[key]
+
+    fn = get_cache_file_name('background_%s_%sx%s_%s' % (map_resolution, width, height, dpi), extent, 'png')
+    if os.path.exists(fn):
+        image = mpl_image.imread(fn)
+    else:
+        fig = mpl_figure.Figure(figsize=(width / float(dpi), height / float(dpi)), dpi=dpi)
+        canvas = backend_agg.FigureCanvasAgg(fig)
+        fig.patch.set_alpha(0)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.axis('off')
+        draw_map_lines(ax, extent)
+        ax.set_xlim(extent[0], extent[1])
+        ax.set_ylim(extent[2], extent[3])
+        canvas.draw()
+        image = np.asarray(canvas.buffer_rgba()).astype('float32') / 255.
+
+        try:
+            if not os.path.exists(cache_path):
+                os.makedirs(cache_path)
+            mpl_image.imsave(fn, image)
+        except (IOError, OSError):
+            pass # the cache folder is not writable: only cache in memory
+
+    _backgrounds[key] = image
+    return image
+
+
+def get_cell_edges(values):
+    """
+    This function returns the edges of the grid cells from the cell centres (e.g. latitudes), as used by
+    pcolormesh: the edges are half-way between the centres, the outer edges are extrapolated.
+    """
+    values = np.asarray(values, dtype='float64')
+    if len(values) == 1:
+        return np.array([values[0] - 0.5, values[0] + 0.5])
+    middle = (values[1:] + values[:-1]) / 2.
+    return np.concatenate([[values[0] - (middle[0] - values[0])], middle, [values[-1] + (values[-1] - middle[-1])]])
+
+
+def get_norm(values, vmin, vmax, levels, cmap):
+    """
+    This function returns the colour normalisation of a panel, in the same way as xarray's plot functions:
+    with levels, the colours are discrete (one colour per interval); without vmin and vmax, the limits are the
+    minimum and maximum of the data, and symmetric around 0 if the data has positive and negative values.
+    """
+
+    if levels is not None:
+        return mpl_colors.BoundaryNorm(levels, ncolors=cmap.N, clip=True)
+
+    if vmin is None or vmax is None:
+        data_min = float(np.nanmin(values)) if np.isfinite(values).any() else 0.
+        data_max = float(np.nanmax(values)) if np.isfinite(values).any() else 1.
+        if vmin is None and vmax is None and data_min < 0 < data_max:
+            vlim = max(abs(data_min), abs(data_max))
+            data_min, data_max = -vlim, vlim
+        vmin = data_min if vmin is None else vmin
+        vmax = data_max if vmax is None else vmax
+
+    return mpl_colors.Normalize(vmin=vmin, vmax=vmax)
+
+
+def is_regular(values, tolerance=1e-3):
+    """
+    Returns True if the coordinates (e.g. latitudes) are equally spaced (within a tolerance relative to the spacing).
+    """
+    if len(values) < 2:
+        return False
+    steps = np.diff(np.asarray(values, dtype='float64'))
+    return bool(np.all(np.abs(steps - steps[0]) <= tolerance * abs(steps[0])))
+
+
+def get_raster(lat, lon, values, extent):
+    """
+    This function prepares a field on a regular grid to be drawn as one image: it selects the grid cells within the
+    region extent (plus one cell on each side) and sorts latitudes and longitudes in ascending order. The image is
+    placed on the map with the outer edges of the grid cells, so that every grid cell is drawn at the same position
+    as with pcolormesh. matplotlib then resamples the image onto the pixels of the panel.
+    """
+
+    # ascending coordinates
+    if lat[0] > lat[-1]:
+        lat = lat[::-1]
+        values = values[::-1, :]
+    if lon[0] > lon[-1]:
+        lon = lon[::-1]
+        values = values[:, ::-1]
+
+    # grid cells within the region extent
+    lat_idx = np.where((lat >= extent[2] - abs(lat[1] - lat[0])) & (lat <= extent[3] + abs(lat[1] - lat[0])))[0]
+    lon_idx = np.where((lon >= extent[0] - abs(lon[1] - lon[0])) & (lon <= extent[1] + abs(lon[1] - lon[0])))[0]
+    if len(lat_idx) < 2 or len(lon_idx) < 2:
+        return lat, lon, values
+
+    lat_slice = slice(lat_idx[0], lat_idx[-1] + 1)
+    lon_slice = slice(lon_idx[0], lon_idx[-1] + 1)
+    return lat[lat_slice], lon[lon_slice], values[lat_slice, lon_slice]
+
+
+class MapTemplate(object):
+    """
+    Figure with a grid of map panels (nrows x ncols) for one region extent. The map layers are drawn once,
+    and the data of each panel is replaced with draw_panel.
+    """
+
+    def __init__(self, coordinates, nrows, ncols, figsize, backend='basemap'):
+        self.coordinates = coordinates
+        self.fig = mpl_figure.Figure(figsize=figsize)
+        backend_agg.FigureCanvasAgg(self.fig)
+        self.axes = self.fig.subplots(nrows=nrows, ncols=ncols, squeeze=False)
+        self.artists = dict()
+        self.colorbars = dict()
+        self.stipples = dict()
+        self.map_lines = dict()
+        self.backend = backend
+        self.layout_done = False
+
+        if backend == 'basemap':
+            self.map = basemap.Basemap(resolution='c', **coordinates)
+            for ax in self.axes.flat:
+                ax.axis('off')
+                self.map.drawcoastlines(ax=ax, linewidth=0.2)
+                self.map.drawstates(ax=ax, linewidth=0.1)
+        elif backend == 'cartopy':
+            extent = get_extent(coordinates)
+            for ax in self.axes.flat:
+                ax.axis('off')
+                # the lines are replaced by the background once the layout is known (see draw_background)
+                self.map_lines[ax] = draw_map_lines(ax, extent)
+                ax.set_xlim(extent[0], extent[1])
+                ax.set_ylim(extent[2], extent[3])
+                ax.set_aspect('equal')
+        else:
+            raise ValueError('Unknown map backend: %s (available: basemap, cartopy)' % backend)
+
+    def draw_panel(self, row_idx, col_idx, da, vmin=None, vmax=None, cmap=None, levels=None, extend='neither',
+                   title='', legend_title='', mode='mesh'):
+        """
+        This method draws a field (xarray data array with the dimensions lat and lon) in a panel. The mesh (or image)
+        is only created for the first field (or if the grid changes), afterwards only the data is replaced.
+        mode is mesh (one quadrilateral per grid cell, exact) or raster (one image, see get_raster, much faster
+        for high-resolution grids). Grids that are not regular are always drawn as mesh.
+        """
+
+        ax = self.axes[row_idx, col_idx]
+        da = da.transpose('lat', 'lon')
+        self.draw_stippling(row_idx, col_idx, None)
+        lat = da['lat'].values
+        lon = da['lon'].values
+        values = da.values
+
+        if mode == 'raster' and is_regular(lat) and is_regular(lon):
+            lat, lon, values = get_raster(lat, lon, values, get_extent(self.coordinates))
+            kind = 'raster'
+        elif mode in ['mesh', 'raster']:
+            kind = 'mesh'
+        else:
+            raise ValueError('Unknown map render mode: %s (available: mesh, raster)' % mode)
+
+        values = np.ma.masked_invalid(values)
+        norm = get_norm(values, vmin, vmax, levels, cmap)
+        grid = (kind, tuple(lat), tuple(lon))
+        lat_edges = get_cell_edges(lat)
+        lon_edges = get_cell_edges(lon)
+
+        key = (row_idx, col_idx)
+        if key not in self.artists or self.artists[key][1] != grid:
+            if key in self.artists:
+                self.artists[key][0].remove()
+            if kind == 'raster':
+                artist = ax.imshow(values, extent=(lon_edges[0], lon_edges[-1], lat_edges[0], lat_edges[-1]),
+                                   origin='lower', interpolation='nearest', aspect=ax.get_aspect(), cmap=cmap, norm=norm)
+            else:
+                artist = ax.pcolormesh(lon_edges, lat_edges, values, cmap=cmap, norm=norm)
+            self.artists[key] = (artist, grid)
+            # the map limits are set by the map layers, not by the data
+            ax.set_xlim(self.coordinates['llcrnrlon'], self.coordinates['urcrnrlon'])
+            ax.set_ylim(self.coordinates['llcrnrlat'], self.coordinates['urcrnrlat'])
+        else:
+            artist = self.artists[key][0]
+            if kind == 'raster':
+                artist.set_data(values)
+            else:
+                artist.set_array(values.ravel())
+            artist.set_cmap(cmap)
+            artist.set_norm(norm)
+
+        # colour bar: only create a new one if the extension of the colour bar changes
+        if key in self.colorbars and self.colorbars[key][1] == extend:
+            colorbar = self.colorbars[key][0]
+            colorbar.update_normal(artist)
+        else:
+            if key in self.colorbars:
+                cax = self.colorbars[key][0].ax
+                cax.clear()
+                colorbar = self.fig.colorbar(artist, cax=cax, extend=extend)
+            else:
+                colorbar = self.fig.colorbar(artist, ax=ax, extend=extend)
+            self.colorbars[key] = (colorbar, extend)
+        colorbar.set_label(legend_title)
+
+        ax.set_title(title, fontsize=10)
+
+    def draw_stippling(self, row_idx, col_idx, da, max_points=80, markersize=0.5):
+        """
+        This method draws dots on the grid cells of a panel where a boolean field (xarray data array with the
+        dimensions lat and lon, e.g. significant bias) is True, or removes the dots if da is None. On fine grids,
+        only every n-th grid cell in each direction is used (at most max_points per direction), so that the dots
+        stay visible and cheap to draw.
+        """
+
+        key = (row_idx, col_idx)
+        if key in self.stipples:
+            self.stipples.pop(key).remove()
+        if da is None:
+            return
+
+        da = da.transpose('lat', 'lon')
+        step = max(1, int(np.ceil(max(da.shape) / float(max_points))))
+        values = da.values[::step, ::step].astype(bool)
+        lat_idx, lon_idx = np.nonzero(values)
+        lat = da['lat'].values[::step][lat_idx]
+        lon = da['lon'].values[::step][lon_idx]
+        self.stipples[key] = self.axes[row_idx, col_idx].scatter(lon, lat, s=markersize, c='k', marker='.',
+                                                                 linewidths=0, zorder=4)
+
+    def set_suptitle(self, title, adjust):
+        """
+        This method sets the title of the figure. The layout of the figure is only calculated for the first plot.
+        """
+        if not self.layout_done:
+            self.fig.tight_layout()
+            self.fig.subplots_adjust(top=adjust)
+            self.layout_done = True
+            if self.backend == 'cartopy':
+                self.draw_background()
+        self.fig.suptitle(title, fontsize=16)
+
+    def draw_background(self, dpi=None):
+        """
+        This method replaces the lines of the map layers (cartopy backend) in each panel by the pre-rendered
+        background (see get_background) with the size of the panel in the saved plot. It is called once the layout
+        of the figure is known, as the size of the panels changes with the layout.
+        """
+
+        if dpi is None:
+            dpi = background_dpi
+
+        extent = get_extent(self.coordinates)
+        for ax in self.axes.flat:
+            ax.apply_aspect()
+            position = ax.get_position()
+            width = int(round(position.width * self.fig.get_figwidth() * dpi))
+            height = int(round(position.height * self.fig.get_figheight() * dpi))
+            if width < 1 or height < 1:
+                continue
+            for collection in self.map_lines.pop(ax, []):
+                collection.remove()
+            ax.imshow(get_background(extent, width, height, dpi), extent=extent, origin='upper',
+                      interpolation='nearest', aspect=ax.get_aspect(), zorder=3)
+            ax.set_xlim(extent[0], extent[1])
+            ax.set_ylim(extent[2], extent[3])
+
+    def close(self):
+        """
+        This method releases the figure.
+        """
+        self.fig.clear()
+        self.artists = dict()
+        self.colorbars = dict()
+        self.stipples = dict()
+        self.map_lines = dict()
+
+
+def get_map_template(coordinates, nrows, ncols, figsize, backend='basemap', reuse=True):
+    """
+    This function returns the map template for a region extent (coordinates), layout and map backend (basemap or
+    cartopy). The template is created for the first plot and reused for all further plots with the same region
+    extent and layout in this process. If reuse is False, a new template is returned, which is not kept in this
+    process (e.g. for a figure that is returned to the caller).
+    """
+
+    if not reuse:
+        return MapTemplate(coordinates, nrows, ncols, figsize, backend)
+
+    key = (tuple(sorted(coordinates.items())), nrows, ncols, tuple(figsize), backend)
+    if key in _templates:
+        _templates.move_to_end(key)
+        return _templates[key]
+
+    while len(_templates) >= max_templates:
+        _templates.popitem(last=False)[1].close()
+
+    _templates[key] = MapTemplate(coordinates, nrows, ncols, figsize, backend)
+    return _templates[key]
+
+
+def clear_map_templates():
+    """
+    This function releases all map templates of this process.
+    """
+    while len(_templates) > 0:
+        _templates.popitem(last=False)[1].close()
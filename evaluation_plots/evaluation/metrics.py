@@ -0,0 +1,174 @@
+# Skill scores of the GCMs for the evaluation library.
+
+# The plots show the differences between the GCMs and the reference data, but comparing the GCMs means looking
+# through hundreds of plots. This module calculates skill scores of the mean fields of each GCM against the
+# reference data (over the grid cells of a region, for each time scale): bias, root mean square error (RMSE),
+# spatial correlation, Perkins skill score (overlap of the distributions), Kolmogorov-Smirnov distance, and the
+# ratio of the standard deviations and centred RMS difference of the Taylor diagram.
+# The scores of all GCMs are calculated at once from the ensemble array (dimension source, see
+# evaluation.read_in.read_in_ensemble_mean_fields), and all scores are collected in one table (one row per region,
+# variable, statistic, time scale and GCM), from which the summary plots are drawn (see
+# evaluation.plotting.plot_metrics_portrait and evaluation.plotting.plot_taylor_diagram).
+
+# Import libraries
+import os
+import collections
+import numpy as np
+import pandas as pd
+
+from evaluation import ensemble as ens
+
+
+# Columns of the metrics table
+metric_columns = ['bias', 'rmse', 'correlation', 'perkins_skill_score', 'ks_distance', 'std_ratio', 'centred_rmse']
+
+
+# Function definitions
+def get_perkins_skill_score(x, y, valid, bins=100):
+    """
+    This function calculates the Perkins skill score (sum of the minimum of the relative frequencies of two
+    distributions, 1: identical distributions) of the values of each row of x (rows: e.g. GCMs) and y, using the
+    valid values only. The bins cover the range of x and y in each row.
+    """
+
+    lo = np.minimum(np.where(valid, x, np.inf).min(axis=-1), np.where(valid, y, np.inf).min(axis=-1))
+    hi = np.maximum(np.where(valid, x, -np.inf).max(axis=-1), np.where(valid, y, -np.inf).max(axis=-1))
+    lo = np.where(np.isfinite(lo), lo, 0.)
+    width = np.where(np.isfinite(hi) & (hi > lo), hi - lo, 1.) / bins
+
+    row = np.broadcast_to(np.arange(x.shape[0])[:, np.newaxis], x.shape)[valid]
+    counts = []
+    for values in [x, y]:
+        idx = np.clip(((values[valid] - lo[row]) / width[row]).astype('int64'), 0, bins - 1)
+        counts.append(np.bincount(row * bins + idx, minlength=x.shape[0] * bins).reshape(x.shape[0], bins))
+
+    n = valid.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.minimum(counts[0], counts[1]).sum(axis=-1) / n
+
+
+def get_ks_distance(x, y, valid):
+    """
+    This function calculates the Kolmogorov-Smirnov distance (largest difference between the empirical cumulative
+    distribution functions) of the valid values of each row of x (rows: e.g. GCMs) and y. The values of x and y of a
+    row are sorted together, and the difference of the distribution functions is the cumulative sum of +1 (x) and
+    -1 (y) divided by the number of values, evaluated after the last of equal values.
+    """
+
+    n = valid.sum(axis=-1)
+    values = np.concatenate([np.where(valid, x, np.inf), np.where(valid, y, np.inf)], axis=-1)
+    signs = np.concatenate([np.ones(x.shape), -np.ones(y.shape)], axis=-1)
+    order = np.argsort(values, axis=-1, kind='mergesort')
+    values = np.take_along_axis(values, order, axis=-1)
+    difference = np.cumsum(np.take_along_axis(signs, order, axis=-1), axis=-1)
+
+    # only at the end of each run of equal values (and only for valid values)
+    last = np.concatenate([values[:, :-1] != values[:, 1:], np.ones((x.shape[0], 1), dtype=bool)], axis=-1)
+    last &= np.isfinite(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(last, np.abs(difference), 0).max(axis=-1) / np.where(n > 0, n, np.nan)
+
+
+def get_field_metrics(ref, sims, bins=100):
+    """
+    This function calculates the skill scores of the fields of several GCMs (2-D array: GCMs, grid cells) against
+    the reference field (1-D array: grid cells), for all GCMs at once. Only grid cells where both the GCM and the
+    reference have data are used. Returns a dictionary with an array (one value per GCM) for n (number of grid
+    cells), the metrics in metric_columns, and the standard deviations std_ref and std_sim.
+    """
+
+    x = np.asarray(sims, dtype='float64')
+    y = np.broadcast_to(np.asarray(ref, dtype='float64'), x.shape)
+    valid = np.isfinite(x) & np.isfinite(y)
+    n = valid.sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        difference = np.where(valid, x - y, 0)
+        bias = difference.sum(axis=-1) / n
+        rmse = np.sqrt((difference ** 2).sum(axis=-1) / n)
+
+        mean_x = np.where(valid, x, 0).sum(axis=-1) / n
+        mean_y = np.where(valid, y, 0).sum(axis=-1) / n
+        dx = np.where(valid, x - mean_x[:, np.newaxis], 0)
+        dy = np.where(valid, y - mean_y[:, np.newaxis], 0)
+        std_sim = np.sqrt((dx * dx).sum(axis=-1) / n)
+        std_ref = np.sqrt((dy * dy).sum(axis=-1) / n)
+        correlation = (dx * dy).sum(axis=-1) / n / (std_sim * std_ref)
+        centred_rmse = np.sqrt(((dx - dy) ** 2).sum(axis=-1) / n)
+
+    return collections.OrderedDict([
+        ('n', n),
+        ('bias', bias),
+        ('rmse', rmse),
+        ('correlation', correlation),
+        ('perkins_skill_score', get_perkins_skill_score(x, y, valid, bins=bins)),
+        ('ks_distance', get_ks_distance(x, y, valid)),
+        ('std_ratio', std_sim / std_ref),
+        ('centred_rmse', centred_rmse),
+        ('std_ref', std_ref),
+        ('std_sim', std_sim)])
+
+
+def get_metrics_table(ensemble, name_ref, var, statistic, region_masks=None, bins=100):
+    """
+    This function calculates the skill scores (see get_field_metrics) of all GCMs in an ensemble array (dimensions
+    source, time_scale, lat and lon, see evaluation.read_in.read_in_ensemble_mean_fields) for each region and
+    time scale. region_masks is an ordered dictionary with the region name and a boolean mask (lat, lon) of each
+    region (default: all grid cells, region 'Australia'). Returns a data frame with the columns region, var,
+    statistic, time_scale, source, n, the metrics in metric_columns, std_ref and std_sim.
+    """
+
+    if region_masks is None:
+        region_masks = collections.OrderedDict([('Australia', None)])
+
+    ref, sims = ens.split_ensemble(ensemble, name_ref)
+    tables = []
+    for region, region_mask in region_masks.items():
+        if region_mask is not None:
+            ref_region, sims_region = ref.where(region_mask), sims.where(region_mask)
+        else:
+            ref_region, sims_region = ref, sims
+        ref_values = ref_region.transpose('time_scale', 'lat', 'lon').values
+        sim_values = sims_region.transpose('time_scale', 'source', 'lat', 'lon').values
+
+        for i, time_scale in enumerate(ref_region['time_scale'].values):
+            metrics = get_field_metrics(ref_values[i].ravel(), sim_values[i].reshape(sim_values.shape[1], -1), bins=bins)
+            table = pd.DataFrame(collections.OrderedDict([('region', region), ('var', var), ('statistic', statistic),
+                                                          ('time_scale', time_scale),
+                                                          ('source', sims_region['source'].values)]))
+            for column, values in metrics.items():
+                table[column] = values
+            tables.append(table)
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def write_metrics_table(table, fn_table):
+    """
+    This function writes the metrics table to a CSV file, or to a Parquet file (columnar, needs pyarrow) if the
+    file name ends with .parquet. An existing file with the same content is not rewritten (its modification time
+    is kept, so the plots drawn from it stay up-to-date). Returns True if the file was written.
+    """
+    if fn_table.endswith('.parquet'):
+        if os.path.exists(fn_table) and pd.read_parquet(fn_table).equals(table.reset_index(drop=True)):
+            return False
+        table.to_parquet(fn_table, index=False)
+        return True
+
+    text = table.to_csv(index=False)
+    if os.path.exists(fn_table):
+        with open(fn_table, 'r', newline='') as f:
+            if f.read() == text:
+                return False
+    with open(fn_table, 'w', newline='') as f:
+        f.write(text)
+    return True
+
+
+def read_metrics_table(fn_table):
+    """
+    This function reads a metrics table written with write_metrics_table.
+    """
+    if fn_table.endswith('.parquet'):
+        return pd.read_parquet(fn_table)
+    return pd.read_csv(fn_table)
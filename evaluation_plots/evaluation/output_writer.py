@@ -0,0 +1,146 @@
+# Background writer for the plot files of the evaluation library.
+
+# Saving a plot at 300 dpi takes two steps: rendering the figure, and compressing the image to PNG and writing
+# it to disk (/g/data). Only the rendering needs the figure; the compression and the write are done in a small
+# pool of background threads, so that they overlap with reading the data and rendering the next plot.
+# The number of threads is set with 'n_writer_threads' in the config file (0: plots are saved directly).
+# At most n_threads + 1 images are waiting to be written, so that memory stays bounded. The writes of each
+# group of plot tasks are waited for at the end of the group, and failed writes are reported as failed
+# plot tasks in the summary (see evaluation.parallel).
+
+# Import libraries
+import io
+import traceback
+import concurrent.futures
+import numpy as np
+
+from evaluation import helpers
+
+Image = helpers.lazy_import('PIL.Image')
+
+
+# Module state (set in the main process with configure, inherited by the worker processes)
+_n_threads = 0
+_executor = None
+_pending = []
+_failed = []
+
+
+# Function definitions
+def configure(parameters=None, n_threads=None):
+    """
+    This function sets the number of background threads for writing plot files from 'n_writer_threads' in the
+    config file (or from n_threads). With 0 threads, plots are saved directly with savefig; this is the default
+    only if the setting is missing (config.json sets 2 threads).
+    """
+
+    global _n_threads, _executor
+
+    if n_threads is None and parameters is not None:
+        n_threads = parameters.get('n_writer_threads', None)
+
+    flush()
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+    _n_threads = max(int(n_threads or 0), 0)
+
+
+def is_enabled():
+    """
+    Returns True if plot files are written in the background.
+    """
+    return _n_threads > 0
+
+
+def get_figure(plot):
+    """
+    This function returns the matplotlib figure of a plot (matplotlib figure, seaborn grid or plotnine plot)
+    and the savefig arguments with which the plot is saved, both directly and in the background: seaborn grids
+    and plotnine plots are saved with a tight bounding box (as FacetGrid.savefig and ggplot.save of the plotnine
+    version of the evaluation environment do), and plotnine plots are drawn first.
+    """
+    if hasattr(plot, 'savefig') and hasattr(plot, 'canvas'):
+        return plot, dict()
+    if hasattr(plot, 'savefig'):
+        return getattr(plot, 'fig', None) or plot.figure, dict(bbox_inches='tight')
+    return plot.draw(), dict(bbox_inches='tight')
+
+
+def render_figure(fig, dpi=300, **kwargs):
+    """
+    This function renders a figure (like savefig) and returns the image as RGBA array (rows x columns x 4),
+    or None if the size of the rendered image cannot be determined.
+    """
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='rgba', dpi=dpi, **kwargs)
+
+    # size of the image (the renderer of the last draw is the one used by savefig)
+    renderer = getattr(fig.canvas, 'renderer', None)
+    if renderer is None:
+        return None
+    width, height = int(renderer.width), int(renderer.height)
+    if width * height * 4 != len(buffer.getvalue()):
+        return None
+
+    return np.frombuffer(buffer.getvalue(), dtype=np.uint8).reshape(height, width, 4)
+
+
+def write_image(image, fn_plot, dpi=300):
+    """
+    This function compresses an RGBA image to PNG and writes it to a file.
+    """
+    Image.fromarray(image).save(fn_plot, format='png', dpi=(dpi, dpi))
+
+
+def _wait(fn_plot, future):
+    """
+    This function waits for one write and keeps the file name and the error if the write failed.
+    """
+    try:
+        future.result()
+    except Exception:
+        _failed.append(dict(fn_plot=fn_plot, error=traceback.format_exc()))
+
+
+def save_figure(plot, fn_plot, dpi=300):
+    """
+    This function saves a plot (matplotlib figure, seaborn grid or plotnine plot) to a PNG file. If the
+    background writer is switched on, the figure is rendered to an image and the image is compressed and written
+    in the background. Otherwise (or for other file formats), the plot is saved directly. Both use the same
+    figure and savefig arguments (see get_figure), so that the files are the same.
+    """
+
+    global _executor
+
+    fig, kwargs = get_figure(plot)
+    if not is_enabled() or not fn_plot.lower().endswith('.png'):
+        fig.savefig(fn_plot, dpi=dpi, **kwargs)
+        return
+
+    image = render_figure(fig, dpi=dpi, **kwargs)
+    if image is None:
+        fig.savefig(fn_plot, dpi=dpi, **kwargs)
+        return
+
+    # wait for the oldest writes if too many images are waiting
+    while len(_pending) > _n_threads:
+        _wait(*_pending.pop(0))
+
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=_n_threads)
+    _pending.append((fn_plot, _executor.submit(write_image, image, fn_plot, dpi)))
+
+
+def flush():
+    """
+    This function waits until all plot files are written and returns a list of dictionaries with the file name
+    and the error of each failed write since the last flush.
+    """
+    while len(_pending) > 0:
+        _wait(*_pending.pop(0))
+
+    failed = list(_failed)
+    del _failed[:]
+    return failed
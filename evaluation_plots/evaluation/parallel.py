@@ -0,0 +1,219 @@
+# Parallel execution of plot tasks for the evaluation library.
+
+# Each evaluation script first enumerates its plot tasks (one task per output file) and then renders
+# them in a pool of worker processes. A task is a dictionary of keyword arguments for the script's
+# plotting function, and always contains the output file name 'fn_plot'.
+
+# Import libraries
+import os
+import sys
+import time
+import traceback
+import multiprocessing
+
+from evaluation import read_in
+from evaluation import instrumentation
+from evaluation import output_writer
+
+
+# Function definitions
+def get_number_of_workers(parameters=None):
+    """
+    This function returns the number of worker processes to use for plotting. The number is taken from
+    the 'n_workers' setting in the config file. If it is not set (None or 0), the number of CPUs of the
+    PBS job (NCPUS) is used, or the number of CPUs of the machine if the script is not run as a PBS job.
+    """
+
+    n_workers = None
+    if parameters is not None:
+        n_workers = parameters.get('n_workers', None)
+
+    if not n_workers:
+        if 'NCPUS' in os.environ:
+            n_workers = int(os.environ['NCPUS'])
+        else:
+            n_workers = multiprocessing.cpu_count()
+
+    return max(int(n_workers), 1)
+
+
+def _init_worker():
+    """
+    This function initialises the matplotlib state of a worker process: it uses the non-interactive
+    Agg backend, so that workers never try to open a display, and turns off warnings (as in the scripts).
+    """
+    import warnings; warnings.simplefilter('ignore')
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _close_figures():
+    """
+    This function closes all open matplotlib figures, so that figures are not kept in memory
+    from one task to the next.
+    """
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+
+
+def _run_task(task_idx, plot_function, task):
+    """
+    This function runs one plot task and catches all errors, so that a failing plot does not stop
+    the other plots. It returns a dictionary with the status and duration of the task.
+    """
+
+    # the lists of input and output files are only used for planning, they are not arguments of the plotting function
+    kwargs = dict([(key, value) for key, value in task.items() if key not in ['input_files', 'output_files']])
+
+    start = time.time()
+    error = None
+    with instrumentation.task() as measurements:
+        try:
+            plot_function(**kwargs)
+            status = 'done'
+        except Exception:
+            status = 'failed'
+            error = traceback.format_exc()
+        finally:
+            _close_figures()
+
+    return dict(task_idx=task_idx, fn_plot=task['fn_plot'], status=status,
+                error=error, duration=time.time() - start, measurements=measurements)
+
+
+def _run_group(args):
+    """
+    This function runs a group of plot tasks one after the other. Files read in by the tasks are kept in
+    memory until all tasks of the group are finished (see evaluation.read_in.cached_reads).
+    Plot files that are written in the background (see evaluation.output_writer) are waited for at the end
+    of the group, and tasks whose plot file could not be written are marked as failed.
+    """
+
+    group, plot_function = args
+
+    with read_in.cached_reads():
+        results = [_run_task(task_idx, plot_function, task) for task_idx, task in group]
+
+    errors = dict([(x['fn_plot'], x['error']) for x in output_writer.flush()])
+    for result in results:
+        if result['fn_plot'] in errors and result['status'] == 'done':
+            result['status'] = 'failed'
+            result['error'] = 'Writing the plot file failed:\n%s' % errors[result['fn_plot']]
+
+    return results
+
+
+def run_plot_tasks(plot_function, tasks, n_workers=1, maxtasksperchild=None, verbose=True):
+    """
+    This function runs the function plot_function for each task in tasks (a list of dictionaries with
+    keyword arguments, each containing the output file name 'fn_plot').
+    If n_workers is larger than 1, the tasks are rendered in a pool of worker processes. Failing tasks
+    are reported in the summary at the end and do not stop the other tasks.
+    Returns a list with one result dictionary per task, in the order of the tasks.
+    """
+    return run_plot_task_groups(plot_function, [[task] for task in tasks], n_workers=n_workers,
+                                maxtasksperchild=maxtasksperchild, verbose=verbose)
+
+
+def run_plot_task_groups(plot_function, groups, n_workers=1, maxtasksperchild=None, verbose=True):
+    """
+    This function runs the function plot_function for each task in groups of tasks (e.g. prepared with
+    evaluation.planner.plan_tasks). The tasks of one group are run one after the other in the same worker
+    process and share the files they read in. Different groups are run in parallel if n_workers is larger than 1.
+    Returns a list with one result dictionary per task, in the order of the tasks.
+    """
+
+    tasks = [task for group in groups for task in group]
+
+    # each task has to write to its own output file, otherwise workers would overwrite each other's plots
+    fn_plots = [task['fn_plot'] for task in tasks]
+    if len(set(fn_plots)) != len(fn_plots):
+        duplicates = sorted(set([x for x in fn_plots if fn_plots.count(x) > 1]))
+        raise ValueError('Several plot tasks write to the same file: %s' % ', '.join(duplicates))
+
+    # number the tasks, so that the results can be sorted in the order of the tasks
+    args = []
+    task_idx = 0
+    for group in groups:
+        args.append(([(task_idx + i, task) for i, task in enumerate(group)], plot_function))
+        task_idx = task_idx + len(group)
+
+    n_tasks = len(tasks)
+    n_workers = max(min(n_workers, len(groups)), 1)
+
+    print('Running %s plot tasks (%s groups) on %s worker(s)' % (n_tasks, len(groups), n_workers))
+    start = time.time()
+
+    results = []
+    if n_workers == 1:
+        _init_worker()
+        results_iterator = map(_run_group, args)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(n_workers, initializer=_init_worker, maxtasksperchild=maxtasksperchild)
+        results_iterator = pool.imap_unordered(_run_group, args)
+
+    try:
+        for group_results in results_iterator:
+            for result in group_results:
+                results.append(result)
+                if verbose:
+                    print('[%s/%s] %s (%.1fs): %s' % (len(results), n_tasks, result['status'],
+                                                     result['duration'], result['fn_plot']))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    results = sorted(results, key=lambda x: x['task_idx'])
+    duration = time.time() - start
+    print_summary(results, duration=duration)
+
+    if instrumentation.is_enabled():
+        instrumentation.write_report(results, duration=duration, n_workers=n_workers)
+
+    return results
+
+
+def map_tiles(function, args, n_workers=1, initializer=None, initargs=()):
+    """
+    This function applies a function to the arguments of each tile (an iterable, e.g. the values of a tile of grid
+    cells) and yields the results in the order of the tiles. With more than one worker, the tiles are processed in a
+    pool of worker processes (initializer is called with initargs in each worker, e.g. to send data that all tiles
+    need only once). Within a worker process of the plot tasks (daemon process), which cannot start a pool of its
+    own, the tiles are processed one after the other (after calling the initializer in this process).
+    """
+
+    if n_workers <= 1 or multiprocessing.current_process().daemon:
+        if initializer is not None:
+            initializer(*initargs)
+        for x in args:
+            yield function(x)
+        return
+
+    pool = multiprocessing.Pool(processes=n_workers, initializer=initializer or _init_worker, initargs=initargs)
+    try:
+        for result in pool.imap(function, args):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def print_summary(results, duration=None):
+    """
+    This function prints a summary of the plot tasks: number of completed and failed tasks, and the
+    error message of each failed task.
+    """
+
+    failed = [x for x in results if x['status'] == 'failed']
+
+    print('##### Summary')
+    print('- plots completed: %s' % (len(results) - len(failed)))
+    print('- plots failed: %s' % len(failed))
+    if duration is not None:
+        print('- wall time: %.1fs' % duration)
+
+    for result in failed:
+        print('Failed: %s' % result['fn_plot'])
+        print(result['error'])
@@ -0,0 +1,137 @@
+# Planning of plot tasks for the evaluation library.
+
+# The evaluation scripts create many plots from the same preprocessed files (e.g. the bias maps of all
+# regions use the same files for one GCM, variable and statistic). The planner removes plots that are
+# up-to-date and groups the remaining plots by the files they read in. All plots of one group are created
+# one after the other in the same worker process while the files are kept in memory
+# (see evaluation.read_in.cached_reads), so that each file is read only once. Groups that are larger than
+# the share of one worker are split, so that all workers have plots to create.
+# Files written by a previous stage of a script (e.g. the p-values of the bias maps) are input files of the plots,
+# so the plots are planned after that stage has run; a dry run lists them as pending files instead.
+
+# Import libraries
+import os
+import sys
+import math
+
+
+# Function definitions
+def is_up_to_date(task):
+    """
+    This function checks if the plot of a task (and the other files the task writes, the list 'output_files', if
+    any) exists and is newer than all of its input files. Input files that do not exist are ignored.
+    """
+
+    fn_outputs = [task['fn_plot']] + list(task.get('output_files', []))
+    if not all([os.path.exists(fn) for fn in fn_outputs]):
+        return False
+
+    time_plot = min([os.path.getmtime(fn) for fn in fn_outputs])
+    for fn in task.get('input_files', []):
+        if os.path.exists(fn) and os.path.getmtime(fn) > time_plot:
+            return False
+
+    return True
+
+
+def get_file_size(fn):
+    """
+    This function returns the size of a file in bytes (0 if the file does not exist).
+    """
+    if os.path.exists(fn):
+        return os.path.getsize(fn)
+    return 0
+
+
+def plan_tasks(tasks, skip_existing=True, shared_reads=True, n_workers=1, pending_files=None):
+    """
+    This function prepares the plot tasks for rendering:
+    1) if skip_existing is True, tasks with a plot that is up-to-date (see is_up_to_date) are removed, except for
+       tasks reading one of the pending_files (files that a previous stage will write, see get_planned_files),
+    2) the remaining tasks are grouped by their input files (tasks with the same input files form one group),
+    3) the groups are sorted by their input files, so that groups sharing some of their files are close to each other,
+    4) groups with more than 1 / n_workers of the tasks are split, so that all workers have plots to create (the
+       files of a split group are read once per part).
+    Each task can have the key 'input_files' with the list of files it reads in, and the key 'output_files' with
+    the files it writes besides fn_plot (e.g. a second diagram of the same data). Tasks without input files
+    form a group of their own. If the plots do not share their reads (shared_reads is False, e.g. if the files are
+    read with xr.open_mfdataset or only single grid cells are read, which are not kept by
+    evaluation.read_in.cached_reads), each task forms a group of its own.
+    Returns a list of groups, each group is a list of tasks.
+    """
+
+    if skip_existing:
+        pending_files = set(pending_files or [])
+        tasks = [task for task in tasks
+                 if not is_up_to_date(task) or len(pending_files.intersection(task.get('input_files', []))) > 0]
+
+    groups = dict()
+    for task_idx, task in enumerate(tasks):
+        input_files = tuple(sorted(set(task.get('input_files', []))))
+        if len(input_files) == 0 or not shared_reads:
+            input_files = input_files + ('', task_idx) # no input files or no shared reads: own group
+        if input_files not in groups:
+            groups[input_files] = []
+        groups[input_files].append(task)
+
+    # sort groups by their input files (and the tasks in each group by file name), so that the order is deterministic
+    group_keys = sorted(groups.keys(), key=lambda x: [str(y) for y in x])
+    groups = [sorted(groups[key], key=lambda x: x['fn_plot']) for key in group_keys]
+
+    # split large groups, so that one worker does not create most of the plots while the others are idle
+    if n_workers > 1 and len(tasks) > 0:
+        max_group_size = int(math.ceil(len(tasks) / float(n_workers)))
+        groups = [group[start:start + max_group_size] for group in groups
+                  for start in range(0, len(group), max_group_size)]
+
+    return groups
+
+
+def get_planned_files(groups):
+    """
+    This function returns the set of the files that the planned tasks (see plan_tasks) will write.
+    """
+    tasks = [task for group in groups for task in group]
+    return set([fn for task in tasks for fn in [task['fn_plot']] + list(task.get('output_files', []))])
+
+
+def print_plan(groups):
+    """
+    This function prints the planned plots and reads (dry run): the plots of each group, the files read in
+    by each group and the total number of bytes to read, with and without grouping.
+    """
+
+    n_tasks = sum([len(group) for group in groups])
+    bytes_grouped = 0
+    bytes_ungrouped = 0
+    files_read = set()
+
+    print('##### Planned plots: %s in %s groups' % (n_tasks, len(groups)))
+    for group_idx, group in enumerate(groups):
+        input_files = sorted(set(group[0].get('input_files', [])))
+        group_bytes = sum([get_file_size(fn) for fn in input_files])
+        bytes_grouped = bytes_grouped + group_bytes
+        bytes_ungrouped = bytes_ungrouped + group_bytes * len(group)
+        files_read.update(input_files)
+
+        print('- Group %s: %s plot(s), %s file(s), %.1f MB' % (group_idx + 1, len(group), len(input_files), group_bytes / 1e6))
+        for task in group:
+            print('    plot: %s' % task['fn_plot'])
+        for fn in input_files:
+            if os.path.exists(fn):
+                print('    read: %s' % fn)
+            else:
+                print('    read: %s (missing)' % fn)
+
+    print('##### Summary')
+    print('- plots to create: %s' % n_tasks)
+    print('- files to read: %s (%s unique)' % (sum([len(set(group[0].get('input_files', []))) for group in groups]), len(files_read)))
+    print('- bytes to read: %.1f MB (%.1f MB without grouping)' % (bytes_grouped / 1e6, bytes_ungrouped / 1e6))
+
+
+def is_dry_run():
+    """
+    Returns True if the script was called with the argument --dry-run. In a dry run, the scripts only
+    print the planned plots and reads, and do not create any plots.
+    """
+    return '--dry-run' in sys.argv
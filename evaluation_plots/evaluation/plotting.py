@@ -5,24 +5,42 @@
 
 # Import libraries
 import numpy as np
-
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotnine as pn
-from plotnine import *
-
-from mpl_toolkits.basemap import Basemap
-import cartopy.crs as ccrs
-import cartopy.feature as cfeat
-import matplotlib.animation as animation
+import pandas as pd
 
 from evaluation.helpers import *
+from evaluation import instrumentation
+from evaluation import maps
+from evaluation import distributions
+from evaluation import spatial_correlation
+from evaluation import spectral
+from evaluation import output_writer
+from evaluation import animations
+from evaluation import summaries
+from evaluation import significance
+from evaluation import autocorrelation
+from evaluation import extremes
+
+# the plotting and mapping libraries are only imported when they are used for the first time (see lazy_import)
+plt = lazy_import('matplotlib.pyplot')
+colors = lazy_import('matplotlib.colors')
+sns = lazy_import('seaborn')
+pn = lazy_import('plotnine')
 
 
 # Function definitions
+def save_figure(plot, fn_plot, dpi=300):
+    """
+    This function saves a matplotlib figure (or seaborn grid) or a plotnine plot to a file and creates the
+    containing folder if needed. Note that plotnine plots are only drawn when they are saved. If the background
+    writer is switched on, the PNG file is written in the background (see evaluation.output_writer).
+    """
+    with instrumentation.step('savefig', label=fn_plot):
+        create_containing_folder(fn_plot)
+        output_writer.save_figure(plot, fn_plot, dpi=dpi)
+
 
 # 01a) Bias maps #################################################################
-# TODO: uses Basemap - change to cartopy
+@instrumentation.timed('render')
 def plot_bias(datasets, name_ref, name_sim, var,
               statistic, year_start, year_end,
               unit=None, region='AU',
@@ -31,12 +49,21 @@ def plot_bias(datasets, name_ref, name_sim, var,
                          urcrnrlat=-10.7,
                          llcrnrlon=112,
                          urcrnrlon=156.25),
-              fn_plot=None, adjust=0.90):
+              fn_plot=None, adjust=0.90, map_backend='basemap', map_render_mode='mesh',
+              p_values=None, significance_level=0.05, fdr=True):
 
     """
     This function creates a plot with a) the 30-year mean for the historical reference,
     b) the simulated / bias corrected data, c) the absolute/relative bias of both, for
     annual and seasonal values.
+    map_backend is the library for the coastlines and states: basemap or cartopy (see evaluation.maps).
+    map_render_mode is mesh (exact, one quadrilateral per grid cell) or raster (faster, one image per panel).
+    p_values are the p-values of the bias (dimensions time_scale, lat and lon, see
+    evaluation.significance.get_bias_p_values). If given, grid cells with a significant bias (at the
+    significance_level, with false discovery rate control if fdr is True) are stippled in the bias maps.
+    If fn_plot is given, the plot is drawn in the map template of this process (see evaluation.maps), which is
+    reused for the next plot with the same region and layout: the plot is saved and None is returned. Otherwise,
+    a new figure is created and returned.
     """
     
     # plot absolute bias for temperature, else relative bias
@@ -46,14 +73,17 @@ def plot_bias(datasets, name_ref, name_sim, var,
     #     plot_bias_type = 'bias_rel'
     plot_bias_type = 'bias_abs'
 
-    # create a map
-    map = Basemap(resolution='c', **coordinates)
     types = [name_ref, name_sim, plot_bias_type]
+
+    if p_values is not None:
+        significant = significance.get_significance_mask(p_values, significance_level, fdr)
    
-    # create a figure
+    # get the figure with the map layers for this region and layout (created once per process, see evaluation.maps);
+    # without fn_plot, the figure is returned to the caller and therefore not shared with other plots
     nrows = len(time_scales)
     ncols = len(types)
-    fig, axes = plt.subplots(nrows=nrows,ncols=ncols,figsize=(3.33*ncols,2.4*nrows))
+    template = maps.get_map_template(coordinates, nrows, ncols, figsize=(3.33*ncols,2.4*nrows), backend=map_backend,
+                                     reuse=fn_plot is not None)
 
     # loop through columns and rows
     # 3 colums: mean of reference, mean of GCM, bias
@@ -63,7 +93,6 @@ def plot_bias(datasets, name_ref, name_sim, var,
         for col_idx in range(len(types)):
             
             ds = None # set dataset to plot to Null before reading in new data
-            ax = axes[row_idx, col_idx]
             
             type = types[col_idx]
             time_scale = time_scales[row_idx]
@@ -137,20 +166,14 @@ def plot_bias(datasets, name_ref, name_sim, var,
             elif time_scale in ['DJF', 'MAM', 'JJA', 'SON']:
                 ds = datasets['seasonal'][type].sel(season=time_scale)
             
+            field = ds[var]
+
             # multiply with 100 for relative bias in percent
             if type == 'bias_rel':
-                ds[var].values = ds[var].values * 100
+                field = field * 100
                         
-            # create plot
-            ds[var].plot.pcolormesh(ax=ax, vmin=vmin, vmax=vmax, levels=levels, extend=extend,cmap=cmap, cbar_kwargs={'label':legend_title})
-            # using imshow: coastlines do not match
-            # ds[var].plot.imshow(ax=ax, vmin=vmin, vmax=vmax, cmap=cmap, cbar_kwargs={'label':legend_title})
-            
-            # turn off borders
-            ax.axis('off')
-            
             # add title
-            mean = np.float(ds[var].mean())
+            mean = float(field.mean())
             if plot_bias_type == 'bias_abs':
                 plot_title = [name_ref.upper(), name_sim.upper(), 'Abs. bias'][col_idx]
             elif plot_bias_type == 'bias_rel':
@@ -159,27 +182,32 @@ def plot_bias(datasets, name_ref, name_sim, var,
                 plot_title = '%s (%s) \nMean: %.2f%s' % (plot_title, time_scale, mean, unit)
             else: 
                 plot_title = '%s (%s) \nMean: %.2f' % (plot_title, time_scale, mean)
-            ax.set_title(plot_title, fontsize=10)
-            
-            # add map
-            map.drawcoastlines(ax=ax, linewidth=0.2)
-            map.drawstates(ax=ax, linewidth=0.1)
 
-    plt.tight_layout()
-    plt.subplots_adjust(top=adjust)
-    x=fig.suptitle('%s: %s vs %s\nRegion: %s, Period: %s-%s' % (get_variable_longname(var), 
-                                                         name_sim.upper(), name_ref.upper(), region,
-                                                         year_start,year_end), fontsize=16)
+            # create plot
+            template.draw_panel(row_idx, col_idx, field, vmin=vmin, vmax=vmax, cmap=cmap, levels=levels, extend=extend,
+                                title=plot_title, legend_title=legend_title, mode=map_render_mode)
+
+            # stipple grid cells with a significant bias
+            if p_values is not None and type == plot_bias_type:
+                template.draw_stippling(row_idx, col_idx, significant.sel(time_scale=time_scale, drop=True).reindex_like(
+                    field, fill_value=False) & field.notnull())
+
+    suptitle = '%s: %s vs %s\nRegion: %s, Period: %s-%s' % (get_variable_longname(var), name_sim.upper(),
+                                                             name_ref.upper(), region, year_start, year_end)
+    if p_values is not None:
+        suptitle = '%s, dots: significant bias (p < %g%s)' % (suptitle, significance_level, ', FDR' if fdr else '')
+    template.set_suptitle(suptitle, adjust=adjust)
 
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        fig.savefig(fn_plot, dpi=300)
+        save_figure(template.fig, fn_plot, dpi=300)
+        return None
 
-    return fig
+    return template.fig
     
 # 01b) Bias maps lag-1 correlation #################################################################
 # similar to maps of the mean bias as previous function, but the difference is
 # that it creates one map for annual, seasonal and monthly, rather than the different seasons
+@instrumentation.timed('render')
 def plot_bias_corr(datasets, name_ref, name_sim, var,
               year_start, year_end, correlation_type='lag1corr',
               unit=None, region='AU',
@@ -188,22 +216,31 @@ def plot_bias_corr(datasets, name_ref, name_sim, var,
                          urcrnrlat=-10.7,
                          llcrnrlon=112,
                          urcrnrlon=156.25),
-              fn_plot=None, adjust=0.83):
+              fn_plot=None, adjust=0.83, map_backend='basemap', map_render_mode='mesh'):
 
     """
     This function creates a plot with a) the 30-year mean for the historical reference,
     b) the simulated / bias corrected data, c) the absolute/relative bias of both, for
     annual and seasonal values.
+    correlation_type is lag1corr (the lag-1 correlation of the preprocessing), lag<k>corr (the correlation of lag k)
+    or decorrelation_time (in time steps), see evaluation.autocorrelation.get_correlation_field.
+    map_backend is the library for the coastlines and states: basemap or cartopy (see evaluation.maps).
+    map_render_mode is mesh (exact, one quadrilateral per grid cell) or raster (faster, one image per panel).
+    If fn_plot is given, the plot is saved and None is returned (the figure is reused, see plot_bias), otherwise
+    a new figure is returned.
     """
     
-    # create a map
-    map = Basemap(resolution='c', **coordinates)
     types = [name_ref, name_sim, 'bias']
+    is_decorrelation_time = correlation_type == 'decorrelation_time'
+    if not is_decorrelation_time:
+        correlation_title = 'Lag-%s correlation' % correlation_type[len('lag'):-len('corr')]
    
-    # create a figure
+    # get the figure with the map layers for this region and layout (created once per process, see evaluation.maps);
+    # without fn_plot, the figure is returned to the caller and therefore not shared with other plots
     nrows = len(time_scales)
     ncols = len(types)
-    fig, axes = plt.subplots(nrows=nrows,ncols=ncols,figsize=(3.33*ncols,2.4*nrows))
+    template = maps.get_map_template(coordinates, nrows, ncols, figsize=(3.33*ncols,2.4*nrows), backend=map_backend,
+                                     reuse=fn_plot is not None)
 
     # loop through columns and rows
     # 3 colums: mean of reference, mean of GCM, bias
@@ -213,20 +250,41 @@ def plot_bias_corr(datasets, name_ref, name_sim, var,
         for col_idx in range(len(types)):
             
             ds = None # set dataset to plot to Null before reading in new data
-            ax = axes[row_idx, col_idx]
             
             type = types[col_idx]
             time_scale = time_scales[row_idx]
             
             # set plotting parameters
 
-            if type in [name_ref, name_sim]:
+            # read in data to plot
+            ds = datasets[time_scale]['%s_%s' % (type, correlation_type)]
+            if 'time' in ds.dims:
+                ds = ds.isel(time=0)
+
+            if is_decorrelation_time:
+                # the same colour range for both datasets of a time scale, so that the maps are comparable
+                unit_str = autocorrelation.time_step_units.get(time_scale, 'time steps')
+                if type in [name_ref, name_sim]:
+                    vmin = 1
+                    vmax = max(get_symmetric_limit(np.concatenate([datasets[time_scale]['%s_%s' % (x, correlation_type)][var].values.ravel()
+                                                                   for x in [name_ref, name_sim]])), 1.5)
+                    cmap = plt.get_cmap('YlGnBu', 10)
+                    legend_title = 'Decorrelation time (%s)' % unit_str
+                    extend = 'max'
+                else:
+                    vmax = get_symmetric_limit(ds[var].values)
+                    vmin = -vmax
+                    cmap = plt.get_cmap('RdBu', 11)
+                    legend_title = 'Bias (%s)' % unit_str
+                    extend = 'both'
+
+            elif type in [name_ref, name_sim]:
                 # Set vmax to the maximum value for this time scale (annual, seasonal, monthly), so that
                 # the plots are comparable
                 vmin = -1
                 vmax = 1
                 cmap = plt.get_cmap('RdBu', 10)
-                legend_title = 'Lag-1 correlation'
+                legend_title = correlation_title
                 
             elif type == 'bias':
                 vmax = 1
@@ -237,86 +295,326 @@ def plot_bias_corr(datasets, name_ref, name_sim, var,
                 legend_title = 'Bias (abs)'
                 
             levels = None
-            extend = 'neither'
+            if not is_decorrelation_time:
+                extend = 'neither'
 
             cmap.set_bad('#f0f0f0')
             cmap.colorbar_extend = True
-                 
-            # read in data to plot
-            ds = datasets[time_scale]['%s_%s' % (type, correlation_type)].isel(time=0)
                         
-            # create plot
-            ds[var].plot.pcolormesh(ax=ax, vmin=vmin, vmax=vmax, levels=levels, extend=extend,cmap=cmap, cbar_kwargs={'label':legend_title})
-            # using imshow: coastlines do not match
-            # ds[var].plot.imshow(ax=ax, vmin=vmin, vmax=vmax, cmap=cmap, cbar_kwargs={'label':legend_title})
-            
-            # turn off borders
-            ax.axis('off')
-            
             # add title
-            mean = np.float(ds[var].mean())
+            mean = float(ds[var].mean())
             plot_title = [name_ref.upper(), name_sim.upper(), 'Abs. bias'][col_idx]
             plot_title = '%s (%s) \nMean: %.2f' % (plot_title, time_scale, mean)
-            ax.set_title(plot_title, fontsize=10)
-            
-            # add map
-            map.drawcoastlines(ax=ax, linewidth=0.2)
-            map.drawstates(ax=ax, linewidth=0.1)
 
-    plt.tight_layout()
-    plt.subplots_adjust(top=adjust)
-    x=fig.suptitle('%s: %s vs %s\nRegion: %s, Period: %s-%s' % (get_variable_longname(var), 
+            # create plot
+            template.draw_panel(row_idx, col_idx, ds[var], vmin=vmin, vmax=vmax, cmap=cmap, levels=levels, extend=extend,
+                                title=plot_title, legend_title=legend_title, mode=map_render_mode)
+
+    template.set_suptitle('%s (%s): %s vs %s\nRegion: %s, Period: %s-%s' % (get_variable_longname(var),
+                                                         'decorrelation time' if is_decorrelation_time else correlation_title.lower(),
                                                          name_sim.upper(), name_ref.upper(), region,
-                                                         year_start,year_end), fontsize=16)
+                                                         year_start,year_end), adjust=adjust)
 
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        fig.savefig(fn_plot, dpi=300)
+        save_figure(template.fig, fn_plot, dpi=300)
+        return None
+
+    return template.fig
+
+
+# 01c) Bias maps trend #################################################################
+def get_symmetric_limit(values, percentile=98):
+    """
+    This function returns the limit of a colour range that is symmetric around 0: a percentile of the absolute
+    values (ignoring NaN values), at least 1e-6.
+    """
+    values = np.abs(np.asarray(values, dtype='float64'))
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return 1e-6
+    return max(float(np.percentile(values, percentile)), 1e-6)
+
+
+
+# maps of the trend (Sen's slope) of the reference and the simulated data and the bias in the trend, for annual
+# and seasonal values; grid cells with a significant trend (Mann-Kendall test) are stippled
+@instrumentation.timed('render')
+def plot_bias_trend(trends, name_ref, name_sim, var,
+              statistic, year_start, year_end,
+              unit=None, region='AU',
+              time_scales = ['annual', 'DJF', 'MAM', 'JJA', 'SON'],
+              coordinates=dict(llcrnrlat=-44.5,
+                         urcrnrlat=-10.7,
+                         llcrnrlon=112,
+                         urcrnrlon=156.25),
+              fn_plot=None, adjust=0.90, map_backend='basemap', map_render_mode='mesh',
+              significance_level=0.05, fdr=True):
+
+    """
+    This function creates a plot with a) the trend of the historical reference, b) the trend of the simulated /
+    bias corrected data, c) the bias in the trend (simulated minus reference), for annual and seasonal values.
+    trends is a dictionary with the trends of name_ref and name_sim (xarray datasets with the variables slope and
+    p_value, see evaluation.trends.get_trend_fields). The trends are shown per decade. Grid cells with a significant
+    trend (at the significance_level, with false discovery rate control if fdr is True) are stippled.
+    map_backend is the library for the coastlines and states: basemap or cartopy (see evaluation.maps).
+    map_render_mode is mesh (exact, one quadrilateral per grid cell) or raster (faster, one image per panel).
+    If fn_plot is given, the plot is saved and None is returned (the figure is reused, see plot_bias), otherwise
+    a new figure is returned.
+    """
+
+    types = [name_ref, name_sim, 'bias']
+
+    # trends per decade, and the bias in the trend on the grid cells of both datasets
+    slopes = dict([(x, trends[x]['slope'] * 10) for x in [name_ref, name_sim]])
+    slopes['bias'] = slopes[name_sim] - slopes[name_ref]
+    significant = dict([(x, significance.get_significance_mask(trends[x]['p_value'], significance_level, fdr))
+                        for x in [name_ref, name_sim]])
+
+    # get the figure with the map layers for this region and layout (created once per process, see evaluation.maps);
+    # without fn_plot, the figure is returned to the caller and therefore not shared with other plots
+    nrows = len(time_scales)
+    ncols = len(types)
+    template = maps.get_map_template(coordinates, nrows, ncols, figsize=(3.33*ncols,2.4*nrows), backend=map_backend,
+                                     reuse=fn_plot is not None)
+
+    unit_str = '%s/decade' % unit if unit is not None else 'per decade'
+
+    for row_idx in range(len(time_scales)):
+        time_scale = time_scales[row_idx]
+
+        # the same colour range for both trends of a time scale, so that the maps are comparable (98th percentile
+        # of the absolute trends, so that single grid cells do not set the range)
+        vmax_trend = get_symmetric_limit(np.concatenate([slopes[x].sel(time_scale=time_scale).values.ravel()
+                                                         for x in [name_ref, name_sim]]))
+
+        for col_idx in range(len(types)):
+
+            type = types[col_idx]
+            field = slopes[type].sel(time_scale=time_scale, drop=True)
+
+            if type in [name_ref, name_sim]:
+                vmax = vmax_trend
+                legend_title = 'Trend (%s)' % unit_str
+            else:
+                vmax = get_symmetric_limit(field.values)
+                legend_title = 'Bias in trend (%s)' % unit_str
+
+            if var in ['temp_min_day', 'temp_max_day', 'solar_exposure_day']:
+                cmap = plt.get_cmap('RdBu_r', 11)
+            else:
+                cmap = plt.get_cmap('RdBu', 11)
+            cmap.set_bad('#f0f0f0')
+
+            # add title
+            mean = float(field.mean())
+            plot_title = [name_ref.upper(), name_sim.upper(), 'Bias in trend'][col_idx]
+            plot_title = '%s (%s) \nMean: %.2f %s' % (plot_title, time_scale, mean, unit_str)
+
+            # create plot
+            template.draw_panel(row_idx, col_idx, field, vmin=-vmax, vmax=vmax, cmap=cmap, extend='both',
+                                title=plot_title, legend_title=legend_title, mode=map_render_mode)
+
+            # stipple grid cells with a significant trend
+            if type in [name_ref, name_sim]:
+                template.draw_stippling(row_idx, col_idx, significant[type].sel(time_scale=time_scale, drop=True)
+                                        & field.notnull())
+
+    suptitle = '%s (%s): trend of %s vs %s\nRegion: %s, Period: %s-%s, dots: significant trend (p < %g%s)' % (
+        get_variable_longname(var), statistic, name_sim.upper(), name_ref.upper(), region, year_start, year_end,
+        significance_level, ', FDR' if fdr else '')
+    template.set_suptitle(suptitle, adjust=adjust)
+
+    if fn_plot is not None:
+        save_figure(template.fig, fn_plot, dpi=300)
+        return None
+
+    return template.fig
+
+
+# 01a) Bias maps of the ensemble of all GCMs ##########################################################
+# maps of the reference data, the ensemble mean of the GCMs, the bias of the ensemble mean and the agreement of
+# the GCMs on the sign of the bias, for annual and seasonal values
+@instrumentation.timed('render')
+def plot_ensemble_bias(statistics, name_ref, name_sim_prefix, var,
+                       statistic, year_start, year_end,
+                       unit=None, region='AU',
+                       time_scales = ['annual', 'DJF', 'MAM', 'JJA', 'SON'],
+                       coordinates=dict(llcrnrlat=-44.5,
+                                        urcrnrlat=-10.7,
+                                        llcrnrlon=112,
+                                        urcrnrlon=156.25),
+                       fn_plot=None, adjust=0.90, map_backend='basemap', map_render_mode='mesh',
+                       agreement_level=0.8):
+
+    """
+    This function creates a plot with a) the mean of the historical reference, b) the ensemble mean of the GCMs,
+    c) the bias of the ensemble mean and d) the fraction of the GCMs whose bias has the same sign as the bias of the
+    ensemble mean, for annual and seasonal values. statistics is the dataset of the ensemble statistics (see
+    evaluation.ensemble.get_ensemble_statistics). Grid cells where at least agreement_level of the GCMs agree on
+    the sign of the bias are stippled in the bias maps.
+    map_backend is the library for the coastlines and states: basemap or cartopy (see evaluation.maps).
+    map_render_mode is mesh (exact, one quadrilateral per grid cell) or raster (faster, one image per panel).
+    If fn_plot is given, the plot is saved and None is returned (the figure is reused, see plot_bias), otherwise
+    a new figure is returned.
+    """
+
+    types = ['reference', 'ensemble_mean', 'ensemble_bias', 'sign_agreement']
+    titles = [name_ref.upper(), 'Ensemble mean', 'Bias of ensemble mean', 'Sign agreement']
+    n_gcms = int(statistics['n_gcms'].max())
+
+    # get the figure with the map layers for this region and layout (created once per process, see evaluation.maps);
+    # without fn_plot, the figure is returned to the caller and therefore not shared with other plots
+    nrows = len(time_scales)
+    ncols = len(types)
+    template = maps.get_map_template(coordinates, nrows, ncols, figsize=(3.33*ncols,2.4*nrows), backend=map_backend,
+                                     reuse=fn_plot is not None)
+
+    for row_idx in range(len(time_scales)):
+        time_scale = time_scales[row_idx]
+
+        for col_idx in range(len(types)):
+
+            type = types[col_idx]
+            field = statistics[type].sel(time_scale=time_scale, drop=True)
+
+            if type in ['reference', 'ensemble_mean']:
+                # the same colour range for the reference and the ensemble mean, so that the maps are comparable
+                vmin = 0
+                vmax = np.ceil(max([float(statistics[x].sel(time_scale=time_scale).max())
+                                    for x in ['reference', 'ensemble_mean']]))
+                if var in ['temp_min_day', 'temp_max_day', 'solar_exposure_day']:
+                    cmap = plt.get_cmap('Reds', 10)
+                else:
+                    cmap = plt.get_cmap('Blues', 10)
+                legend_title = '%s (%s)' % (get_variable_longname(var), unit) if unit is not None else get_variable_longname(var)
+                extend = 'both'
+            elif type == 'ensemble_bias':
+                vmin = None
+                vmax = None
+                if var in ['temp_min_day', 'temp_max_day', 'solar_exposure_day']:
+                    cmap = plt.get_cmap('RdBu_r', 11)
+                else:
+                    cmap = plt.get_cmap('RdBu', 11)
+                cmap.set_under('#addd8e')
+                cmap.set_over('#dd1c77')
+                legend_title = 'Bias (%s)' % unit if unit is not None else 'Bias (abs)'
+                extend = 'both'
+            else:
+                vmin = 0
+                vmax = 1
+                cmap = plt.get_cmap('viridis', 10)
+                legend_title = 'Fraction of GCMs'
+                extend = 'neither'
+            cmap.set_bad('#f0f0f0')
+
+            # add title
+            mean = float(field.mean())
+            if unit is not None and type != 'sign_agreement':
+                plot_title = '%s (%s) \nMean: %.2f%s' % (titles[col_idx], time_scale, mean, unit)
+            else:
+                plot_title = '%s (%s) \nMean: %.2f' % (titles[col_idx], time_scale, mean)
+
+            # create plot
+            template.draw_panel(row_idx, col_idx, field, vmin=vmin, vmax=vmax, cmap=cmap, extend=extend,
+                                title=plot_title, legend_title=legend_title, mode=map_render_mode)
+
+            # stipple grid cells where the GCMs agree on the sign of the bias
+            if type == 'ensemble_bias':
+                agreement = statistics['sign_agreement'].sel(time_scale=time_scale, drop=True)
+                template.draw_stippling(row_idx, col_idx, (agreement >= agreement_level) & field.notnull())
+
+    suptitle = '%s (%s): ensemble of %s %s GCMs vs %s\nRegion: %s, Period: %s-%s, dots: at least %d%% of the GCMs agree on the sign of the bias' % (
+        get_variable_longname(var), statistic, n_gcms, name_sim_prefix.upper(), name_ref.upper(), region, year_start,
+        year_end, round(agreement_level * 100))
+    template.set_suptitle(suptitle, adjust=adjust)
+
+    if fn_plot is not None:
+        save_figure(template.fig, fn_plot, dpi=300)
+        return None
+
+    return template.fig
 
-    return fig
-    
 
 # 02) Boxplots of bias #################################################################
 def plot_boxplots(dataframe, x, y, var, name_ref, name_sim_prefix, statistic=None,
                  col='time_scale', row='statistic', showfliers=False,
                  palette='Blues', height=3, aspect=1.2, adjust=0.7,
                  fn_plot=None):
-    
+    """
+    This function creates box plots of the values in a long data frame (e.g. the output of
+    prepare_dataframes_for_all_gcms_and_statistics): one box per value of x in each panel (rows: row, columns: col).
+    The box statistics are calculated first (see evaluation.summaries) and drawn with plot_box_statistics.
+    """
+
+    with instrumentation.step('aggregate'):
+        box_statistics = summaries.get_box_statistics_table(dataframe, var, [row, col, x])
+
+    plot_box_statistics(box_statistics, var=var, name_ref=name_ref, name_sim_prefix=name_sim_prefix,
+                        statistic=statistic, x=x, col=col, row=row, showfliers=showfliers, palette=palette,
+                        height=height, aspect=aspect, adjust=adjust, fn_plot=fn_plot)
+
+
+@instrumentation.timed('render')
+def plot_box_statistics(box_statistics, var, name_ref, name_sim_prefix, statistic=None,
+                        x='type', col='time_scale', row='statistic', showfliers=False,
+                        palette='Blues', height=3, aspect=1.2, adjust=0.7,
+                        fn_plot=None):
+    """
+    This function draws box plots from precalculated box statistics (one row per box with the columns x, col, row,
+    whislo, q1, med, q3, whishi and fliers, see evaluation.summaries.prepare_box_statistics_for_all_gcms_and_statistics),
+    with the layout of seaborn's catplot: one box per value of x in each panel (rows: row, columns: col).
+    """
+
+    rows = list(pd.unique(box_statistics[row]))
+    cols = list(pd.unique(box_statistics[col]))
+    boxes = list(pd.unique(box_statistics[x]))
+    box_colors = sns.color_palette(palette, len(boxes))
+
     # create plot
-    plot = sns.catplot(data=dataframe, kind='box', sharey='row',
-                               showfliers=showfliers,
-                               x=x, y=var,
-                               col=col, row=row,
-                               palette=palette, height=height, aspect=aspect)
+    fig, axes = plt.subplots(nrows=len(rows), ncols=len(cols), sharey='row', squeeze=False,
+                             figsize=(height * aspect * len(cols), height * len(rows)))
+    for i, row_value in enumerate(rows):
+        for j, col_value in enumerate(cols):
+            ax = axes[i, j]
+            panel = box_statistics[(box_statistics[row] == row_value) & (box_statistics[col] == col_value)]
+            stats = [dict(med=r['med'], q1=r['q1'], q3=r['q3'], whislo=r['whislo'], whishi=r['whishi'],
+                          fliers=r['fliers'], label=r[x]) for r in panel.to_dict('records')]
+            positions = [boxes.index(value) for value in panel[x]]
+            artists = ax.bxp(stats, positions=positions, widths=0.8, showfliers=showfliers, patch_artist=True,
+                             boxprops=dict(edgecolor='0.25'), whiskerprops=dict(color='0.25'),
+                             capprops=dict(color='0.25'), medianprops=dict(color='0.25'),
+                             flierprops=dict(marker='d', markersize=3, markerfacecolor='0.25', markeredgecolor='0.25'))
+            for patch, position in zip(artists['boxes'], positions):
+                patch.set_facecolor(box_colors[position])
+
+            ax.set_xlim(-0.5, len(boxes) - 0.5)
+            ax.set_xticks(range(len(boxes)))
+            ax.set_xticklabels(boxes if i == len(rows) - 1 else [])
+            ax.set_xlabel(x if i == len(rows) - 1 else '')
+            ax.set_ylabel(var if j == 0 else '')
+            ax.set_title('%s = %s | %s = %s' % (row, row_value, col, col_value))
+            for side in ['top', 'right']:
+                ax.spines[side].set_visible(False)
+    fig.tight_layout()
 
     # add title
     plt.subplots_adjust(top=adjust)
-    if statistic is None:
-        statistic_str = 'statistics'
-    else:
-        statistic_str = statistic
-    if showfliers:
-        plot_title = '%s (annual and seasonal %s) %s run vs %s' % \
-        (get_variable_longname(var), statistic_str, name_sim_prefix.upper(), name_ref.upper())
-    else:
-        plot_title = '%s (annual and seasonal %s) %s run vs %s\n--note: not showing outliers--' % \
-        (get_variable_longname(var), statistic_str, name_sim_prefix.upper(), name_ref.upper())
     if showfliers:
         plot_title = '%s (annual and seasonal statistics) %s run vs %s' % \
         (get_variable_longname(var), name_sim_prefix.upper(), name_ref.upper())
     else:
         plot_title = '%s (annual and seasonal statistics) %s run vs %s\n--note: not showing outliers--' % \
         (get_variable_longname(var), name_sim_prefix.upper(), name_ref.upper())
-    x = plt.suptitle(plot_title,fontsize=12)
+    x = fig.suptitle(plot_title,fontsize=12)
 
     # save plot
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        plot.savefig(fn_plot, dpi=300)
+        save_figure(fig, fn_plot, dpi=300)
         
         
 
 # 03) Australia mean time series #################################################################
+@instrumentation.timed('render')
 def plot_timeseries(dataframe, x, y, var, name_sim_prefix, name_ref, 
                     hue='type', col='time_scale', row='statistic', palette=None, 
                     height=2, aspect=1.5, linewidth=0.8, adjust=0.95,
@@ -342,8 +640,7 @@ def plot_timeseries(dataframe, x, y, var, name_sim_prefix, name_ref,
 
     # save plot
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        plot.savefig(fn_plot, dpi=300)
+        save_figure(plot, fn_plot, dpi=300)
         
 
 # 04) Climatologies #################################################################
@@ -352,19 +649,55 @@ def plot_climatologies(dataframe, x, y, name_sim_prefix, name_ref,
                     var=None, region='AU',
                     hue='type', col='var', row='statistic',
                     palette=None, height=2, aspect=1.5, linewidth=0.8, 
-                    fn_plot=None, adjust=0.85):
+                    fn_plot=None, adjust=0.85, band='ci', level=0.95, n_boot=1000):
+    """
+    This function creates a climatology plot of the values y in a long data frame (one row per month and year),
+    with the mean of each month x and an uncertainty band as error bars. The mean and the band are calculated
+    first (band: ci, sd, pi or bootstrap, see evaluation.summaries.get_climatology_summary) and drawn with
+    plot_climatology_summary.
+    """
+
+    with instrumentation.step('aggregate'):
+        summary = summaries.get_climatology_summary(dataframe, x, y, [row, col, hue], band=band, level=level,
+                                                    n_boot=n_boot)
+
+    plot_climatology_summary(summary, x=x, y=y, name_sim_prefix=name_sim_prefix, name_ref=name_ref, var=var,
+                             region=region, hue=hue, col=col, row=row, palette=palette, height=height,
+                             aspect=aspect, linewidth=linewidth, fn_plot=fn_plot, adjust=adjust)
+
+
+@instrumentation.timed('render')
+def plot_climatology_summary(summary, x, y, name_sim_prefix, name_ref,
+                             var=None, region='AU',
+                             hue='type', col='var', row='statistic',
+                             palette=None, height=2, aspect=1.5, linewidth=0.8,
+                             fn_plot=None, adjust=0.85):
+    """
+    This function plots a climatology summary (one row per point with the columns x, y (the mean), lower and
+    upper, see evaluation.summaries.get_climatology_summary): one line per value of hue, with the band from
+    lower to upper as error bars.
+    """
     
     # set defaults
     if palette is None:
-        palette = sns.color_palette("rocket_r", len(dataframe[hue].unique()))
+        palette = sns.color_palette("rocket_r", len(summary[hue].unique()))
         palette.reverse()
         palette[0] = (0,0,0) # set reference to black
+
+    # error bars in the colour of each line (the lines are drawn by seaborn)
+    hue_values = list(pd.unique(summary[hue]))
+    def draw_error_bars(data, **kwargs):
+        for hue_value, temp in data.groupby(hue, sort=False):
+            plt.gca().errorbar(temp[x], temp[y], yerr=[temp[y] - temp['lower'], temp['upper'] - temp[y]],
+                               fmt='none', ecolor=palette[hue_values.index(hue_value)],
+                               elinewidth=linewidth-0.3, capsize=2)
     
-    plot = sns.relplot(data=dataframe, kind='line', x=x, y=y,
+    plot = sns.relplot(data=summary, kind='line', x=x, y=y,
                    hue=hue, col=col, row=row,
-                   palette=palette, err_style='bars',
-                   linewidth=linewidth, err_kws={'linewidth':linewidth-0.3, 'capsize':2},
+                   palette=palette,
+                   linewidth=linewidth,
                    facet_kws=dict(sharey=False))
+    plot.map_dataframe(draw_error_bars)
         
     plt.subplots_adjust(top=adjust)
     if var is None:
@@ -377,64 +710,47 @@ def plot_climatologies(dataframe, x, y, name_sim_prefix, name_ref,
     x = plt.suptitle(plot_title,fontsize=12)
 
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        plot.savefig(fn_plot, dpi=300)
+        save_figure(plot, fn_plot, dpi=300)
 
 
 # 05) Animations #################################################################
-def create_animation(ds, fn_anim, fps=6):
-
-    # helper functions
-    def make_figure():
-        fig = plt.figure(figsize=(15, 6))
-        ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
-
-        # generate a basemap with country borders, oceans and coastlines
-        #ax.add_feature(cfeat.LAND)
-        #ax.add_feature(cfeat.OCEAN)
-        ax.add_feature(cfeat.COASTLINE)
-        ax.add_feature(cfeat.BORDERS, linestyle='dotted')
-        
-        plt.gca().outline_patch.set_visible(False)
-
-        return fig, ax
-
-    def draw(frame, add_colorbar):
-        grid = area[frame]
-        contour = grid.plot(ax=ax, transform=ccrs.PlateCarree(), cmap='Blues',
-                            add_colorbar=add_colorbar, vmin=min_value, vmax=max_value)
-        title = u"%s - %s" % (ds.long_name, str(area.time[frame].values)[:19])
-        ax.set_title(title)
-        return contour
-
-
-    def init():
-        return draw(0, add_colorbar=True)
-
-
-    def animate(frame):
-        return draw(frame, add_colorbar=False)
-
-
-    fig, ax = make_figure()
-    plt.gca().outline_patch.set_visible(False)
+@instrumentation.timed('render')
+def create_animation(ds, fn_anim, fps=6,
+                     coordinates=dict(llcrnrlat=-44,
+                                      urcrnrlat=-10.5,
+                                      llcrnrlon=112.6,
+                                      urcrnrlon=154.3),
+                     n_workers=1, chunk_size=24, map_backend='cartopy', map_render_mode='raster'):
+    """
+    This function creates an animation of a data array (dimensions time, lat and lon) over Australia, with
+    one map per time step. The frames are rendered in chunks of chunk_size time steps (with n_workers worker
+    processes) and streamed to ffmpeg, which writes the video or GIF (see evaluation.animations).
+    map_backend and map_render_mode are the map backend and render mode of the map panel (see plot_bias).
+    """
 
-    area = ds.sel(lat=slice(-10.5,-44), lon=slice(112.6,154.3)) # select Australia
-    frames = area.time.size
-    min_value = np.nanmin(area.values)
-    max_value = np.nanmax(area.values)
+    # select Australia (latitudes in ascending or descending order)
+    lat = ds['lat'].values
+    if lat[0] > lat[-1]:
+        lat_slice = slice(coordinates['urcrnrlat'], coordinates['llcrnrlat'])
+    else:
+        lat_slice = slice(coordinates['llcrnrlat'], coordinates['urcrnrlat'])
+    area = ds.sel(lat=lat_slice, lon=slice(coordinates['llcrnrlon'], coordinates['urcrnrlon']))
+    min_value = float(area.min())
+    max_value = float(area.max())
 
-    ani = animation.FuncAnimation(fig, animate, frames, interval=0.01, blit=False,
-                                    init_func=init, repeat=False)
+    long_name = ds.attrs.get('long_name', ds.name)
+    titles = [u"%s - %s" % (long_name, str(x)[:19]) for x in area['time'].values]
 
     create_containing_folder(fn_anim)
     print('- save animation to: %s' % (fn_anim))
-    ani.save(fn_anim, writer='imagemagick', fps=fps)
-    plt.close(fig)
+    animations.write_animation(area, fn_anim, coordinates=coordinates, titles=titles, vmin=min_value,
+                               vmax=max_value, fps=fps, n_workers=n_workers, chunk_size=chunk_size,
+                               backend=map_backend, mode=map_render_mode)
 
 
 #################################################################
 # 06a), 07) and 09) PDF plots
+@instrumentation.timed('render')
 def plot_distribution(dataframe, x, var, statistic, name_sim_prefix, name_ref, 
                     hue='type', col='time_scale', row='statistic', palette=None, 
                     height=2, aspect=1.5, linewidth=0.8, 
@@ -449,47 +765,50 @@ def plot_distribution(dataframe, x, var, statistic, name_sim_prefix, name_ref,
     # prepare the string to pass to the facet grid function
     facet_str = '~ %s + %s' % (col, row)
     
+    # the density curves are computed before plotting (see evaluation.distributions), only the curves are plotted
+    curves = distributions.get_density_curves(dataframe, x, facets=[col, row], hue=hue)
+    
     # create plot
-    plot = (ggplot(data=dataframe, mapping=aes(x=x, color=hue, fill=hue)) +
+    plot = (pn.ggplot(data=curves, mapping=pn.aes(x=x, y='density', color=hue, fill=hue)) +
                         
-            geom_density(size=0.5, alpha=0.2) +
+            pn.geom_area(size=0.5, alpha=0.2, position='identity') +
             
-            facet_wrap(facet_str, scales='free', ncol=n_col,
-                      labeller=labeller(cols=label_value,multi_line=False), dir='v') +
+            pn.facet_wrap(facet_str, scales='free', ncol=n_col,
+                      labeller=pn.labeller(cols=pn.label_value,multi_line=False), dir='v') +
             
-        theme(panel_background = element_rect(fill='#f0f0f0'),
-           # panel_grid_major = element_line(linetype='dashed', color='white', size=1),
-              panel_grid_major = element_blank(),
-           panel_grid_minor = element_blank(),
-           # axis_ticks = element_blank(),
-           panel_border = element_blank(),
-           strip_text = element_text(size=9, color='black'),
-           strip_background = element_blank(),
+        pn.theme(panel_background = pn.element_rect(fill='#f0f0f0'),
+           # panel_grid_major = pn.element_line(linetype='dashed', color='white', size=1),
+              panel_grid_major = pn.element_blank(),
+           panel_grid_minor = pn.element_blank(),
+           # axis_ticks = pn.element_blank(),
+           panel_border = pn.element_blank(),
+           strip_text = pn.element_text(size=9, color='black'),
+           strip_background = pn.element_blank(),
            figure_size = figure_size,
            legend_key_size = 20,
            legend_key_width = 20,
-           axis_title_y = element_text(size=8),
-           axis_text_x = element_text(size=6),
-           axis_text_y = element_text(size=7),
+           axis_title_y = pn.element_text(size=8),
+           axis_text_x = pn.element_text(size=6),
+           axis_text_y = pn.element_text(size=7),
            panel_spacing_x = 0.4,
              panel_spacing_y = 0.2) +
                       
-            labs(x='', y='density\n', title=plot_title) +
+            pn.labs(x='', y='density\n', title=plot_title) +
             
-        scale_x_continuous(expand=(0,0.1)) +
-        scale_y_continuous(expand=(0,0)))
+        pn.scale_x_continuous(expand=(0,0.1)) +
+        pn.scale_y_continuous(expand=(0,0)))
             
 
     # save plot
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        plot.save(fn_plot, dpi=300)
+        save_figure(plot, fn_plot, dpi=300)
         
     return plot
 
 
 #################################################################
 # 06b), 07b), 09)b empirical cumulative distribution plot - CDF instead of PDF
+@instrumentation.timed('render')
 def plot_ecdf(dataframe, x, var, statistic, name_sim_prefix, name_ref, 
                     hue='type', col='time_scale', row='statistic', palette=None, 
                     height=2, aspect=1.5, linewidth=0.8, 
@@ -504,46 +823,49 @@ def plot_ecdf(dataframe, x, var, statistic, name_sim_prefix, name_ref,
     # prepare the string to pass to the facet grid function
     facet_str = '~ %s + %s' % (col, row)
     
+    # the ECDFs are computed before plotting (see evaluation.distributions), only the curves are plotted
+    curves = distributions.get_ecdf_curves(dataframe, x, facets=[col, row], hue=hue)
+    
     # create plot
-    plot = (ggplot(data=dataframe, mapping=aes(x=x, color=hue, fill=hue)) +
+    plot = (pn.ggplot(data=curves, mapping=pn.aes(x=x, y='ecdf', color=hue, fill=hue)) +
                         
-            stat_ecdf(geom='step', size=0.5) +
+            pn.geom_step(size=0.5) +
             
-            facet_wrap(facet_str, scales='free', ncol=n_col,
-                      labeller=labeller(cols=label_value,multi_line=False), dir='v') +
+            pn.facet_wrap(facet_str, scales='free', ncol=n_col,
+                      labeller=pn.labeller(cols=pn.label_value,multi_line=False), dir='v') +
             
-        theme(panel_background = element_rect(fill='#f0f0f0'),
-           # panel_grid_major = element_line(linetype='dashed', color='white', size=1),
-              panel_grid_major = element_blank(),
-           panel_grid_minor = element_blank(),
-           # axis_ticks = element_blank(),
-           panel_border = element_blank(),
-           strip_text = element_text(size=9, color='black'),
-           strip_background = element_blank(),
+        pn.theme(panel_background = pn.element_rect(fill='#f0f0f0'),
+           # panel_grid_major = pn.element_line(linetype='dashed', color='white', size=1),
+              panel_grid_major = pn.element_blank(),
+           panel_grid_minor = pn.element_blank(),
+           # axis_ticks = pn.element_blank(),
+           panel_border = pn.element_blank(),
+           strip_text = pn.element_text(size=9, color='black'),
+           strip_background = pn.element_blank(),
            figure_size = figure_size,
            legend_key_size = 20,
            legend_key_width = 20,
-           axis_title_y = element_text(size=8),
-           axis_text_x = element_text(size=6),
-           axis_text_y = element_text(size=7),
+           axis_title_y = pn.element_text(size=8),
+           axis_text_x = pn.element_text(size=6),
+           axis_text_y = pn.element_text(size=7),
            panel_spacing_x = 0.4,
              panel_spacing_y = 0.2) +
                       
-            labs(x='', y='density\n', title=plot_title) +
+            pn.labs(x='', y='density\n', title=plot_title) +
             
-        scale_x_continuous(expand=(0,0.1)) +
-        scale_y_continuous(expand=(0,0)))
+        pn.scale_x_continuous(expand=(0,0.1)) +
+        pn.scale_y_continuous(expand=(0,0)))
             
 
     # save plot
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        plot.save(fn_plot, dpi=300)
+        save_figure(plot, fn_plot, dpi=300)
         
     return plot
 
 #################################################################
 # 06c) Scatter plot of simulated / bias corrected data vs historical reference.
+@instrumentation.timed('render')
 def plot_spatial_correlation(dataframe, x, y, var, statistic, name_sim_prefix, name_ref, 
                     hue='type', col='time_scale', row='statistic', palette=None, 
                     height=2, aspect=1.5, linewidth=0.8, 
@@ -559,44 +881,43 @@ def plot_spatial_correlation(dataframe, x, y, var, statistic, name_sim_prefix, n
     facet_str = '~ %s + %s' % (col, row)
     
     # create plot
-    plot = (ggplot(data=dataframe, mapping=aes(x=x, y=y, color=hue, fill=hue)) +
+    plot = (pn.ggplot(data=dataframe, mapping=pn.aes(x=x, y=y, color=hue, fill=hue)) +
                         
-            geom_point(size=0.5, alpha=0.5) +
-            geom_smooth(method='lm', se=False, size=0.5) +
+            pn.geom_point(size=0.5, alpha=0.5) +
+            pn.geom_smooth(method='lm', se=False, size=0.5) +
             
             # add 1:1 line
-            geom_abline(intercept=0, slope=1, size=0.5, linetype='dashed') +
+            pn.geom_abline(intercept=0, slope=1, size=0.5, linetype='dashed') +
             
-            facet_wrap(facet_str, scales='free', ncol=n_col,
-                      labeller=labeller(cols=label_value,multi_line=False), dir='v') +
+            pn.facet_wrap(facet_str, scales='free', ncol=n_col,
+                      labeller=pn.labeller(cols=pn.label_value,multi_line=False), dir='v') +
             
-        theme(panel_background = element_rect(fill='#f0f0f0'),
-           # panel_grid_major = element_line(linetype='dashed', color='white', size=1),
-              panel_grid_major = element_blank(),
-           panel_grid_minor = element_blank(),
-           # axis_ticks = element_blank(),
-           panel_border = element_blank(),
-           strip_text = element_text(size=9, color='black'),
-           strip_background = element_blank(),
+        pn.theme(panel_background = pn.element_rect(fill='#f0f0f0'),
+           # panel_grid_major = pn.element_line(linetype='dashed', color='white', size=1),
+              panel_grid_major = pn.element_blank(),
+           panel_grid_minor = pn.element_blank(),
+           # axis_ticks = pn.element_blank(),
+           panel_border = pn.element_blank(),
+           strip_text = pn.element_text(size=9, color='black'),
+           strip_background = pn.element_blank(),
            figure_size = figure_size,
            legend_key_size = 20,
            legend_key_width = 20,
-           axis_title_y = element_text(size=8),
-           axis_text_x = element_text(size=6),
-           axis_text_y = element_text(size=7),
+           axis_title_y = pn.element_text(size=8),
+           axis_text_x = pn.element_text(size=6),
+           axis_text_y = pn.element_text(size=7),
            panel_spacing_x = 0.4,
              panel_spacing_y = 0.2) +
                       
-            labs(x='', y='density\n', title=plot_title) +
+            pn.labs(x='', y='density\n', title=plot_title) +
             
-        scale_x_continuous(expand=(0,0.1)) +
-        scale_y_continuous(expand=(0,0)))
+        pn.scale_x_continuous(expand=(0,0.1)) +
+        pn.scale_y_continuous(expand=(0,0)))
             
 
     # save plot
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        plot.save(fn_plot, dpi=300)
+        save_figure(plot, fn_plot, dpi=300)
         
     return plot
 
@@ -604,72 +925,119 @@ def plot_spatial_correlation(dataframe, x, y, var, statistic, name_sim_prefix, n
 
 
 
+# 06c) Density of simulated / bias corrected data vs historical reference.
+# Same comparison as plot_spatial_correlation, but the grid cells are counted in 2-D histograms (heatmap) instead of
+# drawn as points, and the regression lines are calculated with NumPy (see evaluation.spatial_correlation).
+@instrumentation.timed('render')
+def plot_spatial_correlation_density(fields, var, statistic, name_sim_prefix, name_ref, region=None,
+                                     time_scales=['annual', 'DJF', 'MAM', 'JJA', 'SON'], kind='heatmap', bins=100,
+                                     height=2.2, fn_plot=None, fn_table=None):
+    """
+    This function plots the mean of each grid cell in the GCM data (x-axis) against the reference data (y-axis),
+    as 2-D histogram (kind='heatmap') or hexagonal bins (kind='hexbin'), with the linear regression line and
+    the 1:1 line. fields is an ordered dictionary with an array (time scales, grid cells) for each dataset
+    (see evaluation.spatial_correlation.get_mean_fields). Rows: GCMs, columns: time scales.
+    The regression statistics (slope, intercept, r) are written to fn_table (CSV), if given.
+    """
+
+    names = [x for x in fields if x != name_ref]
+    x = np.stack([fields[name] for name in names])
+    y = np.broadcast_to(fields[name_ref], x.shape)
+    statistics = spatial_correlation.get_regression_statistics(x, y)
+    if kind == 'heatmap':
+        counts, edges = spatial_correlation.get_histograms(x, y, bins=bins)
+
+    fig, axes = plt.subplots(len(names), len(time_scales), figsize=(height * len(time_scales), height * len(names)),
+                             squeeze=False)
+
+    for row in range(len(names)):
+        for col in range(len(time_scales)):
+            ax = axes[row, col]
+
+            if kind == 'heatmap':
+                lo, hi = edges[row, col, 0], edges[row, col, -1]
+                ax.pcolormesh(edges[row, col], edges[row, col], np.ma.masked_equal(counts[row, col], 0),
+                              cmap='viridis', norm=colors.LogNorm(), rasterized=True)
+            elif kind == 'hexbin':
+                valid = np.isfinite(x[row, col]) & np.isfinite(y[row, col])
+                lo, hi = [float(limit) for limit in spatial_correlation.get_limits(x[row, col], y[row, col])]
+                if valid.any():
+                    ax.hexbin(x[row, col][valid], y[row, col][valid], gridsize=bins // 2, extent=(lo, hi, lo, hi),
+                              cmap='viridis', bins='log', mincnt=1, linewidths=0)
+            else:
+                raise ValueError('Unknown kind: %s (heatmap or hexbin)' % kind)
+
+            # regression line and 1:1 line
+            slope, intercept, r = [statistics[key][row, col] for key in ['slope', 'intercept', 'r']]
+            ax.plot([lo, hi], [intercept + slope * lo, intercept + slope * hi], color='#d7301f', linewidth=0.8)
+            ax.plot([lo, hi], [lo, hi], color='black', linewidth=0.5, linestyle='dashed')
+            ax.text(0.03, 0.97, 'r = %.2f\nslope = %.2f' % (r, slope), transform=ax.transAxes,
+                    fontsize=7, verticalalignment='top')
+            ax.set_xlim(lo, hi)
+            ax.set_ylim(lo, hi)
+            ax.tick_params(labelsize=6)
+
+            if row == 0:
+                ax.set_title(time_scales[col], fontsize=9)
+            if col == 0:
+                ax.set_ylabel('%s\n%s' % (names[row].upper(), name_ref.upper()), fontsize=8)
+            if row == len(names) - 1:
+                ax.set_xlabel(name_sim_prefix.upper(), fontsize=8)
+
+    plot_title = '%s (annual and seasonal %s),\n%s vs %s data' % (get_variable_longname(var), statistic, name_sim_prefix.upper(), name_ref.upper())
+    if region is not None:
+        plot_title = '%s, %s' % (plot_title, region)
+    fig.suptitle(plot_title, fontsize=11)
+    fig.tight_layout(rect=(0, 0, 1, 0.93))
+
+    if fn_table is not None:
+        table = spatial_correlation.get_statistics_table(fields, name_ref, time_scales)
+        if region is not None:
+            table.insert(0, 'region', region)
+        create_containing_folder(fn_table)
+        table.to_csv(fn_table, index=False)
+
+    if fn_plot is not None:
+        save_figure(fig, fn_plot, dpi=300)
+
+    return fig
+
+
 # 10) Fourier transform #################################################################
 # This plot plots the wavelength on the x-axis (instead of the frequency).
+@instrumentation.timed('render')
 def plot_fourier_transform_wavelengths(dataframe, location_name, var, name_sim_prefix, name_ref, timestep='daily',
-                           n_top_frequencies=4, fn_plot=None):
+                           n_top_frequencies=4, fn_plot=None, spectrum=None):
     # adapted from: https://plot.ly/matplotlib/fft/
     
-    obs_and_gcms = dataframe['type'].unique()
+    # the spectra of all datasets are calculated at once (see evaluation.spectral), and can be passed in
+    # (spectrum), so that they are calculated only once for both diagrams
+    if spectrum is None:
+        spectrum = spectral.get_spectra(dataframe, var, timestep)
+    series = spectrum['series']
+    obs_and_gcms = series.columns
     
     fig, axes = plt.subplots(len(obs_and_gcms), 2, figsize=(15,2.5*len(obs_and_gcms)))
     
     # plot in rows: "type", i.e. AWAP, GCM1, GCM2, etc.
     # plot in columns: left colums - time series, right column - fourier transform
     
-    if timestep == 'monthly':
-        # calculate monthly from daily
-        dataframe = dataframe.set_index('time')
-        dataframe = dataframe.groupby(['type', 'lat', 'lon']).resample('1MS')[var].mean()
-        dataframe = dataframe.reset_index()
-            
     for row in range(len(obs_and_gcms)):
         
-        temp = dataframe.loc[dataframe['type'] == obs_and_gcms[row]]
-
-        if timestep == 'daily':
-            
-            time_length = (temp['time'].max() - temp['time'].min()).days + 1 # in days
-            # prepare the frequencies
-            frequencies = np.arange(int(time_length / 2)) # only first half, as 2nd half is duplicated in fft output
-            wavelengths = time_length / frequencies # in days
-            frequencies = frequencies / time_length * 365 # in years, for plotting
-
-        elif timestep == 'monthly':
-            
-            average_days_in_a_month = 30.4375
-            # in months; +1 is because the last month finishes on the 1st
-            time_length = int(np.round((temp['time'].max() - temp['time'].min()).days  / average_days_in_a_month + 1)) # in months
-            
-            # prepare the frequencies
-            frequencies = np.arange(int(time_length / 2)) # only first half, as 2nd half is duplicated in fft output
-            wavelengths = time_length / frequencies # in months
-            frequencies = frequencies / time_length * 365 # in years, for plotting
-            
-        ts = temp[var]
-        time = temp['time']
-        
-        # calculate the fourier transform
-        fourier_transform = np.fft.fft(ts) # fft computing
-        fourier_transform = abs(fourier_transform) # absolute values
-        fourier_transform = fourier_transform[np.arange(len(frequencies))]
+        ts = series[obs_and_gcms[row]]
+        temp = spectrum['spectra'].loc[spectrum['spectra']['type'] == obs_and_gcms[row]]
         
-        # remove Inf from wavelengts (Frequency = 0 --> mean of the time series)
-        fourier_transform = fourier_transform[np.isfinite(wavelengths)]
-        wavelengths = wavelengths[np.isfinite(wavelengths)]
-    
         # remove those wavelengths that are longer than half the time series       
-        selection = wavelengths <= (time_length / 2)
-        fourier_transform = fourier_transform[selection]
-        wavelengths = wavelengths[selection]
-        len_wavelengths = len(wavelengths)
+        temp = temp.loc[temp['wavelength'] <= spectrum['n'] / 2]
+        wavelengths = temp['wavelength'].values
+        fourier_transform = temp['amplitude'].values
         
         # 1) plot time series
         ax = axes[row,0]
-        ax.plot(temp['time'], ts, '#045a8d', linewidth=0.3)
+        ax.plot(series.index, ts, '#045a8d', linewidth=0.3)
         ax.set_xlabel('Time')
         ax.set_ylabel(get_variable_longname(var))
-        ax.set_ylim(0,temp[var].max()*1.1)
+        ax.set_ylim(0,ts.max()*1.1)
         ax.set_title('Time series: %s' % obs_and_gcms[row].upper())
 
         # 2) plot fourier transform
@@ -684,28 +1052,22 @@ def plot_fourier_transform_wavelengths(dataframe, location_name, var, name_sim_p
         
         if timestep == 'daily':
             ax.set_xticks(np.arange(0,wavelengths.max()+1,365)) # in years
-            ax.set_xticklabels(np.arange(0,int((wavelengths.max()+1)/365),1)); # in years
+            ax.set_xticklabels(np.arange(len(ax.get_xticks()))); # in years
             
         elif timestep == 'monthly':
             ax.set_xticks(np.arange(0,wavelengths.max()+1,12)) # in years
-            ax.set_xticklabels(np.arange(0,int((wavelengths.max()+1)/12),1)); # in years
+            ax.set_xticklabels(np.arange(len(ax.get_xticks()))); # in years
 
         # add top wave lengths to the diagram, if applicable
         if n_top_frequencies > 0:           
             
-            top_freq = sorted(fourier_transform[np.isfinite(fourier_transform)], reverse=True)[0:n_top_frequencies]   
-            top_freq_idx = []
-            for x in top_freq:
-                top_freq_idx = top_freq_idx + list(np.where(fourier_transform == x)[0])
-                
-            # # testing
-            # print(top_freq)
-            # print(top_freq_idx)
+            top_freq_idx = spectral.get_top_peaks(fourier_transform, n_top_frequencies)
+            top_freq = fourier_transform[top_freq_idx]
             
             # highlight top frequencies using dot points
-            ax.scatter(wavelengths[top_freq_idx], fourier_transform[top_freq_idx], color='#800026', s=10)
+            ax.scatter(wavelengths[top_freq_idx], top_freq, color='#800026', s=10)
             
-            for i in range(n_top_frequencies):
+            for i in range(len(top_freq_idx)):
                 
                 if i == 0:
                     x = wavelengths.max()*1.06 # outside of the plot
@@ -733,81 +1095,47 @@ def plot_fourier_transform_wavelengths(dataframe, location_name, var, name_sim_p
             axes[row,1].set_xlabel('')
     
     plot_title = 'Fourier transform for %s (%s) -- %s vs %s data' % (get_variable_longname(var), location_name, name_sim_prefix, name_ref)
-    x = plt.suptitle(plot_title,fontsize=12)
+    x = fig.suptitle(plot_title,fontsize=12)
 
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        fig.savefig(fn_plot, dpi=300)
+        save_figure(fig, fn_plot, dpi=300)
 
 
 # 10) Fourier transform #################################################################
 # This plot plots the frequency on the x-axis (instead of the wavelength).
+@instrumentation.timed('render')
 def plot_fourier_transform_frequencies(dataframe, location_name, var, name_sim_prefix, name_ref, timestep='daily',
-                           n_top_frequencies=4, fn_plot=None):
+                           n_top_frequencies=4, fn_plot=None, spectrum=None):
     # adapted from: https://plot.ly/matplotlib/fft/
     
-    obs_and_gcms = dataframe['type'].unique()
+    # the spectra of all datasets are calculated at once (see evaluation.spectral), and can be passed in
+    # (spectrum), so that they are calculated only once for both diagrams
+    if spectrum is None:
+        spectrum = spectral.get_spectra(dataframe, var, timestep)
+    series = spectrum['series']
+    obs_and_gcms = series.columns
     
     fig, axes = plt.subplots(len(obs_and_gcms), 2, figsize=(15,2.5*len(obs_and_gcms)))
     
     # plot in rows: "type", i.e. AWAP, GCM1, GCM2, etc.
     # plot in columns: left colums - time series, right column - fourier transform
-    
-    if timestep == 'monthly':
-        # calculate monthly from daily
-        dataframe = dataframe.set_index('time')
-        dataframe = dataframe.groupby(['type', 'lat', 'lon']).resample('1MS')[var].mean()
-        dataframe = dataframe.reset_index()
             
     for row in range(len(obs_and_gcms)):
         
-        temp = dataframe.loc[dataframe['type'] == obs_and_gcms[row]]
-
-        if timestep == 'daily':
-            
-            time_length = (temp['time'].max() - temp['time'].min()).days + 1 # in days
-            # prepare the frequencies
-            frequencies = np.arange(int(time_length / 2)) # only first half, as 2nd half is duplicated in fft output
-
-        elif timestep == 'monthly':
-            
-            average_days_in_a_month = 30.4375
-            # in months; +1 is because the last month finishes on the 1st
-            time_length = int(np.round((temp['time'].max() - temp['time'].min()).days  / average_days_in_a_month + 1)) # in months
-            
-            # prepare the frequencies
-            frequencies = np.arange(int(time_length / 2)) # only first half, as 2nd half is duplicated in fft output
-            
-            
-        ts = temp[var]
-        time = temp['time']
-        
-#         # testing
-#         time = temp['time']
-#         ts = np.array([200 * np.sin(2*np.pi*x/12) for x in range(time_length)])
-
-        # calculate the fourier transform
-        fourier_transform = np.fft.fft(ts) # fft computing
-        fourier_transform = abs(fourier_transform) # absolute values
-        fourier_transform = fourier_transform[np.arange(len(frequencies))]
+        ts = series[obs_and_gcms[row]]
+        temp = spectrum['spectra'].loc[spectrum['spectra']['type'] == obs_and_gcms[row]]
     
         # remove those wavelengths that are longer than half the time series       
-        selection = frequencies > 2
-        frequencies = frequencies[selection]
-        fourier_transform = fourier_transform[selection]
-        
-        # calculate frequencies as per year, for plotting
-        if timestep == 'daily':
-            frequencies = frequencies / time_length * 365 # in years
-        elif timestep == 'monthly':
-            frequencies = frequencies / time_length * 12 # in years
+        temp = temp.loc[temp['wavelength'] < spectrum['n'] / 2]
+        frequencies = temp['frequency'].values
+        fourier_transform = temp['amplitude'].values
         
         # 1) plot time series
         ax = axes[row,0]
-        ax.plot(temp['time'], ts, '#045a8d', linewidth=0.3)
+        ax.plot(series.index, ts, '#045a8d', linewidth=0.3)
         ax.set_xlabel('Time')
         ax.set_ylabel(get_variable_longname(var))
-        ax.set_ylim(0,temp[var].max()*1.1)
+        ax.set_ylim(0,ts.max()*1.1)
         ax.set_title('Time series: %s' % obs_and_gcms[row].upper())
 
         # 2) plot fourier transform
@@ -822,15 +1150,13 @@ def plot_fourier_transform_frequencies(dataframe, location_name, var, name_sim_p
         # add top frequencies to the diagram, if applicable
         if n_top_frequencies > 0:           
             
-            top_freq = sorted(fourier_transform, reverse=True)[0:n_top_frequencies]   
-            top_freq_idx = []
-            for x in top_freq:
-                top_freq_idx = top_freq_idx + list(np.where(fourier_transform == x)[0])
+            top_freq_idx = spectral.get_top_peaks(fourier_transform, n_top_frequencies)
+            top_freq = fourier_transform[top_freq_idx]
             
             # highlight top frequencies using dot points
-            ax.scatter(frequencies[top_freq_idx], fourier_transform[top_freq_idx], color='#800026', s=10)
+            ax.scatter(frequencies[top_freq_idx], top_freq, color='#800026', s=10)
             
-            for i in range(n_top_frequencies):
+            for i in range(len(top_freq_idx)):
                 
                 if i == 0:
                     x = frequencies.max()*1.06 # outside of the plot
@@ -853,20 +1179,490 @@ def plot_fourier_transform_frequencies(dataframe, location_name, var, name_sim_p
             axes[row,1].set_xlabel('')
     
     plot_title = 'Fourier transform for %s (%s) -- %s vs %s data' % (get_variable_longname(var), location_name, name_sim_prefix.upper(), name_ref.upper())
-    x = plt.suptitle(plot_title,fontsize=12)
+    x = fig.suptitle(plot_title,fontsize=12)
 
     if fn_plot is not None:
-        create_containing_folder(fn_plot)
-        fig.savefig(fn_plot, dpi=300)
+        save_figure(fig, fn_plot, dpi=300)
 
 
 # 10) Fourier transform #################################################################
 # Wrapper function to call the fourier transform plotting function, either using frequencies or wavelengths as x-axis.
+@instrumentation.timed('render')
 def plot_fourier_transform(dataframe, location_name, var, name_sim_prefix, name_ref, timestep='daily',
-                           n_top_frequencies=4, fn_plot=None, x_axis='frequencies'):
+                           n_top_frequencies=4, fn_plot=None, x_axis='frequencies', spectrum=None):
     if x_axis == 'frequencies':
         plot_fourier_transform_frequencies(dataframe, location_name, var, name_sim_prefix, name_ref, timestep,
-                           n_top_frequencies, fn_plot)
+                           n_top_frequencies, fn_plot, spectrum)
     elif x_axis == 'wavelengths':
         plot_fourier_transform_wavelengths(dataframe, location_name, var, name_sim_prefix, name_ref, timestep,
-                           n_top_frequencies, fn_plot)
+                           n_top_frequencies, fn_plot, spectrum)
+
+
+# 11) Skill scores #################################################################
+# Metrics that are shown relative to the standard deviation of the reference data in the portrait plots
+# (their values are in the unit of the variable)
+normalised_metrics = {'bias': 'bias / standard deviation of %s',
+                      'rmse': 'RMSE / standard deviation of %s',
+                      'centred_rmse': 'centred RMS difference / standard deviation of %s'}
+metric_longnames = {'bias': 'Bias', 'rmse': 'RMSE', 'correlation': 'Spatial correlation',
+                    'perkins_skill_score': 'Perkins skill score', 'ks_distance': 'Kolmogorov-Smirnov distance',
+                    'std_ratio': 'Ratio of the standard deviations', 'centred_rmse': 'Centred RMS difference'}
+
+
+@instrumentation.timed('render')
+def plot_metrics_portrait(table, metric, name_sim_prefix, name_ref, region='Australia', statistic=None,
+                          annotate=None, height=0.4, fn_plot=None):
+    """
+    This function creates a portrait plot of one metric from the metrics table (see evaluation.metrics): one row
+    per GCM and one column per variable, statistic and time scale, for one region. Metrics in the unit of the
+    variable (bias, RMSE, centred RMS difference) are divided by the standard deviation of the reference data, so
+    that the variables can be compared. The values are written into the cells if annotate is True (default: if
+    there are at most 400 cells).
+    """
+
+    data = table.loc[table['region'] == region]
+    if statistic is not None:
+        data = data.loc[data['statistic'] == statistic]
+    data = data.copy()
+    data['column'] = ['%s\n%s %s' % (x, y, z) for x, y, z in zip(data['var'], data['statistic'], data['time_scale'])]
+    data['value'] = data[metric] / data['std_ref'] if metric in normalised_metrics else data[metric]
+
+    rows = list(pd.unique(data['source']))
+    columns = list(pd.unique(data['column']))
+    values = data.pivot_table(index='source', columns='column', values='value', aggfunc='mean',
+                              dropna=False).reindex(index=rows, columns=columns).values
+
+    if metric == 'bias':
+        limit = np.nanmax(np.abs(values)) if np.isfinite(values).any() else 1.
+        cmap, vmin, vmax = 'RdBu_r', -limit, limit
+    elif metric in ['correlation', 'perkins_skill_score']:
+        cmap, vmin, vmax = 'viridis', None, None
+    else:
+        cmap, vmin, vmax = 'viridis_r', None, None
+
+    fig, ax = plt.subplots(figsize=(max(4, 0.6 * len(columns) + 2), max(2, height * len(rows) + 2)))
+    mesh = ax.pcolormesh(np.ma.masked_invalid(values), cmap=cmap, vmin=vmin, vmax=vmax, edgecolors='white',
+                         linewidth=0.5)
+    ax.set_xticks(np.arange(len(columns)) + 0.5)
+    ax.set_xticklabels(columns, rotation=90, fontsize=7)
+    ax.set_yticks(np.arange(len(rows)) + 0.5)
+    ax.set_yticklabels([x.upper() for x in rows], fontsize=8)
+    ax.invert_yaxis()
+
+    if annotate is None:
+        annotate = values.size <= 400
+    if annotate:
+        for (i, j), value in np.ndenumerate(values):
+            if np.isfinite(value):
+                ax.text(j + 0.5, i + 0.5, '%.2f' % value, ha='center', va='center', fontsize=6)
+
+    longname = metric_longnames.get(metric, metric)
+    cbar = fig.colorbar(mesh, ax=ax)
+    cbar.set_label(normalised_metrics[metric] % name_ref.upper() if metric in normalised_metrics else longname,
+                   fontsize=7)
+    cbar.ax.tick_params(labelsize=7)
+    ax.set_title('%s: %s vs %s data\nRegion: %s' % (longname, name_sim_prefix.upper(), name_ref.upper(), region),
+                 fontsize=10)
+    fig.tight_layout()
+
+    if fn_plot is not None:
+        save_figure(fig, fn_plot, dpi=300)
+
+
+@instrumentation.timed('render')
+def plot_taylor_diagram(table, var, statistic, name_sim_prefix, name_ref, region='Australia', fn_plot=None):
+    """
+    This function creates a Taylor diagram from the metrics table (see evaluation.metrics) for one region,
+    variable and statistic: each point is a GCM (marker) and time scale (colour), with the ratio of the standard
+    deviations (GCM / reference) as distance from the origin and the spatial correlation as angle. The distance
+    to the reference point (1, 0) is the centred RMS difference divided by the standard deviation of the
+    reference (grey contours).
+    """
+
+    data = table.loc[(table['region'] == region) & (table['var'] == var) & (table['statistic'] == statistic)]
+    sources = list(pd.unique(data['source']))
+    time_scales = list(pd.unique(data['time_scale']))
+    point_colors = sns.color_palette('colorblind', len(time_scales))
+    markers = ['o', 's', '^', 'D', 'v', 'P', 'X', '*', '<', '>', 'h', 'p']
+
+    theta_max = np.pi if (data['correlation'] < 0).any() else np.pi / 2
+    r_max = max(1.5, np.nanmax(data['std_ratio'].values) * 1.1) if len(data) > 0 else 1.5
+
+    fig = plt.figure(figsize=(7, 5.5))
+    ax = fig.add_subplot(1, 1, 1, projection='polar')
+    ax.set_thetamin(0)
+    ax.set_thetamax(np.degrees(theta_max))
+    ax.set_rlim(0, r_max)
+
+    # correlation ticks on the angular axis
+    correlations = np.array([0, 0.2, 0.4, 0.6, 0.8, 0.9, 0.95, 0.99, 1])
+    if theta_max > np.pi / 2:
+        correlations = np.concatenate([-correlations[:0:-1], correlations])
+    ax.set_xticks(np.arccos(correlations))
+    ax.set_xticklabels(['%g' % x for x in correlations], fontsize=8)
+
+    # centred RMS difference (normalised) around the reference point
+    theta, r = np.meshgrid(np.linspace(0, theta_max, 200), np.linspace(0, r_max, 200))
+    rms = np.sqrt(1 + r ** 2 - 2 * r * np.cos(theta))
+    contours = ax.contour(theta, r, rms, levels=np.arange(0.25, 2 * r_max, 0.25), colors='0.6', linewidths=0.5)
+    ax.clabel(contours, fontsize=6, fmt='%.2f')
+    ax.plot(np.linspace(0, theta_max, 100), np.ones(100), color='k', linewidth=0.5, linestyle='--')
+    ax.plot(0, 1, marker='*', color='k', markersize=12, linestyle='none')
+
+    for i, source in enumerate(sources):
+        for j, time_scale in enumerate(time_scales):
+            point = data.loc[(data['source'] == source) & (data['time_scale'] == time_scale)]
+            if len(point) == 0:
+                continue
+            ax.plot(np.arccos(np.clip(point['correlation'].values[0], -1, 1)), point['std_ratio'].values[0],
+                    marker=markers[i % len(markers)], color=point_colors[j], markersize=6, linestyle='none')
+
+    # legends: markers for the GCMs, colours for the time scales
+    handles = [plt.Line2D([], [], marker='*', color='k', markersize=10, linestyle='none', label=name_ref.upper())]
+    handles += [plt.Line2D([], [], marker=markers[i % len(markers)], color='0.3', linestyle='none', label=x.upper())
+                for i, x in enumerate(sources)]
+    handles += [plt.Line2D([], [], marker='o', color=point_colors[j], linestyle='none', label=x)
+                for j, x in enumerate(time_scales)]
+    ax.legend(handles=handles, loc='upper left', bbox_to_anchor=(1.05, 1), fontsize=8, frameon=False)
+
+    ax.tick_params(axis='y', labelsize=8)
+    ax.set_xlabel('standard deviation (relative to %s)' % name_ref.upper(), fontsize=8, labelpad=15)
+    ax.set_title('Taylor diagram: %s (%s), %s vs %s data\nRegion: %s' % (get_variable_longname(var), statistic,
+                 name_sim_prefix.upper(), name_ref.upper(), region), fontsize=10)
+    fig.tight_layout()
+
+    if fn_plot is not None:
+        save_figure(fig, fn_plot, dpi=300)
+
+
+# 12) Spectral bias maps #################################################################
+# colour levels of the ratio of the variance in a frequency band (simulated / reference data)
+band_power_ratio_levels = [0.25, 0.5, 0.67, 0.8, 0.9, 1.11, 1.25, 1.5, 2, 4]
+
+
+@instrumentation.timed('render')
+def plot_band_power_ratio(band_power, name_ref, name_sim, var, year_start, year_end,
+                          unit=None, region='AU',
+                          coordinates=dict(llcrnrlat=-44.5,
+                                           urcrnrlat=-10.7,
+                                           llcrnrlon=112,
+                                           urcrnrlon=156.25),
+                          fn_plot=None, adjust=0.86, map_backend='basemap', map_render_mode='mesh'):
+    """
+    This function creates a plot with a) the variance of the daily time series of the historical reference in each
+    frequency band, b) the same for the simulated / bias corrected data, c) the ratio of both (simulated /
+    reference), with one row per band (e.g. sub-seasonal, annual cycle, interannual). band_power is a dictionary
+    with the band variances of name_ref and name_sim (xarray datasets with the variable band_power, see
+    evaluation.spectral.get_band_power_fields).
+    map_backend is the library for the coastlines and states: basemap or cartopy (see evaluation.maps).
+    map_render_mode is mesh (exact, one quadrilateral per grid cell) or raster (faster, one image per panel).
+    If fn_plot is given, the plot is saved and None is returned (the figure is reused, see plot_bias), otherwise
+    a new figure is returned.
+    """
+
+    types = [name_ref, name_sim, 'ratio']
+    fields = dict([(x, band_power[x]['band_power']) for x in [name_ref, name_sim]])
+    fields['ratio'] = fields[name_sim] / fields[name_ref].where(fields[name_ref] > 0)
+    bands = list(fields[name_ref]['band'].values)
+
+    # get the figure with the map layers for this region and layout (created once per process, see evaluation.maps);
+    # without fn_plot, the figure is returned to the caller and therefore not shared with other plots
+    nrows = len(bands)
+    ncols = len(types)
+    template = maps.get_map_template(coordinates, nrows, ncols, figsize=(3.33*ncols,2.4*nrows), backend=map_backend,
+                                     reuse=fn_plot is not None)
+
+    unit_str = '(%s)$^2$' % unit if unit is not None else ''
+
+    for row_idx in range(len(bands)):
+        band = bands[row_idx]
+        period_min = float(fields[name_ref]['period_min'].sel(band=band))
+        period_max = float(fields[name_ref]['period_max'].sel(band=band))
+        if np.isfinite(period_max):
+            band_str = '%s: %g-%g days' % (band, period_min, period_max)
+        else:
+            band_str = '%s: > %g days' % (band, period_min)
+
+        # the same colour range for both datasets, so that the maps are comparable (98th percentile, so that single
+        # grid cells do not set the range)
+        vmax_band = get_symmetric_limit(np.concatenate([fields[x].sel(band=band).values.ravel()
+                                                        for x in [name_ref, name_sim]]))
+
+        for col_idx in range(len(types)):
+
+            type = types[col_idx]
+            field = fields[type].sel(band=band, drop=True)
+
+            if type in [name_ref, name_sim]:
+                vmin, vmax, levels = 0, vmax_band, None
+                cmap = plt.get_cmap('YlGnBu', 10)
+                legend_title = 'Variance %s' % unit_str
+                extend = 'max'
+                mean = float(field.mean())
+            else:
+                vmin, vmax, levels = None, None, band_power_ratio_levels
+                cmap = plt.get_cmap('RdBu_r', len(band_power_ratio_levels) - 1)
+                cmap.set_under('#addd8e')
+                cmap.set_over('#dd1c77')
+                legend_title = 'Ratio of the variance'
+                extend = 'both'
+                # the median, because the ratio is skewed
+                mean = float(field.median())
+            cmap.set_bad('#f0f0f0')
+
+            # add title
+            plot_title = [name_ref.upper(), name_sim.upper(), 'Ratio'][col_idx]
+            plot_title = '%s (%s) \n%s: %.3g' % (plot_title, band_str, 'Median' if type == 'ratio' else 'Mean', mean)
+
+            # create plot
+            template.draw_panel(row_idx, col_idx, field, vmin=vmin, vmax=vmax, cmap=cmap, levels=levels, extend=extend,
+                                title=plot_title, legend_title=legend_title, mode=map_render_mode)
+
+    suptitle = '%s: variance in frequency bands of %s vs %s (daily data)\nRegion: %s, Period: %s-%s' % (
+        get_variable_longname(var), name_sim.upper(), name_ref.upper(), region, year_start, year_end)
+    template.set_suptitle(suptitle, adjust=adjust)
+
+    if fn_plot is not None:
+        save_figure(template.fig, fn_plot, dpi=300)
+        return None
+
+    return template.fig
+
+
+# 13) EOFs #################################################################
+# maps of the leading EOFs (modes of spatial variability) of the reference data and one GCM, with the explained
+# variance and the congruence (pattern correlation) with the mode of the reference data
+@instrumentation.timed('render')
+def plot_eof_modes(eofs, name_ref, name_sim, var, statistic, time_scale, year_start, year_end,
+                   unit=None, n_modes=4, region='AU',
+                   coordinates=dict(llcrnrlat=-44.5,
+                                    urcrnrlat=-10.7,
+                                    llcrnrlon=112,
+                                    urcrnrlon=156.25),
+                   fn_plot=None, adjust=0.85, map_backend='basemap', map_render_mode='mesh'):
+    """
+    This function creates a plot with the leading n_modes EOFs (one row per mode) of a) the historical reference and
+    b) the simulated / bias corrected data, for one time scale. eofs is an xarray dataset with the EOFs of the
+    reference data and the GCMs (dimension source, see evaluation.eofs.get_eof_fields); the EOFs of the GCM are
+    aligned in sign with the EOFs of the reference data.
+    map_backend is the library for the coastlines and states: basemap or cartopy (see evaluation.maps).
+    map_render_mode is mesh (exact, one quadrilateral per grid cell) or raster (faster, one image per panel).
+    If fn_plot is given, the plot is saved and None is returned (the figure is reused, see plot_bias), otherwise
+    a new figure is returned.
+    """
+
+    types = [name_ref, name_sim]
+    eofs = eofs.sel(time_scale=time_scale, drop=True)
+    n_modes = min(n_modes, eofs.sizes['mode'])
+
+    # get the figure with the map layers for this region and layout (created once per process, see evaluation.maps);
+    # without fn_plot, the figure is returned to the caller and therefore not shared with other plots
+    nrows = n_modes
+    ncols = len(types)
+    template = maps.get_map_template(coordinates, nrows, ncols, figsize=(3.33*ncols,2.4*nrows), backend=map_backend,
+                                     reuse=fn_plot is not None)
+
+    unit_str = ' (%s)' % unit if unit is not None else ''
+    cmap = plt.get_cmap('RdBu', 11)
+    cmap.set_bad('#f0f0f0')
+
+    for row_idx in range(n_modes):
+        mode = row_idx + 1
+
+        # the same colour range for both datasets, so that the patterns are comparable
+        vmax = get_symmetric_limit(eofs['eof'].sel(source=types, mode=mode).values)
+
+        for col_idx in range(len(types)):
+
+            source = types[col_idx]
+            field = eofs['eof'].sel(source=source, mode=mode, drop=True)
+
+            # add title
+            plot_title = '%s mode %s (%s) \nExplained variance: %.1f%%' % (
+                source.upper(), mode, time_scale, 100 * float(eofs['explained_variance'].sel(source=source, mode=mode)))
+            if source != name_ref:
+                plot_title = '%s, congruence: %.2f' % (plot_title, float(eofs['congruence'].sel(source=source, mode=mode)))
+
+            # create plot
+            template.draw_panel(row_idx, col_idx, field, vmin=-vmax, vmax=vmax, cmap=cmap, extend='both',
+                                title=plot_title, legend_title='EOF%s' % unit_str, mode=map_render_mode)
+
+    suptitle = '%s (%s, %s anomalies)\nEOFs of %s vs %s\nRegion: %s, Period: %s-%s' % (
+        get_variable_longname(var), statistic, time_scale, name_sim.upper(), name_ref.upper(), region, year_start, year_end)
+    template.set_suptitle(suptitle, adjust=adjust)
+
+    if fn_plot is not None:
+        save_figure(template.fig, fn_plot, dpi=300)
+        return None
+
+    return template.fig
+
+
+# explained variance of each mode (variance spectrum) of the reference data and all GCMs, and the congruence of the
+# modes of the GCMs with the modes of the reference data
+@instrumentation.timed('render')
+def plot_eof_variance_spectra(eofs, name_ref, var, statistic, time_scale, year_start, year_end, region='AU',
+                              fn_plot=None):
+    """
+    This function creates a plot with a) the fraction of the variance explained by each EOF of the reference data
+    and each GCM (variance spectra), and the fraction of the variance of each GCM that is explained by the EOFs of the
+    reference data (dashed), b) the congruence (pattern correlation) of the EOFs of each GCM with the EOF of the
+    reference data of the same rank. eofs is an xarray dataset with the EOFs of the reference data and the GCMs (see
+    evaluation.eofs.get_eof_fields).
+    """
+
+    eofs = eofs.sel(time_scale=time_scale, drop=True)
+    sources = list(eofs['source'].values)
+    modes = eofs['mode'].values
+    line_colors = sns.color_palette('tab10', max(len(sources) - 1, 1))
+
+    fig, axes = plt.subplots(1, 2, figsize=(10, 4))
+    for i, source in enumerate(sources):
+        explained_variance = 100 * eofs['explained_variance'].sel(source=source).values
+        if source == name_ref:
+            axes[0].plot(modes, explained_variance, color='k', linewidth=2, marker='o', markersize=4, label=source.upper())
+            continue
+        color = line_colors[(i - 1) % len(line_colors)]
+        axes[0].plot(modes, explained_variance, color=color, linewidth=1, marker='o', markersize=3, label=source.upper())
+        axes[0].plot(modes, 100 * eofs['projected_variance'].sel(source=source).values, color=color, linewidth=1,
+                     linestyle='--')
+        axes[1].plot(modes, eofs['congruence'].sel(source=source).values, color=color, linewidth=1, marker='o',
+                     markersize=3, label=source.upper())
+
+    axes[0].set_xlabel('mode', fontsize=8)
+    axes[0].set_ylabel('explained variance (%)', fontsize=8)
+    axes[0].set_title('Variance spectra (dashed: variance explained\nby the modes of %s)' % name_ref.upper(), fontsize=9)
+    axes[1].set_xlabel('mode', fontsize=8)
+    axes[1].set_ylabel('congruence with the mode of %s' % name_ref.upper(), fontsize=8)
+    axes[1].set_ylim(0, 1)
+    axes[1].set_title('Congruence of the modes', fontsize=9)
+    for ax in axes:
+        ax.set_xticks(modes)
+        ax.tick_params(labelsize=8)
+        ax.grid(alpha=0.3)
+    fig.legend(*axes[0].get_legend_handles_labels(), loc='center right', fontsize=8, frameon=False)
+
+    fig.suptitle('%s (%s, %s anomalies): EOFs\nRegion: %s, Period: %s-%s' % (get_variable_longname(var), statistic,
+                 time_scale, region, year_start, year_end), fontsize=10)
+    fig.tight_layout(rect=(0, 0, 0.85, 0.9))
+
+    if fn_plot is not None:
+        save_figure(fig, fn_plot, dpi=300)
+
+    return fig
+
+
+# 14) Return levels #################################################################
+# levels of the relative bias of the return levels (%)
+return_level_bias_rel_levels = [-50, -40, -30, -20, -10, -5, 5, 10, 20, 30, 40, 50]
+
+
+# maps of the return levels (GEV distribution of the annual maxima) of the reference and the simulated data and the
+# bias of the return levels, one row per return period
+@instrumentation.timed('render')
+def plot_return_levels(gevs, name_ref, name_sim, var, statistic, year_start, year_end,
+                       unit=None, region='AU',
+                       coordinates=dict(llcrnrlat=-44.5,
+                                        urcrnrlat=-10.7,
+                                        llcrnrlon=112,
+                                        urcrnrlon=156.25),
+                       fn_plot=None, adjust=0.86, map_backend='basemap', map_render_mode='mesh'):
+    """
+    This function creates a plot with a) the return levels of the historical reference, b) the return levels of the
+    simulated / bias corrected data, c) the bias of the return levels (simulated minus reference, relative in % for
+    all variables but temperature and solar exposure), with one row per return period. gevs is a dictionary with
+    the GEV fits of name_ref and name_sim (xarray datasets with the variable return_level, see
+    evaluation.extremes.get_gev_fields); the bias is taken from the dataset of name_sim if it is stored there (see
+    evaluation.extremes.get_return_level_bias).
+    map_backend is the library for the coastlines and states: basemap or cartopy (see evaluation.maps).
+    map_render_mode is mesh (exact, one quadrilateral per grid cell) or raster (faster, one image per panel).
+    If fn_plot is given, the plot is saved and None is returned (the figure is reused, see plot_bias), otherwise
+    a new figure is returned.
+    """
+
+    if var in ['temp_min_day', 'temp_max_day', 'solar_exposure_day']:
+        plot_bias_type = 'bias_abs'
+    else:
+        plot_bias_type = 'bias_rel'
+
+    types = [name_ref, name_sim, plot_bias_type]
+    fields = dict([(x, gevs[x]['return_level']) for x in [name_ref, name_sim]])
+    bias = gevs[name_sim]
+    if 'return_level_bias' not in bias:
+        bias = extremes.get_return_level_bias(gevs[name_sim], gevs[name_ref])
+    fields['bias_abs'] = bias['return_level_bias']
+    fields['bias_rel'] = bias['return_level_bias_rel']
+    return_periods = list(fields[name_ref]['return_period'].values)
+
+    # get the figure with the map layers for this region and layout (created once per process, see evaluation.maps);
+    # without fn_plot, the figure is returned to the caller and therefore not shared with other plots
+    nrows = len(return_periods)
+    ncols = len(types)
+    template = maps.get_map_template(coordinates, nrows, ncols, figsize=(3.33*ncols,2.4*nrows), backend=map_backend,
+                                     reuse=fn_plot is not None)
+
+    unit_str = ' (%s)' % unit if unit is not None else ''
+
+    for row_idx in range(len(return_periods)):
+        return_period = return_periods[row_idx]
+
+        # the same colour range for both datasets, so that the maps are comparable (2nd to 98th percentile, so that
+        # single grid cells do not set the range)
+        values = np.concatenate([fields[x].sel(return_period=return_period).values.ravel() for x in [name_ref, name_sim]])
+        values = values[np.isfinite(values)]
+        if len(values) > 0:
+            vmin_level, vmax_level = np.percentile(values, [2, 98])
+        else:
+            vmin_level, vmax_level = 0, 1
+
+        for col_idx in range(len(types)):
+
+            type = types[col_idx]
+            field = fields[type].sel(return_period=return_period, drop=True)
+
+            if type in [name_ref, name_sim]:
+                vmin, vmax, levels = vmin_level, max(vmax_level, vmin_level + 1e-6), None
+                if var in ['temp_min_day', 'temp_max_day', 'solar_exposure_day']:
+                    cmap = plt.get_cmap('Reds', 10)
+                else:
+                    cmap = plt.get_cmap('Blues', 10)
+                legend_title = 'Return level%s' % unit_str
+                extend = 'both'
+            elif type == 'bias_abs':
+                vmax = get_symmetric_limit(field.values)
+                vmin, levels = -vmax, None
+                if var in ['temp_min_day', 'temp_max_day', 'solar_exposure_day']:
+                    cmap = plt.get_cmap('RdBu_r', 11)
+                else:
+                    cmap = plt.get_cmap('RdBu', 11)
+                legend_title = 'Bias%s' % unit_str
+                extend = 'both'
+            else:
+                vmin, vmax, levels = None, None, return_level_bias_rel_levels
+                cmap = plt.get_cmap('RdBu', len(return_level_bias_rel_levels) - 1)
+                cmap.set_under('#addd8e')
+                cmap.set_over('#dd1c77')
+                legend_title = 'Bias (%)'
+                extend = 'both'
+            cmap.set_bad('#f0f0f0')
+
+            # add title
+            mean = float(field.mean())
+            plot_title = [name_ref.upper(), name_sim.upper(), 'Bias'][col_idx]
+            plot_title = '%s (%s-year) \nMean: %.2f%s' % (plot_title, return_period, mean,
+                                                          ' %' if type == 'bias_rel' else ' %s' % unit if unit is not None else '')
+
+            # create plot
+            template.draw_panel(row_idx, col_idx, field, vmin=vmin, vmax=vmax, cmap=cmap, levels=levels, extend=extend,
+                                title=plot_title, legend_title=legend_title, mode=map_render_mode)
+
+    suptitle = '%s (%s): return levels of %s vs %s (GEV, %s)\nRegion: %s, Period: %s-%s' % (
+        get_variable_longname(var), statistic, name_sim.upper(), name_ref.upper(),
+        gevs[name_ref].attrs.get('method', 'lmoments'), region, year_start, year_end)
+    template.set_suptitle(suptitle, adjust=adjust)
+
+    if fn_plot is not None:
+        save_figure(template.fig, fn_plot, dpi=300)
+        return None
+
+    return template.fig
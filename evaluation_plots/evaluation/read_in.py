@@ -5,13 +5,195 @@
 
 # Import libraries
 import os
+import calendar
 import glob
+import contextlib
 
 import pandas as pd
 import xarray as xr
 import numpy as np
 
 from evaluation.helpers import *
+from evaluation import instrumentation
+
+
+# Cache of opened datasets. It is only used while a group of plots that share the same input files
+# is created (see cached_reads and evaluation.planner), so that each file is read only once.
+_dataset_cache = None
+
+
+@contextlib.contextmanager
+def cached_reads():
+    """
+    Within this context, every file read with open_dataset is kept in memory and reused when it is read again.
+    The cache is emptied when the context is left.
+    """
+    global _dataset_cache
+    _dataset_cache = dict()
+    try:
+        yield
+    finally:
+        _dataset_cache = None
+
+
+def open_dataset(fn, load=True):
+    """
+    This function opens a netcdf file as xarray dataset and loads it into memory (if load is True).
+    Within the cached_reads context, the dataset is kept in memory and a (shallow) copy of it is returned
+    when the same file is read again.
+    """
+
+    if _dataset_cache is not None and (fn, load) in _dataset_cache:
+        return _dataset_cache[(fn, load)].copy()
+
+    with instrumentation.step('read', nbytes=os.path.getsize(fn) if load else 0, label=fn):
+        ds = xr.open_dataset(fn)
+        if load:
+            ds = ds.load()
+
+    if _dataset_cache is not None:
+        _dataset_cache[(fn, load)] = ds
+        ds = ds.copy()
+
+    return ds
+
+
+def to_dataframe(ds):
+    """
+    This function converts an xarray dataset into a pandas dataframe, with the dimensions as columns.
+    """
+    with instrumentation.step('to_dataframe'):
+        return ds.to_dataframe().reset_index()
+
+
+# Functions to prepare the file names of the preprocessed data.
+def get_statistic_file_name(data_path, name, var, time_scale, statistic, year_start, year_end, suffix='mean', gcm=None):
+    """
+    This function returns the file name of a preprocessed statistic (e.g. awap_rain_day_yearsum_1976_2005_mean.nc).
+    time_scale can be annual, seasonal or monthly, suffix is e.g. mean, merged or lag1corr. For the simulation
+    data, gcm is the name of the subfolder for the GCM.
+    """
+    time_scale_str = dict(annual='year', seasonal='seas', monthly='mon')[time_scale]
+    if gcm is not None:
+        data_path = os.path.join(data_path, gcm)
+    return os.path.join(data_path, '%s_%s_%s%s_%s_%s_%s.nc' % (name, var, time_scale_str, statistic, year_start, year_end, suffix))
+
+
+def get_bias_file_name(data_path_sim, gcm, name_ref, bias_type, var, time_scale, statistic, year_start, year_end):
+    """
+    This function returns the file name of a preprocessed bias (e.g. bias_abs_rain_day_yearsum_1976_2005.nc).
+    """
+    time_scale_str = dict(annual='year', seasonal='seas', monthly='mon')[time_scale]
+    return os.path.join(data_path_sim, gcm, 'bias_%s' % name_ref, '%s_%s_%s%s_%s_%s.nc' % (bias_type, var, time_scale_str, statistic, year_start, year_end))
+
+
+def get_input_files(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref, statistics, year_start, year_end,
+                    time_scales=['annual', 'seasonal'], suffix='mean', var_ref=None, var_sim=None,
+                    read_in_bias_types=None, include_lag1corr=False):
+    """
+    This function returns the list of preprocessed files that are read in to create one plot, for the reference
+    dataset and all gcms. It is used to plan which plots can share their input files (see evaluation.planner).
+    Optional files (lag-1 correlation) are only included if they exist.
+    """
+
+    # set default values
+    if var_ref is None: var_ref=var
+    if var_sim is None: var_sim=var
+
+    if type(statistics) == str:
+        statistics = [statistics]
+
+    files = []
+    for statistic in statistics:
+        for time_scale in time_scales:
+            if name_ref is not None:
+                files.append(get_statistic_file_name(data_path_ref, name_ref, var_ref, time_scale, statistic,
+                                                     year_start, year_end, suffix))
+                if include_lag1corr:
+                    files.append(get_statistic_file_name(data_path_ref, name_ref, var_ref, time_scale, statistic,
+                                                         year_start, year_end, 'lag1corr'))
+            for gcm in gcms:
+                name_sim = '%s_%s' % (name_sim_prefix, gcm)
+                files.append(get_statistic_file_name(data_path_sim, name_sim, var_sim, time_scale, statistic,
+                                                     year_start, year_end, suffix, gcm=gcm))
+                if include_lag1corr:
+                    files.append(get_statistic_file_name(data_path_sim, name_sim, var_sim, time_scale, statistic,
+                                                         year_start, year_end, 'lag1corr', gcm=gcm))
+                if read_in_bias_types is not None:
+                    for bias_type in read_in_bias_types:
+                        files.append(get_bias_file_name(data_path_sim, gcm, name_ref, bias_type, var, time_scale,
+                                                        statistic, year_start, year_end))
+
+    if include_lag1corr:
+        files = [x for x in files if not x.endswith('_lag1corr.nc') or os.path.exists(x)]
+
+    return files
+
+
+def get_daily_files(data_path_ref, data_path_sim, gcms, var_ref, var_sim, year_start, year_end):
+    """
+    This function returns the daily input files of the reference dataset (one file per year) and of
+    each GCM (one file for all years), as used by prepare_daily_timeseries_for_all_gcms.
+    """
+
+    files = dict()
+
+    # reference data: can't just merge all files together, because there is an issue with latitudes after 2017
+    data_path_ref_temp = data_path_ref.replace('#VAR#', var_ref) # replace VAR placeholder, if applicable
+    years_to_read_in = np.arange(year_start, year_end+1)
+    files['ref'] = [glob.glob(os.path.join(data_path_ref_temp, '*%s*%s*.nc' % (var_ref, x))) for x in years_to_read_in]
+
+    # GCM data
+    for gcm in gcms:
+        data_path_sim_temp = data_path_sim.replace('#GCM#', gcm).replace('#VAR#', var_sim)
+        files[gcm] = os.path.join(data_path_sim_temp, '*%s*.nc' % (var_sim))
+
+    return files
+
+
+def get_daily_unit_conversion(var, verbose=True):
+    """
+    This function returns the factor and the offset (value * factor + offset) that convert the daily GCM data of
+    a variable into the unit of the reference data (K --> degC for temperature, mm/s --> mm/day for rainfall).
+    """
+    if var in ['temp_max_day', 'temp_min_day']:
+        if verbose: print('Unit conversion: K --> degC')
+        return 1., -273.15
+    if var == 'rain_day':
+        if verbose: print('Unit conversion: mm/s --> mm/day')
+        return 60. * 60 * 24, 0.
+    return 1., 0.
+
+
+def iterate_daily_data(files, var_in_nc, years, unit_conversion=(1., 0.), lat_slice=None):
+    """
+    This function reads in the daily data one year at a time and yields the year and the data of this year as
+    data array (time, lat, lon). files are the files of each year (list of lists, reference data) or a pattern of
+    the files with all years (GCM data), see get_daily_files. Years without data are skipped. unit_conversion is
+    the factor and offset applied to the data (see get_daily_unit_conversion). lat_slice selects a band of
+    latitudes (index slice), so that only a part of the grid is read in.
+    """
+
+    if isinstance(files, str):
+        files = [sorted(glob.glob(files))] * len(years)
+
+    factor, offset = unit_conversion
+    for year, files_year in zip(years, files):
+        parts = []
+        for fn in files_year:
+            with xr.open_dataset(fn) as ds:
+                da = standardise_dimension_names(ds)[var_in_nc].sel(time=slice(str(year), str(year)))
+                if lat_slice is not None:
+                    da = da.isel(lat=lat_slice)
+                if da.sizes['time'] > 0:
+                    with instrumentation.step('read', label='%s %s' % (fn, year)):
+                        parts.append(standardise_latlon(da.load()))
+        if len(parts) == 0:
+            continue
+        da = xr.concat(parts, dim='time').sortby('time').transpose('time', 'lat', 'lon')
+        if factor != 1 or offset != 0:
+            da = da * factor + offset
+        yield year, da
 
 
 # Read in a regional mask and the related metadata file.
@@ -64,6 +246,7 @@ def read_in_data_for_animations(files, start_date, end_date, var_in_nc):
 
 
 # Function: Read in bias maps as xarray dataset for one GCM and variable.
+@instrumentation.timed('aggregate')
 def read_in_xarray_data_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name_sim, name_ref,
                                     statistic, year_start, year_end, mask=None,
                                     var_ref=None, var_sim=None, var_ref_in_nc=None, var_sim_in_nc=None,
@@ -91,15 +274,14 @@ def read_in_xarray_data_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name
     for time_scale in time_scales:
         
         datasets[time_scale] = dict() # create a new dictionary, for "bias_abs", "bias_rel", "bias_lag1corr"
-        time_scale_str = dict(annual='year', seasonal='seas', monthly='mon')[time_scale]
     
         # read in reference data
         if name_ref is not None:
 
             # read in mean values
-            fn = os.path.join(data_path_ref, '%s_%s_%s%s_%s_%s_mean.nc' % (name_ref, var_ref, time_scale_str, statistic, year_start, year_end))
+            fn = get_statistic_file_name(data_path_ref, name_ref, var_ref, time_scale, statistic, year_start, year_end, 'mean')
             if verbose: print(fn)
-            datasets[time_scale][name_ref] = xr.open_dataset(fn).load()
+            datasets[time_scale][name_ref] = open_dataset(fn)
             
             # if time_scale is seasonal or monthly, aggregate data, so that the dimension name changes to
             # season or month instead of dates (values will be the same)
@@ -109,19 +291,19 @@ def read_in_xarray_data_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name
                 datasets[time_scale][name_ref] = datasets[time_scale][name_ref].groupby('time.month').mean(dim='time')
 
             # read in lag1 correlation (if applicable)
-            fn = os.path.join(data_path_ref, '%s_%s_%s%s_%s_%s_lag1corr.nc' % (name_ref, var_ref, time_scale_str, statistic, year_start, year_end))
+            fn = get_statistic_file_name(data_path_ref, name_ref, var_ref, time_scale, statistic, year_start, year_end, 'lag1corr')
             if os.path.exists(fn):
                 if verbose: print(fn)
-                datasets[time_scale][name_ref + '_lag1corr'] = xr.open_dataset(fn).load()
+                datasets[time_scale][name_ref + '_lag1corr'] = open_dataset(fn)
 
 
         # read in simulation data
         if name_sim is not None:
 
             # read in mean values
-            fn = os.path.join(data_path_sim, gcm, '%s_%s_%s%s_%s_%s_mean.nc' % (name_sim, var_sim, time_scale_str, statistic, year_start, year_end))
+            fn = get_statistic_file_name(data_path_sim, name_sim, var_sim, time_scale, statistic, year_start, year_end, 'mean', gcm=gcm)
             if verbose: print(fn)
-            datasets[time_scale][name_sim] = xr.open_dataset(fn).load()
+            datasets[time_scale][name_sim] = open_dataset(fn)
             
             # if time_scale is seasonal or monthly, aggregate data, so that the dimension name changes to
             # season or month (values will be the same)
@@ -131,17 +313,17 @@ def read_in_xarray_data_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name
                 datasets[time_scale][name_sim] = datasets[time_scale][name_sim].groupby('time.month').mean(dim='time')
 
             # read inlag1 correlation (if applicable)
-            fn = os.path.join(data_path_sim, gcm, '%s_%s_%s%s_%s_%s_lag1corr.nc' % (name_sim, var_sim, time_scale_str, statistic, year_start, year_end))
+            fn = get_statistic_file_name(data_path_sim, name_sim, var_sim, time_scale, statistic, year_start, year_end, 'lag1corr', gcm=gcm)
             if os.path.exists(fn):
                 if verbose: print(fn)
-                datasets[time_scale][name_sim + '_lag1corr'] = xr.open_dataset(fn).load()
+                datasets[time_scale][name_sim + '_lag1corr'] = open_dataset(fn)
 
         # read in absolute / relative bias or bias in lag1corr
         if read_in_bias_types is not None:
             for bias_type in read_in_bias_types:
-                fn = os.path.join(data_path_sim, gcm, 'bias_%s' % name_ref, '%s_%s_%s%s_%s_%s.nc' % (bias_type, var, time_scale_str, statistic, year_start, year_end))
+                fn = get_bias_file_name(data_path_sim, gcm, name_ref, bias_type, var, time_scale, statistic, year_start, year_end)
                 if verbose: print(fn)
-                datasets[time_scale][bias_type] = xr.open_dataset(fn).load()
+                datasets[time_scale][bias_type] = open_dataset(fn)
                 
                 if bias_type in ['bias_abs', 'bias_rel']:
                     # if time_scale is seasonal or monthly, aggregate data, so that the dimension name changes to
@@ -174,6 +356,7 @@ def read_in_xarray_data_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name
 
     
 # Function: Prepare dataframes of bias maps for creating boxplots, for all GCMs.
+@instrumentation.timed('aggregate')
 def prepare_dataframes_for_all_gcms_and_statistics(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref, 
                                                    statistics, year_start, year_end, mask=None,
                                                    time_scales = ['annual', 'seasonal', 'monthly'],
@@ -219,7 +402,7 @@ def prepare_dataframes_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
                                                       var_sim_in_nc=None, time_scales=[time_scale],
                                                       read_in_bias_types=None)
             
-            temp = datasets[time_scale][name_ref].to_dataframe().reset_index()
+            temp = to_dataframe(datasets[time_scale][name_ref])
             temp['type'] = name_ref
             temp['statistic'] = statistic
             
@@ -246,7 +429,7 @@ def prepare_dataframes_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
                                                       var_sim_in_nc=var_sim_in_nc, time_scales=[time_scale],
                                                       read_in_bias_types=None)
 
-                temp = datasets[time_scale][name_sim].to_dataframe().reset_index()
+                temp = to_dataframe(datasets[time_scale][name_sim])
                 temp['type'] = name_sim
                 temp['statistic'] = statistic
                                       
@@ -266,6 +449,7 @@ def prepare_dataframes_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
 
 
 # Read in time series of monthly, seasonal or annual values to be plotted in time series plots, for one GCM.
+@instrumentation.timed('aggregate')
 def read_in_timeseries_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name_sim, name_ref, statistic, year_start, year_end, mask=None,
                  var_ref=None, var_sim=None, var_ref_in_nc=None, var_sim_in_nc=None, 
                                    read_in_bias_types=['bias_abs', 'bias_rel'], 
@@ -292,22 +476,18 @@ def read_in_timeseries_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name_
     
     for time_scale in time_scales:
         
-        time_scale_str = dict(annual='year', seasonal='seas', monthly='mon')[time_scale]
-        
         # read in reference data
         if name_ref is not None:
-            fn = os.path.join(data_path_ref, '%s_%s_%s%s_%s_%s_merged.nc' % (name_ref, var_ref, time_scale_str, 
-                                                                              statistic, year_start, year_end))
+            fn = get_statistic_file_name(data_path_ref, name_ref, var_ref, time_scale, statistic, year_start, year_end, 'merged')
             if verbose: print(fn)
-            datasets[time_scale][name_ref] = xr.open_dataset(fn)
+            datasets[time_scale][name_ref] = open_dataset(fn, load=load and lat is None) # point locations: only load the selected grid cell (below)
 
 
         # read in simulation data
         if name_sim is not None:
-            fn = os.path.join(data_path_sim, gcm, '%s_%s_%s%s_%s_%s_merged.nc' % (name_sim, var_sim, time_scale_str,
-                                                                              statistic, year_start, year_end))
+            fn = get_statistic_file_name(data_path_sim, name_sim, var_sim, time_scale, statistic, year_start, year_end, 'merged', gcm=gcm)
             if verbose: print(fn)
-            datasets[time_scale][name_sim] = xr.open_dataset(fn)
+            datasets[time_scale][name_sim] = open_dataset(fn, load=load and lat is None) # point locations: only load the selected grid cell (below)
         
     # standardise dimension and variable names and apply AWRA mask
     for key1 in datasets.keys():
@@ -343,6 +523,7 @@ def read_in_timeseries_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name_
 
 
 # Read in time series of monthly, seasonal or annual values to be plotted in time series plots, for one GCM.
+@instrumentation.timed('aggregate')
 def read_in_mean_field_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name_sim, name_ref, statistic, year_start, year_end, mask=None,
                                    var_ref=None, var_sim=None, var_ref_in_nc=None, var_sim_in_nc=None, 
                                    time_scales=['annual', 'seasonal', 'monthly'], load=True,
@@ -368,22 +549,18 @@ def read_in_mean_field_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name_
     
     for time_scale in time_scales:
         
-        time_scale_str = dict(annual='year', seasonal='seas', monthly='mon')[time_scale]
-        
         # read in reference data
         if name_ref is not None:
-            fn = os.path.join(data_path_ref, '%s_%s_%s%s_%s_%s_mean.nc' % (name_ref, var_ref, time_scale_str, 
-                                                                              statistic, year_start, year_end))
+            fn = get_statistic_file_name(data_path_ref, name_ref, var_ref, time_scale, statistic, year_start, year_end, 'mean')
             if verbose: print(fn)
-            datasets[time_scale][name_ref] = xr.open_dataset(fn)
+            datasets[time_scale][name_ref] = open_dataset(fn, load=load and lat is None) # point locations: only load the selected grid cell (below)
 
 
         # read in simulation data
         if name_sim is not None:
-            fn = os.path.join(data_path_sim, gcm, '%s_%s_%s%s_%s_%s_mean.nc' % (name_sim, var_sim, time_scale_str,
-                                                                              statistic, year_start, year_end))
+            fn = get_statistic_file_name(data_path_sim, name_sim, var_sim, time_scale, statistic, year_start, year_end, 'mean', gcm=gcm)
             if verbose: print(fn)
-            datasets[time_scale][name_sim] = xr.open_dataset(fn)
+            datasets[time_scale][name_sim] = open_dataset(fn, load=load and lat is None) # point locations: only load the selected grid cell (below)
         
     # standardise dimension and variable names and apply AWRA mask
     for key1 in datasets.keys():
@@ -418,6 +595,7 @@ def read_in_mean_field_for_one_gcm(data_path_ref, data_path_sim, gcm, var, name_
 
 
 # Read in the monthly time series and calculate climatologies to be plotted in climatology plots.
+@instrumentation.timed('aggregate')
 def prepare_climatologies_for_all_gcms_and_statistics(data_path_ref, data_path_sim, gcms, variables, name_sim_prefix, name_ref, 
                                                    statistics, year_start, year_end, mask=None,
                                                    ref_vars=None, sim_vars=None, ref_vars_in_nc=None, 
@@ -457,7 +635,7 @@ def prepare_climatologies_for_all_gcms_and_statistics(data_path_ref, data_path_s
             # calculate the spatial mean for each time step
             temp = datasets['monthly'][name_ref].groupby('time').mean()
             temp['month'] = temp['time.month'] # add month variable
-            temp = temp.to_dataframe().reset_index()
+            temp = to_dataframe(temp)
             temp['type'] = name_ref
             temp['statistic'] = statistic
             temp['var'] = var
@@ -477,7 +655,7 @@ def prepare_climatologies_for_all_gcms_and_statistics(data_path_ref, data_path_s
                 # calculate the spatial mean for each time step
                 temp = datasets['monthly'][name_sim].groupby('time').mean()
                 temp['month'] = temp['time.month'] # add month variable
-                temp = temp.to_dataframe().reset_index()
+                temp = to_dataframe(temp)
                 temp['type'] = name_sim
                 temp['statistic'] = statistic
                 temp['var'] = var
@@ -489,6 +667,7 @@ def prepare_climatologies_for_all_gcms_and_statistics(data_path_ref, data_path_s
 
 # Read in time series of monthly, seasonal or annual time series to be plotted in time series plots, for all GCMs.
 # This function calculates the spatial mean for each time step (i.e. combining all lat/lons into one mean value).
+@instrumentation.timed('aggregate')
 def prepare_timeseries_for_all_gcms_and_statistics(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref, 
                                                    statistics, year_start, year_end, mask=None,
                                                    var_ref=None, var_sim=None, var_ref_in_nc=None, 
@@ -528,7 +707,7 @@ def prepare_timeseries_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
         
         # calculate the mean for each time step
         temp = datasets['annual'][name_ref].groupby('time').mean()
-        temp = temp.to_dataframe().reset_index()
+        temp = to_dataframe(temp)
         temp['type'] = name_ref
         temp['time_scale'] = 'annual'
         temp['statistic'] = statistic
@@ -536,7 +715,7 @@ def prepare_timeseries_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
 
         # read in reference data - seasonal
         temp = datasets['seasonal'][name_ref].groupby('time').mean()
-        temp = temp.to_dataframe().reset_index()
+        temp = to_dataframe(temp)
         temp['type'] = name_ref
         temp['statistic'] = statistic
         temp['time_scale'] = 'seasonal'
@@ -556,7 +735,7 @@ def prepare_timeseries_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
             
             # calculate the mean for each time step
             temp = datasets['annual'][name_sim].groupby('time').mean()
-            temp = temp.to_dataframe().reset_index()
+            temp = to_dataframe(temp)
             temp['type'] = name_sim
             temp['time_scale'] = 'annual'
             temp['statistic'] = statistic
@@ -564,7 +743,7 @@ def prepare_timeseries_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
 
             # calculate the mean for each time step
             temp = datasets['seasonal'][name_sim].groupby('time').mean()
-            temp = temp.to_dataframe().reset_index()
+            temp = to_dataframe(temp)
             temp['type'] = name_sim
             temp['statistic'] = statistic
             temp['time_scale'] = 'seasonal'
@@ -583,6 +762,7 @@ def prepare_timeseries_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
 
 # Read in time series of monthly, seasonal or annual time series to be plotted in time series plots, for all GCMs.
 # This function calculates the temporal mean for all grid cells (i.e. combining all time steps into one mean value).
+@instrumentation.timed('aggregate')
 def prepare_mean_field_for_all_gcms_and_statistics(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref, 
                                                    statistics, year_start, year_end, mask=None,
                                                    var_ref=None, var_sim=None, var_ref_in_nc=None, 
@@ -621,7 +801,7 @@ def prepare_mean_field_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
         
         # calculate the mean over time
         temp = datasets['annual'][name_ref].mean(dim='time') # calculate the time mean, for each grid cell
-        temp = temp.to_dataframe().reset_index()
+        temp = to_dataframe(temp)
         temp['type'] = name_ref
         temp['time_scale'] = 'annual'
         temp['statistic'] = statistic
@@ -629,7 +809,7 @@ def prepare_mean_field_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
 
         # calculate the mean over time
         temp = datasets['seasonal'][name_ref].groupby('time.season').mean(dim='time')
-        temp = temp.to_dataframe().reset_index()
+        temp = to_dataframe(temp)
         temp['type'] = name_ref
         temp['statistic'] = statistic
         temp['time_scale'] = temp['season']
@@ -649,7 +829,7 @@ def prepare_mean_field_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
             
             # calculate the mean over time
             temp = datasets['annual'][name_sim].mean(dim='time')
-            temp = temp.to_dataframe().reset_index()
+            temp = to_dataframe(temp)
             temp['type'] = name_sim
             temp['time_scale'] = 'annual'
             temp['statistic'] = statistic
@@ -657,7 +837,7 @@ def prepare_mean_field_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
 
             # calculate the mean over time
             temp = datasets['seasonal'][name_sim].groupby('time.season').mean(dim='time')
-            temp = temp.to_dataframe().reset_index()
+            temp = to_dataframe(temp)
             temp['type'] = name_sim
             temp['statistic'] = statistic
             temp['time_scale'] = temp['season']
@@ -668,8 +848,64 @@ def prepare_mean_field_for_all_gcms_and_statistics(data_path_ref, data_path_sim,
 
 
 
+# Calculate the mean over time of annual or seasonal data, for each time scale.
+def get_time_means(ds, var, time_scales):
+    """
+    This function returns the mean over time of a variable in the annual or seasonal datasets (see
+    read_in_mean_field_for_one_gcm), for each of the time scales ('annual' or a season, e.g. 'DJF').
+    """
+
+    means = []
+    seasonal = None
+    for time_scale in time_scales:
+        if time_scale == 'annual':
+            means.append(ds['annual'][var].mean(dim='time'))
+        else:
+            if seasonal is None:
+                seasonal = ds['seasonal'][var].groupby('time.season').mean(dim='time')
+            means.append(seasonal.sel(season=time_scale, drop=True))
+
+    return xr.concat(means, dim='time_scale')
+
+
+# Read in the mean fields of the reference data and all GCMs as one array with a 'source' dimension.
+@instrumentation.timed('aggregate')
+def read_in_ensemble_mean_fields(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref,
+                                 statistic, year_start, year_end, mask=None,
+                                 var_ref=None, var_sim=None, var_ref_in_nc=None, var_sim_in_nc=None,
+                                 time_scales=['annual', 'DJF', 'MAM', 'JJA', 'SON'], lat=None, lon=None, verbose=False):
+
+    """
+    This function reads in the annual and seasonal mean fields of the reference data and all GCMs, calculates the
+    mean over time for each time scale (see get_time_means) and returns them as one xarray data array with the
+    dimensions source (name_ref and the GCMs, e.g. awap, isimip_NorESM1-M), time_scale, lat and lon.
+    The fields are aligned on the grid cells that all datasets have in common.
+    Ensemble statistics can be calculated along the source dimension (see evaluation.ensemble).
+    """
+
+    names = [name_ref] + ['%s_%s' % (name_sim_prefix, gcm) for gcm in gcms]
+    fields = []
+    for gcm, name in zip([None] + list(gcms), names):
+        is_ref = gcm is None
+        datasets = read_in_mean_field_for_one_gcm(data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+                                                  gcm=gcm, var=var, name_sim=None if is_ref else name,
+                                                  name_ref=name if is_ref else None, statistic=statistic,
+                                                  year_start=year_start, year_end=year_end, mask=mask,
+                                                  var_ref=var_ref if is_ref else None, var_sim=None if is_ref else var_sim,
+                                                  var_ref_in_nc=var_ref_in_nc if is_ref else None,
+                                                  var_sim_in_nc=None if is_ref else var_sim_in_nc,
+                                                  time_scales=['annual', 'seasonal'], lat=lat, lon=lon, verbose=verbose)
+        fields.append(get_time_means(dict([(x, datasets[x][name]) for x in datasets]), var, time_scales))
+
+    # the grids are the same after preprocessing, align only drops grid cells that are missing in one of the datasets
+    fields = xr.align(*fields, join='inner')
+    ensemble = xr.concat(fields, dim=pd.Index(names, name='source'))
+    return ensemble.assign_coords(time_scale=list(time_scales))
+
+
 # Read in time series of monthly, seasonal or annual time series to be plotted in time series plots, for all GCMs, without
 # spatial or temporal aggregation.
+@instrumentation.timed('aggregate')
 def prepare_spatiotemporal_data_for_all_gcms_and_statistics(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref, 
                                                    statistics, year_start, year_end, mask=None,
                                                    var_ref=None, var_sim=None, var_ref_in_nc=None, 
@@ -708,7 +944,7 @@ def prepare_spatiotemporal_data_for_all_gcms_and_statistics(data_path_ref, data_
         
         # calculate the mean for each time step
         temp = datasets['annual'][name_ref]
-        temp = temp.to_dataframe().reset_index()
+        temp = to_dataframe(temp)
         temp['type'] = name_ref
         temp['time_scale'] = 'annual'
         temp['statistic'] = statistic
@@ -716,7 +952,7 @@ def prepare_spatiotemporal_data_for_all_gcms_and_statistics(data_path_ref, data_
 
         # read in reference data - seasonal
         temp = datasets['seasonal'][name_ref]
-        temp = temp.to_dataframe().reset_index()
+        temp = to_dataframe(temp)
         temp['type'] = name_ref
         temp['statistic'] = statistic
         temp['time_scale'] = 'seasonal'
@@ -736,7 +972,7 @@ def prepare_spatiotemporal_data_for_all_gcms_and_statistics(data_path_ref, data_
             
             # calculate the mean for each time step
             temp = datasets['annual'][name_sim]
-            temp = temp.to_dataframe().reset_index()
+            temp = to_dataframe(temp)
             temp['type'] = name_sim
             temp['time_scale'] = 'annual'
             temp['statistic'] = statistic
@@ -744,7 +980,7 @@ def prepare_spatiotemporal_data_for_all_gcms_and_statistics(data_path_ref, data_
 
             # calculate the mean for each time step
             temp = datasets['seasonal'][name_sim]
-            temp = temp.to_dataframe().reset_index()
+            temp = to_dataframe(temp)
             temp['type'] = name_sim
             temp['statistic'] = statistic
             temp['time_scale'] = 'seasonal'
@@ -763,6 +999,7 @@ def prepare_spatiotemporal_data_for_all_gcms_and_statistics(data_path_ref, data_
 
 
 # Read in daily time series to be plotted in time series plots, for a given lat/lon coordinate - for all GCMs.
+@instrumentation.timed('aggregate')
 def prepare_daily_timeseries_for_all_gcms(data_path_sim, data_path_ref, gcms, var, name_sim_prefix, name_ref,
                                            year_start, year_end, lat=None, lon=None,
                                            var_ref=None, var_sim=None, var_ref_in_nc=None,
@@ -782,10 +1019,10 @@ def prepare_daily_timeseries_for_all_gcms(data_path_sim, data_path_ref, gcms, va
     
     df = pd.DataFrame()
     
+    daily_files = get_daily_files(data_path_ref, data_path_sim, gcms, var_ref, var_sim, year_start, year_end)
+
     # Read in reference data
-    data_path_ref_temp = data_path_ref.replace('#VAR#', var_ref) # replace VAR placeholder, if applicable    
-    years_to_read_in = np.arange(year_start, year_end+1) # can't just merge all files together, because there is an issue with latitudes after 2017
-    files = [glob.glob(os.path.join(data_path_ref_temp, '*%s*%s*.nc' % (var_ref, x))) for x in years_to_read_in]
+    files = daily_files['ref']
     temp = xr.open_mfdataset(files)
     
     # Standardise dimension names
@@ -795,10 +1032,11 @@ def prepare_daily_timeseries_for_all_gcms(data_path_sim, data_path_ref, gcms, va
     # extract time and coordinates
     temp = temp.sel(time=slice(str(year_start), str(year_end)))
     temp = temp.sel(lat=lat, lon=lon, method='nearest')
-    temp = temp.load()
+    with instrumentation.step('read', label=var_ref):
+        temp = temp.load()
     
     # create a dataframe
-    temp = temp.to_dataframe().reset_index()
+    temp = to_dataframe(temp)
     temp['type'] = name_ref
     temp['time_scale'] = 'daily'
     
@@ -809,8 +1047,7 @@ def prepare_daily_timeseries_for_all_gcms(data_path_sim, data_path_ref, gcms, va
     for gcm in gcms:
         
         name_sim = '%s_%s' % (name_sim_prefix, gcm)
-        data_path_sim_temp = data_path_sim.replace('#GCM#', gcm).replace('#VAR#', var_sim)
-        files = os.path.join(data_path_sim_temp, '*%s*.nc' % (var_sim))
+        files = daily_files[gcm]
         
         # Open data
         temp = xr.open_mfdataset(files)
@@ -822,18 +1059,16 @@ def prepare_daily_timeseries_for_all_gcms(data_path_sim, data_path_ref, gcms, va
         # extract time and coordinates
         temp = temp.sel(time=slice(str(year_start), str(year_end)))
         temp = temp.sel(lat=lat, lon=lon, method='nearest')
-        temp = temp.load()
+        with instrumentation.step('read', label=gcm):
+            temp = temp.load()
         
         # Do unit adjustments (only needed for GCMs)
-        if var in ['temp_max_day', 'temp_min_day']:
-            print('Unit conversion: K --> degC')
-            temp[var].values = temp[var].values - 273.15 # K --> degC
-        if var == 'rain_day':
-            print('Unit conversion: mm/s --> mm/day')
-            temp[var].values = temp[var].values * 60 * 60 * 24 # mm/s --> mm/day
+        factor, offset = get_daily_unit_conversion(var)
+        if factor != 1 or offset != 0:
+            temp[var].values = temp[var].values * factor + offset
 
         # create a dataframe
-        temp = temp.to_dataframe().reset_index()
+        temp = to_dataframe(temp)
         temp['type'] = name_sim
         temp['time_scale'] = 'daily'
         
@@ -0,0 +1,250 @@
+# Significance of the bias for the evaluation library.
+
+# The bias maps (see evaluation.plotting.plot_bias) show the difference between the 30-year means of a GCM and
+# the reference data. To show where this difference is larger than the differences expected from the
+# year-to-year variability alone, the mean difference of each grid cell is tested with a (moving) block
+# bootstrap or a permutation test of the annual or seasonal values (the *_merged.nc time series). The bootstrap
+# test is studentised (the mean difference is divided by its standard error in the data and in each resample), as
+# the resampled mean differences alone are too narrow for 30 years and the test would be liberal.
+# The resamples are the same for all grid cells: they are drawn once as a matrix of weights (resamples x years),
+# and the resampled mean differences of many grid cells are one matrix product. The grid cells are tested in
+# tiles, so that memory is bounded (at most max_memory bytes per tile), and the tiles are tested in a pool of
+# worker processes. As the weights are drawn once with a fixed seed, the p-values do not depend on the tiling
+# or the number of workers.
+
+# Import libraries
+import numpy as np
+import xarray as xr
+
+from evaluation import read_in
+from evaluation import parallel
+from evaluation import instrumentation
+
+
+# Weights of the resamples in the worker processes (see _init_tile_worker)
+_weights = None
+
+
+# Function definitions
+def get_default_block_length(n_time):
+    """
+    This function returns the default block length of the block bootstrap for a time series of n_time values
+    (n^(1/3), e.g. 3 for 30 years).
+    """
+    return max(1, int(round(n_time ** (1. / 3))))
+
+
+def get_block_bootstrap_weights(n_time, n_boot, block_length, rng):
+    """
+    This function returns how often each of the n_time values is drawn in each of n_boot moving block bootstrap
+    resamples (array: resamples x values). Each resample consists of blocks of block_length consecutive values
+    (so that the autocorrelation within a block is kept), with random start, truncated to n_time values.
+    """
+
+    block_length = min(block_length, n_time)
+    n_blocks = int(np.ceil(n_time / float(block_length)))
+    starts = rng.randint(0, n_time - block_length + 1, (n_boot, n_blocks))
+    idx = (starts[:, :, np.newaxis] + np.arange(block_length)).reshape(n_boot, -1)[:, :n_time]
+    counts = np.bincount((idx + n_time * np.arange(n_boot)[:, np.newaxis]).ravel(), minlength=n_boot * n_time)
+    return counts.reshape(n_boot, n_time).astype('float64')
+
+
+def get_variance_factor(n_time, block_length=None):
+    """
+    This function returns the factor of the variances of the moving block bootstrap resamples of n_time values
+    (see get_block_bootstrap_weights) in the standard errors of the studentised mean differences. The values near
+    the ends of the time series are in fewer blocks, so the means of the resamples vary less than the data, by about
+    (n_time - block_length + 1) / n_time.
+    """
+    block_length = min(block_length or get_default_block_length(n_time), n_time)
+    return (n_time - block_length + 1.) / n_time
+
+
+def get_resample_weights(n_sim, n_ref, test='bootstrap', n_resamples=1000, block_length=None, seed=0):
+    """
+    This function returns the weights (array: resamples x values) with which the resampled mean differences are
+    calculated from the values of all years of the simulation (first n_sim values) and of the reference data
+    (last n_ref values), see get_tile_p_values:
+    - bootstrap: the anomalies (from the mean) of the simulation and the reference are resampled independently
+      with a moving block bootstrap (see get_block_bootstrap_weights), i.e. resamples without a mean difference
+      (weights of the simulation positive, of the reference negative)
+    - permutation: the years of both datasets are pooled and randomly assigned to the simulation and the reference
+    """
+
+    rng = np.random.RandomState(seed)
+    if test == 'bootstrap':
+        weights_sim = get_block_bootstrap_weights(n_sim, n_resamples, block_length or get_default_block_length(n_sim), rng)
+        weights_ref = get_block_bootstrap_weights(n_ref, n_resamples, block_length or get_default_block_length(n_ref), rng)
+        return np.concatenate([weights_sim / n_sim, -weights_ref / n_ref], axis=1)
+    elif test == 'permutation':
+        labels = np.concatenate([np.full(n_sim, 1. / n_sim), np.full(n_ref, -1. / n_ref)])
+        return np.array([labels[rng.permutation(n_sim + n_ref)] for i in range(n_resamples)])
+    else:
+        raise ValueError('Unknown significance test: %s (available: bootstrap, permutation)' % test)
+
+
+def get_studentised_differences(mean_sim, mean_sq_sim, n_sim, mean_ref, mean_sq_ref, n_ref, factors=(1., 1.)):
+    """
+    This function returns the mean differences (simulation minus reference) divided by their standard errors,
+    from the means and the means of the squares of the values (or anomalies) of the simulation and the reference.
+    The variances are multiplied by factors (simulation, reference, see get_variance_factor). Where the difference
+    is zero, the result is zero; where only the standard error is zero, it is infinite.
+    """
+    variance = ((mean_sq_sim - mean_sim ** 2) * factors[0] / n_sim + (mean_sq_ref - mean_ref ** 2) * factors[1] / n_ref)
+    difference = mean_sim - mean_ref
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(difference == 0, 0., difference / np.sqrt(np.maximum(variance, 0)))
+
+
+def get_tile_p_values(sim, ref, weights, test='bootstrap', factors=(1., 1.)):
+    """
+    This function returns the two-sided p-values of the mean difference (simulation minus reference) of a tile of
+    grid cells (sim, ref: arrays years x grid cells without missing values), i.e. the fraction of the resamples
+    (see get_resample_weights) with an absolute test statistic at least as large as the observed one:
+    - bootstrap: the studentised mean difference (see get_studentised_differences; the variances of the resamples
+      are multiplied by factors, see get_variance_factor)
+    - permutation: the mean difference
+    """
+
+    n_sim = len(sim)
+    if test == 'bootstrap':
+        observed = get_studentised_differences(sim.mean(axis=0), (sim ** 2).mean(axis=0), n_sim,
+                                               ref.mean(axis=0), (ref ** 2).mean(axis=0), len(ref))
+        anomalies_sim = sim - sim.mean(axis=0)
+        anomalies_ref = ref - ref.mean(axis=0)
+        weights_sim, weights_ref = weights[:, :n_sim], -weights[:, n_sim:]
+        resampled = get_studentised_differences(np.dot(weights_sim, anomalies_sim),
+                                                np.dot(weights_sim, anomalies_sim ** 2), n_sim,
+                                                np.dot(weights_ref, anomalies_ref),
+                                                np.dot(weights_ref, anomalies_ref ** 2), len(ref), factors=factors)
+    else:
+        observed = sim.mean(axis=0) - ref.mean(axis=0)
+        resampled = np.dot(weights, np.concatenate([sim, ref], axis=0))
+
+    # resampled statistics (resamples x grid cells), with a tolerance for rounding errors
+    exceed = (np.abs(resampled) >= np.abs(observed) * (1 - 1e-10)).sum(axis=0)
+    return (exceed + 1.) / (len(weights) + 1.)
+
+
+def _init_tile_worker(weights):
+    """
+    This function initialises a worker process of the tile pool (or the current process, if the tiles are tested
+    one after the other): the resample weights are sent to each worker once.
+    """
+    global _weights
+    _weights = weights
+
+
+def _test_tile(args):
+    """
+    This function tests one tile of grid cells in a worker process (see get_tile_p_values).
+    """
+    sim, ref, test, factors = args
+    return get_tile_p_values(sim, ref, _weights, test=test, factors=factors)
+
+
+def get_tile_size(n_resamples, n_time, max_memory=2**28):
+    """
+    This function returns the number of grid cells per tile, so that the resampled means and test statistics and
+    the values of a tile need at most max_memory bytes.
+    """
+    return max(1, int(max_memory // (8 * (6 * n_resamples + 4 * n_time))))
+
+
+def get_p_values(sim, ref, test='bootstrap', n_resamples=1000, block_length=None, seed=0, max_memory=2**28,
+                 n_workers=1):
+    """
+    This function tests the mean difference of each grid cell of two arrays (sim, ref: years x grid cells) with a
+    block bootstrap or permutation test (see get_resample_weights) and returns the p-values (one per grid cell,
+    NaN for grid cells with missing values). The grid cells are tested in tiles (see get_tile_size), in a pool of
+    n_workers processes. Within a worker process of the plot tasks (daemon process), the tiles are tested one after
+    the other.
+    """
+
+    sim = np.asarray(sim, dtype='float64')
+    ref = np.asarray(ref, dtype='float64')
+    valid = np.where(np.isfinite(sim).all(axis=0) & np.isfinite(ref).all(axis=0))[0]
+    p_values = np.full(sim.shape[1], np.nan)
+    if len(valid) == 0:
+        return p_values
+
+    weights = get_resample_weights(len(sim), len(ref), test=test, n_resamples=n_resamples,
+                                   block_length=block_length, seed=seed)
+    tile_size = get_tile_size(n_resamples, len(sim) + len(ref), max_memory)
+    tiles = [valid[start:start + tile_size] for start in range(0, len(valid), tile_size)]
+    factors = (1., 1.)
+    if test == 'bootstrap':
+        factors = (get_variance_factor(len(sim), block_length), get_variance_factor(len(ref), block_length))
+    args = ((sim[:, idx], ref[:, idx], test, factors) for idx in tiles)
+
+    results = parallel.map_tiles(_test_tile, args, n_workers=min(n_workers, len(tiles)), initializer=_init_tile_worker,
+                                 initargs=(weights,))
+    for idx, result in zip(tiles, results):
+        p_values[idx] = result
+
+    return p_values
+
+
+def get_significance_mask(p_values, significance_level=0.05, fdr=True):
+    """
+    This function returns a boolean field that is True where the bias is significant. With fdr, the false
+    discovery rate of all grid cells of the field (and time scale, if p_values has the dimension time_scale) is
+    controlled at the significance level (Benjamini-Hochberg), otherwise each grid cell is tested at the
+    significance level.
+    """
+
+    if not fdr:
+        return p_values < significance_level
+
+    if 'time_scale' in p_values.dims:
+        return xr.concat([get_significance_mask(p_values.sel(time_scale=x), significance_level, fdr)
+                          for x in p_values['time_scale'].values], dim='time_scale')
+
+    values = p_values.values.ravel()
+    valid = np.isfinite(values)
+    p_sorted = np.sort(values[valid])
+    thresholds = significance_level * np.arange(1, len(p_sorted) + 1) / max(len(p_sorted), 1)
+    below = np.where(p_sorted <= thresholds)[0]
+    p_max = p_sorted[below[-1]] if len(below) > 0 else -1.
+    return p_values <= p_max
+
+
+@instrumentation.timed('aggregate')
+def get_bias_p_values(data_path_ref, data_path_sim, gcm, var, name_sim, name_ref, statistic, year_start, year_end,
+                      mask=None, var_ref=None, var_sim=None, var_ref_in_nc=None, var_sim_in_nc=None,
+                      time_scales=['annual', 'DJF', 'MAM', 'JJA', 'SON'], test='bootstrap', n_resamples=1000,
+                      block_length=None, seed=0, max_memory=2**28, n_workers=1, verbose=False):
+    """
+    This function reads in the time series of annual and seasonal values (*_merged.nc) of one GCM and the reference
+    data and tests the mean difference of each grid cell for each time scale ('annual' or a season, e.g. 'DJF'),
+    see get_p_values. Returns the p-values as xarray data array with the dimensions time_scale, lat and lon.
+    """
+
+    datasets = read_in.read_in_timeseries_for_one_gcm(
+        data_path_ref=data_path_ref, data_path_sim=data_path_sim, gcm=gcm, var=var, name_sim=name_sim,
+        name_ref=name_ref, statistic=statistic, year_start=year_start, year_end=year_end, mask=mask,
+        var_ref=var_ref, var_sim=var_sim, var_ref_in_nc=var_ref_in_nc, var_sim_in_nc=var_sim_in_nc,
+        time_scales=sorted(set(['annual' if x == 'annual' else 'seasonal' for x in time_scales])), verbose=verbose)
+
+    fields = []
+    for time_scale in time_scales:
+        key = 'annual' if time_scale == 'annual' else 'seasonal'
+        da_sim, da_ref = xr.align(datasets[key][name_sim][var], datasets[key][name_ref][var], join='inner',
+                                  exclude=['time'])
+        if time_scale != 'annual':
+            da_sim = da_sim.isel(time=(da_sim['time.season'] == time_scale).values)
+            da_ref = da_ref.isel(time=(da_ref['time.season'] == time_scale).values)
+        da_sim = da_sim.transpose('time', 'lat', 'lon')
+        da_ref = da_ref.transpose('time', 'lat', 'lon')
+
+        p_values = get_p_values(da_sim.values.reshape(da_sim.shape[0], -1), da_ref.values.reshape(da_ref.shape[0], -1),
+                                test=test, n_resamples=n_resamples, block_length=block_length, seed=seed,
+                                max_memory=max_memory, n_workers=n_workers)
+        fields.append(xr.DataArray(p_values.reshape(da_sim.shape[1:]), dims=['lat', 'lon'],
+                                   coords=dict(lat=da_sim['lat'], lon=da_sim['lon'])))
+
+    fields = xr.align(*fields, join='outer')
+    p_values = xr.concat(fields, dim='time_scale').assign_coords(time_scale=list(time_scales))
+    p_values.name = 'p_value'
+    p_values.attrs = dict(test=test, n_resamples=n_resamples)
+    return p_values
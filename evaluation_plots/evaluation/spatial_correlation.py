@@ -0,0 +1,144 @@
+# Spatial correlation of the simulated and reference mean fields for the evaluation library.
+
+# The spatial correlation plots compare the mean of each grid cell in the GCM data with the mean in the
+# reference data, for each season. Instead of merging long data frames on time scale, statistic and lat / lon
+# and drawing one point per grid cell, the mean fields are kept as arrays (one row per time scale, one column
+# per grid cell), which are aligned by their index. The 2-D histograms and the linear regressions of all
+# panels are calculated at once with NumPy (see evaluation.plotting.plot_spatial_correlation_density).
+
+# Import libraries
+import collections
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from evaluation import read_in
+from evaluation import instrumentation
+
+
+# Function definitions
+@instrumentation.timed('aggregate')
+def get_mean_fields(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref, statistic,
+                    year_start, year_end, mask=None, var_ref=None, var_sim=None, var_ref_in_nc=None,
+                    var_sim_in_nc=None, time_scales=['annual', 'DJF', 'MAM', 'JJA', 'SON']):
+    """
+    This function reads in the mean fields of the reference data and of all GCMs, and returns an ordered
+    dictionary with an array of shape (time scales, grid cells) for each dataset (name_ref and the GCMs).
+    The arrays are aligned: the same column is the same grid cell in all datasets. Grid cells outside the mask
+    are NaN.
+    """
+
+    fields = collections.OrderedDict()
+
+    datasets = read_in.read_in_mean_field_for_one_gcm(data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+                                                      gcm=None, var=var, name_sim=None, name_ref=name_ref,
+                                                      statistic=statistic, year_start=year_start, year_end=year_end,
+                                                      mask=mask, var_ref=var_ref, var_ref_in_nc=var_ref_in_nc,
+                                                      time_scales=['annual', 'seasonal'])
+    ref = read_in.get_time_means(dict([(x, datasets[x][name_ref]) for x in datasets]), var, time_scales)
+
+    for gcm in gcms:
+        name_sim = '%s_%s' % (name_sim_prefix, gcm)
+        datasets = read_in.read_in_mean_field_for_one_gcm(data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+                                                          gcm=gcm, var=var, name_sim=name_sim, name_ref=None,
+                                                          statistic=statistic, year_start=year_start, year_end=year_end,
+                                                          mask=mask, var_sim=var_sim, var_sim_in_nc=var_sim_in_nc,
+                                                          time_scales=['annual', 'seasonal'])
+        sim = read_in.get_time_means(dict([(x, datasets[x][name_sim]) for x in datasets]), var, time_scales)
+
+        # the grids are the same after preprocessing, align only returns views of the arrays; the grid of the
+        # first GCM is the grid of all datasets
+        ref_aligned, sim = xr.align(ref, sim, join='inner')
+        if name_ref not in fields:
+            ref = ref_aligned
+            fields[name_ref] = ref_aligned.values.reshape(len(time_scales), -1)
+        elif ref_aligned.shape != ref.shape:
+            raise ValueError('The grid of %s differs from the grid of the other GCMs' % name_sim)
+        fields[name_sim] = sim.values.reshape(len(time_scales), -1)
+
+    return fields
+
+
+def get_regression_statistics(x, y):
+    """
+    This function calculates the linear regression of y on x (y = intercept + slope * x) and the correlation
+    coefficient r along the last axis of the arrays x and y (e.g. for each GCM and time scale at once).
+    Grid cells where x or y is NaN are ignored. Returns a dictionary with arrays n, slope, intercept and r.
+    """
+
+    valid = np.isfinite(x) & np.isfinite(y)
+    n = valid.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.where(valid, x, 0).sum(axis=-1) / n
+        mean_y = np.where(valid, y, 0).sum(axis=-1) / n
+        dx = np.where(valid, x - mean_x[..., np.newaxis], 0)
+        dy = np.where(valid, y - mean_y[..., np.newaxis], 0)
+        sxx = (dx * dx).sum(axis=-1)
+        syy = (dy * dy).sum(axis=-1)
+        sxy = (dx * dy).sum(axis=-1)
+
+        slope = sxy / sxx
+        intercept = mean_y - slope * mean_x
+        r = sxy / np.sqrt(sxx * syy)
+
+    return dict(n=n, slope=slope, intercept=intercept, r=r)
+
+
+def get_limits(x, y):
+    """
+    This function returns the common range (lo, hi) of x and y along the last axis of the arrays, for the grid
+    cells where both x and y are valid. Without valid grid cells (or with only one value), the range is lo to lo + 1.
+    """
+
+    valid = np.isfinite(x) & np.isfinite(y)
+    lo = np.where(valid, np.fmin(x, y), np.inf).min(axis=-1, initial=np.inf)
+    hi = np.where(valid, np.fmax(x, y), -np.inf).max(axis=-1, initial=-np.inf)
+    lo = np.where(np.isfinite(lo), lo, 0.)
+    hi = np.where(np.isfinite(hi) & (hi > lo), hi, lo + 1.)
+    return lo, hi
+
+
+def get_histograms(x, y, bins=100):
+    """
+    This function calculates 2-D histograms of x and y along the last axis of the arrays (e.g. for each GCM and
+    time scale at once). The bins of each histogram cover the range of both x and y, so that the 1:1 line is
+    the diagonal. Returns the counts (shape: x.shape[:-1] + (bins, bins), first index: y) and the bin edges
+    (shape: x.shape[:-1] + (bins + 1,)).
+    """
+
+    shape = x.shape[:-1]
+    x = x.reshape(-1, x.shape[-1])
+    y = y.reshape(-1, y.shape[-1])
+    valid = np.isfinite(x) & np.isfinite(y)
+    lo, hi = get_limits(x, y)
+    width = (hi - lo) / bins
+
+    x = np.where(valid, x, lo[:, np.newaxis])
+    y = np.where(valid, y, lo[:, np.newaxis])
+    idx_x = np.clip(((x - lo[:, np.newaxis]) / width[:, np.newaxis]).astype('int64'), 0, bins - 1)
+    idx_y = np.clip(((y - lo[:, np.newaxis]) / width[:, np.newaxis]).astype('int64'), 0, bins - 1)
+    facet = np.broadcast_to(np.arange(x.shape[0])[:, np.newaxis], x.shape)
+    counts = np.bincount(((facet * bins + idx_y) * bins + idx_x)[valid], minlength=x.shape[0] * bins * bins)
+
+    edges = lo[:, np.newaxis] + width[:, np.newaxis] * np.arange(bins + 1)
+    return counts.reshape(shape + (bins, bins)), edges.reshape(shape + (bins + 1,))
+
+
+def get_statistics_table(fields, name_ref, time_scales):
+    """
+    This function returns a table with the linear regression of the reference data on each GCM (see
+    get_regression_statistics), for each time scale: columns Dataset, time_scale, n, slope, intercept, r.
+    """
+
+    names = [x for x in fields if x != name_ref]
+    x = np.stack([fields[name] for name in names])
+    y = np.broadcast_to(fields[name_ref], x.shape)
+    statistics = get_regression_statistics(x, y)
+
+    return pd.DataFrame(collections.OrderedDict([
+        ('Dataset', np.repeat([x.upper() for x in names], len(time_scales))),
+        ('time_scale', np.tile(time_scales, len(names))),
+        ('n', statistics['n'].ravel()),
+        ('slope', statistics['slope'].ravel()),
+        ('intercept', statistics['intercept'].ravel()),
+        ('r', statistics['r'].ravel())]))
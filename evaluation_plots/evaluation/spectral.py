@@ -0,0 +1,303 @@
+# Spectral analysis for the Fourier diagrams of the evaluation library.
+
+# The Fourier diagrams (see evaluation.plotting.plot_fourier_transform) show the amplitude spectrum of the daily
+# or monthly time series at a point location, for the reference data and each GCM. The time series of all
+# datasets are put into one array (one row per dataset, on a common time axis), the spectra of all rows are
+# calculated at once with a real FFT, and the result is returned as a table that is used by both diagrams
+# (x-axis: frequencies or wave lengths).
+# The spectral bias maps (see evaluation.plotting.plot_band_power_ratio) show the variance of the daily time series
+# of each grid cell in frequency bands (e.g. sub-seasonal, annual cycle, interannual), for the reference data and a
+# GCM, and the ratio of both. The land cells of the grid are read in as passes of latitudes with all years, as many
+# as fit into half of the memory budget (see get_band_power_fields), so that each year of the daily data is read
+# once per pass (a few passes for the 0.05 degree grid). The spectra of the land cells of a pass are calculated with
+# one real FFT per tile of grid cells; the tiles are processed in a pool of worker processes (see
+# evaluation.parallel.map_tiles), which share the other half of the memory budget.
+
+# Import libraries
+import glob
+import collections
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from evaluation import read_in
+from evaluation import parallel
+from evaluation import instrumentation
+from evaluation.helpers import standardise_dimension_names, standardise_latlon
+
+
+# Frequency bands of the spectral bias maps: the shortest and longest period (in days) of each band, None: no limit
+bands = collections.OrderedDict([
+    ('sub-seasonal', [2, 90]),
+    ('annual_cycle', [300, 450]),
+    ('interannual', [450, None]),
+])
+
+
+# Function definitions
+def get_aligned_series(dataframe, var, timestep='daily'):
+    """
+    This function returns the time series of all datasets ('type') in a long data frame (columns: type, time, var)
+    as a wide data frame with one column per dataset (in the order of the data frame) on a common time axis.
+    Monthly time series are calculated as the mean of the daily values.
+    """
+
+    types = list(pd.unique(dataframe['type']))
+    series = dataframe.pivot_table(index='time', columns='type', values=var, aggfunc='mean')[types]
+
+    if timestep == 'monthly':
+        series = series.resample('1MS').mean()
+
+    return series
+
+
+def get_tapers(n, method='periodogram', segment_length=None, n_tapers=5):
+    """
+    This function returns the tapers (windows) for the spectral estimate of a time series of length n, as an
+    array (tapers, time steps):
+    - periodogram: one rectangular window over the whole time series (no averaging)
+    - welch: Hann windows over segments of segment_length time steps (default: n / 8), overlapping by half
+    - multitaper: n_tapers sine tapers over the whole time series.
+    """
+
+    if method == 'periodogram':
+        return np.ones((1, n))
+
+    elif method == 'welch':
+        if segment_length is None:
+            segment_length = max(n // 8, 16)
+        segment_length = min(segment_length, n)
+        window = np.hanning(segment_length)
+        starts = np.arange(0, n - segment_length + 1, max(segment_length // 2, 1))
+        tapers = np.zeros((len(starts), n))
+        for i, start in enumerate(starts):
+            tapers[i, start:start + segment_length] = window
+        return tapers
+
+    elif method == 'multitaper':
+        k = np.arange(1, n_tapers + 1)[:, np.newaxis]
+        return np.sqrt(2. / (n + 1)) * np.sin(np.pi * k * np.arange(1, n + 1) / (n + 1))
+
+    raise ValueError('Unknown method: %s (periodogram, welch or multitaper)' % method)
+
+
+def get_amplitudes(values, method='periodogram', segment_length=None, n_tapers=5):
+    """
+    This function calculates the amplitude spectra of the rows of a 2-D array (datasets, time steps) with one real
+    FFT for all rows (and tapers). The mean of each row is removed (it would leak into the low frequencies of the
+    tapered spectra) and missing values are replaced with zero, i.e. the mean. The amplitudes are scaled so that
+    the level of white noise is the same for all methods (periodogram: the absolute value of the FFT).
+    Returns an array (datasets, n // 2 + 1) for the frequencies 0, 1, ... n // 2 (cycles per time series).
+    """
+
+    values = np.asarray(values, dtype='float64')
+    n = values.shape[-1]
+    values = values - np.nanmean(values, axis=-1, keepdims=True)
+    values = np.where(np.isfinite(values), values, 0.)
+
+    # the tapers have the length of the time series (Welch: zero outside of the segment), so that the spectra of all
+    # methods have the same frequencies
+    tapers = get_tapers(n, method=method, segment_length=segment_length, n_tapers=n_tapers)
+    power = np.abs(np.fft.rfft(values[:, np.newaxis, :] * tapers[np.newaxis, :, :], axis=-1)) ** 2
+    power = power.mean(axis=1) * n / (tapers ** 2).sum(axis=-1).mean()
+
+    return np.sqrt(power)
+
+
+def get_spectra(dataframe, var, timestep='daily', method='periodogram', segment_length=None, n_tapers=5):
+    """
+    This function calculates the amplitude spectra of the time series of all datasets in a long data frame
+    (columns: type, time, var), see get_amplitudes. Returns a dictionary with:
+    - series: the time series (see get_aligned_series)
+    - spectra: a table with the columns type, frequency (per year), wavelength (in days or months, depending on
+      timestep) and amplitude, for the frequencies 1 to n / 2 (cycles per time series, n: length of the time series)
+    Both Fourier diagrams use the same spectra (see evaluation.plotting.plot_fourier_transform).
+    """
+
+    series = get_aligned_series(dataframe, var, timestep)
+    n = len(series)
+    amplitudes = get_amplitudes(series.values.T, method=method, segment_length=segment_length, n_tapers=n_tapers)
+
+    k = np.arange(1, amplitudes.shape[1])
+    amplitudes = amplitudes[:, 1:]
+    steps_per_year = 365 if timestep == 'daily' else 12
+
+    spectra = pd.DataFrame(dict(type=np.repeat(series.columns.values, len(k)),
+                                frequency=np.tile(k / n * steps_per_year, len(series.columns)),
+                                wavelength=np.tile(n / k, len(series.columns)),
+                                amplitude=amplitudes.ravel()),
+                           columns=['type', 'frequency', 'wavelength', 'amplitude'])
+
+    return dict(series=series, spectra=spectra, n=n)
+
+
+def get_top_peaks(amplitudes, n_top):
+    """
+    This function returns the indices of the n_top largest amplitudes, sorted from the largest to the smallest
+    (NaN values are ignored).
+    """
+    amplitudes = np.where(np.isfinite(amplitudes), amplitudes, -np.inf)
+    n_top = min(n_top, int(np.isfinite(amplitudes).sum()))
+    if n_top <= 0:
+        return np.zeros(0, dtype='int64')
+    idx = np.argpartition(-amplitudes, n_top - 1)[:n_top]
+    return idx[np.argsort(-amplitudes[idx], kind='mergesort')]
+
+
+def get_band_power(values, bands=bands, method='periodogram', segment_length=None, n_tapers=5):
+    """
+    This function calculates the variance of the rows of a 2-D array (grid cells, days) in frequency bands (a
+    dictionary: name: [shortest, longest period in days], see bands) from the power spectra (see get_amplitudes).
+    The variance of a frequency is 2 * power / n ** 2 (n: length of the time series), so that the variances of all
+    frequencies add up to the variance of the time series. Returns an array (bands, grid cells).
+    """
+
+    values = np.asarray(values, dtype='float64')
+    n = values.shape[-1]
+    power = get_amplitudes(values, method=method, segment_length=segment_length, n_tapers=n_tapers)[:, 1:] ** 2
+
+    # the Nyquist frequency (n even) has no negative counterpart
+    k = np.arange(1, power.shape[1] + 1)
+    weights = np.where(2 * k == n, 1., 2.) / n ** 2
+    periods = n / k
+
+    band_power = np.zeros((len(bands), len(values)))
+    for i, (period_min, period_max) in enumerate(bands.values()):
+        in_band = periods >= (period_min if period_min is not None else 0)
+        if period_max is not None:
+            in_band &= periods < period_max
+        band_power[i] = np.dot(power[:, in_band], weights[in_band])
+    return band_power
+
+
+def get_band_power_tile_size(n_days, n_tapers=1, max_memory=2**28):
+    """
+    This function returns the number of grid cells for which the spectra are calculated at once, so that the
+    tapered time series and their FFTs need at most max_memory bytes.
+    """
+    return max(1, int(max_memory // (8 * n_days * (2 + 3 * n_tapers))))
+
+
+def get_daily_grid(files, var_in_nc):
+    """
+    This function returns the latitudes and longitudes of the daily data (files: see
+    evaluation.read_in.get_daily_files), from the first file.
+    """
+    if isinstance(files, str):
+        files = sorted(glob.glob(files))
+    else:
+        files = [fn for files_year in files for fn in files_year]
+    if len(files) == 0:
+        raise IOError('No daily files found')
+    with xr.open_dataset(files[0]) as ds:
+        da = standardise_latlon(standardise_dimension_names(ds)[var_in_nc].isel(time=0).load())
+    return da['lat'].values, da['lon'].values
+
+
+def _band_power_tile(args):
+    """
+    This function calculates the variance in the frequency bands (see get_band_power) of a tile of land cells
+    (values: array grid cells x days) in a worker process.
+    """
+    values, bands, method, segment_length, n_tapers = args
+    return get_band_power(values, bands, method=method, segment_length=segment_length, n_tapers=n_tapers)
+
+
+def get_passes(land, max_cells):
+    """
+    This function splits the rows (latitudes) with land cells of a land mask (lat, lon) into passes of consecutive
+    rows with at most max_cells land cells each (at least one row per pass). Returns a list of index slices.
+    """
+
+    cells_per_row = land.sum(axis=1)
+    passes = []
+    start = None
+    n_cells = 0
+    for row, n in enumerate(cells_per_row):
+        if start is not None and (n == 0 or n_cells + n > max_cells):
+            passes.append(slice(start, row))
+            start = None
+        if n > 0:
+            if start is None:
+                start, n_cells = row, 0
+            n_cells = n_cells + n
+    if start is not None:
+        passes.append(slice(start, len(cells_per_row)))
+    return passes
+
+
+def read_pass(files, var_in_nc, years, unit_conversion, lat_slice, land):
+    """
+    This function reads in the daily data of the land cells (land: mask of the rows of the pass) of a band of
+    latitudes (lat_slice), one year after the other (each year is read once). Returns an array (land cells x days,
+    float32).
+    """
+
+    idx = np.where(land.ravel())[0]
+    values = np.full((len(idx), 366 * len(years)), np.nan, dtype='float32')
+    n_days = 0
+    for year, da in read_in.iterate_daily_data(files, var_in_nc, years, unit_conversion, lat_slice=lat_slice):
+        year_values = da.values.reshape(da.shape[0], -1)[:, idx]
+        values[:, n_days:n_days + len(year_values)] = year_values.T
+        n_days = n_days + len(year_values)
+    return values[:, :n_days]
+
+
+@instrumentation.timed('aggregate')
+def get_band_power_fields(files, var_in_nc, year_start, year_end, bands=bands, mask=None, unit_conversion=(1., 0.),
+                          method='periodogram', segment_length=None, n_tapers=5, max_memory=2**32, n_workers=1):
+    """
+    This function calculates the variance of the daily time series (year_start to year_end) of each land cell in
+    frequency bands (see get_band_power). files are the daily files of the reference data or a GCM (see
+    evaluation.read_in.get_daily_files), mask is a boolean data array of the land cells (default: all grid cells
+    with data). max_memory is the memory (bytes) of the whole calculation: half of it holds the daily data of the
+    land cells of a pass of latitudes (see get_passes, each year is read once per pass), the other half the spectra
+    of the tiles of grid cells, which are processed in a pool of n_workers processes. Returns an xarray dataset
+    with the variable band_power (dimensions band, lat, lon) and the shortest and longest period of each band.
+    """
+
+    years = np.arange(year_start, year_end + 1)
+    lat, lon = get_daily_grid(files, var_in_nc)
+    if mask is not None:
+        land = mask.reindex(lat=lat, lon=lon, method='nearest', tolerance=1e-3).fillna(False).astype(bool).values
+    else:
+        land = np.ones((len(lat), len(lon)), dtype=bool)
+
+    n_days = 366 * len(years)
+    passes = get_passes(land, max(1, int(max_memory // (2 * 4 * n_days))))
+    n_workers = max(n_workers, 1)
+
+    band_power = np.full((len(bands), len(lat), len(lon)), np.nan)
+    for lat_slice in passes:
+        land_pass = land[lat_slice]
+        values = read_pass(files, var_in_nc, years, unit_conversion, lat_slice, land_pass)
+
+        # only land cells with data (the ocean is not read in or transformed)
+        cells = np.where(np.isfinite(values).any(axis=1))[0]
+        n_time = values.shape[1]
+        if len(cells) == 0 or n_time == 0:
+            continue
+        n_tapers_method = len(get_tapers(n_time, method, segment_length, n_tapers))
+        tile_size = get_band_power_tile_size(n_time, n_tapers_method, max_memory // (2 * n_workers))
+        tiles = [cells[start:start + tile_size] for start in range(0, len(cells), tile_size)]
+        args = ((values[idx], bands, method, segment_length, n_tapers) for idx in tiles)
+
+        result = np.full((len(bands), len(values)), np.nan)
+        results = parallel.map_tiles(_band_power_tile, args, n_workers=min(n_workers, len(tiles)))
+        for idx, tile_result in zip(tiles, results):
+            result[:, idx] = tile_result
+        del values
+
+        band_power_pass = band_power[:, lat_slice].reshape(len(bands), -1)
+        band_power_pass[:, np.where(land_pass.ravel())[0]] = result
+        band_power[:, lat_slice] = band_power_pass.reshape((len(bands),) + land_pass.shape)
+
+    period_min = [np.nan if x[0] is None else x[0] for x in bands.values()]
+    period_max = [np.nan if x[1] is None else x[1] for x in bands.values()]
+    ds = xr.Dataset(dict(band_power=(['band', 'lat', 'lon'], band_power)),
+                    coords=dict(band=list(bands.keys()), lat=lat, lon=lon,
+                                period_min=('band', period_min), period_max=('band', period_max)))
+    ds['band_power'].attrs = dict(long_name='Variance in the frequency band', method=method)
+    ds['period_min'].attrs = dict(long_name='Shortest period of the band', units='days')
+    ds['period_max'].attrs = dict(long_name='Longest period of the band', units='days')
+    return ds
@@ -0,0 +1,246 @@
+# Summary statistics for the box plots and climatology plots of the evaluation library.
+
+# The box plots (see evaluation.plotting.plot_box_statistics) show the distribution of the values of all grid
+# cells for each dataset, statistic and time scale (annual, each season or each month). Instead of converting
+# all fields into one long data frame and letting seaborn calculate the quartiles and whiskers, the five-number
+# summaries and a sample of the outliers are calculated here directly on the fields (one row per box, one column
+# per grid cell), for all boxes of a field at once. Only the summaries (a few numbers per box) are plotted.
+# Similarly, the climatology plots (see evaluation.plotting.plot_climatologies) show the mean of each month of
+# the year and an uncertainty band. The mean, standard deviation and band of all months and datasets are
+# calculated at once here, instead of letting seaborn bootstrap the confidence interval of each point.
+
+# Import libraries
+import math
+import calendar
+import collections
+import numpy as np
+import pandas as pd
+
+from evaluation import read_in
+from evaluation import instrumentation
+
+
+# Function definitions
+def get_sorted_quantiles(values, n, probabilities):
+    """
+    This function returns the quantiles (linear interpolation, as np.percentile) of the rows of a sorted 2-D array
+    (NaN values at the end of each row) with n valid values per row, as an array (probabilities, rows).
+    """
+
+    positions = np.asarray(probabilities)[:, np.newaxis] * np.maximum(n - 1, 0)[np.newaxis, :]
+    lower = np.floor(positions).astype('int64')
+    upper = np.minimum(lower + 1, np.maximum(n - 1, 0)[np.newaxis, :])
+    fraction = positions - lower
+    rows = np.arange(values.shape[0])[np.newaxis, :]
+    quantiles = values[rows, lower] + fraction * (values[rows, upper] - values[rows, lower])
+    return np.where(n[np.newaxis, :] > 0, quantiles, np.nan)
+
+
+def get_box_statistics(values, whis=1.5, max_fliers=100):
+    """
+    This function calculates the statistics of box plots (as matplotlib's boxplot_stats) along the last axis of a
+    2-D array (boxes, values), ignoring NaN values: the number of values n, the quartiles q1, med and q3, the
+    whiskers whislo and whishi (the most extreme values within whis times the interquartile range from the
+    quartiles) and the outliers beyond the whiskers (fliers). Of the outliers of each box, at most max_fliers are
+    kept (evenly spaced over the sorted outliers, including the most extreme ones).
+    Returns a dictionary with an array for each statistic and a list of arrays for the fliers.
+    """
+
+    values = np.sort(np.asarray(values, dtype='float64'), axis=-1)
+    n = np.isfinite(values).sum(axis=-1)
+    q1, med, q3 = get_sorted_quantiles(values, n, [0.25, 0.5, 0.75])
+
+    # whiskers: most extreme values within the limits (NaN values are at the end of the sorted rows)
+    iqr = q3 - q1
+    with np.errstate(invalid='ignore'):
+        lo_limit = q1 - whis * iqr
+        hi_limit = q3 + whis * iqr
+        valid = np.isfinite(values)
+        n_low = (valid & (values < lo_limit[:, np.newaxis])).sum(axis=-1)
+        n_high = (valid & (values > hi_limit[:, np.newaxis])).sum(axis=-1)
+    rows = np.arange(values.shape[0])
+    whislo = np.where(n > 0, values[rows, np.minimum(n_low, values.shape[1] - 1)], np.nan)
+    whishi = np.where(n > 0, values[rows, np.maximum(n - n_high - 1, 0)], np.nan)
+
+    # sample of the outliers
+    fliers = []
+    for i in rows:
+        idx = np.concatenate([np.arange(n_low[i]), np.arange(n[i] - n_high[i], n[i])])
+        if len(idx) > max_fliers:
+            idx = idx[np.round(np.linspace(0, len(idx) - 1, max_fliers)).astype('int64')]
+        fliers.append(values[i, idx])
+
+    return dict(n=n, whislo=whislo, q1=q1, med=med, q3=q3, whishi=whishi, fliers=fliers)
+
+
+def get_padded_values(dataframe, value, groups):
+    """
+    This function returns the values of the column value of a long data frame for each group (unique combination
+    of the columns in groups, in the order of the data frame) as a 2-D array (one row per group, padded with NaN
+    values) and a data frame with the values of groups for each row. NaN values are removed.
+    """
+
+    data = dataframe.loc[np.isfinite(dataframe[value].values.astype('float64')), groups + [value]]
+    keys = data[groups].drop_duplicates().reset_index(drop=True)
+    group_idx = pd.MultiIndex.from_frame(keys).get_indexer(pd.MultiIndex.from_frame(data[groups]))
+
+    n_values = np.bincount(group_idx, minlength=len(keys))
+    order = np.argsort(group_idx, kind='mergesort')
+    position = np.arange(len(order)) - np.repeat(np.cumsum(n_values) - n_values, n_values)
+    values = np.full((len(keys), max(n_values.max(), 1) if len(keys) > 0 else 1), np.nan)
+    values[group_idx[order], position] = data[value].values[order]
+
+    return values, keys
+
+
+def get_box_statistics_table(dataframe, value, groups, whis=1.5, max_fliers=100):
+    """
+    This function returns the box plot statistics (see get_box_statistics) of the column value of a long data
+    frame, for each group (unique combination of the columns in groups, in the order of the data frame), as a
+    data frame with the columns groups, n, whislo, q1, med, q3, whishi and fliers (one row per box).
+    """
+    values, keys = get_padded_values(dataframe, value, groups)
+    return get_box_statistics_frame(keys, get_box_statistics(values, whis=whis, max_fliers=max_fliers))
+
+
+def get_box_statistics_frame(keys, statistics):
+    """
+    This function combines the labels of the boxes (data frame, one row per box) and their statistics (see
+    get_box_statistics) into one data frame.
+    """
+    table = keys.reset_index(drop=True).copy()
+    for column in ['n', 'whislo', 'q1', 'med', 'q3', 'whishi']:
+        table[column] = statistics[column]
+    table['fliers'] = pd.Series(statistics['fliers'], index=table.index, dtype='object')
+    return table
+
+
+def get_time_scale_labels(da, time_scale):
+    """
+    This function returns the field of a variable (read in with evaluation.read_in.read_in_xarray_data_for_one_gcm)
+    as a 2-D array (one row per time scale label, one column per grid cell and time step) and the labels: 'annual'
+    for annual data, the seasons for seasonal data and the month abbreviations for monthly data.
+    """
+
+    if time_scale == 'annual':
+        return da.values.reshape(1, -1), ['annual']
+
+    dim = 'season' if time_scale == 'seasonal' else 'month'
+    da = da.transpose(dim, *[x for x in da.dims if x != dim])
+    labels = [str(x) for x in da[dim].values] if dim == 'season' else [calendar.month_abbr[x] for x in da[dim].values]
+    return da.values.reshape(len(labels), -1), labels
+
+
+@instrumentation.timed('aggregate')
+def prepare_box_statistics_for_all_gcms_and_statistics(data_path_ref, data_path_sim, gcms, var, name_sim_prefix,
+                                                       name_ref, statistics, year_start, year_end, mask=None,
+                                                       time_scales=['annual', 'seasonal', 'monthly'],
+                                                       var_ref=None, var_sim=None, var_ref_in_nc=None,
+                                                       var_sim_in_nc=None, whis=1.5, max_fliers=100, verbose=False):
+    """
+    This function reads in the 30-year mean (annual, seasonal and/or monthly) of the reference data and all GCMs,
+    and calculates the box plot statistics of the grid cells (see get_box_statistics) for each dataset, statistic
+    and time scale. It replaces prepare_dataframes_for_all_gcms_and_statistics for the box plots: the
+    result has one row per box (columns: type, time_scale, statistic, n, whislo, q1, med, q3, whishi, fliers)
+    instead of one row per grid cell.
+    """
+
+    if type(statistics) == str:
+        statistics = [statistics]
+
+    tables = []
+    for statistic in statistics:
+        if verbose: print(statistic)
+        for time_scale in time_scales:
+            names = [(None, name_ref)] + [(gcm, '%s_%s' % (name_sim_prefix, gcm)) for gcm in gcms]
+            for gcm, name in names:
+                is_ref = gcm is None
+                datasets = read_in.read_in_xarray_data_for_one_gcm(
+                    data_path_ref=data_path_ref, data_path_sim=data_path_sim, gcm=gcm, var=var,
+                    name_sim=None if is_ref else name, name_ref=name if is_ref else None,
+                    statistic=statistic, year_start=year_start, year_end=year_end, mask=mask,
+                    var_ref=var_ref if is_ref else None, var_sim=None if is_ref else var_sim,
+                    var_ref_in_nc=var_ref_in_nc if is_ref else None, var_sim_in_nc=None if is_ref else var_sim_in_nc,
+                    time_scales=[time_scale], read_in_bias_types=None, verbose=verbose)
+
+                values, labels = get_time_scale_labels(datasets[time_scale][name][var], time_scale)
+                keys = pd.DataFrame(collections.OrderedDict([('type', name), ('time_scale', labels),
+                                                             ('statistic', statistic)]))
+                tables.append(get_box_statistics_frame(keys, get_box_statistics(values, whis=whis,
+                                                                                 max_fliers=max_fliers)))
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def get_normal_quantile(probability):
+    """
+    This function returns the quantile of the standard normal distribution for a probability (between 0 and 1),
+    e.g. 1.96 for 0.975.
+    """
+    lo, hi = -10., 10.
+    for i in range(100):
+        mid = (lo + hi) / 2.
+        if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < probability:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2.
+
+
+def get_bootstrap_interval(values, level=0.95, n_boot=1000, seed=0):
+    """
+    This function returns the bootstrap confidence interval (percentile method) of the mean of each row of a 2-D
+    array (NaN values are ignored), with n_boot resamples of all rows at once. The random numbers are drawn from a
+    generator with a fixed seed, so that the interval is the same in every run.
+    """
+
+    rng = np.random.RandomState(seed)
+    n = np.isfinite(values).sum(axis=-1)
+    values = np.sort(values, axis=-1)
+    lower = np.full(len(values), np.nan)
+    upper = np.full(len(values), np.nan)
+    for size in np.unique(n[n > 0]):
+        rows = np.where(n == size)[0]
+        idx = rng.randint(0, size, (n_boot, size))
+        means = values[rows][:, idx].mean(axis=-1)
+        lower[rows], upper[rows] = np.percentile(means, [50 * (1 - level), 50 * (1 + level)], axis=-1)
+    return lower, upper
+
+
+def get_climatology_summary(dataframe, x, y, groups, band='ci', level=0.95, n_boot=1000, seed=0):
+    """
+    This function summarises the values y of a long data frame (e.g. one row per month and year, see
+    evaluation.read_in.prepare_climatologies_for_all_gcms_and_statistics) for each value of x (e.g. the month)
+    and each group (unique combination of the columns in groups, e.g. dataset and statistic), as a data frame with
+    the columns groups, x, n, y (the mean), std, lower and upper (one row per point). The band (lower to upper) is:
+    - ci: the confidence interval of the mean (normal approximation, mean +/- z * std / sqrt(n))
+    - sd: the mean +/- the standard deviation
+    - pi: the percentile interval of the values (e.g. 2.5th to 97.5th percentile for level 0.95)
+    - bootstrap: the bootstrap confidence interval of the mean with n_boot resamples (see get_bootstrap_interval)
+    """
+
+    values, keys = get_padded_values(dataframe, y, groups + [x])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = np.isfinite(values).sum(axis=-1)
+        mean = np.nanmean(values, axis=-1)
+        std = np.sqrt(np.nansum((values - mean[:, np.newaxis]) ** 2, axis=-1) / (n - 1))
+
+        if band == 'ci':
+            z = get_normal_quantile(0.5 * (1 + level))
+            lower, upper = mean - z * std / np.sqrt(n), mean + z * std / np.sqrt(n)
+        elif band == 'sd':
+            lower, upper = mean - std, mean + std
+        elif band == 'pi':
+            lower, upper = np.nanpercentile(values, [50 * (1 - level), 50 * (1 + level)], axis=-1)
+        elif band == 'bootstrap':
+            lower, upper = get_bootstrap_interval(values, level=level, n_boot=n_boot, seed=seed)
+        else:
+            raise ValueError('Unknown band: %s (available: ci, sd, pi, bootstrap)' % band)
+
+    summary = keys.copy()
+    summary['n'] = n
+    summary[y] = mean
+    summary['std'] = std
+    summary['lower'] = lower
+    summary['upper'] = upper
+    return summary
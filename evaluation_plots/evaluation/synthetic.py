@@ -0,0 +1,199 @@
+# Synthetic input data for the evaluation library.
+
+# The functions in this module create NetCDF files with random data that have the grids, variable names and
+# file names of the preprocessed evaluation statistics (see the preprocessing scripts and
+# evaluation.read_in.get_statistic_file_name), and daily input files (see evaluation.read_in.get_daily_files).
+# They are used to benchmark the read in and plotting functions without access to the real data (see
+# benchmark_evaluation.py).
+
+# Import libraries
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from evaluation import read_in
+
+
+# Grids of the reference data (AWAP, 0.05 degree) and of the GCM data (ISIMIP, 0.5 degree)
+GRIDS = dict(awap=dict(lat_start=-44., lat_end=-10., lon_start=112., lon_end=154., resolution=0.05),
+             isimip=dict(lat_start=-44.25, lat_end=-10.25, lon_start=112.25, lon_end=153.75, resolution=0.5))
+
+# Months of the time steps in the seasonal files (one month of each season: DJF, MAM, JJA, SON)
+SEASON_MONTHS = [1, 4, 7, 10]
+
+
+# Function definitions
+def get_grid(grid='awap', size=1.):
+    """
+    This function returns the latitudes and longitudes of a grid (awap or isimip). With size < 1, only a part of
+    the domain is used (size is the fraction of the number of latitudes and of longitudes), e.g. to benchmark
+    smaller data sizes. The part is taken from the south-east of the domain, so that it includes land cells.
+    """
+
+    temp = GRIDS[grid]
+    lat = np.round(np.arange(temp['lat_start'], temp['lat_end'] + temp['resolution'] / 2, temp['resolution']), 3)
+    lon = np.round(np.arange(temp['lon_start'], temp['lon_end'] + temp['resolution'] / 2, temp['resolution']), 3)
+
+    n_lat = max(int(round(len(lat) * size)), 2)
+    n_lon = max(int(round(len(lon) * size)), 2)
+
+    return lat[:n_lat], lon[-n_lon:]
+
+
+def create_mask(lat, lon):
+    """
+    This function returns a land mask (1: land, 0: ocean) for the grid, with an ellipse roughly the shape
+    of mainland Australia.
+    """
+    lat2d, lon2d = np.meshgrid(lat, lon, indexing='ij')
+    distance = ((lat2d + 26.) / 14.) ** 2 + ((lon2d - 133.5) / 19.) ** 2
+    mask = (distance <= 1).astype('int32')
+    return xr.Dataset({'mask': (('lat', 'lon'), mask)}, coords=dict(lat=lat, lon=lon))
+
+
+def get_times(time_scale, year_start, year_end, suffix):
+    """
+    This function returns the time steps of a preprocessed file: one time step for the annual mean, one per
+    season or month for the seasonal / monthly mean, and one per year, season or month for merged files.
+    """
+
+    if suffix == 'merged':
+        years = np.arange(year_start, year_end + 1)
+    else:
+        years = [year_end]
+
+    if time_scale == 'annual':
+        months = [7]
+    elif time_scale == 'seasonal':
+        months = SEASON_MONTHS
+    else:
+        months = np.arange(1, 13)
+
+    return pd.to_datetime(['%s-%02d-15' % (year, month) for year in years for month in months])
+
+
+def create_field(var_in_nc, times, lat, lon, rng, offset=0., scale=1.):
+    """
+    This function returns a dataset with a random field: a smooth spatial pattern, a seasonal cycle and noise.
+    """
+
+    lat2d, lon2d = np.meshgrid(lat, lon, indexing='ij')
+    pattern = np.cos(np.deg2rad(lat2d) * 3.) + 0.5 * np.sin(np.deg2rad(lon2d) * 5.)
+    cycle = np.cos(2 * np.pi * (times.month.values - 1) / 12.)
+
+    values = offset + scale * (pattern[np.newaxis, :, :] + 0.5 * cycle[:, np.newaxis, np.newaxis] +
+                               0.3 * rng.standard_normal((len(times), len(lat), len(lon))))
+
+    return xr.Dataset({var_in_nc: (('time', 'lat', 'lon'), values.astype('float32'))},
+                      coords=dict(time=times, lat=lat, lon=lon))
+
+
+def write_file(ds, fn):
+    """
+    This function writes a dataset to a NetCDF file and creates the containing folder if needed.
+    """
+    if not os.path.exists(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    ds.to_netcdf(fn)
+
+
+def create_statistic_files(data_path_ref, data_path_sim, gcms, variables, name_ref, name_sim_prefix,
+                           statistics, year_start, year_end, grid='awap', size=1.,
+                           time_scales=['annual', 'seasonal', 'monthly'], seed=0):
+    """
+    This function creates the preprocessed files that are read in by the evaluation scripts, for the reference
+    dataset and all GCMs:
+    - the 30-year mean (_mean), the time series (_merged) and the lag-1 correlation (_lag1corr) of each statistic
+    - the absolute and relative bias, and the bias in the lag-1 correlation, for each GCM (in bias_[name_ref]).
+    variables is a dictionary with the variable names of the reference and the simulation data, e.g.:
+    dict(rain_day=dict(var_ref='rain_day', var_sim='pr')). The variable names in the files are the same as in the
+    file names. Returns the file name of the mask (mask.nc in data_path_ref).
+    """
+
+    rng = np.random.RandomState(seed)
+    lat, lon = get_grid(grid, size)
+
+    fn_mask = os.path.join(data_path_ref, 'mask.nc')
+    write_file(create_mask(lat, lon), fn_mask)
+
+    for var, names in variables.items():
+        var_ref = names['var_ref']
+        var_sim = names['var_sim']
+
+        for statistic in statistics:
+            for time_scale in time_scales:
+
+                for suffix in ['mean', 'merged', 'lag1corr']:
+                    times = get_times(time_scale, year_start, year_end, suffix)
+
+                    fn = read_in.get_statistic_file_name(data_path_ref, name_ref, var_ref, time_scale, statistic,
+                                                         year_start, year_end, suffix)
+                    ref = create_field(var_ref, times, lat, lon, rng, offset=10., scale=5.)
+                    write_file(ref, fn)
+
+                    for gcm in gcms:
+                        name_sim = '%s_%s' % (name_sim_prefix, gcm)
+                        fn = read_in.get_statistic_file_name(data_path_sim, name_sim, var_sim, time_scale, statistic,
+                                                             year_start, year_end, suffix, gcm=gcm)
+                        sim = create_field(var_sim, times, lat, lon, rng, offset=10.5, scale=5.)
+                        write_file(sim, fn)
+
+                        # biases (as calculated by the preprocessing scripts, with the variable name of the GCM data)
+                        if suffix == 'mean':
+                            bias_types = dict(bias_abs=sim[var_sim] - ref[var_ref].values,
+                                              bias_rel=(sim[var_sim] - ref[var_ref].values) / ref[var_ref].values * 100)
+                        elif suffix == 'lag1corr':
+                            bias_types = dict(bias_lag1corr=sim[var_sim] - ref[var_ref].values)
+                        else:
+                            bias_types = dict()
+
+                        for bias_type, values in bias_types.items():
+                            fn = read_in.get_bias_file_name(data_path_sim, gcm, name_ref, bias_type, var, time_scale,
+                                                            statistic, year_start, year_end)
+                            write_file(values.to_dataset(name=var_sim), fn)
+
+    return fn_mask
+
+
+def create_daily_field(var, times, lat, lon, rng):
+    """
+    This function returns a random daily field (time, lat, lon): rainfall with dry days and heavy rainfall days for
+    rain_day, otherwise values with a seasonal cycle and noise (e.g. temperature).
+    """
+
+    shape = (len(times), len(lat), len(lon))
+    if var == 'rain_day':
+        return rng.gamma(0.6, 10., shape) * (rng.uniform(size=shape) < 0.35)
+    cycle = np.cos(2 * np.pi * (times.dayofyear.values - 15) / 365.25)
+    return 20. + 6. * cycle[:, np.newaxis, np.newaxis] + 3. * rng.standard_normal(shape)
+
+
+def create_daily_files(path_daily_ref, path_daily_sim, gcms, variables, year_start, year_end, grid='awap', size=1.,
+                       seed=0):
+    """
+    This function creates daily input files (as read in by evaluation.read_in.get_daily_files): one file per year
+    for the reference dataset (path_daily_ref/VAR_YEAR.nc) and one file with all years for each GCM
+    (path_daily_sim/VAR_historical.nc, in the units of the GCM data, see
+    evaluation.read_in.get_daily_unit_conversion). The paths can contain the placeholders #VAR# and #GCM#.
+    variables is a dictionary as in create_statistic_files.
+    """
+
+    rng = np.random.RandomState(seed)
+    lat, lon = get_grid(grid, size)
+
+    for var, names in variables.items():
+        for year in range(year_start, year_end + 1):
+            times = pd.date_range('%s-01-01' % year, '%s-12-31' % year, freq='D')
+            ds = xr.Dataset({names['var_ref']: (('time', 'lat', 'lon'), create_daily_field(var, times, lat, lon, rng).astype('float32'))},
+                            coords=dict(time=times, lat=lat, lon=lon))
+            write_file(ds, os.path.join(path_daily_ref.replace('#VAR#', names['var_ref']), '%s_%s.nc' % (names['var_ref'], year)))
+
+        factor, offset = read_in.get_daily_unit_conversion(var, verbose=False)
+        times = pd.date_range('%s-01-01' % year_start, '%s-12-31' % year_end, freq='D')
+        for gcm in gcms:
+            values = (create_daily_field(var, times, lat, lon, rng) - offset) / factor
+            ds = xr.Dataset({names['var_sim']: (('time', 'lat', 'lon'), values.astype('float32'))},
+                            coords=dict(time=times, lat=lat, lon=lon))
+            write_file(ds, os.path.join(path_daily_sim.replace('#GCM#', gcm).replace('#VAR#', names['var_sim']),
+                                        '%s_historical.nc' % names['var_sim']))
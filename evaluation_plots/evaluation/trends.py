@@ -0,0 +1,177 @@
+# Trends for the evaluation library.
+
+# The preprocessing calculates the trend of each grid cell with 'cdo trend' (ordinary least squares), which is
+# sensitive to outliers and has no significance. This module calculates Sen's slope (the median of the slopes
+# between all pairs of years) and the significance of the trend with the Mann-Kendall test (the number of
+# increasing minus decreasing pairs, with the variance corrected for ties) of the annual, seasonal and monthly
+# time series (*_merged.nc) of each grid cell.
+# Both use the differences between all pairs of years. For a tile of grid cells, the differences are one array
+# (pairs x grid cells), from which the slopes, the median and the Mann-Kendall statistic of all grid cells of the
+# tile are calculated at once; the tiles are small enough to keep the memory bounded (at most max_memory bytes)
+# and are processed in a pool of worker processes (see evaluation.parallel.map_tiles).
+
+# Import libraries
+import math
+import calendar
+import numpy as np
+import xarray as xr
+
+from evaluation import read_in
+from evaluation import parallel
+from evaluation import instrumentation
+
+
+# Function definitions
+def get_pair_indices(n_time):
+    """
+    This function returns the indices (i, j) of all pairs of time steps with i < j, and the incidence matrix
+    (time steps x pairs) that is 1 where a time step is part of a pair.
+    """
+
+    i, j = np.triu_indices(n_time, 1)
+    incidence = np.zeros((n_time, len(i)))
+    incidence[i, np.arange(len(i))] = 1
+    incidence[j, np.arange(len(i))] = 1
+    return i, j, incidence
+
+
+def get_mann_kendall_variance(n_time, n_ties):
+    """
+    This function returns the variance of the Mann-Kendall statistic for n_time values, corrected for ties. n_ties
+    is the number of values that are equal to each value (array: time steps x grid cells, 0 without ties); each
+    group of t equal values reduces the variance by t(t-1)(2t+5)/18.
+    """
+    t = n_ties + 1.
+    return (n_time * (n_time - 1) * (2 * n_time + 5) - ((t - 1) * (2 * t + 5)).sum(axis=0)) / 18.
+
+
+def get_tile_trends(values, times):
+    """
+    This function returns Sen's slope (per unit of times, e.g. per year) and the two-sided p-value of the
+    Mann-Kendall test (normal approximation with continuity correction) of each column of a tile of time series
+    (values: array time steps x grid cells, without missing values) as an array (2 x grid cells).
+    """
+
+    n_time = len(values)
+    i, j, incidence = get_pair_indices(n_time)
+    differences = values[j] - values[i]
+
+    slopes = np.median(differences / (times[j] - times[i])[:, np.newaxis], axis=0)
+
+    s = np.sign(differences).sum(axis=0)
+    variance = get_mann_kendall_variance(n_time, np.dot(incidence, (differences == 0).astype('float64')))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(variance > 0, (s - np.sign(s)) / np.sqrt(variance), 0.)
+    p_values = erfc(np.abs(z) / np.sqrt(2))
+
+    return np.array([slopes, p_values])
+
+
+def erfc(x):
+    """
+    This function returns the complementary error function of each value of an array.
+    """
+    return np.vectorize(math.erfc, otypes=['float64'])(x)
+
+
+def _trend_tile(args):
+    """
+    This function calculates the trends of one tile of grid cells in a worker process (see get_tile_trends).
+    """
+    values, times = args
+    return get_tile_trends(values, times)
+
+
+def get_tile_size(n_time, max_memory=2**28):
+    """
+    This function returns the number of grid cells per tile, so that the differences and slopes of all pairs of
+    time steps of a tile need at most max_memory bytes.
+    """
+    n_pairs = n_time * (n_time - 1) // 2
+    return max(1, int(max_memory // (8 * (3 * n_pairs + 2 * n_time))))
+
+
+def get_trends(values, times, max_memory=2**28, n_workers=1):
+    """
+    This function calculates Sen's slope and the p-value of the Mann-Kendall test (see get_tile_trends) of each
+    grid cell of an array (time steps x grid cells), in tiles (see get_tile_size) with a pool of n_workers
+    processes. Returns the slopes and p-values (one per grid cell, NaN for grid cells with missing values).
+    """
+
+    values = np.asarray(values, dtype='float64')
+    times = np.asarray(times, dtype='float64')
+    valid = np.where(np.isfinite(values).all(axis=0))[0]
+    slopes = np.full(values.shape[1], np.nan)
+    p_values = np.full(values.shape[1], np.nan)
+    if len(valid) == 0 or len(values) < 3:
+        return slopes, p_values
+
+    tile_size = get_tile_size(len(values), max_memory)
+    tiles = [valid[start:start + tile_size] for start in range(0, len(valid), tile_size)]
+    args = ((values[:, idx], times) for idx in tiles)
+
+    for idx, result in zip(tiles, parallel.map_tiles(_trend_tile, args, n_workers=min(n_workers, len(tiles)))):
+        slopes[idx], p_values[idx] = result
+
+    return slopes, p_values
+
+
+def get_time_scale_series(datasets, var, time_scales=['annual', 'seasonal', 'monthly']):
+    """
+    This function splits the annual, seasonal and monthly time series of a variable (see
+    evaluation.read_in.read_in_timeseries_for_one_gcm, one dataset per time scale) into one time series per label:
+    'annual', the seasons (e.g. 'DJF') and the month abbreviations (e.g. 'Jan'). Returns a list of (label, data
+    array) pairs.
+    """
+
+    series = []
+    for time_scale in time_scales:
+        da = datasets[time_scale][var]
+        if time_scale == 'annual':
+            series.append(('annual', da))
+        elif time_scale == 'seasonal':
+            for season in ['DJF', 'MAM', 'JJA', 'SON']:
+                series.append((season, da.isel(time=(da['time.season'] == season).values)))
+        elif time_scale == 'monthly':
+            for month in range(1, 13):
+                series.append((calendar.month_abbr[month], da.isel(time=(da['time.month'] == month).values)))
+    return series
+
+
+@instrumentation.timed('aggregate')
+def get_trend_fields(data_path, name, var, statistic, year_start, year_end, gcm=None, mask=None, var_in_nc=None,
+                     var_file=None, time_scales=['annual', 'seasonal', 'monthly'], max_memory=2**28, n_workers=1,
+                     verbose=False):
+    """
+    This function reads in the annual, seasonal and/or monthly time series (*_merged.nc) of one dataset (the
+    reference data if gcm is None, otherwise the simulation of this GCM), and calculates Sen's slope (per year) and
+    the p-value of the Mann-Kendall test of each grid cell, for each time scale label ('annual', the seasons and
+    the months, see get_time_scale_series). Returns an xarray dataset with the variables slope and p_value
+    (dimensions time_scale, lat and lon).
+    """
+
+    is_ref = gcm is None
+    datasets = read_in.read_in_timeseries_for_one_gcm(
+        data_path_ref=data_path, data_path_sim=data_path, gcm=gcm, var=var, name_sim=None if is_ref else name,
+        name_ref=name if is_ref else None, statistic=statistic, year_start=year_start, year_end=year_end, mask=mask,
+        var_ref=var_file, var_sim=var_file, var_ref_in_nc=var_in_nc, var_sim_in_nc=var_in_nc,
+        time_scales=time_scales, verbose=verbose)
+    datasets = dict([(x, datasets[x][name]) for x in datasets])
+
+    labels = []
+    slopes = []
+    p_values = []
+    for label, da in get_time_scale_series(datasets, var, time_scales):
+        da = da.transpose('time', 'lat', 'lon')
+        slope, p_value = get_trends(da.values.reshape(da.shape[0], -1), da['time.year'].values,
+                                    max_memory=max_memory, n_workers=n_workers)
+        labels.append(label)
+        slopes.append(slope.reshape(da.shape[1:]))
+        p_values.append(p_value.reshape(da.shape[1:]))
+
+    coords = dict(time_scale=labels, lat=da['lat'].values, lon=da['lon'].values)
+    dims = ['time_scale', 'lat', 'lon']
+    trends = xr.Dataset(dict(slope=(dims, np.array(slopes)), p_value=(dims, np.array(p_values))), coords=coords)
+    trends['slope'].attrs = dict(long_name="Sen's slope", units='per year')
+    trends['p_value'].attrs = dict(long_name='p-value of the Mann-Kendall test')
+    return trends
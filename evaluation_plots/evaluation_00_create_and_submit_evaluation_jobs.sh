@@ -14,10 +14,13 @@ PBS_JOB_TEMPLATE_FILE=evaluation_jobs_TEMPLATE.pbs
 mkdir -p ${PBS_JOBS_FOLDER}
 
 
+# submits a job (optional fourth argument: id of a job that has to finish successfully before the job starts)
+# and stores the id of the job in submitted_job_id
 create_job_and_submit() {
     local script_to_run=$1
     local num_cpus=$2
     local memory_required=$3
+    local depends_on_job_id=$4
 
     local job_file_basename=job_${script_to_run%.py}
     local job_file=${PBS_JOBS_FOLDER}/${job_file_basename}.pbs
@@ -34,80 +37,121 @@ create_job_and_submit() {
     sed -i "s|xxJOB_ERROR_FILExx|${job_error_file}|g" ${job_file}
 
     echo "Submitting Job ${job_file}"
-    qsub ${job_file}
+    if [ -n "${depends_on_job_id}" ]; then
+        submitted_job_id=$(qsub -W depend=afterok:${depends_on_job_id} ${job_file})
+    else
+        submitted_job_id=$(qsub ${job_file})
+    fi
+    echo "Submitted Job ${submitted_job_id}"
     wait
 }
 
 
 
+# 0 (indices of daily extremes: they are read in by the other scripts if they are listed in their statistics,
+# so the other jobs only start after this job has finished successfully)
+cpus=4
+memory=32gb
+python_script='evaluation_00_extreme_indices.py'
+create_job_and_submit "${python_script}" ${cpus} ${memory}
+indices_job_id=${submitted_job_id}
+if [ -z "${indices_job_id}" ]; then
+    echo "Submitting the job of the indices failed, the other jobs are not submitted"
+    exit 1
+fi
+
 # 1
 cpus=4
 memory=16gb
 python_script='evaluation_01a_bias_maps.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 2
 cpus=4
 memory=16gb
 python_script='evaluation_01b_bias_lag1_correlation.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 3
 cpus=4
 memory=16gb
 python_script='evaluation_01c_bias_trend.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 4
 cpus=4
 memory=8gb
 python_script='evaluation_02_climatologies.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 5
 cpus=4
 memory=32gb
 python_script='evaluation_03a_PDFs_spatial_variability.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 6
 cpus=4
 memory=32gb
 python_script='evaluation_03b_CDFs_spatial_variability.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 7
 cpus=4
 memory=16gb
 python_script='evaluation_04_spatial_correlation.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 8
 cpus=4
 memory=8gb
 python_script='evaluation_05a_PDFs_temporal_variability.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 9
 cpus=4
 memory=8gb
 python_script='evaluation_05b_CDFs_temporal_variability.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 10
 cpus=4
 memory=8gb
 python_script='evaluation_06a_point_PDFs.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 11
 cpus=4
 memory=8gb
 python_script='evaluation_06b_point_CDFs.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
 
 # 12
 cpus=4
 memory=8gb
 python_script='evaluation_07_point_Fourier_diagrams.py'
-create_job_and_submit "${python_script}" ${cpus} ${memory}
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
+
+# 13
+cpus=4
+memory=16gb
+python_script='evaluation_08_metrics.py'
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
+
+# 14 (spectral bias maps: the daily data are read in as tiles of latitudes with all years)
+cpus=4
+memory=16gb
+python_script='evaluation_09_spectral_bias_maps.py'
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
+
+# 15 (EOFs: the time series of the reference data and each GCM are read in one after the other)
+cpus=4
+memory=16gb
+python_script='evaluation_10_EOFs_spatial_variability.py'
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
+
+# 16 (return levels: the GEV distributions of the reference data are fitted first)
+cpus=4
+memory=16gb
+python_script='evaluation_11_return_levels.py'
+create_job_and_submit "${python_script}" ${cpus} ${memory} ${indices_job_id}
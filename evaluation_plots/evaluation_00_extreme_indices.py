@@ -0,0 +1,147 @@
+import os
+import sys
+import glob
+# turn off all warnings
+import warnings; warnings.simplefilter('ignore')
+
+
+### Functions
+import evaluation as evl
+
+### Parameters
+parameters = evl.config.load_config()
+
+
+# prepare settings
+skip_existing = parameters['skip_existing']
+data_path_ref = parameters['data_path_processed_ref']
+data_path_sim = parameters['data_path_processed_sim']
+path_daily_ref = parameters['path_daily_ref']
+path_daily_sim = parameters['path_daily_sim']
+year_start = parameters['evaluation_year_start']
+year_end = parameters['evaluation_year_end']
+name_sim_prefix = parameters['name_sim_prefix']
+name_ref = parameters['name_ref']
+gcms = parameters['gcms']
+vars = parameters['vars']
+ref_vars = parameters['ref_vars']
+ref_vars_in_nc = parameters['ref_vars_in_nc']
+sim_vars = parameters['sim_vars']
+sim_vars_in_nc = parameters['sim_vars_in_nc']
+
+# indices of daily extremes of each variable (see evaluation.indices)
+extreme_indices = parameters.get('extreme_indices', dict())
+time_scales = ['annual', 'seasonal', 'monthly']
+
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+
+
+#### Indices of daily extremes
+
+def get_index_file_name(gcm, var, index, time_scale='monthly', suffix='std'):
+    """
+    Returns the file name of an index of the reference data (gcm is None) or of a GCM, in the layout of the
+    preprocessed statistics. The default is the file that is written last for each index.
+    """
+    if gcm is None:
+        return evl.read_in.get_statistic_file_name(data_path_ref, name_ref, ref_vars[var], time_scale, index,
+                                                   year_start, year_end, suffix)
+    return evl.read_in.get_statistic_file_name(data_path_sim, '%s_%s' % (name_sim_prefix, gcm), sim_vars[var], time_scale,
+                                               index, year_start, year_end, suffix, gcm=gcm)
+
+
+def get_threshold_files(var):
+    """
+    Returns the preprocessed statistics of the reference data that are used as thresholds of the indices of a
+    variable (e.g. the annual 90th percentile for tx90p).
+    """
+    statistics = sorted(set([evl.indices.indices[index]['threshold'] for index in extreme_indices[var]
+                             if isinstance(evl.indices.indices[index].get('threshold'), str)]))
+    return dict([(statistic, evl.read_in.get_statistic_file_name(data_path_ref, name_ref, ref_vars[var], 'annual', statistic,
+                                                                 year_start, year_end, 'mean')) for statistic in statistics])
+
+
+def create_indices(fn_plot, gcm, var):
+    """
+    Reads in the daily data of the reference data (gcm is None) or one GCM one year at a time, and writes the
+    indices of daily extremes of one variable.
+    """
+
+    print('Calculating indices: %s' % fn_plot)
+
+    thresholds = dict()
+    for index in extreme_indices[var]:
+        statistic = evl.indices.indices[index].get('threshold')
+        if isinstance(statistic, str):
+            thresholds[index] = evl.indices.read_threshold_field(data_path_ref, name_ref, ref_vars[var], ref_vars_in_nc[var],
+                                                                 statistic, year_start, year_end)
+
+    # the year before the first year is read in for the DJF season and spells that start before the first year
+    daily_files = evl.read_in.get_daily_files(path_daily_ref, path_daily_sim, [] if gcm is None else [gcm], ref_vars[var],
+                                              sim_vars[var], year_start - 1, year_end)
+    if gcm is None:
+        files, data_path, name, var_file, var_in_nc = daily_files['ref'], data_path_ref, name_ref, ref_vars[var], ref_vars_in_nc[var]
+        unit_conversion = (1., 0.)
+    else:
+        files, data_path, name, var_file, var_in_nc = daily_files[gcm], data_path_sim, '%s_%s' % (name_sim_prefix, gcm), sim_vars[var], sim_vars_in_nc[var]
+        unit_conversion = evl.read_in.get_daily_unit_conversion(var)
+
+    evl.indices.calculate_indices(files, var_in_nc, extreme_indices[var], year_start, year_end, data_path, name, var_file,
+                                  gcm=gcm, thresholds=thresholds, time_scales=time_scales, unit_conversion=unit_conversion)
+
+
+def create_biases(fn_plot, gcm, var):
+    """
+    Writes the absolute and relative bias of the indices of one GCM and variable.
+    """
+
+    print('Calculating biases: %s' % fn_plot)
+
+    for index in extreme_indices[var]:
+        evl.indices.write_index_biases(data_path_ref, data_path_sim, gcm, var, index, name_ref, '%s_%s' % (name_sim_prefix, gcm),
+                                       ref_vars[var], sim_vars[var], ref_vars_in_nc[var], sim_vars_in_nc[var],
+                                       year_start, year_end, time_scales=time_scales)
+
+
+if __name__ == '__main__':
+
+    # prepare the indices: one calculation per dataset (reference data and each GCM) and variable
+    index_tasks = []
+    bias_tasks = []
+    for gcm in [None] + list(gcms):
+        for var in [x for x in vars if x in extreme_indices]:
+
+            daily_files = evl.read_in.get_daily_files(path_daily_ref, path_daily_sim, [] if gcm is None else [gcm],
+                                                      ref_vars[var], sim_vars[var], year_start - 1, year_end)
+            if gcm is None:
+                input_files = [fn for files_year in daily_files['ref'] for fn in files_year]
+            else:
+                input_files = sorted(glob.glob(daily_files[gcm]))
+            input_files = input_files + list(get_threshold_files(var).values())
+
+            index_tasks.append(dict(fn_plot=get_index_file_name(gcm, var, extreme_indices[var][-1]), gcm=gcm, var=var,
+                                    input_files=input_files))
+
+            # biases of the GCMs: from the means of the reference data and the GCM
+            if gcm is not None:
+                fn_plot = evl.read_in.get_bias_file_name(data_path_sim, gcm, name_ref, 'bias_rel', var, time_scales[-1],
+                                                         extreme_indices[var][-1], year_start, year_end)
+                input_files = [get_index_file_name(x, var, index, time_scale, 'mean') for x in [None, gcm]
+                               for index in extreme_indices[var] for time_scale in time_scales]
+                bias_tasks.append(dict(fn_plot=fn_plot, gcm=gcm, var=var, input_files=input_files))
+
+    # plan the indices: skip indices that are up-to-date
+    index_groups = evl.planner.plan_tasks(index_tasks, skip_existing=skip_existing, n_workers=n_workers)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(index_groups)
+        evl.planner.print_plan(evl.planner.plan_tasks(bias_tasks, skip_existing=skip_existing, n_workers=n_workers))
+        sys.exit(0)
+
+    # calculate the indices (each worker reads in one year of daily data at a time)
+    evl.parallel.run_plot_task_groups(create_indices, index_groups, n_workers=n_workers)
+
+    # calculate the biases (planned after the indices, which are input files of the biases)
+    bias_groups = evl.planner.plan_tasks(bias_tasks, skip_existing=skip_existing, n_workers=n_workers)
+    evl.parallel.run_plot_task_groups(create_biases, bias_groups, n_workers=n_workers)
@@ -1,6 +1,7 @@
 import os
 import sys
 import json
+import traceback
 import numpy as np
 import xarray as xr
 # turn off all warnings
@@ -33,6 +34,7 @@ sim_vars_in_nc = parameters['sim_vars_in_nc']
 
 statistics = parameters['bias_maps_statistics']
 seasons = parameters['seasons']
+include_all_gcms_plot = parameters['include_all_gcms_plot']
 
 # read in mask
 mask = parameters['mask_file']
@@ -46,76 +48,234 @@ region_meta_data_label_column = parameters['region_meta_data_label_column']
 region_ids = parameters['region_codes_to_use']
 
 
+# map settings
+map_backend = parameters.get('map_backend', 'basemap')
+map_render_mode = parameters.get('map_render_mode', 'mesh')
+
+# significance of the bias (stippling): bootstrap, permutation or none
+significance_test = parameters.get('bias_maps_significance_test', 'none')
+significance_level = parameters.get('bias_maps_significance_level', 0.05)
+significance_fdr = parameters.get('bias_maps_significance_fdr', True)
+n_resamples = parameters.get('bias_maps_n_resamples', 1000)
+p_value_path = os.path.join(plot_path, 'p_values')
+
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
+
+
+#### Significance of the bias
+
+def get_p_value_file_name(gcm, var, statistic):
+    """
+    Returns the file name of the p-values of the bias of one GCM, variable and statistic.
+    """
+    name_sim = '%s_%s' % (name_sim_prefix, gcm)
+    return os.path.join(p_value_path, 'p_values_%s_%s_%s_%s_%s_%s_%s.nc' % (significance_test, name_ref.upper(), name_sim.upper(),
+                                                                         sim_vars[var], statistic, year_start, year_end))
+
+
+def create_p_values(fn_plot, gcm, var, statistic, mask):
+    """
+    Tests the bias of one GCM, variable and statistic in each grid cell (all regions) and writes the p-values.
+    The grid cells are tested in tiles in a pool of n_workers processes.
+    """
+
+    print('Testing the bias: %s' % fn_plot)
+
+    p_values = evl.significance.get_bias_p_values(
+        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+        gcm=gcm, var=var, name_sim='%s_%s' % (name_sim_prefix, gcm), name_ref=name_ref,
+        statistic=statistic, year_start=year_start, year_end=year_end, mask=mask,
+        var_ref=ref_vars[var], var_sim=sim_vars[var], var_ref_in_nc=ref_vars_in_nc[var], var_sim_in_nc=sim_vars_in_nc[var],
+        time_scales=seasons, test=significance_test, n_resamples=n_resamples, n_workers=n_workers)
+
+    evl.helpers.create_containing_folder(fn_plot)
+    p_values.to_netcdf(fn_plot)
+
+
 #### Plotting
 
-# Reading and preparing data
+def create_ensemble_plot(fn_plot, var, statistic, mask, coordinates, region_str):
+    """
+    Reads in the mean fields of the reference data and all GCMs and creates the map of the bias of the ensemble
+    mean and of the agreement of the GCMs on the sign of the bias for one region, variable and statistic.
+    """
 
-# read in the region mask and the AWRA mask
+    # mean fields of the reference data and all GCMs as one array (dimension source)
+    ensemble = evl.read_in.read_in_ensemble_mean_fields(
+        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+        gcms=gcms, var=var, name_sim_prefix=name_sim_prefix, name_ref=name_ref,
+        statistic=statistic, year_start=year_start, year_end=year_end, mask=mask,
+        var_ref=ref_vars[var], var_sim=sim_vars[var], var_ref_in_nc=ref_vars_in_nc[var], var_sim_in_nc=sim_vars_in_nc[var],
+        time_scales=seasons)
 
-regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
-                                             region_meta_data_id_column, region_meta_data_label_column)
+    evl.plotting.plot_ensemble_bias(statistics=evl.ensemble.get_ensemble_statistics(ensemble, name_ref),
+                                    name_ref=name_ref, name_sim_prefix=name_sim_prefix,
+                                    fn_plot=fn_plot, var=var, unit=units[var],
+                                    statistic=statistic, time_scales=seasons,
+                                    year_start=year_start, year_end=year_end,
+                                    coordinates=coordinates, region=region_str, map_backend=map_backend,
+                                    map_render_mode=map_render_mode)
 
-if mask is not None and type(mask) == str:
-    mask = xr.open_dataset(mask)
-    mask = evl.helpers.standardise_dimension_names(mask)
-    mask = mask['mask'] == 1
 
+def create_plot(fn_plot, gcm, var, statistic, mask, coordinates, region_str, fn_p_values=None):
+    """
+    Reads in the data and creates the bias map for one region, GCM (or the ensemble of all GCMs, gcm ALL-GCMS),
+    variable and statistic.
+    """
 
-for region_id in region_ids:
+    print('Preparing plot: %s' % fn_plot)
 
-    if region_id == 'AU':
-        region_str = 'Australia'
-        region_code = 'AU'
-        mask_temp = mask
-    else:
-        region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
-        region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
-        # extract the new mask: for each region
-        mask_temp = (mask & (regions == region_id))
+    if gcm == 'ALL-GCMS':
+        create_ensemble_plot(fn_plot, var, statistic, mask, coordinates, region_str)
+        return
+
+    name_sim = '%s_%s' % (name_sim_prefix, gcm)
+    var_sim = sim_vars[var]
+    var_sim_in_nc = sim_vars_in_nc[var]
+    var_ref = ref_vars[var]
+    var_ref_in_nc = ref_vars_in_nc[var]
+
+    datasets = evl.read_in.read_in_xarray_data_for_one_gcm(
+        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+        gcm=gcm, var=var, name_sim=name_sim, name_ref=name_ref,
+        statistic=statistic, year_start=year_start, year_end=year_end,
+        mask=mask, var_ref=var_ref, var_sim=var_sim, var_ref_in_nc=var_ref_in_nc, 
+        read_in_bias_types=['bias_abs', 'bias_rel'],
+        var_sim_in_nc=var_sim_in_nc, time_scales = ['annual', 'seasonal'], verbose=False)
+
+
+    # p-values of the bias (if the test was successful)
+    p_values = None
+    if fn_p_values is not None and os.path.exists(fn_p_values):
+        p_values = evl.read_in.open_dataset(fn_p_values)['p_value']
 
-    # prepare the geographic extent
-    mask_df = mask_temp.where(mask_temp==1).to_dataframe(name='mask').dropna().reset_index()
-    coordinates=dict(llcrnrlat=np.min(mask_df['lat'])-0.2,
-                     urcrnrlat=np.max(mask_df['lat'])+0.2,
-                     llcrnrlon=np.min(mask_df['lon'])-0.2,
-                     urcrnrlon=np.max(mask_df['lon'])+0.2)
+    if datasets is not None:
+        evl.plotting.plot_bias(datasets=datasets, name_ref=name_ref, name_sim=name_sim,
+                              fn_plot=fn_plot, var=var, unit=units[var],
+                               statistic=statistic, time_scales=seasons,
+                              year_start=year_start, year_end=year_end,
+                              coordinates=coordinates, region=region_str, map_backend=map_backend,
+                              map_render_mode=map_render_mode, p_values=p_values,
+                              significance_level=significance_level, fdr=significance_fdr)
 
-    print('- %s' % region_str)
 
-    for gcm in gcms:
+if __name__ == '__main__':
 
-        name_sim = '%s_%s' % (name_sim_prefix, gcm)
+    # Reading and preparing data
 
-        for var in vars:
-            var_sim = sim_vars[var]
-            var_sim_in_nc = sim_vars_in_nc[var]
-            var_ref = ref_vars[var]
-            var_ref_in_nc = ref_vars_in_nc[var]
+    # read in the region mask and the AWRA mask
 
-            for statistic in statistics[var]:
+    regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
+                                                 region_meta_data_id_column, region_meta_data_label_column)
 
-                fn_plot = os.path.join(plot_path, region_code, 'bias_%s_%s_%s_%s_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), name_sim.upper(), var_sim,
-                                                                                                                  statistic, year_start, year_end,
-                                                                                                                  region_code))
+    if mask is not None and type(mask) == str:
+        mask = xr.open_dataset(mask)
+        mask = evl.helpers.standardise_dimension_names(mask)
+        mask = mask['mask'] == 1
 
-                print('Preparing plot: %s' % fn_plot)
+    # prepare the significance tests: one test per GCM, variable and statistic (for all regions)
+    significance_tasks = []
+    if significance_test != 'none':
+        for gcm in gcms:
+            for var in vars:
+                for statistic in statistics[var]:
+                    input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, [gcm], var, name_sim_prefix, name_ref,
+                                                                 [statistic], year_start, year_end, time_scales=['annual', 'seasonal'], suffix='merged',
+                                                                 var_ref=ref_vars[var], var_sim=sim_vars[var])
+                    significance_tasks.append(dict(fn_plot=get_p_value_file_name(gcm, var, statistic), gcm=gcm, var=var,
+                                                   statistic=statistic, mask=mask, input_files=input_files))
 
-                if not os.path.exists(fn_plot) or not skip_existing:
-                    datasets = evl.read_in.read_in_xarray_data_for_one_gcm(
-                        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
-                        gcm=gcm, var=var, name_sim=name_sim, name_ref=name_ref,
-                        statistic=statistic, year_start=year_start, year_end=year_end,
-                        mask=mask_temp, var_ref=var_ref, var_sim=var_sim, var_ref_in_nc=var_ref_in_nc, 
-                        read_in_bias_types=['bias_abs', 'bias_rel'],
-                        var_sim_in_nc=var_sim_in_nc, time_scales = ['annual', 'seasonal'], verbose=False)
+    # prepare the list of plots
+    tasks = []
 
+    for region_id in region_ids:
 
-                    if datasets is not None:
-                        fig = evl.plotting.plot_bias(datasets=datasets, name_ref=name_ref, name_sim=name_sim,
-                                                    fn_plot=fn_plot, var=var, unit=units[var],
-                                                     statistic=statistic, time_scales=seasons,
-                                                    year_start=year_start, year_end=year_end,
-                                                    coordinates=coordinates, region=region_str)
+        if region_id == 'AU':
+            region_str = 'Australia'
+            region_code = 'AU'
+            mask_temp = mask
+        else:
+            region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
+            region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
+            # extract the new mask: for each region
+            mask_temp = (mask & (regions == region_id))
 
+        # prepare the geographic extent
+        mask_df = mask_temp.where(mask_temp==1).to_dataframe(name='mask').dropna().reset_index()
+        coordinates=dict(llcrnrlat=np.min(mask_df['lat'])-0.2,
+                         urcrnrlat=np.max(mask_df['lat'])+0.2,
+                         llcrnrlon=np.min(mask_df['lon'])-0.2,
+                         urcrnrlon=np.max(mask_df['lon'])+0.2)
+
+        print('- %s' % region_str)
+
+        for gcm in gcms:
+
+            name_sim = '%s_%s' % (name_sim_prefix, gcm)
+
+            for var in vars:
+                var_sim = sim_vars[var]
+
+                for statistic in statistics[var]:
+
+                    fn_plot = os.path.join(plot_path, region_code, 'bias_%s_%s_%s_%s_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), name_sim.upper(), var_sim,
+                                                                                                                      statistic, year_start, year_end,
+                                                                                                                      region_code))
+
+                    input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, [gcm], var, name_sim_prefix, name_ref,
+                                                                 [statistic], year_start, year_end, time_scales=['annual', 'seasonal'], suffix='mean',
+                                                                 var_ref=ref_vars[var], var_sim=var_sim, read_in_bias_types=['bias_abs', 'bias_rel'])
+                    fn_p_values = None
+                    if significance_test != 'none':
+                        fn_p_values = get_p_value_file_name(gcm, var, statistic)
+                        input_files = input_files + [fn_p_values]
+                    tasks.append(dict(fn_plot=fn_plot, gcm=gcm, var=var, statistic=statistic,
+                                      mask=mask_temp, coordinates=coordinates, region_str=region_str,
+                                      fn_p_values=fn_p_values, input_files=input_files))
+
+        # bias of the ensemble mean of all GCMs and agreement of the GCMs on the sign of the bias
+        if include_all_gcms_plot:
+
+            name_sim = '%s_%s' % (name_sim_prefix, 'ALL-GCMS')
+
+            for var in vars:
+                var_sim = sim_vars[var]
+
+                for statistic in statistics[var]:
+
+                    fn_plot = os.path.join(plot_path, region_code, 'bias_%s_%s_%s_%s_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), name_sim.upper(), var_sim,
+                                                                                                                      statistic, year_start, year_end,
+                                                                                                                      region_code))
+
+                    input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref,
+                                                                 [statistic], year_start, year_end, time_scales=['annual', 'seasonal'], suffix='mean',
+                                                                 var_ref=ref_vars[var], var_sim=var_sim)
+                    tasks.append(dict(fn_plot=fn_plot, gcm='ALL-GCMS', var=var, statistic=statistic,
+                                      mask=mask_temp, coordinates=coordinates, region_str=region_str,
+                                      input_files=input_files))
+
+    # plan the tests: skip outputs that are up-to-date
+    significance_groups = evl.planner.plan_tasks(significance_tasks, skip_existing=skip_existing)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(significance_groups)
+        evl.planner.print_plan(evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers,
+                                                      pending_files=evl.planner.get_planned_files(significance_groups)))
+    else:
+        # test the bias: one test after the other, the tiles of grid cells of each test are tested in parallel
+        # (plots without p-values are created without stippling)
+        for task in [task for group in significance_groups for task in group]:
+            try:
+                create_p_values(**dict([(x, task[x]) for x in task if x != 'input_files']))
+            except Exception:
+                print('Testing the bias failed: %s' % task['fn_plot'])
+                traceback.print_exc()
 
+        # plan the plots after the tests (the p-values are input files of the plots): skip plots that are
+        # up-to-date and group plots that read in the same files
+        groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers)
 
+        # create the plots
+        evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
@@ -1,6 +1,7 @@
 import os
 import sys
 import json
+import traceback
 import numpy as np
 import xarray as xr
 # turn off all warnings
@@ -45,79 +46,182 @@ region_meta_data_label_column = parameters['region_meta_data_label_column']
 region_ids = parameters['region_codes_to_use']
 
 
-#### Plotting
+# map settings
+map_backend = parameters.get('map_backend', 'basemap')
+map_render_mode = parameters.get('map_render_mode', 'mesh')
+
+# autocorrelation of lags 1 to autocorrelation_max_lag, and the maps to create: lag<k>corr (e.g. lag1corr, lag3corr)
+# or decorrelation_time
+autocorrelation_max_lag = parameters.get('autocorrelation_max_lag', 10)
+correlation_types = parameters.get('autocorrelation_plot_types', ['lag1corr'])
+time_scales = ['annual', 'seasonal', 'monthly']
+autocorrelation_path = os.path.join(plot_path, 'autocorrelation')
+
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
 
-# Reading and preparing data
 
-# read in the region mask and the AWRA mask
+#### Autocorrelation
 
-regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
-                                             region_meta_data_id_column, region_meta_data_label_column)
+def get_autocorrelation_file_name(name, var, statistic):
+    """
+    Returns the file name of the autocorrelation (lags 1 to autocorrelation_max_lag and the decorrelation time) of one
+    dataset, variable and statistic.
+    """
+    return os.path.join(autocorrelation_path, 'autocorrelation_%s_%s_%s_%s_%s.nc' % (name.upper(), var, statistic,
+                                                                                    year_start, year_end))
 
-if mask is not None and type(mask) == str:
-    mask = xr.open_dataset(mask)
-    mask = evl.helpers.standardise_dimension_names(mask)
-    mask = mask['mask'] == 1
 
+def create_autocorrelation(fn_plot, gcm, var, statistic, mask):
+    """
+    Calculates the autocorrelation of the annual, seasonal and monthly time series of one dataset (the reference data
+    if gcm is None), variable and statistic in each grid cell (all regions) and writes it. The grid cells are
+    processed in tiles in a pool of n_workers processes.
+    """
 
-for region_id in region_ids:
+    print('Calculating autocorrelation: %s' % fn_plot)
 
-    if region_id == 'AU':
-        region_str = 'Australia'
-        region_code = 'AU'
-        mask_temp = mask
+    if gcm is None:
+        data_path, name, var_file, var_in_nc = data_path_ref, name_ref, ref_vars[var], ref_vars_in_nc[var]
     else:
-        region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
-        region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
-        # extract the new mask: for each region
-        mask_temp = (mask & (regions == region_id))
+        data_path, name, var_file, var_in_nc = data_path_sim, '%s_%s' % (name_sim_prefix, gcm), sim_vars[var], sim_vars_in_nc[var]
 
-    # prepare the geographic extent
-    mask_df = mask_temp.where(mask_temp==1).to_dataframe(name='mask').dropna().reset_index()
-    coordinates=dict(llcrnrlat=np.min(mask_df['lat'])-0.2,
-                     urcrnrlat=np.max(mask_df['lat'])+0.2,
-                     llcrnrlon=np.min(mask_df['lon'])-0.2,
-                     urcrnrlon=np.max(mask_df['lon'])+0.2)
+    autocorrelation = evl.autocorrelation.get_autocorrelation_fields(
+        data_path, name, var, statistic, year_start, year_end, gcm=gcm, mask=mask, var_in_nc=var_in_nc,
+        var_file=var_file, time_scales=time_scales, max_lag=autocorrelation_max_lag, n_workers=n_workers)
 
-    print('- %s' % region_str)
+    evl.helpers.create_containing_folder(fn_plot)
+    autocorrelation.to_netcdf(fn_plot)
 
-    for gcm in gcms:
 
-        name_sim = '%s_%s' % (name_sim_prefix, gcm)
+#### Plotting
 
-        for var in vars:
-            var_sim = sim_vars[var]
-            var_sim_in_nc = sim_vars_in_nc[var]
-            var_ref = ref_vars[var]
-            var_ref_in_nc = ref_vars_in_nc[var]
+def create_plot(fn_plot, gcm, var, statistic, correlation_type, mask, coordinates, region_str, fn_autocorrelation_ref,
+                fn_autocorrelation_sim):
+    """
+    Reads in the autocorrelation and creates the map of the bias in the lag correlation or decorrelation time for one
+    region, GCM, variable and statistic.
+    """
 
-            for statistic in statistics[var]:
-                
-                if statistic not in ['mean', 'sum']:
-                    continue
-                
-                # lag-1 correlation was only calculated for the 
+    name_sim = '%s_%s' % (name_sim_prefix, gcm)
 
-                fn_plot = os.path.join(plot_path, region_code, 'bias_%s_%s_%s_lag1corr_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), name_sim.upper(), var_sim,
-                                                                                                                  year_start, year_end, region_code))
+    print('Preparing plot: %s' % fn_plot)
 
-                print('Preparing plot: %s' % fn_plot)
+    autocorrelations = dict()
+    for name, fn in [(name_ref, fn_autocorrelation_ref), (name_sim, fn_autocorrelation_sim)]:
+        autocorrelations[name] = evl.helpers.apply_mask(evl.read_in.open_dataset(fn), mask)
+    datasets = evl.autocorrelation.get_correlation_datasets(autocorrelations, name_ref, name_sim, var, correlation_type,
+                                                            time_scales=time_scales)
 
-                if not os.path.exists(fn_plot) or not skip_existing:
-                    datasets = evl.read_in.read_in_xarray_data_for_one_gcm(
-                        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
-                        gcm=gcm, var=var, name_sim=name_sim, name_ref=name_ref,
-                        statistic=statistic, year_start=year_start, year_end=year_end,
-                        mask=mask_temp, var_ref=var_ref, var_sim=var_sim, var_ref_in_nc=var_ref_in_nc,
-                        read_in_bias_types=['bias_lag1corr'],
-                        var_sim_in_nc=var_sim_in_nc, time_scales = ['annual', 'seasonal', 'monthly'], verbose=False)
+    if datasets is not None:
+        evl.plotting.plot_bias_corr(datasets=datasets, name_ref=name_ref, name_sim=name_sim,
+                              fn_plot=fn_plot, var=var, unit=units[var],
+                               correlation_type=correlation_type, time_scales=time_scales,
+                              year_start=year_start, year_end=year_end,
+                              coordinates=coordinates, region=region_str, map_backend=map_backend,
+                              map_render_mode=map_render_mode)
 
-                    if datasets is not None:
-                        fig = evl.plotting.plot_bias_corr(datasets=datasets, name_ref=name_ref, name_sim=name_sim,
-                                                    fn_plot=fn_plot, var=var, unit=units[var],
-                                                     correlation_type='lag1corr', time_scales=['annual','seasonal','monthly'],
-                                                    year_start=year_start, year_end=year_end,
-                                                    coordinates=coordinates, region=region_str)
 
+if __name__ == '__main__':
 
+    # Reading and preparing data
 
+    # read in the region mask and the AWRA mask
+
+    regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
+                                                 region_meta_data_id_column, region_meta_data_label_column)
+
+    if mask is not None and type(mask) == str:
+        mask = xr.open_dataset(mask)
+        mask = evl.helpers.standardise_dimension_names(mask)
+        mask = mask['mask'] == 1
+
+    # prepare the autocorrelation: one calculation per dataset (reference data and each GCM), variable and statistic
+    # (the mean and sum, as the lag-1 correlation of the preprocessing)
+    autocorrelation_tasks = []
+    for gcm in [None] + list(gcms):
+        for var in vars:
+            for statistic in [x for x in statistics[var] if x in ['mean', 'sum']]:
+                input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, [] if gcm is None else [gcm], var,
+                                                             name_sim_prefix, name_ref if gcm is None else None, [statistic],
+                                                             year_start, year_end, time_scales=time_scales,
+                                                             suffix='merged', var_ref=ref_vars[var], var_sim=sim_vars[var])
+                name = name_ref if gcm is None else '%s_%s' % (name_sim_prefix, gcm)
+                autocorrelation_tasks.append(dict(fn_plot=get_autocorrelation_file_name(name, var, statistic), gcm=gcm,
+                                                  var=var, statistic=statistic, mask=mask, input_files=input_files))
+
+    # prepare the list of plots
+    tasks = []
+
+    for region_id in region_ids:
+
+        if region_id == 'AU':
+            region_str = 'Australia'
+            region_code = 'AU'
+            mask_temp = mask
+        else:
+            region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
+            region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
+            # extract the new mask: for each region
+            mask_temp = (mask & (regions == region_id))
+
+        # prepare the geographic extent
+        mask_df = mask_temp.where(mask_temp==1).to_dataframe(name='mask').dropna().reset_index()
+        coordinates=dict(llcrnrlat=np.min(mask_df['lat'])-0.2,
+                         urcrnrlat=np.max(mask_df['lat'])+0.2,
+                         llcrnrlon=np.min(mask_df['lon'])-0.2,
+                         urcrnrlon=np.max(mask_df['lon'])+0.2)
+
+        print('- %s' % region_str)
+
+        for gcm in gcms:
+
+            name_sim = '%s_%s' % (name_sim_prefix, gcm)
+
+            for var in vars:
+                var_sim = sim_vars[var]
+
+                for statistic in statistics[var]:
+                    
+                    if statistic not in ['mean', 'sum']:
+                        continue
+                    
+                    # lag correlations are only shown for the mean and sum
+
+                    fn_autocorrelation_ref = get_autocorrelation_file_name(name_ref, var, statistic)
+                    fn_autocorrelation_sim = get_autocorrelation_file_name(name_sim, var, statistic)
+
+                    for correlation_type in correlation_types:
+                        fn_plot = os.path.join(plot_path, region_code, 'bias_%s_%s_%s_%s_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), name_sim.upper(), var_sim,
+                                                                                                                    correlation_type, year_start, year_end, region_code))
+
+                        tasks.append(dict(fn_plot=fn_plot, gcm=gcm, var=var, statistic=statistic,
+                                          correlation_type=correlation_type, mask=mask_temp, coordinates=coordinates,
+                                          region_str=region_str, fn_autocorrelation_ref=fn_autocorrelation_ref,
+                                          fn_autocorrelation_sim=fn_autocorrelation_sim,
+                                          input_files=[fn_autocorrelation_ref, fn_autocorrelation_sim]))
+
+    # plan the autocorrelation: skip outputs that are up-to-date
+    autocorrelation_groups = evl.planner.plan_tasks(autocorrelation_tasks, skip_existing=skip_existing)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(autocorrelation_groups)
+        evl.planner.print_plan(evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers,
+                                                      pending_files=evl.planner.get_planned_files(autocorrelation_groups)))
+    else:
+        # calculate the autocorrelation: one dataset after the other, the tiles of grid cells of each dataset are
+        # processed in parallel (plots of datasets without autocorrelation fail and are listed in the summary)
+        for task in [task for group in autocorrelation_groups for task in group]:
+            try:
+                create_autocorrelation(**dict([(x, task[x]) for x in task if x != 'input_files']))
+            except Exception:
+                print('Calculating the autocorrelation failed: %s' % task['fn_plot'])
+                traceback.print_exc()
+
+        # plan the plots after the autocorrelation (the autocorrelation files are input files of the plots): skip
+        # plots that are up-to-date and group plots that read in the same files
+        groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers)
+
+        # create the plots
+        evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
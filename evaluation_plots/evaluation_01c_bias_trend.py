@@ -1,6 +1,7 @@
 import os
 import sys
 import json
+import traceback
 import numpy as np
 import xarray as xr
 # turn off all warnings
@@ -8,15 +9,10 @@ import warnings; warnings.simplefilter('ignore')
 
 
 ### Functions
-
-# import data evaluation plotting functions
-sys.path.append('/g/data/er4/exv563/hydro_projections/code/functions')
 import evaluation as evl
 
-
 ### Parameters
-with open('config.json', 'r') as fp:
-    parameters = json.load(fp)
+parameters = evl.config.load_config()
 
 # prepare settings
 skip_existing = parameters['skip_existing']
@@ -50,74 +46,165 @@ region_meta_data_label_column = parameters['region_meta_data_label_column']
 region_ids = parameters['region_codes_to_use']
 
 
-#### Plotting
+# map settings
+map_backend = parameters.get('map_backend', 'basemap')
+map_render_mode = parameters.get('map_render_mode', 'mesh')
+
+# significance of the trends (stippling)
+significance_level = parameters.get('trend_significance_level', 0.05)
+significance_fdr = parameters.get('trend_significance_fdr', True)
+trend_path = os.path.join(plot_path, 'trends')
 
-# Reading and preparing data
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
 
-# read in the region mask and the AWRA mask
 
-regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
-                                             region_meta_data_id_column, region_meta_data_label_column)
+#### Trends
 
-if mask is not None and type(mask) == str:
-    mask = xr.open_dataset(mask)
-    mask = evl.helpers.standardise_dimension_names(mask)
-    mask = mask['mask'] == 1
+def get_trend_file_name(name, var, statistic):
+    """
+    Returns the file name of the trends (Sen's slope and Mann-Kendall p-values) of one dataset, variable and statistic.
+    """
+    return os.path.join(trend_path, 'trends_%s_%s_%s_%s_%s.nc' % (name.upper(), var, statistic, year_start, year_end))
 
 
-for region_id in region_ids:
+def create_trends(fn_plot, gcm, var, statistic, mask):
+    """
+    Calculates the trends of the annual, seasonal and monthly time series of one dataset (the reference data if gcm
+    is None), variable and statistic in each grid cell (all regions) and writes them. The grid cells are processed
+    in tiles in a pool of n_workers processes.
+    """
 
-    if region_id == 'AU':
-        region_str = 'Australia'
-        region_code = 'AU'
-        mask_temp = mask
+    print('Calculating trends: %s' % fn_plot)
+
+    if gcm is None:
+        data_path, name, var_file, var_in_nc = data_path_ref, name_ref, ref_vars[var], ref_vars_in_nc[var]
     else:
-        region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
-        region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
-        # extract the new mask: for each region
-        mask_temp = (mask & (regions == region_id))
+        data_path, name, var_file, var_in_nc = data_path_sim, '%s_%s' % (name_sim_prefix, gcm), sim_vars[var], sim_vars_in_nc[var]
 
-    # prepare the geographic extent
-    mask_df = mask_temp.where(mask_temp==1).to_dataframe(name='mask').dropna().reset_index()
-    coordinates=dict(llcrnrlat=np.min(mask_df['lat'])-0.2,
-                     urcrnrlat=np.max(mask_df['lat'])+0.2,
-                     llcrnrlon=np.min(mask_df['lon'])-0.2,
-                     urcrnrlon=np.max(mask_df['lon'])+0.2)
+    trends = evl.trends.get_trend_fields(data_path, name, var, statistic, year_start, year_end, gcm=gcm, mask=mask,
+                                         var_in_nc=var_in_nc, var_file=var_file, n_workers=n_workers)
 
-    print('- %s' % region_str)
+    evl.helpers.create_containing_folder(fn_plot)
+    trends.to_netcdf(fn_plot)
 
-    for gcm in gcms:
 
-        name_sim = '%s_%s' % (name_sim_prefix, gcm)
+#### Plotting
 
-        for var in vars:
-            var_sim = sim_vars[var]
-            var_sim_in_nc = sim_vars_in_nc[var]
-            var_ref = ref_vars[var]
-            var_ref_in_nc = ref_vars_in_nc[var]
+def create_plot(fn_plot, gcm, var, statistic, mask, coordinates, region_str, fn_trends_ref, fn_trends_sim):
+    """
+    Reads in the trends and creates the map of the trend bias for one region, GCM, variable and statistic.
+    """
 
-            for statistic in statistics[var]:
+    name_sim = '%s_%s' % (name_sim_prefix, gcm)
+
+    print('Preparing plot: %s' % fn_plot)
+
+    trends = dict()
+    for name, fn in [(name_ref, fn_trends_ref), (name_sim, fn_trends_sim)]:
+        trends[name] = evl.helpers.apply_mask(evl.read_in.open_dataset(fn), mask)
+
+    evl.plotting.plot_bias_trend(trends=trends, name_ref=name_ref, name_sim=name_sim,
+                                 fn_plot=fn_plot, var=var, unit=units[var],
+                                 statistic=statistic, time_scales=seasons,
+                                 year_start=year_start, year_end=year_end,
+                                 coordinates=coordinates, region=region_str, map_backend=map_backend,
+                                 map_render_mode=map_render_mode, significance_level=significance_level,
+                                 fdr=significance_fdr)
 
-                fn_plot = os.path.join(plot_path, region_code, 'bias_trend_abs_%s_%s_%s_trend_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), name_sim.upper(), var_sim,
-                                                                                                                  year_start, year_end, region_code))
 
-                print('Preparing plot: %s' % fn_plot)
+if __name__ == '__main__':
 
-                if not os.path.exists(fn_plot) or not skip_existing:
-                    datasets = evl.read_in.read_in_xarray_data_for_one_gcm(
-                        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
-                        gcm=gcm, var=var, name_sim=name_sim, name_ref=name_ref,
-                        statistic=statistic, year_start=year_start, year_end=year_end,
-                        mask=mask_temp, var_ref=var_ref, var_sim=var_sim, var_ref_in_nc=var_ref_in_nc, 
-                        var_sim_in_nc=var_sim_in_nc, time_scales = ['annual', 'seasonal'], verbose=True,
-                        read_in_bias_types=['bias_trend_abs'])                    
+    # Reading and preparing data
 
-                    if datasets is not None:
-                        fig = evl.plotting.plot_bias_trend(datasets=datasets, name_ref=name_ref, name_sim=name_sim,
-                                                    fn_plot=fn_plot, var=var, unit=units[var],
-                                                     statistic=statistic, time_scales=seasons,
-                                                    year_start=year_start, year_end=year_end,
-                                                    coordinates=coordinates, region=region_str)
+    # read in the region mask and the AWRA mask
 
+    regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
+                                                 region_meta_data_id_column, region_meta_data_label_column)
 
+    if mask is not None and type(mask) == str:
+        mask = xr.open_dataset(mask)
+        mask = evl.helpers.standardise_dimension_names(mask)
+        mask = mask['mask'] == 1
 
+    # prepare the trends: one calculation per dataset (reference data and each GCM), variable and statistic
+    trend_tasks = []
+    for gcm in [None] + list(gcms):
+        for var in vars:
+            for statistic in statistics[var]:
+                input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, [] if gcm is None else [gcm], var,
+                                                             name_sim_prefix, name_ref if gcm is None else None, [statistic],
+                                                             year_start, year_end, time_scales=['annual', 'seasonal', 'monthly'],
+                                                             suffix='merged', var_ref=ref_vars[var], var_sim=sim_vars[var])
+                name = name_ref if gcm is None else '%s_%s' % (name_sim_prefix, gcm)
+                trend_tasks.append(dict(fn_plot=get_trend_file_name(name, var, statistic), gcm=gcm, var=var,
+                                        statistic=statistic, mask=mask, input_files=input_files))
+
+    # prepare the list of plots
+    tasks = []
+
+    for region_id in region_ids:
+
+        if region_id == 'AU':
+            region_str = 'Australia'
+            region_code = 'AU'
+            mask_temp = mask
+        else:
+            region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
+            region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
+            # extract the new mask: for each region
+            mask_temp = (mask & (regions == region_id))
+
+        # prepare the geographic extent
+        mask_df = mask_temp.where(mask_temp==1).to_dataframe(name='mask').dropna().reset_index()
+        coordinates=dict(llcrnrlat=np.min(mask_df['lat'])-0.2,
+                         urcrnrlat=np.max(mask_df['lat'])+0.2,
+                         llcrnrlon=np.min(mask_df['lon'])-0.2,
+                         urcrnrlon=np.max(mask_df['lon'])+0.2)
+
+        print('- %s' % region_str)
+
+        for gcm in gcms:
+
+            name_sim = '%s_%s' % (name_sim_prefix, gcm)
+
+            for var in vars:
+                var_sim = sim_vars[var]
+
+                for statistic in statistics[var]:
+
+                    # the statistic is part of the file name, so that each plot has its own output file
+                    fn_plot = os.path.join(plot_path, region_code, 'bias_trend_abs_%s_%s_%s_%s_trend_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), name_sim.upper(), var_sim,
+                                                                                                                      statistic, year_start, year_end, region_code))
+
+                    fn_trends_ref = get_trend_file_name(name_ref, var, statistic)
+                    fn_trends_sim = get_trend_file_name(name_sim, var, statistic)
+                    tasks.append(dict(fn_plot=fn_plot, gcm=gcm, var=var, statistic=statistic,
+                                      mask=mask_temp, coordinates=coordinates, region_str=region_str,
+                                      fn_trends_ref=fn_trends_ref, fn_trends_sim=fn_trends_sim,
+                                      input_files=[fn_trends_ref, fn_trends_sim]))
+
+    # plan the trends: skip outputs that are up-to-date
+    trend_groups = evl.planner.plan_tasks(trend_tasks, skip_existing=skip_existing)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(trend_groups)
+        evl.planner.print_plan(evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers,
+                                                      pending_files=evl.planner.get_planned_files(trend_groups)))
+    else:
+        # calculate the trends: one dataset after the other, the tiles of grid cells of each dataset are processed
+        # in parallel (plots of datasets without trends fail and are listed in the summary)
+        for task in [task for group in trend_groups for task in group]:
+            try:
+                create_trends(**dict([(x, task[x]) for x in task if x != 'input_files']))
+            except Exception:
+                print('Calculating the trends failed: %s' % task['fn_plot'])
+                traceback.print_exc()
+
+        # plan the plots after the trends (the trends are input files of the plots): skip plots that are
+        # up-to-date and group plots that read in the same files
+        groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers)
+
+        # create the plots
+        evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
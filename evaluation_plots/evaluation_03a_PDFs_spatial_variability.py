@@ -47,88 +47,111 @@ region_meta_data_id_column = parameters['region_meta_data_id_column']
 region_meta_data_label_column = parameters['region_meta_data_label_column']
 region_ids = parameters['region_codes_to_use']
 
-#### Plotting
-
-# Reading and preparing data
-
-# read in the region mask and the AWRA mask
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
 
-regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
-                                             region_meta_data_id_column, region_meta_data_label_column)
-if mask is not None and type(mask) == str:
-    mask = xr.open_dataset(mask)
-    mask = evl.helpers.standardise_dimension_names(mask)
-    mask = mask['mask'] == 1
-    
-for region_id in region_ids:
-                
-    if region_id == 'AU':
-        region_str = 'Australia'
-        region_code = 'AU'
-        mask_temp = mask
-    else:
-        region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
-        region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
-        # extract the new mask: for each region
-        mask_temp = (mask & (regions == region_id))
+#### Plotting
 
-    print('- %s' % region_str)
+def create_plot(fn_plot, gcms, var, statistic, mask, region_str):
+    """
+    Reads in the data and creates the plot of the spatial variability for one region, GCM (or all GCMs), variable and statistic.
+    """
+
+    print('Preparing plot: %s' % fn_plot)
+    print('Reading in data')
+
+    # mean fields of the reference data and all GCMs as one array (dimension source)
+    ensemble = evl.read_in.read_in_ensemble_mean_fields(
+        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+        gcms=gcms, var=var, name_sim_prefix=name_sim_prefix, name_ref=name_ref,
+        statistic=statistic, year_start=year_start, year_end=year_end, mask=mask, 
+        var_ref=ref_vars[var], var_sim=sim_vars[var], var_ref_in_nc=ref_vars_in_nc[var], var_sim_in_nc=sim_vars_in_nc[var],
+        time_scales=seasons)
+    df = evl.ensemble.to_dataframe(ensemble, statistic)
+
+    df['region'] = region_str
+
+    # select seasons
+    df = df.loc[df['time_scale'].isin(seasons)]
+    df['time_scale'] = pd.Categorical(df['time_scale'], categories=seasons, ordered=True)
+    df['region'] = pd.Categorical(df['region'], categories=df['region'].unique(), ordered=True)
+    df['type'] = [x.upper() for x in df['type']]
     
-    for gcm in gcms + ['ALL-GCMS']:
-        
-        name_sim = '%s_%s' % (name_sim_prefix, gcm)
-        if gcm == 'ALL-GCMS':
-            if include_all_gcms_plot:
-                gcms_temp = gcms # all gcms
-            else:
-                continue
-        else:
-            gcms_temp = [gcm] # individual gcm
+    # change variable names and values for better plotting using seaborn
+    df = df.rename({'type':'Dataset'}, axis=1)
+    df['Dataset'] = [x.upper() for x in df['Dataset']]
 
-        for var in vars:
+    evl.plotting.plot_distribution(dataframe=df, x=var, var=var, statistic=statistic,
+                hue='Dataset', col='time_scale', row='region',
+                name_sim_prefix=name_sim_prefix.upper(),
+                        name_ref=name_ref.upper(), fn_plot=fn_plot)
 
-            var_sim = sim_vars[var]
-            var_sim_in_nc = sim_vars_in_nc[var]
-            var_ref = ref_vars[var]
-            var_ref_in_nc = ref_vars_in_nc[var]
 
-            for statistic in statistics[var]:
-                
-                df = None
-                
-                fn_plot = os.path.join(plot_path, region_code, 'PDF_spatial_variability_%s_%s_%s_%s_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), 
-                                                                                                                     name_sim.upper(), var_sim,
-                                                                                                                     statistic, year_start,
-                                                                                                                     year_end, region_code))
+if __name__ == '__main__':
 
-                print('Preparing plot: %s' % fn_plot)
+    # Reading and preparing data
 
-                if not os.path.exists(fn_plot) or not skip_existing:
-                    print('Reading in data')
+    # read in the region mask and the AWRA mask
 
-                    df = pd.DataFrame()
+    regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
+                                                 region_meta_data_id_column, region_meta_data_label_column)
+    if mask is not None and type(mask) == str:
+        mask = xr.open_dataset(mask)
+        mask = evl.helpers.standardise_dimension_names(mask)
+        mask = mask['mask'] == 1
 
+    # prepare the list of plots
+    tasks = []
+        
+    for region_id in region_ids:
                     
-                    df = evl.read_in.prepare_mean_field_for_all_gcms_and_statistics(
-                        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
-                        gcms=gcms_temp, var=var, name_sim_prefix=name_sim_prefix, name_ref=name_ref,
-                        statistics=[statistic], year_start=year_start, year_end=year_end, mask=mask_temp, 
-                        var_ref=var_ref, var_sim=var_sim, var_ref_in_nc=var_ref_in_nc, var_sim_in_nc=var_sim_in_nc)
-
-                    df['region'] = region_str
-
-                    # select seasons
-                    df = df.loc[df['time_scale'].isin(seasons)]
-                    df['time_scale'] = pd.Categorical(df['time_scale'], categories=seasons, ordered=True)
-                    df['region'] = pd.Categorical(df['region'], categories=df['region'].unique(), ordered=True)
-                    df['type'] = [x.upper() for x in df['type']]
-                    
-                    # change variable names and values for better plotting using seaborn
-                    df = df.rename({'type':'Dataset'}, axis=1)
-                    df['Dataset'] = [x.upper() for x in df['Dataset']]
+        if region_id == 'AU':
+            region_str = 'Australia'
+            region_code = 'AU'
+            mask_temp = mask
+        else:
+            region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
+            region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
+            # extract the new mask: for each region
+            mask_temp = (mask & (regions == region_id))
 
-                    evl.plotting.plot_distribution(dataframe=df, x=var, var=var, statistic=statistic,
-                                hue='Dataset', col='time_scale', row='region',
-                                name_sim_prefix=name_sim_prefix.upper(),
-                                        name_ref=name_ref.upper(), fn_plot=fn_plot)
+        print('- %s' % region_str)
+        
+        for gcm in gcms + ['ALL-GCMS']:
+            
+            name_sim = '%s_%s' % (name_sim_prefix, gcm)
+            if gcm == 'ALL-GCMS':
+                if include_all_gcms_plot:
+                    gcms_temp = gcms # all gcms
+                else:
+                    continue
+            else:
+                gcms_temp = [gcm] # individual gcm
 
+            for var in vars:
+
+                var_sim = sim_vars[var]
+
+                for statistic in statistics[var]:
+                    
+                    fn_plot = os.path.join(plot_path, region_code, 'PDF_spatial_variability_%s_%s_%s_%s_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), 
+                                                                                                                         name_sim.upper(), var_sim,
+                                                                                                                         statistic, year_start,
+                                                                                                                         year_end, region_code))
+
+                    input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, gcms_temp, var, name_sim_prefix, name_ref,
+                                                                 [statistic], year_start, year_end, time_scales=['annual', 'seasonal'], suffix='mean',
+                                                                 var_ref=ref_vars[var], var_sim=var_sim)
+                    tasks.append(dict(fn_plot=fn_plot, gcms=gcms_temp, var=var, statistic=statistic,
+                                      mask=mask_temp, region_str=region_str,
+                                      input_files=input_files))
+
+    # plan the plots: skip plots that are up-to-date and group plots that read in the same files
+    groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(groups)
+    else:
+        # create the plots
+        evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
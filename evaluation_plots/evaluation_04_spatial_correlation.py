@@ -47,97 +47,138 @@ region_meta_data_id_column = parameters['region_meta_data_id_column']
 region_meta_data_label_column = parameters['region_meta_data_label_column']
 region_ids = parameters['region_codes_to_use']
 
-#### Plotting
-
-# Reading and preparing data
+# points (one point per grid cell), or heatmap / hexbin (density of the grid cells, faster for large regions)
+spatial_correlation_mode = parameters.get('spatial_correlation_mode', 'points')
 
-# read in the region mask and the AWRA mask
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
 
-regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
-                                             region_meta_data_id_column, region_meta_data_label_column)
-if mask is not None and type(mask) == str:
-    mask = xr.open_dataset(mask)
-    mask = evl.helpers.standardise_dimension_names(mask)
-    mask = mask['mask'] == 1
-    
-for region_id in region_ids:
-                
-    if region_id == 'AU':
-        region_str = 'Australia'
-        region_code = 'AU'
-        mask_temp = mask
-    else:
-        region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
-        region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
-        # extract the new mask: for each region
-        mask_temp = (mask & (regions == region_id))
+#### Plotting
 
-    print('- %s' % region_str)
+def create_plot(fn_plot, gcms, var, statistic, mask, region_str):
+    """
+    Reads in the data and creates the spatial correlation plot for one region, GCM (or all GCMs), variable and statistic.
+    """
+
+    print('Preparing plot: %s' % fn_plot)
+    print('Reading in data')
+
+    if spatial_correlation_mode != 'points':
+        # the mean fields are compared as arrays (aligned by grid cell), the regression statistics are written to a table
+        fields = evl.spatial_correlation.get_mean_fields(
+            data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+            gcms=gcms, var=var, name_sim_prefix=name_sim_prefix, name_ref=name_ref,
+            statistic=statistic, year_start=year_start, year_end=year_end, mask=mask,
+            var_ref=ref_vars[var], var_sim=sim_vars[var], var_ref_in_nc=ref_vars_in_nc[var], var_sim_in_nc=sim_vars_in_nc[var],
+            time_scales=seasons)
+
+        evl.plotting.plot_spatial_correlation_density(fields=fields, var=var, statistic=statistic,
+                                                      name_sim_prefix=name_sim_prefix, name_ref=name_ref,
+                                                      region=region_str, time_scales=seasons, kind=spatial_correlation_mode,
+                                                      fn_plot=fn_plot, fn_table=os.path.splitext(fn_plot)[0] + '.csv')
+        return
+
+    temp_df = evl.read_in.prepare_mean_field_for_all_gcms_and_statistics(
+        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+        gcms=gcms, var=var, name_sim_prefix=name_sim_prefix, name_ref=name_ref,
+        statistics=[statistic], year_start=year_start, year_end=year_end, mask=mask, 
+        var_ref=ref_vars[var], var_sim=sim_vars[var], var_ref_in_nc=ref_vars_in_nc[var], var_sim_in_nc=sim_vars_in_nc[var])
+
+    temp_df['region'] = region_str
+
+    # reshape the table and put simulation and reference data in two columns to be able to plot them against each other
+    temp_ref = temp_df.loc[temp_df['type'] == name_ref].copy()
+    temp_ref = temp_ref.rename({var: name_ref}, axis=1)
+    temp_ref = temp_ref.drop('type', axis=1)
+
+    temp_sim = temp_df.loc[temp_df['type'] != name_ref].copy()
+    temp_sim = temp_sim.rename({var: name_sim_prefix}, axis=1)
+
+    # merge the two so that each grid cell has one observation, but all of the GCM data
+    temp_df = temp_ref.merge(temp_sim, on=['time_scale', 'statistic', 'lat', 'lon', 'region'], how='outer')
+    temp_df = temp_df.dropna()
+
+    df = temp_df
+
+    # select seasons
+    df = df.loc[df['time_scale'].isin(seasons)]
+    df['time_scale'] = pd.Categorical(df['time_scale'], categories=seasons, ordered=True)
+    df['region'] = pd.Categorical(df['region'], categories=df['region'].unique(), ordered=True)
+    df['type'] = [x.upper() for x in df['type']]
     
-    for gcm in gcms + ['ALL-GCMS']:
-        
-        name_sim = '%s_%s' % (name_sim_prefix, gcm)
-        if gcm == 'ALL-GCMS':
-            if include_all_gcms_plot:
-                gcms_temp = gcms # all gcms
-            else:
-                continue
-        else:
-            gcms_temp = [gcm] # individual gcm
+    # change variable names and values for better plotting using seaborn
+    df = df.rename({'type':'Dataset'}, axis=1)
+    df['Dataset'] = [x.upper() for x in df['Dataset']]
 
-        for var in vars:
+    evl.plotting.plot_spatial_correlation(dataframe=df, x=name_sim_prefix, y=name_ref, var=var, 
+                                 statistic=statistic, hue='Dataset', row='region', col='time_scale', 
+                                 name_sim_prefix=name_sim_prefix, name_ref=name_ref, fn_plot=fn_plot)
 
-            var_sim = sim_vars[var]
-            var_sim_in_nc = sim_vars_in_nc[var]
-            var_ref = ref_vars[var]
-            var_ref_in_nc = ref_vars_in_nc[var]
 
-            for statistic in statistics[var]:
+if __name__ == '__main__':
 
-                df = None
+    # Reading and preparing data
 
-                fn_plot = os.path.join(plot_path, region_code, 'spatial_corr_%s_%s_%s_%s_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), name_sim.upper(), var_sim,
-                                                                                                                     statistic, year_start,
-                                                                                                                     year_end, region_code))
-                
-                print('Preparing plot: %s' % fn_plot)
+    # read in the region mask and the AWRA mask
 
-                if not os.path.exists(fn_plot) or not skip_existing:
-                    print('Reading in data')
+    regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data, 
+                                                 region_meta_data_id_column, region_meta_data_label_column)
+    if mask is not None and type(mask) == str:
+        mask = xr.open_dataset(mask)
+        mask = evl.helpers.standardise_dimension_names(mask)
+        mask = mask['mask'] == 1
 
-                    temp_df = evl.read_in.prepare_mean_field_for_all_gcms_and_statistics(
-                        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
-                        gcms=gcms_temp, var=var, name_sim_prefix=name_sim_prefix, name_ref=name_ref,
-                        statistics=[statistic], year_start=year_start, year_end=year_end, mask=mask_temp, 
-                        var_ref=var_ref, var_sim=var_sim, var_ref_in_nc=var_ref_in_nc, var_sim_in_nc=var_sim_in_nc)
+    # prepare the list of plots
+    tasks = []
+        
+    for region_id in region_ids:
+                    
+        if region_id == 'AU':
+            region_str = 'Australia'
+            region_code = 'AU'
+            mask_temp = mask
+        else:
+            region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
+            region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
+            # extract the new mask: for each region
+            mask_temp = (mask & (regions == region_id))
 
-                    temp_df['region'] = region_str
+        print('- %s' % region_str)
+        
+        for gcm in gcms + ['ALL-GCMS']:
+            
+            name_sim = '%s_%s' % (name_sim_prefix, gcm)
+            if gcm == 'ALL-GCMS':
+                if include_all_gcms_plot:
+                    gcms_temp = gcms # all gcms
+                else:
+                    continue
+            else:
+                gcms_temp = [gcm] # individual gcm
 
-                    # reshape the table and put simulation and reference data in two columns to be able to plot them against each other
-                    temp_ref = temp_df.loc[temp_df['type'] == name_ref].copy()
-                    temp_ref = temp_ref.rename({var: name_ref}, axis=1)
-                    temp_ref = temp_ref.drop('type', axis=1)
+            for var in vars:
 
-                    temp_sim = temp_df.loc[temp_df['type'] != name_ref].copy()
-                    temp_sim = temp_sim.rename({var: name_sim_prefix}, axis=1)
+                var_sim = sim_vars[var]
 
-                    # merge the two so that each grid cell has one observation, but all of the GCM data
-                    temp_df = temp_ref.merge(temp_sim, on=['time_scale', 'statistic', 'lat', 'lon', 'region'], how='outer')
-                    temp_df = temp_df.dropna()
+                for statistic in statistics[var]:
 
-                    df = temp_df
+                    fn_plot = os.path.join(plot_path, region_code, 'spatial_corr_%s_%s_%s_%s_%s_%s_%s_ALL-SEASONS.png' % (name_ref.upper(), name_sim.upper(), var_sim,
+                                                                                                                         statistic, year_start,
+                                                                                                                         year_end, region_code))
 
-                    # select seasons
-                    df = df.loc[df['time_scale'].isin(seasons)]
-                    df['time_scale'] = pd.Categorical(df['time_scale'], categories=seasons, ordered=True)
-                    df['region'] = pd.Categorical(df['region'], categories=df['region'].unique(), ordered=True)
-                    df['type'] = [x.upper() for x in df['type']]
-                    
-                    # change variable names and values for better plotting using seaborn
-                    df = df.rename({'type':'Dataset'}, axis=1)
-                    df['Dataset'] = [x.upper() for x in df['Dataset']]
+                    input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, gcms_temp, var, name_sim_prefix, name_ref,
+                                                                 [statistic], year_start, year_end, time_scales=['annual', 'seasonal'], suffix='mean',
+                                                                 var_ref=ref_vars[var], var_sim=var_sim)
+                    tasks.append(dict(fn_plot=fn_plot, gcms=gcms_temp, var=var, statistic=statistic,
+                                      mask=mask_temp, region_str=region_str,
+                                      input_files=input_files))
 
-                    evl.plotting.plot_spatial_correlation(dataframe=df, x=name_sim_prefix, y=name_ref, var=var, 
-                                                 statistic=statistic, hue='Dataset', row='region', col='time_scale', 
-                                                 name_sim_prefix=name_sim_prefix, name_ref=name_ref, fn_plot=fn_plot)
+    # plan the plots: skip plots that are up-to-date and group plots that read in the same files
+    groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers)
 
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(groups)
+    else:
+        # create the plots
+        evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
@@ -37,70 +37,94 @@ mask = parameters['mask_file']
 coordinates = parameters['point_locations']
 
 
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
+
+
 #### Plot all time series - annual and seasonal mean
 
-# Reading and preparing data
-for gcm in gcms + ['ALL-GCMS']:
-        
-    name_sim = '%s_%s' % (name_sim_prefix, gcm)
-    if gcm == 'ALL-GCMS':
-        if include_all_gcms_plot:
-            gcms_temp = gcms # all gcms
-        else:
-            continue
-    else:
-        gcms_temp = [gcm] # individual gcm
-    
-    for var in vars:  
-            
-        var_sim = sim_vars[var]
-        var_sim_in_nc = sim_vars_in_nc[var]
-        var_ref = ref_vars[var]
-        var_ref_in_nc = ref_vars_in_nc[var]
-            
-        for statistic in statistics[var]:        
-            print(statistic)
+def create_plot(fn_plot, gcms, var, statistic):
+    """
+    Reads in the data for all point locations and creates the plot for one GCM (or all GCMs), variable and statistic.
+    """
 
-            df = None
-            
-            fn_plot = os.path.join(plot_path, 'point_locations', 'point_CDFs_%s_%s_%s_%s_%s_%s_AU_ANNUAL-DJF-JJA.png' % (name_ref.upper(), name_sim.upper(), var_sim,
-                                                                                                         statistic, year_start, year_end))
-               
-            print('Preparing plot: %s' % fn_plot)
+    print('Preparing plot: %s' % fn_plot)
+    print('Reading in data')
 
-            if not os.path.exists(fn_plot) or not skip_existing:
-                print('Reading in data')
+    df = pd.DataFrame()
 
-                df = pd.DataFrame()
+    for i, location in enumerate(coordinates):
 
-                for i, location in enumerate(coordinates):
+        lat = coordinates[location]['lat']
+        lon = coordinates[location]['lon']
 
-                    lat = coordinates[location]['lat']
-                    lon = coordinates[location]['lon']
+        print('- %s' % location)
 
-                    print('- %s' % location)
+        temp_df = evl.read_in.prepare_timeseries_for_all_gcms_and_statistics(
+            data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+            gcms=gcms, var=var, name_sim_prefix=name_sim_prefix, name_ref=name_ref, 
+            statistics=[statistic], year_start=year_start, year_end=year_end, mask=mask,
+            var_ref=var, var_sim=sim_vars[var], var_ref_in_nc=var, var_sim_in_nc=sim_vars_in_nc[var], lat=lat, lon=lon)
 
-                    temp_df = evl.read_in.prepare_timeseries_for_all_gcms_and_statistics(
-                        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
-                        gcms=gcms_temp, var=var, name_sim_prefix=name_sim_prefix, name_ref=name_ref, 
-                        statistics=[statistic], year_start=year_start, year_end=year_end, mask=mask,
-                        var_ref=var, var_sim=var_sim, var_ref_in_nc=var, var_sim_in_nc=var_sim_in_nc, lat=lat, lon=lon)
+        temp_df['lat'] = lat
+        temp_df['lon'] = lon
+        temp_df['location'] = location
+        df = df.append(temp_df)
 
-                    temp_df['lat'] = lat
-                    temp_df['lon'] = lon
-                    temp_df['location'] = location
-                    df = df.append(temp_df)
+    # select only annual, DJF and JJA
+    df = df.loc[df['time_scale'].isin(['annual', 'DJF', 'JJA'])]
+    df['time_scale'] = pd.Categorical(df['time_scale'], categories=['annual', 'DJF', 'JJA'], ordered=True)
+    df['type'] = [x.upper() for x in df['type']]
 
-                # select only annual, DJF and JJA
-                df = df.loc[df['time_scale'].isin(['annual', 'DJF', 'JJA'])]
-                df['time_scale'] = pd.Categorical(df['time_scale'], categories=['annual', 'DJF', 'JJA'], ordered=True)
-                df['type'] = [x.upper() for x in df['type']]
+    # change variable names and values for better plotting using seaborn
+    df = df.rename({'type':'Dataset'}, axis=1)
+    df['Dataset'] = [x.upper() for x in df['Dataset']]
+        
+    evl.plotting.plot_distribution(dataframe=df, x=var, var=var, statistic=statistic,
+                hue='Dataset', col='location', row='time_scale', 
+                name_sim_prefix=name_sim_prefix, name_ref=name_ref, fn_plot=fn_plot)
+
+
+if __name__ == '__main__':
+
+    # Reading and preparing data
 
-                # change variable names and values for better plotting using seaborn
-                df = df.rename({'type':'Dataset'}, axis=1)
-                df['Dataset'] = [x.upper() for x in df['Dataset']]
-                    
-                evl.plotting.plot_distribution(dataframe=df, x=var, var=var, statistic=statistic,
-                            hue='Dataset', col='location', row='time_scale', 
-                            name_sim_prefix=name_sim_prefix, name_ref=name_ref, fn_plot=fn_plot)
+    # prepare the list of plots
+    tasks = []
 
+    for gcm in gcms + ['ALL-GCMS']:
+            
+        name_sim = '%s_%s' % (name_sim_prefix, gcm)
+        if gcm == 'ALL-GCMS':
+            if include_all_gcms_plot:
+                gcms_temp = gcms # all gcms
+            else:
+                continue
+        else:
+            gcms_temp = [gcm] # individual gcm
+        
+        for var in vars:  
+                
+            var_sim = sim_vars[var]
+                
+            for statistic in statistics[var]:        
+                
+                fn_plot = os.path.join(plot_path, 'point_locations', 'point_CDFs_%s_%s_%s_%s_%s_%s_AU_ANNUAL-DJF-JJA.png' % (name_ref.upper(), name_sim.upper(), var_sim,
+                                                                                                             statistic, year_start, year_end))
+
+                input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, gcms_temp, var, name_sim_prefix, name_ref,
+                                                             [statistic], year_start, year_end, time_scales=['annual', 'seasonal'], suffix='merged',
+                                                             var_ref=var, var_sim=var_sim)
+                tasks.append(dict(fn_plot=fn_plot, gcms=gcms_temp, var=var, statistic=statistic,
+                                  input_files=input_files))
+
+    # plan the plots: skip plots that are up-to-date and group plots that read in the same files
+    groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, shared_reads=False,
+                                    n_workers=n_workers)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(groups)
+    else:
+        # create the plots
+        evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
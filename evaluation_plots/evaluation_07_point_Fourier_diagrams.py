@@ -1,4 +1,5 @@
 import os
+import glob
 import sys
 import json
 # turn off all warnings
@@ -31,63 +32,101 @@ sim_vars = parameters['sim_vars']
 sim_vars_in_nc = parameters['sim_vars_in_nc']
 
 fourier_time_aggregations = parameters['fourier_time_aggregations']
+# periodogram (FFT of the whole time series), or welch / multitaper (averaged spectra, less noisy)
+fourier_spectrum_method = parameters.get('fourier_spectrum_method', 'periodogram')
 coordinates = parameters['point_locations']
 
 
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
+
+
 #### Plot all time series - annual and seasonal mean
 
-# Reading and preparing data
-for gcm in gcms:
+def get_fn_plot(plot_type, timestep, name_sim, var_sim, location):
+    """
+    Returns the file name of the Fourier diagram for one plot type (wavelengths or frequencies).
+    """
+    return os.path.join(plot_path, 'point_locations', 'point_Fourier_diagrams_%s_%s_%s_%s_%s_%s_%s_%s.png' % (plot_type, timestep,
+                                                                                                           name_ref.upper(),
+                                                                                                           name_sim.upper(), var_sim,
+                                                                                                           year_start, year_end,
+                                                                                                           location))
+
+
+def create_plot(fn_plot, gcm, var, location, timestep):
+    """
+    Reads in the daily data for one location and creates the Fourier diagrams (wavelengths and frequencies)
+    for one GCM and variable.
+    """
+
     name_sim = '%s_%s' % (name_sim_prefix, gcm)
-    gcms_temp = [gcm] # individual gcm
-        
-    for var in vars:
-        
-        var_sim = sim_vars[var]
-        var_sim_in_nc = sim_vars_in_nc[var]
-        var_ref = ref_vars[var]
-        var_ref_in_nc = ref_vars_in_nc[var]
-        
-        for location in coordinates.keys():
-            for timestep in fourier_time_aggregations:
-                print(var, location, timestep)
-
-                fn_plot = os.path.join(plot_path, 'point_locations', 'point_Fourier_diagrams_frequencies_%s_%s_%s_%s_%s_%s_%s.png' % (name_ref.upper(), timestep,
-                                                                                                                                            name_sim.upper(), var_sim,
-                                                                                                                                            year_start, year_end,
-                                                                                                                                            location))
-
-                if os.path.exists(fn_plot):
-                    continue
-
-                print('Reading in data')
-
-                var_sim = sim_vars[var]
-                var_sim_in_nc = sim_vars_in_nc[var]
-                var_ref = ref_vars[var]
-                var_ref_in_nc = ref_vars_in_nc[var]
-                lat = coordinates[location]['lat']
-                lon = coordinates[location]['lon']
-
-                df = evl.read_in.prepare_daily_timeseries_for_all_gcms(
-                    data_path_sim=path_daily_sim, data_path_ref=path_daily_ref, gcms=gcms_temp, var=var, lat=lat, lon=lon, 
-                    name_sim_prefix=name_sim_prefix, name_ref=name_ref, year_start=year_start, year_end=year_end,
-                    var_ref=var_ref, var_sim=var_sim, var_ref_in_nc=var_ref_in_nc, var_sim_in_nc=var_sim_in_nc)
-
-                print('Plotting data')
-
-                for plot_type in ['wavelengths', 'frequencies']:
-
-                    fn_plot = os.path.join(plot_path, 'point_locations', 'point_Fourier_diagrams_%s_%s_%s_%s_%s_%s_%s_%s.png' % (plot_type, timestep,
-                                                                                                                                       name_ref.upper(),
-                                                                                                                                       name_sim.upper(), var_sim,
-                                                                                                                                       year_start, year_end,
-                                                                                                                                       location))
-
-                    print('Preparing plot: %s' % fn_plot)
-
-                    if not os.path.exists(fn_plot) or not skip_existing:
-                        evl.plotting.plot_fourier_transform(dataframe=df, location_name=location, var=var, timestep=timestep,
-                                                   name_sim_prefix=name_sim_prefix, name_ref=name_ref,
-                                                   fn_plot=fn_plot, n_top_frequencies=5, x_axis=plot_type)
+    var_sim = sim_vars[var]
+    var_sim_in_nc = sim_vars_in_nc[var]
+    var_ref = ref_vars[var]
+    var_ref_in_nc = ref_vars_in_nc[var]
+    lat = coordinates[location]['lat']
+    lon = coordinates[location]['lon']
+
+    print(var, location, timestep)
+    print('Reading in data')
+
+    df = evl.read_in.prepare_daily_timeseries_for_all_gcms(
+        data_path_sim=path_daily_sim, data_path_ref=path_daily_ref, gcms=[gcm], var=var, lat=lat, lon=lon, 
+        name_sim_prefix=name_sim_prefix, name_ref=name_ref, year_start=year_start, year_end=year_end,
+        var_ref=var_ref, var_sim=var_sim, var_ref_in_nc=var_ref_in_nc, var_sim_in_nc=var_sim_in_nc)
+
+    print('Plotting data')
+
+    # the spectra are calculated once for both diagrams
+    spectrum = evl.spectral.get_spectra(df, var, timestep, method=fourier_spectrum_method)
+
+    for plot_type in ['wavelengths', 'frequencies']:
+
+        fn_plot = get_fn_plot(plot_type, timestep, name_sim, var_sim, location)
+
+        print('Preparing plot: %s' % fn_plot)
+
+        evl.plotting.plot_fourier_transform(dataframe=df, location_name=location, var=var, timestep=timestep,
+                                   name_sim_prefix=name_sim_prefix, name_ref=name_ref,
+                                   fn_plot=fn_plot, n_top_frequencies=5, x_axis=plot_type, spectrum=spectrum)
+
+
+if __name__ == '__main__':
+
+    # Reading and preparing data
+
+    # prepare the list of plots (one task creates both the wavelength and the frequency diagram)
+    tasks = []
+
+    for gcm in gcms:
+        name_sim = '%s_%s' % (name_sim_prefix, gcm)
+            
+        for var in vars:
+            
+            var_sim = sim_vars[var]
+
+            # daily input files (the same files for all locations and time steps)
+            daily_files = evl.read_in.get_daily_files(path_daily_ref, path_daily_sim, [gcm], ref_vars[var], var_sim, year_start, year_end)
+            input_files = [fn for files_year in daily_files['ref'] for fn in files_year] + sorted(glob.glob(daily_files[gcm]))
+            
+            for location in coordinates.keys():
+                for timestep in fourier_time_aggregations:
+
+                    # both diagrams are outputs of the task: it is run if one of them is missing or out-of-date
+                    fn_plot = get_fn_plot('frequencies', timestep, name_sim, var_sim, location)
+                    fn_plot_wavelengths = get_fn_plot('wavelengths', timestep, name_sim, var_sim, location)
+
+                    tasks.append(dict(fn_plot=fn_plot, gcm=gcm, var=var, location=location, timestep=timestep,
+                                      input_files=input_files, output_files=[fn_plot_wavelengths]))
+
+    # plan the plots: skip plots that are up-to-date and group plots that read in the same files
+    groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, shared_reads=False,
+                                    n_workers=n_workers)
 
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(groups)
+    else:
+        # create the plots
+        evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+# turn off all warnings
+import warnings; warnings.simplefilter('ignore')
+
+import collections
+import pandas as pd
+import xarray as xr
+
+
+### Functions
+import evaluation as evl
+
+### Parameters
+parameters = evl.config.load_config()
+
+
+# prepare settings
+skip_existing = parameters['skip_existing']
+data_path_ref = parameters['data_path_processed_ref']
+data_path_sim = parameters['data_path_processed_sim']
+plot_path = os.path.join(parameters['plot_path'], '11_metrics')
+year_start = parameters['evaluation_year_start']
+year_end = parameters['evaluation_year_end']
+name_sim_prefix = parameters['name_sim_prefix']
+name_ref = parameters['name_ref']
+gcms = parameters['gcms']
+seasons = parameters['seasons']
+vars = parameters['vars']
+ref_vars = parameters['ref_vars']
+ref_vars_in_nc = parameters['ref_vars_in_nc']
+sim_vars = parameters['sim_vars']
+sim_vars_in_nc = parameters['sim_vars_in_nc']
+
+statistics = parameters['metrics_statistics']
+
+# read in mask
+mask = parameters['mask_file']
+
+# region mask
+region_file = parameters['region_file']
+region_var = parameters['region_var']
+region_meta_data = parameters['region_meta_data']
+region_meta_data_id_column = parameters['region_meta_data_id_column']
+region_meta_data_label_column = parameters['region_meta_data_label_column']
+region_ids = parameters['region_codes_to_use']
+
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
+
+
+#### Metrics and summary plots
+
+def create_table(fn_plot, var, statistic, region_masks):
+    """
+    Reads in the mean fields of the reference data and all GCMs and writes the metrics table of one variable and
+    statistic (all regions, time scales and GCMs).
+    """
+
+    print('Preparing table: %s' % fn_plot)
+    print('Reading in data')
+
+    ensemble = evl.read_in.read_in_ensemble_mean_fields(
+        data_path_ref=data_path_ref, data_path_sim=data_path_sim,
+        gcms=gcms, var=var, name_sim_prefix=name_sim_prefix, name_ref=name_ref,
+        statistic=statistic, year_start=year_start, year_end=year_end, mask=mask,
+        var_ref=ref_vars[var], var_sim=sim_vars[var], var_ref_in_nc=ref_vars_in_nc[var], var_sim_in_nc=sim_vars_in_nc[var],
+        time_scales=seasons)
+
+    print('Calculating metrics')
+    table = evl.metrics.get_metrics_table(ensemble, name_ref, var, statistic, region_masks=region_masks)
+
+    evl.helpers.create_containing_folder(fn_plot)
+    evl.metrics.write_metrics_table(table, fn_plot)
+
+
+def create_summary_plot(fn_plot, fn_table, plot_type, region_str, metric=None, var=None, statistic=None):
+    """
+    Creates a portrait plot (one metric) or a Taylor diagram (one variable and statistic) from the metrics table.
+    """
+
+    print('Preparing plot: %s' % fn_plot)
+    table = evl.metrics.read_metrics_table(fn_table)
+
+    if plot_type == 'portrait':
+        evl.plotting.plot_metrics_portrait(table, metric, name_sim_prefix=name_sim_prefix, name_ref=name_ref,
+                                           region=region_str, fn_plot=fn_plot)
+    else:
+        evl.plotting.plot_taylor_diagram(table, var, statistic, name_sim_prefix=name_sim_prefix, name_ref=name_ref,
+                                         region=region_str, fn_plot=fn_plot)
+
+
+if __name__ == '__main__':
+
+    # Reading and preparing data
+
+    # read in the region mask and the AWRA mask
+
+    regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data,
+                                                 region_meta_data_id_column, region_meta_data_label_column)
+    if mask is not None and type(mask) == str:
+        mask = xr.open_dataset(mask)
+        mask = evl.helpers.standardise_dimension_names(mask)
+        mask = mask['mask'] == 1
+
+    # masks of the regions (the fields are read in with the AWRA mask, Australia: no further mask)
+    region_masks = collections.OrderedDict()
+    region_strs = dict()
+    for region_id in region_ids:
+        if region_id == 'AU':
+            region_str = 'Australia'
+            region_code = 'AU'
+            region_masks[region_str] = None
+        else:
+            region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
+            region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
+            region_masks[region_str] = (regions == region_id)
+        region_strs[region_code] = region_str
+
+    # prepare the list of tables: one table per variable and statistic
+    tasks = []
+    for var in vars:
+
+        var_sim = sim_vars[var]
+
+        for statistic in statistics[var]:
+
+            fn_plot = os.path.join(plot_path, 'tables', 'metrics_%s_%s_%s_%s_%s_%s.csv' % (name_ref.upper(), name_sim_prefix.upper(),
+                                                                                       var_sim, statistic, year_start, year_end))
+
+            input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref,
+                                                         [statistic], year_start, year_end, time_scales=['annual', 'seasonal'], suffix='mean',
+                                                         var_ref=ref_vars[var], var_sim=var_sim)
+            tasks.append(dict(fn_plot=fn_plot, var=var, statistic=statistic, region_masks=region_masks,
+                              input_files=input_files))
+
+    # plan the tables: skip tables that are up-to-date and group tables that read in the same files
+    groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(groups)
+        sys.exit(0)
+
+    # calculate the metrics
+    evl.parallel.run_plot_task_groups(create_table, groups, n_workers=n_workers)
+
+    # combine all tables into one table
+    fn_tables = [task['fn_plot'] for task in tasks if os.path.exists(task['fn_plot'])]
+    if len(fn_tables) == 0:
+        sys.exit(0)
+    fn_table = os.path.join(plot_path, 'metrics_%s_%s_%s_%s.csv' % (name_ref.upper(), name_sim_prefix.upper(), year_start, year_end))
+    table = pd.concat([evl.metrics.read_metrics_table(fn) for fn in fn_tables], ignore_index=True)
+    if evl.metrics.write_metrics_table(table, fn_table):
+        print('Metrics table: %s (%s rows)' % (fn_table, len(table)))
+    else:
+        print('Metrics table unchanged: %s (%s rows)' % (fn_table, len(table)))
+
+    # summary plots: portrait plots of each metric (from the combined table, they depend on all tables) and Taylor
+    # diagrams of each variable and statistic (from its own table), for each region
+    fn_tables_var = dict([((task['var'], task['statistic']), task['fn_plot']) for task in tasks])
+    tasks = []
+    for region_code, region_str in region_strs.items():
+        for metric in evl.metrics.metric_columns:
+            fn_plot = os.path.join(plot_path, region_code, 'portrait_%s_%s_%s_%s_%s_%s.png' % (name_ref.upper(), name_sim_prefix.upper(),
+                                                                                            metric, year_start, year_end, region_code))
+            tasks.append(dict(fn_plot=fn_plot, fn_table=fn_table, plot_type='portrait', region_str=region_str,
+                              metric=metric, input_files=fn_tables))
+        for var in vars:
+            for statistic in statistics[var]:
+                fn_table_var = fn_tables_var[(var, statistic)]
+                if fn_table_var not in fn_tables:
+                    continue
+                fn_plot = os.path.join(plot_path, region_code, 'taylor_%s_%s_%s_%s_%s_%s_%s.png' % (name_ref.upper(), name_sim_prefix.upper(),
+                                                                                                 sim_vars[var], statistic, year_start,
+                                                                                                 year_end, region_code))
+                tasks.append(dict(fn_plot=fn_plot, fn_table=fn_table_var, plot_type='taylor', region_str=region_str,
+                                  var=var, statistic=statistic, input_files=[fn_table_var]))
+
+    # one group per figure (the tables are small), so that the figures are spread over the workers
+    groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, shared_reads=False, n_workers=n_workers)
+    evl.parallel.run_plot_task_groups(create_summary_plot, groups, n_workers=n_workers)
@@ -0,0 +1,215 @@
+import os
+import sys
+import glob
+import traceback
+import collections
+import numpy as np
+import xarray as xr
+# turn off all warnings
+import warnings; warnings.simplefilter('ignore')
+
+
+### Functions
+import evaluation as evl
+
+### Parameters
+parameters = evl.config.load_config()
+
+
+# prepare settings
+skip_existing = parameters['skip_existing']
+path_daily_ref = parameters['path_daily_ref']
+path_daily_sim = parameters['path_daily_sim']
+plot_path = os.path.join(parameters['plot_path'], '12_spectral_maps')
+year_start = parameters['evaluation_year_start']
+year_end = parameters['evaluation_year_end']
+name_sim_prefix = parameters['name_sim_prefix']
+name_ref = parameters['name_ref']
+gcms = parameters['gcms']
+vars = parameters['vars']
+units = parameters['units']
+ref_vars = parameters['ref_vars']
+ref_vars_in_nc = parameters['ref_vars_in_nc']
+sim_vars = parameters['sim_vars']
+sim_vars_in_nc = parameters['sim_vars_in_nc']
+
+# frequency bands (shortest and longest period in days, null: no limit), see evaluation.spectral.bands
+spectral_bands = collections.OrderedDict(parameters.get('spectral_bands', evl.spectral.bands))
+# periodogram (full frequency resolution), or multitaper / welch (less noisy, but the segments of welch are too
+# short for the interannual band)
+spectral_bands_method = parameters.get('spectral_bands_method', 'periodogram')
+# memory (bytes) of the band power of one dataset (all workers), below the memory of the PBS job (16 GB, see
+# evaluation_00_create_and_submit_evaluation_jobs.sh): the more memory, the fewer passes over the daily data
+spectral_max_memory = int(parameters.get('spectral_max_memory', 2**32))
+
+# read in mask
+mask = parameters['mask_file']
+
+# region mask
+region_file = parameters['region_file']
+region_var = parameters['region_var']
+region_meta_data = parameters['region_meta_data']
+region_meta_data_id_column = parameters['region_meta_data_id_column']
+region_meta_data_label_column = parameters['region_meta_data_label_column']
+region_ids = parameters['region_codes_to_use']
+
+# map settings
+map_backend = parameters.get('map_backend', 'basemap')
+map_render_mode = parameters.get('map_render_mode', 'mesh')
+
+band_power_path = os.path.join(plot_path, 'band_power')
+
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
+
+
+#### Variance in frequency bands
+
+def get_band_power_file_name(name, var):
+    """
+    Returns the file name of the variance in the frequency bands of one dataset and variable.
+    """
+    return os.path.join(band_power_path, 'band_power_%s_%s_%s_%s.nc' % (name.upper(), var, year_start, year_end))
+
+
+def create_band_power(fn_plot, gcm, var, mask):
+    """
+    Reads in the daily data of one dataset (the reference data if gcm is None) and variable as passes of latitudes
+    with all years, and writes the variance of each land cell in the frequency bands. The tiles of grid cells of
+    each pass are processed in a pool of n_workers processes.
+    """
+
+    print('Calculating band power: %s' % fn_plot)
+
+    daily_files = evl.read_in.get_daily_files(path_daily_ref, path_daily_sim, [] if gcm is None else [gcm], ref_vars[var],
+                                              sim_vars[var], year_start, year_end)
+    if gcm is None:
+        files, var_in_nc, unit_conversion = daily_files['ref'], ref_vars_in_nc[var], (1., 0.)
+    else:
+        files, var_in_nc, unit_conversion = daily_files[gcm], sim_vars_in_nc[var], evl.read_in.get_daily_unit_conversion(var)
+
+    band_power = evl.spectral.get_band_power_fields(files, var_in_nc, year_start, year_end, bands=spectral_bands,
+                                                    mask=mask, unit_conversion=unit_conversion,
+                                                    method=spectral_bands_method, max_memory=spectral_max_memory,
+                                                    n_workers=n_workers)
+
+    evl.helpers.create_containing_folder(fn_plot)
+    band_power.to_netcdf(fn_plot)
+
+
+#### Plotting
+
+def create_plot(fn_plot, gcm, var, mask, coordinates, region_str, fn_band_power_ref, fn_band_power_sim):
+    """
+    Reads in the variance in the frequency bands and creates the spectral bias map for one region, GCM and variable.
+    """
+
+    name_sim = '%s_%s' % (name_sim_prefix, gcm)
+
+    print('Preparing plot: %s' % fn_plot)
+
+    band_power = dict()
+    for name, fn in [(name_ref, fn_band_power_ref), (name_sim, fn_band_power_sim)]:
+        band_power[name] = evl.helpers.apply_mask(evl.read_in.open_dataset(fn), mask)
+
+    evl.plotting.plot_band_power_ratio(band_power=band_power, name_ref=name_ref, name_sim=name_sim,
+                                       fn_plot=fn_plot, var=var, unit=units[var],
+                                       year_start=year_start, year_end=year_end,
+                                       coordinates=coordinates, region=region_str, map_backend=map_backend,
+                                       map_render_mode=map_render_mode)
+
+
+if __name__ == '__main__':
+
+    # Reading and preparing data
+
+    # read in the region mask and the AWRA mask
+
+    regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data,
+                                                 region_meta_data_id_column, region_meta_data_label_column)
+
+    if mask is not None and type(mask) == str:
+        mask = xr.open_dataset(mask)
+        mask = evl.helpers.standardise_dimension_names(mask)
+        mask = mask['mask'] == 1
+
+    # prepare the band power: one calculation per dataset (reference data and each GCM) and variable
+    band_power_tasks = []
+    for gcm in [None] + list(gcms):
+        for var in vars:
+            daily_files = evl.read_in.get_daily_files(path_daily_ref, path_daily_sim, [] if gcm is None else [gcm],
+                                                      ref_vars[var], sim_vars[var], year_start, year_end)
+            if gcm is None:
+                input_files = [fn for files_year in daily_files['ref'] for fn in files_year]
+            else:
+                input_files = sorted(glob.glob(daily_files[gcm]))
+            name = name_ref if gcm is None else '%s_%s' % (name_sim_prefix, gcm)
+            band_power_tasks.append(dict(fn_plot=get_band_power_file_name(name, var), gcm=gcm, var=var, mask=mask,
+                                         input_files=input_files))
+
+    # prepare the list of plots
+    tasks = []
+
+    for region_id in region_ids:
+
+        if region_id == 'AU':
+            region_str = 'Australia'
+            region_code = 'AU'
+            mask_temp = mask
+        else:
+            region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
+            region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
+            # extract the new mask: for each region
+            mask_temp = (mask & (regions == region_id))
+
+        # prepare the geographic extent
+        mask_df = mask_temp.where(mask_temp==1).to_dataframe(name='mask').dropna().reset_index()
+        coordinates=dict(llcrnrlat=np.min(mask_df['lat'])-0.2,
+                         urcrnrlat=np.max(mask_df['lat'])+0.2,
+                         llcrnrlon=np.min(mask_df['lon'])-0.2,
+                         urcrnrlon=np.max(mask_df['lon'])+0.2)
+
+        print('- %s' % region_str)
+
+        for gcm in gcms:
+
+            name_sim = '%s_%s' % (name_sim_prefix, gcm)
+
+            for var in vars:
+                var_sim = sim_vars[var]
+
+                fn_plot = os.path.join(plot_path, region_code, 'spectral_bias_%s_%s_%s_%s_%s_%s.png' % (name_ref.upper(), name_sim.upper(), var_sim,
+                                                                                                     year_start, year_end, region_code))
+
+                fn_band_power_ref = get_band_power_file_name(name_ref, var)
+                fn_band_power_sim = get_band_power_file_name(name_sim, var)
+                tasks.append(dict(fn_plot=fn_plot, gcm=gcm, var=var, mask=mask_temp, coordinates=coordinates,
+                                  region_str=region_str, fn_band_power_ref=fn_band_power_ref,
+                                  fn_band_power_sim=fn_band_power_sim,
+                                  input_files=[fn_band_power_ref, fn_band_power_sim]))
+
+    # plan the band power: skip outputs that are up-to-date
+    band_power_groups = evl.planner.plan_tasks(band_power_tasks, skip_existing=skip_existing)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(band_power_groups)
+        evl.planner.print_plan(evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers,
+                                                      pending_files=evl.planner.get_planned_files(band_power_groups)))
+        sys.exit(0)
+
+    # calculate the band power: one dataset after the other, the tiles of latitudes of each dataset are processed in
+    # parallel (plots of datasets without band power fail and are listed in the summary)
+    for task in [task for group in band_power_groups for task in group]:
+        try:
+            create_band_power(**dict([(x, task[x]) for x in task if x != 'input_files']))
+        except Exception:
+            print('Calculating the band power failed: %s' % task['fn_plot'])
+            traceback.print_exc()
+
+    # plan the plots after the band power (the band power files are input files of the plots): skip plots that are
+    # up-to-date and group plots that read in the same files
+    groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers)
+
+    # create the plots
+    evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
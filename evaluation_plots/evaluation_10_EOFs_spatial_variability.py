@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import numpy as np
+import xarray as xr
+# turn off all warnings
+import warnings; warnings.simplefilter('ignore')
+
+
+### Functions
+import evaluation as evl
+
+### Parameters
+parameters = evl.config.load_config()
+
+
+# prepare settings
+skip_existing = parameters['skip_existing']
+data_path_ref = parameters['data_path_processed_ref']
+data_path_sim = parameters['data_path_processed_sim']
+plot_path = os.path.join(parameters['plot_path'], '13_EOFs_spatial_variability')
+year_start = parameters['evaluation_year_start']
+year_end = parameters['evaluation_year_end']
+name_sim_prefix = parameters['name_sim_prefix']
+name_ref = parameters['name_ref']
+gcms = parameters['gcms']
+vars = parameters['vars']
+units = parameters['units']
+ref_vars = parameters['ref_vars']
+ref_vars_in_nc = parameters['ref_vars_in_nc']
+sim_vars = parameters['sim_vars']
+sim_vars_in_nc = parameters['sim_vars_in_nc']
+
+# EOFs (modes of spatial variability) of the anomalies of the time series of these statistics and time scales
+statistics = parameters.get('eof_statistics', parameters['metrics_statistics'])
+time_scales = parameters.get('eof_time_scales', ['annual', 'monthly'])
+n_modes = parameters.get('eof_modes', 10)
+n_plot_modes = parameters.get('eof_plot_modes', 4)
+
+# read in mask
+mask = parameters['mask_file']
+
+# map settings
+map_backend = parameters.get('map_backend', 'basemap')
+map_render_mode = parameters.get('map_render_mode', 'mesh')
+
+eof_path = os.path.join(plot_path, 'eofs')
+
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
+
+
+#### EOFs
+
+def get_eof_file_name(var, statistic):
+    """
+    Returns the file name of the EOFs of the reference data and all GCMs of one variable and statistic.
+    """
+    return os.path.join(eof_path, 'eofs_%s_%s_%s_%s_%s_%s.nc' % (name_ref.upper(), name_sim_prefix.upper(), sim_vars[var],
+                                                               statistic, year_start, year_end))
+
+
+def create_eofs(fn_plot, var, statistic):
+    """
+    Reads in the time series of the reference data and each GCM (one after the other) and writes the leading EOFs
+    of each time scale of one variable and statistic.
+    """
+
+    print('Calculating EOFs: %s' % fn_plot)
+
+    eofs = evl.eofs.get_eof_fields(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref, statistic,
+                                   year_start, year_end, mask=mask, var_ref=ref_vars[var], var_sim=sim_vars[var],
+                                   var_ref_in_nc=ref_vars_in_nc[var], var_sim_in_nc=sim_vars_in_nc[var],
+                                   time_scales=time_scales, n_modes=n_modes)
+
+    evl.helpers.create_containing_folder(fn_plot)
+    eofs.to_netcdf(fn_plot)
+
+
+#### Plotting
+
+def create_plot(fn_plot, plot_type, var, statistic, time_scale, fn_eofs, gcm=None, coordinates=None):
+    """
+    Reads in the EOFs and creates the maps of the modes of one GCM (plot_type modes) or the variance spectra of all
+    GCMs (plot_type spectra) for one variable, statistic and time scale.
+    """
+
+    print('Preparing plot: %s' % fn_plot)
+
+    eofs = evl.read_in.open_dataset(fn_eofs)
+
+    if plot_type == 'modes':
+        evl.plotting.plot_eof_modes(eofs, name_ref=name_ref, name_sim='%s_%s' % (name_sim_prefix, gcm), var=var,
+                                    statistic=statistic, time_scale=time_scale, year_start=year_start,
+                                    year_end=year_end, unit=units[var], n_modes=n_plot_modes,
+                                    region='Australia', coordinates=coordinates, fn_plot=fn_plot,
+                                    map_backend=map_backend, map_render_mode=map_render_mode)
+    else:
+        fig = evl.plotting.plot_eof_variance_spectra(eofs, name_ref=name_ref, var=var, statistic=statistic,
+                                                     time_scale=time_scale, year_start=year_start, year_end=year_end,
+                                                     region='Australia', fn_plot=fn_plot)
+
+
+if __name__ == '__main__':
+
+    # Reading and preparing data
+
+    # read in the AWRA mask (the EOFs are calculated for all land cells in the mask, i.e. for Australia)
+
+    if mask is not None and type(mask) == str:
+        mask = xr.open_dataset(mask)
+        mask = evl.helpers.standardise_dimension_names(mask)
+        mask = mask['mask'] == 1
+
+    # prepare the geographic extent
+    mask_df = mask.where(mask==1).to_dataframe(name='mask').dropna().reset_index()
+    coordinates=dict(llcrnrlat=np.min(mask_df['lat'])-0.2,
+                     urcrnrlat=np.max(mask_df['lat'])+0.2,
+                     llcrnrlon=np.min(mask_df['lon'])-0.2,
+                     urcrnrlon=np.max(mask_df['lon'])+0.2)
+
+    # prepare the EOFs: one calculation per variable and statistic (reference data and all GCMs)
+    eof_tasks = []
+    tasks = []
+    for var in vars:
+        for statistic in statistics.get(var, []):
+
+            fn_eofs = get_eof_file_name(var, statistic)
+            input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, gcms, var, name_sim_prefix, name_ref,
+                                                         [statistic], year_start, year_end, time_scales=time_scales,
+                                                         suffix='merged', var_ref=ref_vars[var], var_sim=sim_vars[var])
+            eof_tasks.append(dict(fn_plot=fn_eofs, var=var, statistic=statistic, input_files=input_files))
+
+            # plots: the maps of the modes of each GCM and the variance spectra of all GCMs, for each time scale
+            for time_scale in time_scales:
+                fn_plot = os.path.join(plot_path, 'AU', 'eof_spectra_%s_%s_%s_%s_%s_%s_%s_AU.png' % (name_ref.upper(), name_sim_prefix.upper(),
+                                                                                                   sim_vars[var], statistic, time_scale,
+                                                                                                   year_start, year_end))
+                tasks.append(dict(fn_plot=fn_plot, plot_type='spectra', var=var, statistic=statistic,
+                                  time_scale=time_scale, fn_eofs=fn_eofs, input_files=[fn_eofs]))
+
+                for gcm in gcms:
+                    name_sim = '%s_%s' % (name_sim_prefix, gcm)
+                    fn_plot = os.path.join(plot_path, 'AU', 'eof_modes_%s_%s_%s_%s_%s_%s_%s_AU.png' % (name_ref.upper(), name_sim.upper(),
+                                                                                                     sim_vars[var], statistic, time_scale,
+                                                                                                     year_start, year_end))
+                    tasks.append(dict(fn_plot=fn_plot, plot_type='modes', var=var, statistic=statistic,
+                                      time_scale=time_scale, fn_eofs=fn_eofs, gcm=gcm, coordinates=coordinates,
+                                      input_files=[fn_eofs]))
+
+    # plan the EOFs: skip outputs that are up-to-date
+    eof_groups = evl.planner.plan_tasks(eof_tasks, skip_existing=skip_existing, n_workers=n_workers)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(eof_groups)
+        evl.planner.print_plan(evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers,
+                                                      pending_files=evl.planner.get_planned_files(eof_groups)))
+        sys.exit(0)
+
+    # calculate the EOFs (each worker reads in the time series of one dataset at a time)
+    evl.parallel.run_plot_task_groups(create_eofs, eof_groups, n_workers=n_workers)
+
+    # plan the plots after the EOFs (the EOF files are input files of the plots): skip plots that are up-to-date and
+    # group plots that read in the same files
+    groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers)
+
+    # create the plots
+    evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
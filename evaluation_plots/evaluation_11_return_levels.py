@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import traceback
+import numpy as np
+import xarray as xr
+# turn off all warnings
+import warnings; warnings.simplefilter('ignore')
+
+
+### Functions
+import evaluation as evl
+
+### Parameters
+parameters = evl.config.load_config()
+
+
+# prepare settings
+skip_existing = parameters['skip_existing']
+data_path_ref = parameters['data_path_processed_ref']
+data_path_sim = parameters['data_path_processed_sim']
+plot_path = os.path.join(parameters['plot_path'], '14_return_levels')
+year_start = parameters['evaluation_year_start']
+year_end = parameters['evaluation_year_end']
+name_sim_prefix = parameters['name_sim_prefix']
+name_ref = parameters['name_ref']
+gcms = parameters['gcms']
+vars = parameters['vars']
+units = parameters['units']
+ref_vars = parameters['ref_vars']
+ref_vars_in_nc = parameters['ref_vars_in_nc']
+sim_vars = parameters['sim_vars']
+sim_vars_in_nc = parameters['sim_vars_in_nc']
+
+# statistics of the annual maxima (annual time series, e.g. max or rx1day) to which the GEV distributions are fitted
+statistics = parameters.get('gev_statistics', {'rain_day': ['max'], 'temp_max_day': ['max']})
+return_periods = parameters.get('gev_return_periods', evl.extremes.return_periods)
+# lmoments (fast) or mle (maximum likelihood, refined from the L-moment estimates)
+gev_method = parameters.get('gev_method', 'lmoments')
+
+# read in mask
+mask = parameters['mask_file']
+
+# region mask
+region_file = parameters['region_file']
+region_var = parameters['region_var']
+region_meta_data = parameters['region_meta_data']
+region_meta_data_id_column = parameters['region_meta_data_id_column']
+region_meta_data_label_column = parameters['region_meta_data_label_column']
+region_ids = parameters['region_codes_to_use']
+
+# map settings
+map_backend = parameters.get('map_backend', 'basemap')
+map_render_mode = parameters.get('map_render_mode', 'mesh')
+
+gev_path = os.path.join(plot_path, 'gev')
+
+n_workers = evl.parallel.get_number_of_workers(parameters)
+evl.instrumentation.configure(parameters)
+evl.output_writer.configure(parameters)
+
+
+#### GEV distributions and return levels
+
+def get_gev_file_name(name, var, statistic):
+    """
+    Returns the file name of the GEV distributions and return levels of one dataset, variable and statistic.
+    """
+    return os.path.join(gev_path, 'gev_%s_%s_%s_%s_%s.nc' % (name.upper(), var, statistic, year_start, year_end))
+
+
+def create_gev(fn_plot, gcm, var, statistic, mask):
+    """
+    Fits the GEV distributions to the annual maxima of one dataset (the reference data if gcm is None), variable
+    and statistic in each grid cell (all regions) and writes them with the return levels. For the GCMs, the bias of
+    the return levels (against the reference data, which is fitted first) is written as well. The grid cells are
+    processed in tiles in a pool of n_workers processes.
+    """
+
+    print('Fitting GEV distributions: %s' % fn_plot)
+
+    if gcm is None:
+        data_path, name, var_file, var_in_nc = data_path_ref, name_ref, ref_vars[var], ref_vars_in_nc[var]
+    else:
+        data_path, name, var_file, var_in_nc = data_path_sim, '%s_%s' % (name_sim_prefix, gcm), sim_vars[var], sim_vars_in_nc[var]
+
+    gev = evl.extremes.get_gev_fields(data_path, name, var, statistic, year_start, year_end, gcm=gcm, mask=mask,
+                                      var_in_nc=var_in_nc, var_file=var_file, return_periods=return_periods,
+                                      method=gev_method, n_workers=n_workers)
+
+    if gcm is not None:
+        gev_ref = evl.read_in.open_dataset(get_gev_file_name(name_ref, var, statistic))
+        bias = evl.extremes.get_return_level_bias(gev, gev_ref)
+        for x in bias.data_vars:
+            gev[x] = bias[x]
+
+    evl.helpers.create_containing_folder(fn_plot)
+    gev.to_netcdf(fn_plot)
+
+
+#### Plotting
+
+def create_plot(fn_plot, gcm, var, statistic, mask, coordinates, region_str, fn_gev_ref, fn_gev_sim):
+    """
+    Reads in the return levels and creates the map of the return levels and their bias for one region, GCM,
+    variable and statistic.
+    """
+
+    name_sim = '%s_%s' % (name_sim_prefix, gcm)
+
+    print('Preparing plot: %s' % fn_plot)
+
+    gevs = dict()
+    for name, fn in [(name_ref, fn_gev_ref), (name_sim, fn_gev_sim)]:
+        gevs[name] = evl.helpers.apply_mask(evl.read_in.open_dataset(fn), mask)
+
+    evl.plotting.plot_return_levels(gevs=gevs, name_ref=name_ref, name_sim=name_sim,
+                                    fn_plot=fn_plot, var=var, unit=units[var], statistic=statistic,
+                                    year_start=year_start, year_end=year_end,
+                                    coordinates=coordinates, region=region_str, map_backend=map_backend,
+                                    map_render_mode=map_render_mode)
+
+
+if __name__ == '__main__':
+
+    # Reading and preparing data
+
+    # read in the region mask and the AWRA mask
+
+    regions, region_codes = evl.read_in.read_region_mask(region_file, region_var, region_meta_data,
+                                                 region_meta_data_id_column, region_meta_data_label_column)
+
+    if mask is not None and type(mask) == str:
+        mask = xr.open_dataset(mask)
+        mask = evl.helpers.standardise_dimension_names(mask)
+        mask = mask['mask'] == 1
+
+    # prepare the GEV distributions: one fit per dataset (the reference data first, then each GCM), variable and
+    # statistic
+    gev_tasks = []
+    for gcm in [None] + list(gcms):
+        for var in vars:
+            for statistic in statistics.get(var, []):
+                input_files = evl.read_in.get_input_files(data_path_ref, data_path_sim, [] if gcm is None else [gcm], var,
+                                                          name_sim_prefix, name_ref if gcm is None else None, [statistic],
+                                                          year_start, year_end, time_scales=['annual'], suffix='merged',
+                                                          var_ref=ref_vars[var], var_sim=sim_vars[var])
+                if gcm is None:
+                    name = name_ref
+                else:
+                    # the bias is calculated against the fit of the reference data
+                    name = '%s_%s' % (name_sim_prefix, gcm)
+                    input_files.append(get_gev_file_name(name_ref, var, statistic))
+                gev_tasks.append(dict(fn_plot=get_gev_file_name(name, var, statistic), gcm=gcm, var=var,
+                                      statistic=statistic, mask=mask, input_files=input_files))
+
+    # prepare the list of plots
+    tasks = []
+
+    for region_id in region_ids:
+
+        if region_id == 'AU':
+            region_str = 'Australia'
+            region_code = 'AU'
+            mask_temp = mask
+        else:
+            region_str = region_codes.loc[region_codes['region_id'] == region_id, 'label'].values[0]
+            region_code = region_codes.loc[region_codes['region_id'] == region_id, 'code'].values[0]
+            # extract the new mask: for each region
+            mask_temp = (mask & (regions == region_id))
+
+        # prepare the geographic extent
+        mask_df = mask_temp.where(mask_temp==1).to_dataframe(name='mask').dropna().reset_index()
+        coordinates=dict(llcrnrlat=np.min(mask_df['lat'])-0.2,
+                         urcrnrlat=np.max(mask_df['lat'])+0.2,
+                         llcrnrlon=np.min(mask_df['lon'])-0.2,
+                         urcrnrlon=np.max(mask_df['lon'])+0.2)
+
+        print('- %s' % region_str)
+
+        for gcm in gcms:
+
+            name_sim = '%s_%s' % (name_sim_prefix, gcm)
+
+            for var in vars:
+                var_sim = sim_vars[var]
+
+                for statistic in statistics.get(var, []):
+
+                    fn_plot = os.path.join(plot_path, region_code, 'return_levels_%s_%s_%s_%s_%s_%s_%s.png' % (name_ref.upper(), name_sim.upper(), var_sim,
+                                                                                                            statistic, year_start, year_end, region_code))
+
+                    fn_gev_ref = get_gev_file_name(name_ref, var, statistic)
+                    fn_gev_sim = get_gev_file_name(name_sim, var, statistic)
+                    tasks.append(dict(fn_plot=fn_plot, gcm=gcm, var=var, statistic=statistic,
+                                      mask=mask_temp, coordinates=coordinates, region_str=region_str,
+                                      fn_gev_ref=fn_gev_ref, fn_gev_sim=fn_gev_sim,
+                                      input_files=[fn_gev_ref, fn_gev_sim]))
+
+    # plan the GEV fits: skip outputs that are up-to-date
+    gev_groups = evl.planner.plan_tasks(gev_tasks, skip_existing=skip_existing)
+
+    if evl.planner.is_dry_run():
+        evl.planner.print_plan(gev_groups)
+        evl.planner.print_plan(evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers,
+                                                      pending_files=evl.planner.get_planned_files(gev_groups)))
+        sys.exit(0)
+
+    # fit the GEV distributions: one dataset after the other (the reference data first, as the bias of the GCMs is
+    # calculated against it), the tiles of grid cells of each dataset are processed in parallel (plots of datasets
+    # without a fit fail and are listed in the summary)
+    gev_tasks = sorted([task for group in gev_groups for task in group], key=lambda x: x['gcm'] is not None)
+    for task in gev_tasks:
+        try:
+            create_gev(**dict([(x, task[x]) for x in task if x != 'input_files']))
+        except Exception:
+            print('Fitting the GEV distributions failed: %s' % task['fn_plot'])
+            traceback.print_exc()
+
+    # plan the plots after the GEV fits (the GEV files are input files of the plots): skip plots that are up-to-date
+    # and group plots that read in the same files
+    groups = evl.planner.plan_tasks(tasks, skip_existing=skip_existing, n_workers=n_workers)
+
+    # create the plots
+    evl.parallel.run_plot_task_groups(create_plot, groups, n_workers=n_workers)
@@ -0,0 +1,43 @@
+# Configuration of the tests of the evaluation library.
+
+# The tests are run from the folder evaluation_plots (python -m pytest) and import the library as the
+# evaluation scripts do (import evaluation as evl).
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the plots are created without a display
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+
+@pytest.fixture
+def bias_datasets():
+    """
+    Annual and seasonal means of a reference dataset, a GCM and their bias on a coarse regular grid over
+    Australia (as read in by evaluation.read_in.read_in_xarray_data for plotting.plot_bias).
+    """
+    rng = np.random.RandomState(42)
+    lat = np.arange(-44., -10., 1.)
+    lon = np.arange(112., 156., 1.)
+    seasons = ['DJF', 'MAM', 'JJA', 'SON']
+    mean = 2. + np.cos(np.deg2rad(lat))[:, None] * np.ones(len(lon))
+
+    datasets = dict(annual=dict(), seasonal=dict())
+    for name, offset in [('AWAP', 0.), ('GCM1', 0.3)]:
+        annual = mean + offset + 0.2 * rng.randn(len(lat), len(lon))
+        seasonal = mean + offset + 0.2 * rng.randn(len(seasons), len(lat), len(lon))
+        datasets['annual'][name] = xr.Dataset(dict(rain_day=(('time', 'lat', 'lon'), annual[None])),
+                                              coords=dict(time=pd.to_datetime(['2000-01-01']), lat=lat, lon=lon))
+        datasets['seasonal'][name] = xr.Dataset(dict(rain_day=(('season', 'lat', 'lon'), seasonal)),
+                                                coords=dict(season=seasons, lat=lat, lon=lon))
+    for time_scale in ['annual', 'seasonal']:
+        datasets[time_scale]['bias_abs'] = datasets[time_scale]['GCM1'] - datasets[time_scale]['AWAP']
+    return datasets
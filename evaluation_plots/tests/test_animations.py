@@ -0,0 +1,68 @@
+# Tests of the animations (evaluation.animations). ffmpeg is replaced by a Python process that reads the frames.
+
+import os
+import sys
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import evaluation as evl
+
+
+def use_encoder(monkeypatch, exit_code):
+    """
+    Replaces ffmpeg by a process that reads all frames from stdin, writes the number of bytes to the animation file
+    and exits with exit_code.
+    """
+    def get_encoder_command(fn_anim, width, height, fps):
+        code = ('import sys; n = len(sys.stdin.buffer.read()); open(%r, "w").write(str(n)); sys.exit(%d)'
+                % (fn_anim, exit_code))
+        return [sys.executable, '-c', code]
+    monkeypatch.setattr(evl.animations, 'get_encoder_command', get_encoder_command)
+
+
+def use_frames(monkeypatch, n_chunks, error=None):
+    """
+    Replaces the rendering of the frames by chunks of two black frames, followed by an error (if given).
+    """
+    def iterate_chunks(chunk_kwargs, n_workers=1):
+        for i in range(n_chunks):
+            yield [np.zeros((4, 6, 3), dtype='uint8')] * 2
+        if error is not None:
+            raise error
+    monkeypatch.setattr(evl.animations, 'iterate_chunks', iterate_chunks)
+
+
+def write_animation(fn_anim):
+    da = xr.DataArray(np.zeros((6, 2, 2)), dims=('time', 'lat', 'lon'))
+    return evl.animations.write_animation(da, fn_anim, coordinates=None, titles=[''] * 6, vmin=0, vmax=1, chunk_size=2)
+
+
+def test_frames_are_streamed_to_the_encoder(monkeypatch, tmpdir):
+    fn_anim = str(tmpdir.join('animation.gif'))
+    use_encoder(monkeypatch, 0)
+    use_frames(monkeypatch, 3)
+
+    assert write_animation(fn_anim) == 6
+    with open(fn_anim) as f:
+        assert int(f.read()) == 6 * 4 * 6 * 3
+
+
+def test_error_of_a_frame_is_raised_and_the_animation_is_removed(monkeypatch, tmpdir):
+    fn_anim = str(tmpdir.join('animation.gif'))
+    # the encoder fails when its input ends early: its error must not replace the error of the frame
+    use_encoder(monkeypatch, 1)
+    use_frames(monkeypatch, 1, error=ValueError('frame failed'))
+
+    with pytest.raises(ValueError, match='frame failed'):
+        write_animation(fn_anim)
+    assert not os.path.exists(fn_anim)
+
+
+def test_error_of_the_encoder_is_raised(monkeypatch, tmpdir):
+    use_encoder(monkeypatch, 1)
+    use_frames(monkeypatch, 3)
+
+    with pytest.raises(RuntimeError, match='ffmpeg failed'):
+        write_animation(str(tmpdir.join('animation.gif')))
@@ -0,0 +1,55 @@
+# Tests of the lagged correlations and decorrelation time (evaluation.autocorrelation).
+
+import numpy as np
+import pytest
+
+import evaluation as evl
+
+
+def get_values(n_time=40, n_cells=5, seed=0):
+    rng = np.random.RandomState(seed)
+    values = np.zeros((n_time, n_cells))
+    values[0] = rng.randn(n_cells)
+    for t in range(1, n_time):
+        values[t] = np.linspace(0., 0.9, n_cells) * values[t - 1] + rng.randn(n_cells)
+    return values + 1000. # large mean
+
+
+def test_lagged_correlations_match_numpy():
+    values = get_values()
+
+    correlations = evl.autocorrelation.get_autocorrelation(values, max_lag=10)
+
+    for k in range(1, 11):
+        for i in range(values.shape[1]):
+            expected = np.corrcoef(values[:-k, i], values[k:, i])[0, 1]
+            assert correlations[k - 1, i] == pytest.approx(expected, abs=1e-10)
+
+
+def test_lags_without_enough_pairs_and_missing_values():
+    values = get_values(n_time=8)
+    values[3, 1] = np.nan
+
+    correlations = evl.autocorrelation.get_autocorrelation(values, max_lag=10)
+
+    assert np.isfinite(correlations[:5, [0, 2, 3, 4]]).all()
+    assert np.isnan(correlations[5:]).all() # less than 3 pairs
+    assert np.isnan(correlations[:, 1]).all()
+
+
+def test_autocorrelation_does_not_depend_on_the_tiling():
+    values = get_values(n_cells=30)
+
+    expected = evl.autocorrelation.get_autocorrelation(values, max_lag=5)
+    tiled = evl.autocorrelation.get_autocorrelation(values, max_lag=5, max_memory=8 * (4 * 128 + 4 * 40) * 4)
+
+    assert evl.autocorrelation.get_tile_size(40, 8 * (4 * 128 + 4 * 40) * 4) == 4
+    np.testing.assert_allclose(tiled, expected, rtol=1e-12)
+
+
+def test_decorrelation_time_stops_at_the_first_non_positive_lag():
+    correlations = np.array([[0.5, -0.1, np.nan], [0.25, 0.3, np.nan], [-0.1, 0.2, np.nan], [0.4, 0.4, np.nan]])
+
+    times = evl.autocorrelation.get_decorrelation_time(correlations)
+
+    np.testing.assert_allclose(times, [1 + 2 * 0.75, 1., 1.])
@@ -0,0 +1,98 @@
+# Tests of the distribution curves of the PDF and CDF plots (evaluation.distributions).
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import evaluation as evl
+
+
+def get_dataframe(n=1000):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame(dict(value=np.concatenate([rng.randn(n), 2. + 3. * rng.randn(n), rng.gamma(2., size=n)]),
+                             time_scale=np.repeat(['annual', 'annual', 'DJF'], n),
+                             statistic='mean',
+                             type=np.repeat(['AWAP', 'GCM1', 'AWAP'], n)))
+
+
+def test_ecdf_curves_are_the_quantiles():
+    df = get_dataframe()
+
+    curves = evl.distributions.get_ecdf_curves(df, 'value', facets=['time_scale', 'statistic'], hue='type', n=101)
+
+    assert len(curves) == 3 * 101
+    for (time_scale, name), curve in curves.groupby(['time_scale', 'type']):
+        values = df.loc[(df['time_scale'] == time_scale) & (df['type'] == name), 'value']
+        np.testing.assert_allclose(curve['value'].values, np.quantile(values, curve['ecdf'].values))
+
+
+def test_ecdf_curves_of_the_quantile_sketch():
+    values = np.random.RandomState(1).randn(100000)
+    probabilities = np.linspace(0, 1, 101)
+
+    quantiles = evl.distributions.get_quantiles(values, probabilities, max_values=1000, chunk_size=10000)
+
+    np.testing.assert_allclose(quantiles, np.quantile(values, probabilities), atol=0.02)
+
+
+def test_ecdf_curves_without_values():
+    df = get_dataframe()
+    df.loc[df['time_scale'] == 'DJF', 'value'] = np.nan
+
+    curves = evl.distributions.get_ecdf_curves(df, 'value', facets=['time_scale', 'statistic'], hue='type', n=11)
+    assert sorted(curves['time_scale'].unique()) == ['annual']
+    assert np.isfinite(curves['value']).all()
+
+    for data in [df.loc[df['time_scale'] == 'DJF'], df.iloc[:0]]:
+        curves = evl.distributions.get_ecdf_curves(data, 'value', facets=['time_scale', 'statistic'], hue='type')
+        assert len(curves) == 0
+        assert list(curves.columns) == ['time_scale', 'statistic', 'type', 'value', 'ecdf']
+
+    assert np.isnan(evl.distributions.get_quantiles(np.zeros(0), [0., 0.5, 1.])).all()
+
+
+def test_density_curves_match_the_kernel_density_estimate():
+    df = get_dataframe()
+
+    curves = evl.distributions.get_density_curves(df, 'value', facets=['time_scale', 'statistic'], hue='type', n=512)
+
+    for (time_scale, name), curve in curves.groupby(['time_scale', 'type']):
+        values = df.loc[(df['time_scale'] == time_scale) & (df['type'] == name), 'value'].values
+        bandwidth = evl.distributions.get_bandwidth(values)
+        grid = curve['value'].values
+        exact = np.exp(-0.5 * ((grid[:, np.newaxis] - values) / bandwidth) ** 2).sum(axis=1) / (
+            len(values) * bandwidth * np.sqrt(2 * np.pi))
+        np.testing.assert_allclose(curve['density'].values, exact, atol=0.01 * exact.max())
+
+
+def test_density_curves_without_values():
+    df = get_dataframe()
+    df.loc[df['time_scale'] == 'DJF', 'value'] = np.nan
+
+    curves = evl.distributions.get_density_curves(df, 'value', facets=['time_scale', 'statistic'], hue='type', n=11)
+    assert sorted(curves['time_scale'].unique()) == ['annual']
+
+    curves = evl.distributions.get_density_curves(df.iloc[:0], 'value', facets=['time_scale', 'statistic'], hue='type')
+    assert len(curves) == 0
+
+
+def test_bandwidth_matches_statsmodels():
+    bandwidths = pytest.importorskip('statsmodels.nonparametric.bandwidths')
+    rng = np.random.RandomState(3)
+
+    for values in [rng.randn(500), rng.standard_t(2, 200), np.concatenate([np.zeros(50), rng.randn(10)])]:
+        assert evl.distributions.get_bandwidth(values) == pytest.approx(bandwidths.bw_normal_reference(values))
+
+
+def test_density_curves_of_heavy_tails_integrate_to_one():
+    # normal values with a few outliers far away: the bandwidth is much smaller than the spacing of the points
+    rng = np.random.RandomState(4)
+    values = np.concatenate([rng.randn(10000), [-800., 500., 1000.]])
+    df = pd.DataFrame(dict(value=values, type='AWAP', time_scale='annual'))
+
+    curves = evl.distributions.get_density_curves(df, 'value', facets=['time_scale'], hue='type', n=512)
+
+    delta = np.diff(curves['value'].values)[0]
+    assert evl.distributions.get_bandwidth(values) < delta
+    assert curves['density'].sum() * delta == pytest.approx(1., abs=1e-6)
+    assert curves['density'].max() < 0.4
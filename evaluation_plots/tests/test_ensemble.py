@@ -0,0 +1,59 @@
+# Tests of the ensemble statistics (evaluation.ensemble) and the ensemble bias maps.
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import evaluation as evl
+
+time_scales = ['annual', 'DJF']
+
+
+def get_ensemble(n_gcms=5, seed=0):
+    rng = np.random.RandomState(seed)
+    lat = np.arange(-44., -10., 2.)
+    lon = np.arange(112., 156., 2.)
+    values = 2. + rng.randn(n_gcms + 1, len(time_scales), len(lat), len(lon))
+    values[1:, :, :3] = np.nan # no GCM data in the south
+    values[2, :, 3] = np.nan # one GCM without data
+    names = ['awap'] + ['gcm_%s' % (i + 1) for i in range(n_gcms)]
+    return xr.DataArray(values, dims=('source', 'time_scale', 'lat', 'lon'), name='rain_day',
+                        coords=dict(source=pd.Index(names, name='source'), time_scale=time_scales, lat=lat, lon=lon))
+
+
+def test_ensemble_statistics_match_numpy():
+    ensemble = get_ensemble()
+    ref = ensemble.values[0]
+    sims = ensemble.values[1:]
+
+    statistics = evl.ensemble.get_ensemble_statistics(ensemble, 'awap')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # grid cells without GCM data
+        mean = np.nanmean(sims, axis=0)
+        expected = dict(reference=ref, ensemble_mean=mean, ensemble_spread=np.nanstd(sims, axis=0, ddof=1),
+                        ensemble_min=np.nanmin(sims, axis=0), ensemble_max=np.nanmax(sims, axis=0),
+                        ensemble_bias=mean - ref,
+                        sign_agreement=(np.sign(sims - ref) == np.sign(mean - ref)).sum(axis=0) /
+                                       np.isfinite(sims).sum(axis=0),
+                        n_gcms=np.isfinite(sims).sum(axis=0))
+    expected['sign_agreement'][~np.isfinite(mean)] = np.nan
+
+    for name, values in expected.items():
+        np.testing.assert_allclose(statistics[name].values, values, err_msg=name)
+    assert list(statistics['sign_agreement'].dims) == ['time_scale', 'lat', 'lon']
+
+
+def test_plot_ensemble_bias(tmpdir):
+    statistics = evl.ensemble.get_ensemble_statistics(get_ensemble(), 'awap')
+    kwargs = dict(statistics=statistics, name_ref='awap', name_sim_prefix='gcm', var='rain_day', statistic='mean',
+                  year_start=1976, year_end=2005, unit='mm', time_scales=time_scales)
+
+    fig = evl.plotting.plot_ensemble_bias(**kwargs)
+
+    # 4 maps and their colour bars per time scale
+    assert len(fig.axes) == 2 * 4 * len(time_scales)
+    assert evl.plotting.plot_ensemble_bias(fn_plot=str(tmpdir.join('ensemble.png')), **kwargs) is None
+    assert tmpdir.join('ensemble.png').check()
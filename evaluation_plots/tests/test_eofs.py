@@ -0,0 +1,89 @@
+# Tests of the EOFs (evaluation.eofs).
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+import evaluation as evl
+
+
+def get_monthly_data(seed=0, n_years=10):
+    # three patterns with decreasing amplitudes, noise, a seasonal cycle and ocean cells without data
+    rng = np.random.RandomState(seed)
+    times = pd.date_range('1990-01-15', periods=12 * n_years, freq='MS') + pd.Timedelta(days=14)
+    lat = np.linspace(-40., -12., 8)
+    lon = np.linspace(115., 150., 10)
+    patterns = rng.randn(3, len(lat), len(lon))
+    amplitudes = rng.randn(len(times), 3) * np.array([5., 3., 2.])
+    values = np.einsum('tk,kij->tij', amplitudes, patterns) + 0.1 * rng.randn(len(times), len(lat), len(lon))
+    values += 10. * np.sin(2 * np.pi * times.month.values / 12.)[:, None, None]
+    values[:, 0, :3] = np.nan
+    return xr.DataArray(values, dims=('time', 'lat', 'lon'), coords=dict(time=times, lat=lat, lon=lon))
+
+
+def get_reference_svd(da):
+    values = da.values.reshape(da.shape[0], -1)
+    cells = np.where(np.isfinite(values).all(axis=0))[0]
+    df = pd.DataFrame(values[:, cells])
+    anomalies = (df - df.groupby(da['time.month'].values).transform('mean')).values
+    weights = np.sqrt(np.cos(np.deg2rad(np.repeat(da['lat'].values, da.shape[2])[cells])))
+    u, s, vt = np.linalg.svd(anomalies * weights, full_matrices=False)
+    return s, vt, cells, weights, anomalies
+
+
+def test_modes_match_numpy_svd():
+    da = get_monthly_data()
+    s, vt, cells, weights, anomalies = get_reference_svd(da)
+    n_time = da.shape[0]
+
+    modes = evl.eofs.get_modes(da, 'monthly', n_modes=4)
+
+    np.testing.assert_array_equal(modes['cells'], cells)
+    assert modes['total_variance'] == pytest.approx((s ** 2).sum() / (n_time - 1), rel=1e-5)
+    # the fourth mode is noise, found less precisely by the randomised SVD
+    np.testing.assert_allclose(modes['explained_variance'], s[:4] ** 2 / (s ** 2).sum(), rtol=1e-4, atol=1e-6)
+    for k in range(3):
+        # same pattern up to the sign, the largest loading is positive
+        vector = vt[k] * np.sign(vt[k][np.abs(vt[k]).argmax()])
+        np.testing.assert_allclose(modes['vectors'][k], vector, atol=1e-4)
+        eof = modes['eof'][k].ravel()
+        np.testing.assert_allclose(eof[cells], vector * s[k] / np.sqrt(n_time - 1) / weights, rtol=1e-3, atol=1e-3)
+        assert np.isnan(np.delete(eof, cells)).all()
+
+
+def test_randomised_svd_matches_numpy():
+    rng = np.random.RandomState(1)
+    matrix = np.dot(rng.randn(50, 6) * np.arange(6, 0, -1), rng.randn(6, 300)) + 0.01 * rng.randn(50, 300)
+
+    u, s, vt = evl.eofs.get_randomised_svd(matrix, 4)
+    u_ref, s_ref, vt_ref = np.linalg.svd(matrix, full_matrices=False)
+
+    np.testing.assert_allclose(s, s_ref[:4], rtol=1e-6)
+    np.testing.assert_allclose(np.abs((vt * vt_ref[:4]).sum(axis=1)), 1., rtol=1e-6)
+
+
+def test_comparison_with_the_reference_modes():
+    da = get_monthly_data()
+    modes_ref = evl.eofs.get_modes(da, 'monthly', n_modes=3)
+
+    # the same data: congruence 1, the variance explained by the reference modes is their explained variance
+    congruence, signs = evl.eofs.get_congruence(modes_ref, modes_ref)
+    np.testing.assert_allclose(congruence, 1., rtol=1e-6)
+    np.testing.assert_allclose(evl.eofs.get_projected_variance(modes_ref, modes_ref), modes_ref['explained_variance'],
+                               rtol=1e-4)
+
+    # patterns with opposite sign
+    modes = dict(modes_ref, vectors=-modes_ref['vectors'])
+    congruence, signs = evl.eofs.get_congruence(modes, modes_ref)
+    np.testing.assert_allclose(congruence, 1., rtol=1e-6)
+    assert (signs == -1).all()
+
+
+def test_modes_of_constant_data_are_missing():
+    da = get_monthly_data() * 0.
+
+    modes = evl.eofs.get_modes(da, 'monthly', n_modes=3)
+
+    assert modes['total_variance'] == 0
+    assert np.isnan(modes['explained_variance']).all() and np.isnan(modes['eof']).all()
@@ -0,0 +1,82 @@
+# Tests of the GEV distributions and return levels (evaluation.extremes).
+
+import numpy as np
+import pytest
+
+import evaluation as evl
+
+stats = pytest.importorskip('scipy.stats')
+
+
+# location, scale and shape (Hosking's k, the shape c of scipy.stats.genextreme)
+parameters = np.array([[30., 10., 0.], [50., 15., 0.2], [20., 5., -0.2], [40., 8., 1e-8]]).T
+
+
+def get_annual_maxima(n_years, seed=0):
+    rng = np.random.RandomState(seed)
+    return np.array([stats.genextreme.rvs(c, loc=loc, scale=scale, size=n_years, random_state=rng)
+                     for loc, scale, c in parameters.T]).T
+
+
+def test_return_levels_match_scipy():
+    levels = evl.extremes.get_return_levels(parameters, return_periods=[2, 20, 100])
+
+    for i, (loc, scale, c) in enumerate(parameters.T):
+        expected = stats.genextreme.isf(1. / np.array([2, 20, 100]), c, loc=loc, scale=scale)
+        np.testing.assert_allclose(levels[:, i], expected, rtol=1e-6)
+
+
+def test_negative_log_likelihood_matches_scipy():
+    values = get_annual_maxima(40)
+    fit = np.array([parameters[0], np.log(parameters[1]), parameters[2]]).T
+
+    nll = evl.extremes.get_gev_negative_log_likelihood(values, fit)
+
+    for i, (loc, scale, c) in enumerate(parameters.T):
+        expected = -stats.genextreme.logpdf(values[:, i], c, loc=loc, scale=scale).sum()
+        assert nll[i] == pytest.approx(expected, rel=1e-6)
+
+    # outside of the support or of the range of the shapes
+    fit[1, 0] = values[:, 1].min() - 1000. # bounded upper tail below the largest values
+    fit[2, 2] = -0.6
+    nll = evl.extremes.get_gev_negative_log_likelihood(values, fit)
+    assert np.isinf(nll[1]) and np.isinf(nll[2])
+
+
+def test_l_moment_estimates_of_a_long_record():
+    values = get_annual_maxima(20000, seed=1)
+
+    estimates = evl.extremes.get_gev(values, method='lmoments')
+
+    np.testing.assert_allclose(estimates[0], parameters[0], rtol=0.02)
+    np.testing.assert_allclose(estimates[1], parameters[1], rtol=0.03)
+    np.testing.assert_allclose(estimates[2], parameters[2], atol=0.02)
+
+
+def test_maximum_likelihood_estimates_match_scipy():
+    values = get_annual_maxima(60, seed=2)
+
+    estimates = evl.extremes.get_gev(values, method='mle')
+    fit = np.array([estimates[0], np.log(estimates[1]), estimates[2]]).T
+    nll = evl.extremes.get_gev_negative_log_likelihood(values, fit)
+
+    for i in range(values.shape[1]):
+        c, loc, scale = stats.genextreme.fit(values[:, i])
+        expected = -stats.genextreme.logpdf(values[:, i], c, loc=loc, scale=scale).sum()
+        # at least as likely as the fit of scipy, with similar return levels
+        assert nll[i] <= expected + 1e-3
+        np.testing.assert_allclose(evl.extremes.get_return_levels(estimates[:, i:i + 1])[:, 0],
+                                   stats.genextreme.isf(1. / np.array(evl.extremes.return_periods), c, loc=loc,
+                                                        scale=scale), rtol=0.05)
+
+
+def test_gev_of_missing_and_constant_values():
+    values = get_annual_maxima(30)
+    values[5, 0] = np.nan
+    values[:, 1] = 3.
+
+    for method in ['lmoments', 'mle']:
+        estimates = evl.extremes.get_gev(values, method=method)
+        assert np.isnan(estimates[:, :2]).all()
+        assert np.isfinite(estimates[:, 2:]).all()
+    assert np.isnan(evl.extremes.get_gev(values[:2])).all()
@@ -0,0 +1,38 @@
+# Tests of the import time of the evaluation package: the plotting and mapping libraries are imported on first use,
+# so that scripts and pool workers that only read and prepare data start fast.
+
+import os
+import sys
+import subprocess
+
+# maximum time to import the evaluation package in seconds (the same budget as in benchmark_evaluation.py)
+import_budget = 2.0
+
+# libraries that must not be imported by 'import evaluation' (only when plots are created)
+plotting_modules = ['matplotlib.pyplot', 'seaborn', 'plotnine', 'mpl_toolkits.basemap', 'cartopy', 'matplotlib.animation']
+
+
+def import_in_new_interpreter(statement):
+    """
+    Runs the import statement in a new interpreter and returns the import time (in seconds) and the plotting
+    libraries that were imported with it.
+    """
+    code = ('import sys, time; start = time.perf_counter(); %s; duration = time.perf_counter() - start; '
+            'print(duration); print(\',\'.join([x for x in %r if x in sys.modules]))' % (statement, plotting_modules))
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    lines = output.decode().strip().split('\n')
+    imported = [x for x in lines[1].split(',') if x != ''] if len(lines) > 1 else []
+    return float(lines[0]), imported
+
+
+def test_import_evaluation_does_not_import_plotting_libraries():
+    for statement in ['import evaluation', 'from evaluation import read_in, helpers']:
+        duration, imported = import_in_new_interpreter(statement)
+        assert imported == []
+
+
+def test_import_evaluation_is_within_budget():
+    # the fastest of three imports, so that a busy machine does not make the test fail
+    duration = min(import_in_new_interpreter('import evaluation')[0] for i in range(3))
+    assert duration < import_budget
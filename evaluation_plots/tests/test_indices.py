@@ -0,0 +1,111 @@
+# Tests of the daily extremes indices (evaluation.indices).
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+import evaluation as evl
+
+
+def get_daily_data(seed=0):
+    rng = np.random.RandomState(seed)
+    times = pd.date_range('1999-01-01', '2001-12-31', freq='D')
+    values = rng.gamma(0.4, 8., (len(times), 3, 4))
+    values[values < 1.5] = 0.
+    values[400:460, 0, 0] = 0. # long dry spell in 2000
+    values[700:740, 0, 1] = 0. # dry spell over the turn of the year 2000/2001
+    values[725:760, 0, 1] = 0.
+    values[100, 1, 2] = np.nan
+    return xr.DataArray(values, dims=('time', 'lat', 'lon'),
+                        coords=dict(time=times, lat=[-30., -29., -28.], lon=[140., 141., 142., 143.]))
+
+
+def calculate_periods(da, index_names, time_scales, thresholds=None, max_memory=2**28):
+    # the indices of one year after the other, as in calculate_indices: (index, time scale) -> data frame of the
+    # completed periods (time step x grid cells)
+    states, open_periods, periods = dict(), dict(), dict()
+    for year, da_year in da.groupby('time.year'):
+        completed = evl.indices.calculate_year(da_year, index_names, time_scales, states, thresholds or dict(),
+                                               open_periods, max_memory=max_memory)
+        for key, done in completed.items():
+            periods.setdefault(key, []).extend(done)
+    for key, period in open_periods.items():
+        periods.setdefault(key, []).append(period)
+
+    lat, lon = da['lat'].values, da['lon'].values
+    results = dict()
+    for (index, time_scale), done in periods.items():
+        result = evl.indices.finalise_periods(done, index, time_scale, 1999, 2001, lat, lon, 'pr')
+        results[(index, time_scale)] = pd.DataFrame(result.values.reshape(result.shape[0], -1),
+                                                    index=result['time'].to_index())
+    return results
+
+
+def get_spell_lengths(condition):
+    lengths = np.zeros(condition.shape)
+    for t in range(len(condition)):
+        lengths[t] = np.where(condition[t], (lengths[t - 1] if t > 0 else 0) + 1, 0)
+    return lengths
+
+
+def test_annual_indices_match_pandas():
+    da = get_daily_data()
+    df = pd.DataFrame(da.values.reshape(da.shape[0], -1), index=da['time'].to_index())
+    years = df.index.year
+
+    results = calculate_periods(da, ['rx1day', 'rx5day', 'r10mm', 'cdd', 'cwd'], ['annual'])
+
+    expected = dict(
+        rx1day=df.groupby(years).max(),
+        rx5day=df.rolling(5).sum().groupby(years).max(),
+        r10mm=(df >= 10).groupby(years).sum(),
+        cdd=pd.DataFrame(get_spell_lengths((df < 1).values), index=df.index).groupby(years).max(),
+        cwd=pd.DataFrame(get_spell_lengths((df >= 1).values), index=df.index).groupby(years).max())
+    for index, values in expected.items():
+        result = results[(index, 'annual')]
+        assert list(result.index.year) == [1999, 2000, 2001]
+        np.testing.assert_allclose(result.values, values.values, rtol=1e-6, err_msg=index)
+
+    # the spell over the turn of the year counts in the year it ends
+    assert results[('cdd', 'annual')].values[2, 1] >= 60
+
+
+def test_seasonal_percent_index_with_threshold_field():
+    da = get_daily_data(1)
+    df = pd.DataFrame(da.values.reshape(da.shape[0], -1), index=da['time'].to_index())
+    threshold = np.linspace(0., 10., df.shape[1])
+
+    # small tiles: the states are carried over per tile
+    results = calculate_periods(da, ['tx90p'], ['seasonal'], thresholds=dict(tx90p=threshold),
+                                max_memory=8 * 8 * 376 * 5)
+
+    # December belongs to the DJF season of the next year
+    season_year = df.index.year + (df.index.month == 12)
+    season = (df.index.month % 12) // 3
+    above = pd.DataFrame(np.where(df.notnull(), df.values > threshold, np.nan), index=df.index)
+    expected = 100. * above.groupby([season_year, season]).mean()
+    result = results[('tx90p', 'seasonal')]
+
+    assert evl.indices.get_tile_size(366, 8 * 8 * 376 * 5) == 5
+    # the first DJF (January and February 1999 only) is included, the DJF of December 2001 belongs to 2002
+    expected = expected.loc[expected.index.get_level_values(0) <= 2001]
+    assert len(result) == len(expected) == 12
+    np.testing.assert_allclose(result.values, expected.values, rtol=1e-6)
+
+
+def test_window_sums_and_spell_lengths_with_carry():
+    values = np.array([[1., 2., np.nan, 4., 5., 6.]]).T
+    sums, carry = evl.indices.get_window_sums(values, np.array([[10.], [20.]]), 3)
+    np.testing.assert_array_equal(sums[:, 0], [31., 23., np.nan, np.nan, np.nan, 15.])
+    np.testing.assert_array_equal(carry[:, 0], [5., 6.])
+
+    condition = np.array([[True, True, False, True, True, True]]).T
+    lengths, carry = evl.indices.get_spell_lengths(condition, np.array([4]))
+    np.testing.assert_array_equal(lengths[:, 0], [5, 6, 0, 1, 2, 3])
+    assert carry[0] == 3
+
+
+def test_index_with_a_threshold_field_needs_the_field():
+    with pytest.raises(ValueError):
+        evl.indices.get_daily_index_values(np.ones((10, 2)), 'tx90p', dict())
@@ -0,0 +1,80 @@
+# Tests of the timing and memory instrumentation (evaluation.instrumentation).
+
+import json
+
+from evaluation import instrumentation
+
+
+@instrumentation.timed('aggregate')
+def aggregate(values):
+    with instrumentation.step('read', nbytes=100, label='file.nc'):
+        values = list(values)
+    return sum(values)
+
+
+def switch_on(monkeypatch, path):
+    monkeypatch.delenv('EVALUATION_INSTRUMENTATION_PATH', raising=False)
+    monkeypatch.setattr(instrumentation, '_report_path', None)
+    instrumentation.configure(dict(instrumentation_path=path))
+
+
+def test_no_records_when_switched_off(monkeypatch):
+    monkeypatch.delenv('EVALUATION_INSTRUMENTATION_PATH', raising=False)
+    instrumentation.configure(dict())
+    assert not instrumentation.is_enabled()
+
+    with instrumentation.task() as measurements:
+        assert instrumentation.step('read') is instrumentation._NO_STEP
+        assert aggregate(range(4)) == 6
+
+    assert measurements == dict()
+    assert instrumentation._records == [] and instrumentation._stack == []
+    # the decorator keeps the name of the function
+    assert aggregate.__name__ == 'aggregate'
+
+
+def test_report_of_the_steps(monkeypatch, tmp_path):
+    switch_on(monkeypatch, str(tmp_path / 'reports'))
+    try:
+        assert instrumentation.is_enabled()
+        with instrumentation.task() as measurements:
+            assert aggregate(range(4)) == 6
+            assert aggregate(range(3)) == 3
+        results = [dict(fn_plot='plot.png', status='done', duration=1., measurements=measurements)]
+        fn_report = instrumentation.write_report(results, duration=1.5, n_workers=1)
+    finally:
+        instrumentation.configure(dict())
+
+    assert [x['step'] for x in measurements['steps']] == ['read', 'aggregate', 'read', 'aggregate']
+    assert measurements['bytes_read'] == 200
+    assert measurements['peak_rss'] > 0
+
+    with open(fn_report) as fp:
+        report = json.load(fp)
+    assert report['n_tasks'] == 1 and report['n_failed'] == 0 and report['wall_time'] == 1.5
+    assert report['peak_rss'] > 0 and report['tasks'][0]['peak_rss'] > 0
+    assert sorted(report['steps']) == ['aggregate', 'read']
+    assert report['steps']['read']['count'] == 2 and report['steps']['read']['bytes_read'] == 200
+    for temp in report['steps'].values():
+        assert temp['wall_time'] >= 0 and temp['peak_rss'] > 0
+    assert report['top_offenders']['wall_time'][0]['fn_plot'] == 'plot.png'
+
+
+def test_reset_of_the_peak_memory_fails_safely(monkeypatch, tmp_path):
+    real_open = open
+
+    def unwritable_open(fn, mode='r', *args, **kwargs):
+        if fn == '/proc/self/clear_refs':
+            raise PermissionError('Permission denied: %s' % fn)
+        return real_open(fn, mode, *args, **kwargs)
+    monkeypatch.setattr('builtins.open', unwritable_open)
+
+    instrumentation._reset_peak_rss()
+
+    switch_on(monkeypatch, str(tmp_path))
+    try:
+        with instrumentation.task() as measurements:
+            aggregate(range(2))
+    finally:
+        instrumentation.configure(dict())
+    assert measurements['peak_rss'] > 0
@@ -0,0 +1,71 @@
+# Tests of the map panels of the evaluation library (evaluation.maps).
+
+import os
+
+import numpy as np
+
+import evaluation as evl
+
+coordinates = dict(llcrnrlat=-44.5, urcrnrlat=-10.7, llcrnrlon=112, urcrnrlon=156.25)
+
+
+def use_test_map_lines(monkeypatch, tmpdir):
+    """
+    Uses a cache folder in tmpdir and puts a square and a diagonal line into the cache of the map layers, so that
+    the Natural Earth shapefiles are not needed.
+    """
+    extent = evl.maps.get_extent(coordinates)
+    monkeypatch.setattr(evl.maps, 'cache_path', str(tmpdir))
+    monkeypatch.setattr(evl.maps, '_backgrounds', dict())
+    monkeypatch.setattr(evl.maps, '_map_lines', {
+        ('coastline', tuple(extent), evl.maps.map_resolution): [np.array([[120., -35.], [150., -35.], [150., -15.],
+                                                                         [120., -15.], [120., -35.]])],
+        ('states', tuple(extent), evl.maps.map_resolution): [np.array([[120., -35.], [150., -15.]])]})
+    return extent
+
+
+def draw_template(backend_lines=False):
+    template = evl.maps.MapTemplate(coordinates, 2, 2, figsize=(6., 4.8), backend='cartopy')
+    if backend_lines:
+        template.draw_background = lambda dpi=None: None
+    for ax in template.axes.flat:
+        ax.set_title('panel')
+    template.set_suptitle('title', adjust=0.9)
+    template.fig.set_dpi(evl.maps.background_dpi)
+    template.fig.canvas.draw()
+    return template, np.asarray(template.fig.canvas.buffer_rgba())[:, :, :3] / 255.
+
+
+def test_background_is_cached_in_memory_and_on_disk(monkeypatch, tmpdir):
+    extent = use_test_map_lines(monkeypatch, tmpdir)
+
+    image = evl.maps.get_background(extent, 400, 300, dpi=100)
+
+    assert image.shape == (300, 400, 4)
+    assert image[:, :, 3].max() > 0. and image[:, :, 3].min() == 0.
+    assert evl.maps.get_background(extent, 400, 300, dpi=100) is image
+    fn_cache = [x for x in os.listdir(str(tmpdir)) if x.startswith('background_')]
+    assert len(fn_cache) == 1
+
+    # read from the cache on disk
+    monkeypatch.setattr(evl.maps, '_backgrounds', dict())
+    assert np.abs(evl.maps.get_background(extent, 400, 300, dpi=100) - image).max() < 1e-2
+
+
+def test_background_replaces_the_map_lines(monkeypatch, tmpdir):
+    use_test_map_lines(monkeypatch, tmpdir)
+
+    template, pixels = draw_template()
+    template_lines, pixels_lines = draw_template(backend_lines=True)
+
+    for ax in template.axes.flat:
+        assert len(ax.collections) == 0 and len(ax.images) == 1
+    for ax in template_lines.axes.flat:
+        assert len(ax.collections) == 2 and len(ax.images) == 0
+
+    # the background is drawn at the same place as the lines (up to anti-aliasing of the lines at the pixel edges)
+    assert pixels.shape == pixels_lines.shape
+    dark = (pixels.min(axis=-1) < 0.9).mean()
+    dark_lines = (pixels_lines.min(axis=-1) < 0.9).mean()
+    assert abs(dark - dark_lines) < 0.1 * dark_lines
+    assert (np.abs(pixels - pixels_lines).max(axis=-1) > 0.1).mean() < 0.005
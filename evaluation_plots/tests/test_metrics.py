@@ -0,0 +1,115 @@
+# Tests of the skill scores of the GCMs (evaluation.metrics).
+
+import collections
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+import evaluation as evl
+
+
+def get_fields(seed=0):
+    rng = np.random.RandomState(seed)
+    ref = rng.gamma(2., 1., 500)
+    sims = np.stack([ref + 0.5 + 0.3 * rng.randn(500), 2. * rng.gamma(2., 1., 500), ref.copy()])
+    ref[:20] = np.nan
+    sims[0, 480:] = np.nan
+    return ref, sims
+
+
+def test_field_metrics_match_numpy():
+    ref, sims = get_fields()
+
+    metrics = evl.metrics.get_field_metrics(ref, sims)
+
+    for i in range(sims.shape[0]):
+        valid = np.isfinite(ref) & np.isfinite(sims[i])
+        x, y = sims[i][valid], ref[valid]
+        assert metrics['n'][i] == valid.sum()
+        assert metrics['bias'][i] == pytest.approx(np.mean(x - y))
+        assert metrics['rmse'][i] == pytest.approx(np.sqrt(np.mean((x - y) ** 2)))
+        assert metrics['correlation'][i] == pytest.approx(np.corrcoef(x, y)[0, 1])
+        assert metrics['std_ratio'][i] == pytest.approx(np.std(x) / np.std(y))
+        assert metrics['centred_rmse'][i] == pytest.approx(np.sqrt(np.mean(((x - x.mean()) - (y - y.mean())) ** 2)))
+
+    # identical fields
+    assert metrics['perkins_skill_score'][2] == pytest.approx(1.)
+    assert metrics['ks_distance'][2] == 0.
+
+
+def test_ks_distance_matches_scipy():
+    stats = pytest.importorskip('scipy.stats')
+    ref, sims = get_fields()
+    # ties between the GCM and the reference
+    sims[1, :100] = np.round(sims[1, :100])
+    ref[100:200] = np.round(ref[100:200])
+
+    metrics = evl.metrics.get_field_metrics(ref, sims)
+
+    for i in range(sims.shape[0]):
+        valid = np.isfinite(ref) & np.isfinite(sims[i])
+        expected = stats.ks_2samp(sims[i][valid], ref[valid]).statistic
+        assert metrics['ks_distance'][i] == pytest.approx(expected)
+
+
+def test_perkins_skill_score_matches_histograms():
+    ref, sims = get_fields()
+
+    metrics = evl.metrics.get_field_metrics(ref, sims, bins=20)
+
+    for i in range(sims.shape[0]):
+        valid = np.isfinite(ref) & np.isfinite(sims[i])
+        x, y = sims[i][valid], ref[valid]
+        edges = np.linspace(min(x.min(), y.min()), max(x.max(), y.max()), 21)
+        expected = np.minimum(np.histogram(x, edges)[0], np.histogram(y, edges)[0]).sum() / float(valid.sum())
+        assert metrics['perkins_skill_score'][i] == pytest.approx(expected)
+
+
+def test_field_metrics_without_common_grid_cells():
+    ref = np.full(10, np.nan)
+    sims = np.ones((2, 10))
+
+    metrics = evl.metrics.get_field_metrics(ref, sims)
+
+    assert list(metrics['n']) == [0, 0]
+    for column in evl.metrics.metric_columns:
+        assert np.isnan(metrics[column]).all()
+
+
+def test_metrics_table_of_regions_and_time_scales():
+    rng = np.random.RandomState(1)
+    values = rng.randn(3, 2, 6, 8)
+    ensemble = xr.DataArray(values, dims=('source', 'time_scale', 'lat', 'lon'),
+                            coords=dict(source=['AWAP', 'GCM1', 'GCM2'], time_scale=['annual', 'DJF'],
+                                        lat=np.arange(6.), lon=np.arange(8.)))
+    north = xr.DataArray(np.arange(6.)[:, None] * np.ones(8) >= 3, dims=('lat', 'lon'),
+                         coords=dict(lat=np.arange(6.), lon=np.arange(8.)))
+    region_masks = collections.OrderedDict([('Australia', None), ('North', north)])
+
+    table = evl.metrics.get_metrics_table(ensemble, 'AWAP', 'rain_day', 'mean', region_masks=region_masks)
+
+    assert len(table) == 2 * 2 * 2
+    row = table.loc[(table['region'] == 'North') & (table['time_scale'] == 'DJF') & (table['source'] == 'GCM2')].iloc[0]
+    assert row['n'] == 24
+    assert row['bias'] == pytest.approx(np.mean(values[2, 1, 3:] - values[0, 1, 3:]))
+
+
+def test_metrics_table_is_only_rewritten_if_changed(tmp_path):
+    table = pd.DataFrame(dict(source=['GCM1', 'GCM2'], bias=[0.1, 1. / 3.]))
+    fn_table = str(tmp_path / 'metrics.csv')
+
+    assert evl.metrics.write_metrics_table(table, fn_table)
+    pd.testing.assert_frame_equal(evl.metrics.read_metrics_table(fn_table), table)
+    os.utime(fn_table, (time.time() - 100, time.time() - 100))
+    mtime = os.path.getmtime(fn_table)
+
+    assert not evl.metrics.write_metrics_table(table.copy(), fn_table)
+    assert os.path.getmtime(fn_table) == mtime
+
+    table.loc[1, 'bias'] = 0.5
+    assert evl.metrics.write_metrics_table(table, fn_table)
+    assert os.path.getmtime(fn_table) > mtime
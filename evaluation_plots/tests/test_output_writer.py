@@ -0,0 +1,74 @@
+# Tests of the background writer for the plot files (evaluation.output_writer).
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import evaluation as evl
+
+
+def get_plots():
+    import matplotlib.pyplot as plt
+    sns = pytest.importorskip('seaborn')
+    p9 = pytest.importorskip('plotnine')
+
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame(dict(x=rng.randn(200), y=rng.randn(200), type=np.repeat(['AWAP', 'GCM1'], 100)))
+
+    def matplotlib_plot():
+        fig, ax = plt.subplots(figsize=(4, 3))
+        ax.plot(df['x'].values, df['y'].values, '.')
+        ax.set_title('matplotlib')
+        return fig
+
+    def seaborn_plot():
+        return sns.FacetGrid(df, col='type', height=2.5).map(plt.scatter, 'x', 'y')
+
+    def plotnine_plot():
+        return (p9.ggplot(df, p9.aes('x', 'y', colour='type')) + p9.geom_point() +
+                p9.theme(figure_size=(4, 3)))
+
+    return [('matplotlib', matplotlib_plot), ('seaborn', seaborn_plot), ('plotnine', plotnine_plot)]
+
+
+def read_image(fn):
+    from PIL import Image
+    return np.asarray(Image.open(fn).convert('RGBA'))
+
+
+@pytest.mark.parametrize('kind', ['matplotlib', 'seaborn', 'plotnine'])
+def test_background_writer_writes_the_same_images(tmp_path, kind):
+    import matplotlib.pyplot as plt
+    create_plot = dict(get_plots())[kind]
+
+    images = []
+    try:
+        for n_threads in [0, 2]:
+            evl.output_writer.configure(n_threads=n_threads)
+            fn_plot = str(tmp_path / ('%s_%s.png' % (kind, n_threads)))
+            evl.output_writer.save_figure(create_plot(), fn_plot, dpi=100)
+            assert evl.output_writer.flush() == []
+            images.append(read_image(fn_plot))
+            plt.close('all')
+    finally:
+        evl.output_writer.configure(n_threads=0)
+
+    assert images[0].shape == images[1].shape
+    assert (images[0] == images[1]).all()
+
+
+def test_failed_writes_are_reported(tmp_path):
+    import matplotlib.pyplot as plt
+    fn_plot = str(tmp_path / 'missing_folder' / 'plot.png')
+
+    try:
+        evl.output_writer.configure(n_threads=1)
+        fig, ax = plt.subplots(figsize=(2, 2))
+        evl.output_writer.save_figure(fig, fn_plot, dpi=50)
+        failed = evl.output_writer.flush()
+    finally:
+        evl.output_writer.configure(n_threads=0)
+        plt.close('all')
+
+    assert [x['fn_plot'] for x in failed] == [fn_plot]
+    assert evl.output_writer.flush() == []
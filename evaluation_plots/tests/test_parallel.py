@@ -0,0 +1,96 @@
+# Tests of the parallel execution of the plot tasks (evaluation.parallel).
+
+import os
+
+import numpy as np
+import pytest
+
+import evaluation as evl
+
+
+def write_pid(fn_plot, fail=False):
+    """
+    Plot function of the tests: writes the process id to the plot file, or fails.
+    """
+    if fail:
+        raise RuntimeError('plot failed: %s' % fn_plot)
+    with open(fn_plot, 'w') as fp:
+        fp.write('%s' % os.getpid())
+
+
+def save_empty_figure(fn_plot):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(2, 2))
+    evl.output_writer.save_figure(fig, fn_plot, dpi=50)
+
+
+def square(x):
+    return x ** 2
+
+
+def get_groups(tmp_path, failing=()):
+    groups = []
+    for i in range(3):
+        groups.append([dict(fn_plot=str(tmp_path / ('plot_%s_%s.txt' % (i, j))),
+                            fail=(i, j) in failing) for j in range(3)])
+    return groups
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_failing_tasks_do_not_stop_the_others(tmp_path, n_workers):
+    groups = get_groups(tmp_path, failing=[(0, 0), (1, 1)])
+
+    results = evl.parallel.run_plot_task_groups(write_pid, groups, n_workers=n_workers, verbose=False)
+
+    tasks = [task for group in groups for task in group]
+    assert [x['fn_plot'] for x in results] == [x['fn_plot'] for x in tasks]
+    assert [x['task_idx'] for x in results] == list(range(len(tasks)))
+    for task, result in zip(tasks, results):
+        assert result['status'] == ('failed' if task['fail'] else 'done')
+        assert os.path.exists(task['fn_plot']) != task['fail']
+        if task['fail']:
+            assert 'plot failed' in result['error']
+
+
+def test_single_worker_runs_in_process(tmp_path):
+    groups = get_groups(tmp_path)
+
+    results = evl.parallel.run_plot_task_groups(write_pid, groups, n_workers=1, verbose=False)
+
+    assert all([x['status'] == 'done' for x in results])
+    for group in groups:
+        for task in group:
+            with open(task['fn_plot']) as fp:
+                assert int(fp.read()) == os.getpid()
+
+
+def test_tasks_writing_the_same_file_are_refused(tmp_path):
+    groups = [[dict(fn_plot=str(tmp_path / 'plot.txt'))], [dict(fn_plot=str(tmp_path / 'plot.txt'))]]
+
+    with pytest.raises(ValueError):
+        evl.parallel.run_plot_task_groups(write_pid, groups, verbose=False)
+
+
+def test_run_group_marks_failed_background_writes(tmp_path):
+    tasks = [dict(fn_plot=str(tmp_path / 'plot.png')), dict(fn_plot=str(tmp_path / 'missing_folder' / 'plot.png'))]
+
+    try:
+        evl.output_writer.configure(n_threads=1)
+        results = evl.parallel._run_group((list(enumerate(tasks)), save_empty_figure))
+    finally:
+        evl.output_writer.configure(n_threads=0)
+
+    assert [x['status'] for x in results] == ['done', 'failed']
+    assert results[1]['error'].startswith('Writing the plot file failed:')
+    assert os.path.exists(tasks[0]['fn_plot'])
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_map_tiles_keeps_the_order_of_the_tiles(n_workers):
+    tiles = [np.arange(i, i + 5) for i in range(0, 50, 5)]
+
+    results = list(evl.parallel.map_tiles(square, tiles, n_workers=n_workers))
+
+    assert len(results) == len(tiles)
+    for tile, result in zip(tiles, results):
+        np.testing.assert_array_equal(result, tile ** 2)
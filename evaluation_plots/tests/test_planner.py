@@ -0,0 +1,116 @@
+# Tests of the planning of plot tasks (evaluation.planner).
+
+import os
+import time
+
+import evaluation as evl
+
+
+def touch(fn, mtime):
+    with open(fn, 'w') as f:
+        f.write('x')
+    os.utime(fn, (mtime, mtime))
+
+
+def test_up_to_date_plots_are_skipped(tmpdir):
+    fn_in = str(tmpdir.join('in.nc'))
+    fn_new = str(tmpdir.join('new.png'))
+    fn_old = str(tmpdir.join('old.png'))
+    now = time.time()
+    touch(fn_in, now - 100)
+    touch(fn_new, now)
+    touch(fn_old, now - 200)
+
+    tasks = [dict(fn_plot=fn_new, input_files=[fn_in]),
+             dict(fn_plot=fn_old, input_files=[fn_in]),
+             dict(fn_plot=str(tmpdir.join('missing.png')), input_files=[fn_in])]
+    groups = evl.planner.plan_tasks(tasks, skip_existing=True)
+    planned = sorted(task['fn_plot'] for group in groups for task in group)
+
+    assert planned == sorted([fn_old, str(tmpdir.join('missing.png'))])
+    assert len(evl.planner.plan_tasks(tasks, skip_existing=False)[0]) == 3
+
+
+def test_tasks_are_grouped_by_input_files():
+    tasks = [dict(fn_plot='a_%s.png' % i, input_files=['a.nc', 'b.nc']) for i in range(3)]
+    tasks += [dict(fn_plot='b_%s.png' % i, input_files=['b.nc', 'a.nc', 'a.nc']) for i in range(3)]
+    tasks += [dict(fn_plot='c_%s.png' % i, input_files=['c.nc']) for i in range(2)]
+    tasks += [dict(fn_plot='d_%s.png' % i) for i in range(2)]
+
+    groups = evl.planner.plan_tasks(tasks, skip_existing=False)
+
+    assert sorted(len(group) for group in groups) == [1, 1, 2, 6]
+    assert sum(len(group) for group in groups) == len(tasks)
+
+
+def test_tasks_without_shared_reads_are_not_grouped():
+    tasks = [dict(fn_plot='a_%s.png' % i, input_files=['a.nc']) for i in range(5)]
+
+    groups = evl.planner.plan_tasks(tasks, skip_existing=False, shared_reads=False)
+
+    assert [len(group) for group in groups] == [1] * 5
+
+
+def test_large_groups_are_split_across_workers():
+    tasks = [dict(fn_plot='a_%02d.png' % i, input_files=['a.nc']) for i in range(10)]
+    tasks += [dict(fn_plot='b.png', input_files=['b.nc'])]
+
+    groups = evl.planner.plan_tasks(tasks, skip_existing=False, n_workers=4)
+
+    # at most ceil(11 / 4) = 3 plots per group, all plots are planned once
+    assert max(len(group) for group in groups) == 3
+    assert len(groups) >= 4
+    planned = sorted(task['fn_plot'] for group in groups for task in group)
+    assert planned == sorted(task['fn_plot'] for task in tasks)
+
+
+def test_plots_are_redrawn_after_a_previous_stage(tmpdir):
+    # bias map drawn without stippling, then the significance test is switched on: the p-values are written by
+    # the previous stage of the script, after the map
+    fn_mean = str(tmpdir.join('mean.nc'))
+    fn_p_values = str(tmpdir.join('p_values.nc'))
+    fn_plot = str(tmpdir.join('bias.png'))
+    now = time.time()
+    touch(fn_mean, now - 200)
+    touch(fn_plot, now - 100)
+    tasks = [dict(fn_plot=fn_plot, input_files=[fn_mean, fn_p_values])]
+    stage = [dict(fn_plot=fn_p_values, input_files=[fn_mean])]
+
+    # dry run: the p-values are pending
+    stage_groups = evl.planner.plan_tasks(stage, skip_existing=True)
+    assert evl.planner.get_planned_files(stage_groups) == set([fn_p_values])
+    assert len(evl.planner.plan_tasks(tasks, skip_existing=True)) == 0
+    groups = evl.planner.plan_tasks(tasks, skip_existing=True, pending_files=evl.planner.get_planned_files(stage_groups))
+    assert [task['fn_plot'] for group in groups for task in group] == [fn_plot]
+
+    # planned after the stage has written the p-values
+    touch(fn_p_values, now)
+    groups = evl.planner.plan_tasks(tasks, skip_existing=True)
+    assert [task['fn_plot'] for group in groups for task in group] == [fn_plot]
+
+    # second run: nothing to do
+    touch(fn_plot, now + 10)
+    assert len(evl.planner.plan_tasks(stage, skip_existing=True)) == 0
+    assert len(evl.planner.plan_tasks(tasks, skip_existing=True)) == 0
+
+
+def test_tasks_with_several_outputs(tmpdir):
+    # the frequency and wavelength diagrams of the Fourier script are written by one task
+    fn_in = str(tmpdir.join('in.nc'))
+    fn_frequencies = str(tmpdir.join('frequencies.png'))
+    fn_wavelengths = str(tmpdir.join('wavelengths.png'))
+    now = time.time()
+    touch(fn_in, now - 100)
+    touch(fn_frequencies, now)
+    tasks = [dict(fn_plot=fn_frequencies, input_files=[fn_in], output_files=[fn_wavelengths])]
+
+    # missing second output
+    assert len(evl.planner.plan_tasks(tasks, skip_existing=True)) == 1
+    assert evl.planner.get_planned_files(evl.planner.plan_tasks(tasks)) == set([fn_frequencies, fn_wavelengths])
+
+    # out-of-date second output
+    touch(fn_wavelengths, now - 200)
+    assert len(evl.planner.plan_tasks(tasks, skip_existing=True)) == 1
+
+    touch(fn_wavelengths, now)
+    assert len(evl.planner.plan_tasks(tasks, skip_existing=True)) == 0
@@ -0,0 +1,48 @@
+# Tests of the map plots of the evaluation library (evaluation.plotting and evaluation.maps).
+
+import os
+
+import evaluation as evl
+
+
+def test_plot_bias_returns_a_figure_owned_by_the_caller(bias_datasets):
+    kwargs = dict(datasets=bias_datasets, name_ref='AWAP', name_sim='GCM1', var='rain_day', statistic='mean',
+                  year_start=1976, year_end=2005, unit='mm')
+    evl.maps.clear_map_templates()
+
+    fig1 = evl.plotting.plot_bias(**kwargs)
+    fig2 = evl.plotting.plot_bias(**kwargs)
+
+    # the returned figures are new figures, not the reused map templates
+    assert fig1 is not fig2
+    assert all(template.fig not in [fig1, fig2] for template in evl.maps._templates.values())
+
+
+def test_plot_bias_saves_the_reused_template(bias_datasets, tmpdir):
+    kwargs = dict(datasets=bias_datasets, name_ref='AWAP', name_sim='GCM1', var='rain_day', statistic='mean',
+                  year_start=1976, year_end=2005, unit='mm')
+    evl.maps.clear_map_templates()
+
+    for i in range(2):
+        fn_plot = str(tmpdir.join('bias_%s.png' % i))
+        assert evl.plotting.plot_bias(fn_plot=fn_plot, **kwargs) is None
+        assert os.path.exists(fn_plot)
+
+    # both plots were drawn in the same template
+    assert len(evl.maps._templates) == 1
+
+
+def test_plot_bias_raster_matches_mesh(bias_datasets, tmpdir):
+    import matplotlib.image
+
+    kwargs = dict(datasets=bias_datasets, name_ref='AWAP', name_sim='GCM1', var='rain_day', statistic='mean',
+                  year_start=1976, year_end=2005, unit='mm')
+    images = dict()
+    for map_render_mode in ['mesh', 'raster']:
+        fn_plot = str(tmpdir.join('bias_%s.png' % map_render_mode))
+        evl.plotting.plot_bias(fn_plot=fn_plot, map_render_mode=map_render_mode, **kwargs)
+        images[map_render_mode] = matplotlib.image.imread(fn_plot)[:, :, :3]
+
+    # fraction of pixels that differ (the same limit as in benchmark_evaluation.py)
+    assert images['mesh'].shape == images['raster'].shape
+    assert (abs(images['mesh'] - images['raster']).max(axis=-1) > 0.1).mean() < 0.02
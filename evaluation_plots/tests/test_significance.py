@@ -0,0 +1,73 @@
+# Tests of the significance of the bias (evaluation.significance).
+
+import numpy as np
+import xarray as xr
+import pytest
+
+import evaluation as evl
+
+
+@pytest.mark.parametrize('test', ['bootstrap', 'permutation'])
+def test_false_positive_rate_of_null_data(test):
+    # 30 years of independent values without a mean difference: the rate of false positives is the level
+    rng = np.random.RandomState(5)
+    sim = rng.randn(30, 4000)
+    ref = rng.randn(30, 4000)
+
+    p_values = evl.significance.get_p_values(sim, ref, test=test, n_resamples=500)
+
+    for level in [0.05, 0.1]:
+        rate = (p_values < level).mean()
+        assert abs(rate - level) < 0.012, (level, rate)
+
+
+@pytest.mark.parametrize('test', ['bootstrap', 'permutation'])
+def test_large_differences_are_significant(test):
+    rng = np.random.RandomState(1)
+    sim = rng.randn(30, 200) + 1.5
+    ref = rng.randn(30, 200)
+    sim[:, 0] = 2. # constant and different
+    ref[:, 0] = 1.
+    sim[:, 1] = 1. # constant and equal
+    ref[:, 1] = 1.
+
+    p_values = evl.significance.get_p_values(sim, ref, test=test, n_resamples=200)
+
+    assert (p_values[2:] < 0.05).mean() > 0.95
+    assert p_values[0] == pytest.approx(1. / 201)
+    assert p_values[1] == 1.
+
+
+def test_p_values_do_not_depend_on_the_tiling():
+    rng = np.random.RandomState(2)
+    sim = rng.randn(20, 300) + 0.3
+    ref = rng.randn(20, 300)
+    sim[3, 10] = np.nan
+
+    p_values = evl.significance.get_p_values(sim, ref, n_resamples=200)
+    p_values_tiles = evl.significance.get_p_values(sim, ref, n_resamples=200, max_memory=8 * 1300 * 7)
+
+    assert np.isnan(p_values[10]) and np.isfinite(np.delete(p_values, 10)).all()
+    np.testing.assert_array_equal(p_values, p_values_tiles)
+
+
+def test_block_bootstrap_weights():
+    rng = np.random.RandomState(0)
+
+    weights = evl.significance.get_block_bootstrap_weights(30, 100, 3, rng)
+
+    assert weights.shape == (100, 30)
+    assert (weights.sum(axis=1) == 30).all()
+    assert evl.significance.get_default_block_length(30) == 3
+    assert evl.significance.get_variance_factor(30) == pytest.approx(28. / 30)
+    assert evl.significance.get_variance_factor(30, block_length=1) == 1.
+
+
+def test_significance_mask_with_false_discovery_rate():
+    p_values = xr.DataArray(np.array([[0.001, 0.01, 0.03], [0.04, 0.2, np.nan]]), dims=('lat', 'lon'))
+
+    # Benjamini-Hochberg with 5 p-values: thresholds 0.01, 0.02, 0.03, 0.04, 0.05
+    expected = np.array([[True, True, True], [True, False, False]])
+    np.testing.assert_array_equal(evl.significance.get_significance_mask(p_values, 0.05, fdr=True).values, expected)
+    np.testing.assert_array_equal(evl.significance.get_significance_mask(p_values, 0.02, fdr=False).values,
+                                  np.array([[True, True, False], [False, False, False]]))
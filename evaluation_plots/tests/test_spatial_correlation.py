@@ -0,0 +1,101 @@
+# Tests of the spatial correlation of the mean fields (evaluation.spatial_correlation).
+
+import collections
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import evaluation as evl
+
+time_scales = ['annual', 'DJF']
+
+
+def get_fields(n=500, seed=0):
+    rng = np.random.RandomState(seed)
+    ref = rng.gamma(2., size=(len(time_scales), n))
+    fields = collections.OrderedDict([('AWAP', ref)])
+    for i in range(2):
+        fields['GCM%s' % (i + 1)] = ref * (1 + 0.2 * i) + 0.3 * rng.randn(len(time_scales), n)
+    fields['GCM1'][:, :10] = np.nan
+    return fields
+
+
+def test_regression_statistics_match_numpy():
+    fields = get_fields()
+    x = np.stack([fields['GCM1'], fields['GCM2']])
+    y = np.broadcast_to(fields['AWAP'], x.shape)
+
+    statistics = evl.spatial_correlation.get_regression_statistics(x, y)
+
+    for i in range(2):
+        for j in range(len(time_scales)):
+            valid = np.isfinite(x[i, j])
+            slope, intercept = np.polyfit(x[i, j][valid], y[i, j][valid], 1)
+            assert statistics['n'][i, j] == valid.sum()
+            assert statistics['slope'][i, j] == pytest.approx(slope)
+            assert statistics['intercept'][i, j] == pytest.approx(intercept)
+            assert statistics['r'][i, j] == pytest.approx(np.corrcoef(x[i, j][valid], y[i, j][valid])[0, 1])
+
+
+def test_histograms_match_numpy():
+    fields = get_fields()
+    x = fields['GCM1']
+    y = fields['AWAP']
+
+    counts, edges = evl.spatial_correlation.get_histograms(x, y, bins=20)
+
+    for j in range(len(time_scales)):
+        valid = np.isfinite(x[j])
+        expected = np.histogram2d(y[j][valid], x[j][valid], bins=[edges[j], edges[j]])[0]
+        np.testing.assert_array_equal(counts[j], expected)
+
+
+def test_limits_without_valid_grid_cells():
+    x = np.array([[np.nan, np.nan], [1., 3.]])
+    y = np.array([[1., 2.], [2., np.nan]])
+
+    lo, hi = evl.spatial_correlation.get_limits(x, y)
+    np.testing.assert_array_equal(lo, [0., 1.])
+    np.testing.assert_array_equal(hi, [1., 2.])
+
+    lo, hi = evl.spatial_correlation.get_limits(np.zeros((2, 0)), np.zeros((2, 0)))
+    np.testing.assert_array_equal(hi - lo, [1., 1.])
+
+
+@pytest.mark.parametrize('kind', ['heatmap', 'hexbin'])
+def test_plot_without_valid_grid_cells(kind):
+    fields = get_fields()
+    fields['GCM2'][1] = np.nan
+
+    fig = evl.plotting.plot_spatial_correlation_density(fields, var='rain_day', statistic='mean', name_sim_prefix='GCM',
+                                                        name_ref='AWAP', time_scales=time_scales, kind=kind, bins=20)
+    assert len(fig.axes) == 4
+
+
+def test_mean_fields_of_different_grids(monkeypatch):
+    lat = np.arange(-40., -30.)
+    grids = dict(AWAP=lat, GCM_GCM1=lat[1:], GCM_GCM2=lat[1:], GCM_GCM3=lat[2:])
+
+    # the fields of each dataset are taken from grids instead of the files
+    def read_in_mean_field_for_one_gcm(name_sim=None, name_ref=None, **kwargs):
+        name = name_ref if name_sim is None else name_sim
+        return dict(annual={name: name})
+
+    def get_time_means(datasets, var, time_scales):
+        lat = grids[datasets['annual']]
+        return xr.DataArray(np.ones((len(time_scales), len(lat))), dims=('time_scale', 'lat'),
+                            coords=dict(time_scale=time_scales, lat=lat))
+
+    monkeypatch.setattr(evl.read_in, 'read_in_mean_field_for_one_gcm', read_in_mean_field_for_one_gcm)
+    monkeypatch.setattr(evl.read_in, 'get_time_means', get_time_means)
+    kwargs = dict(data_path_ref='', data_path_sim='', var='rain_day', name_sim_prefix='GCM', name_ref='AWAP',
+                  statistic='mean', year_start=1976, year_end=2005, time_scales=time_scales)
+
+    # the reference grid is reduced to the grid of the GCMs
+    fields = evl.spatial_correlation.get_mean_fields(gcms=['GCM1', 'GCM2'], **kwargs)
+    assert [x.shape for x in fields.values()] == [(2, 9)] * 3
+
+    # a GCM with a different grid than the first GCM
+    with pytest.raises(ValueError):
+        evl.spatial_correlation.get_mean_fields(gcms=['GCM1', 'GCM3'], **kwargs)
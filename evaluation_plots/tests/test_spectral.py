@@ -0,0 +1,144 @@
+# Tests of the spectral analysis of the Fourier diagrams and spectral bias maps (evaluation.spectral).
+
+import collections
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+import evaluation as evl
+
+
+# bands that cover all frequencies
+all_bands = collections.OrderedDict([('short', [None, 30]), ('medium', [30, 400]), ('long', [400, None])])
+
+
+def test_band_variances_add_up_to_the_variance():
+    rng = np.random.RandomState(0)
+    values = rng.randn(4, 3650) + np.sin(2 * np.pi * np.arange(3650) / 365.)[np.newaxis]
+
+    for n_days in [3650, 3651]:
+        band_power = evl.spectral.get_band_power(values[:, :n_days], all_bands)
+        np.testing.assert_allclose(band_power.sum(axis=0), values[:, :n_days].var(axis=1), rtol=1e-10)
+
+
+def test_sinusoid_is_in_the_band_of_its_period():
+    days = np.arange(3650)
+    values = np.array([3. * np.sin(2 * np.pi * days / 365.), np.cos(2 * np.pi * days / 10.),
+                       np.sin(2 * np.pi * days / 1825.)])
+
+    band_power = evl.spectral.get_band_power(values, evl.spectral.bands)
+
+    # sub-seasonal, annual cycle, interannual: the variance of a sinusoid is half of its squared amplitude
+    expected = np.array([[0., 0.5, 0.], [4.5, 0., 0.], [0., 0., 0.5]])
+    np.testing.assert_allclose(band_power, expected, atol=1e-10)
+
+
+def test_passes_of_latitudes():
+    land = np.array([[0, 0, 0], [1, 1, 0], [1, 1, 1], [0, 0, 0], [1, 0, 0], [1, 1, 1]], dtype=bool)
+
+    passes = evl.spectral.get_passes(land, 4)
+
+    assert passes == [slice(1, 2), slice(2, 3), slice(4, 6)]
+    assert evl.spectral.get_passes(land, 5) == [slice(1, 3), slice(4, 6)]
+    assert evl.spectral.get_passes(land, 1) == [slice(1, 2), slice(2, 3), slice(4, 5), slice(5, 6)]
+
+
+def test_band_power_fields_read_each_year_once_per_pass(monkeypatch):
+    rng = np.random.RandomState(1)
+    years = [2000, 2001, 2002]
+    lat = np.array([-30., -29., -28., -27.])
+    lon = np.array([140., 141., 142.])
+    times = pd.date_range('2000-01-01', '2002-12-31', freq='D')
+    annual_cycle = np.sin(2 * np.pi * np.arange(len(times)) / 365.)[:, None, None]
+    data = xr.DataArray(rng.randn(len(times), len(lat), len(lon)) + annual_cycle,
+                        dims=('time', 'lat', 'lon'), coords=dict(time=times, lat=lat, lon=lon))
+    data[:, 3, 2] = np.nan
+    land = xr.DataArray(np.array([[1, 1, 1], [0, 0, 0], [1, 0, 1], [1, 1, 1]], dtype=bool), dims=('lat', 'lon'),
+                        coords=dict(lat=lat, lon=lon))
+
+    reads = []
+    def iterate_daily_data(files, var_in_nc, years, unit_conversion=(1., 0.), lat_slice=None):
+        for year in years:
+            reads.append((year, lat_slice.start, lat_slice.stop))
+            yield year, data.sel(time=str(year)).isel(lat=lat_slice)
+    monkeypatch.setattr(evl.read_in, 'iterate_daily_data', iterate_daily_data)
+    monkeypatch.setattr(evl.spectral, 'get_daily_grid', lambda files, var_in_nc: (lat, lon))
+
+    # memory for 3 land cells per pass
+    max_memory = 2 * 4 * 366 * 3 * 3
+    ds = evl.spectral.get_band_power_fields('files', 'pr', 2000, 2002, bands=all_bands, mask=land,
+                                            max_memory=max_memory)
+
+    assert len(reads) == 3 * 3 and len(set(reads)) == len(reads)
+    values = data.values.reshape(len(times), -1)
+    expected = np.where(land.values.ravel(), values.var(axis=0), np.nan)
+    np.testing.assert_allclose(ds['band_power'].sum('band', skipna=False).values.ravel(), expected, rtol=1e-5)
+    assert np.isnan(ds['band_power'].values[:, 1]).all() and np.isnan(ds['band_power'].values[:, 3, 2]).all()
+    assert ds['band_power'].sel(band='medium').values[0, 0] > 10 * ds['band_power'].sel(band='long').values[0, 0]
+
+
+def get_sinusoids(n=730, gaps=True):
+    times = pd.date_range('2000-01-01', periods=n, freq='D')
+    t = np.arange(n)
+    awap = 3. * np.sin(2 * np.pi * t / 365.) + 1. * np.cos(2 * np.pi * t / 10.) + 5.
+    gcm = 2. * np.sin(2 * np.pi * t / 73.) + 2.
+    if gaps:
+        gcm[100:130] = np.nan
+        gcm[500] = np.nan
+    return pd.DataFrame(dict(type=np.repeat(['AWAP', 'GCM1'], n), time=np.tile(times, 2),
+                             pr=np.concatenate([awap, gcm])))
+
+
+def test_amplitudes_match_numpy_fft():
+    dataframe = get_sinusoids()
+    values = dataframe['pr'].values.reshape(2, -1)
+
+    amplitudes = evl.spectral.get_amplitudes(values)
+
+    for i in range(2):
+        x = values[i] - np.nanmean(values[i])
+        expected = np.abs(np.fft.rfft(np.where(np.isfinite(x), x, 0.)))
+        np.testing.assert_allclose(amplitudes[i], expected, atol=1e-8)
+
+
+def test_spectra_of_sinusoids():
+    n = 730
+    dataframe = get_sinusoids(n, gaps=False)
+
+    spectra = evl.spectral.get_spectra(dataframe, 'pr')['spectra']
+
+    awap = spectra.loc[spectra['type'] == 'AWAP'].reset_index(drop=True)
+    peak = awap.loc[awap['amplitude'].idxmax()]
+    assert peak['wavelength'] == pytest.approx(365.)
+    assert peak['frequency'] == pytest.approx(1.)
+    # amplitude of a sinusoid with a whole number of periods: n / 2 times its amplitude
+    assert peak['amplitude'] == pytest.approx(3. * n / 2)
+    gcm = spectra.loc[spectra['type'] == 'GCM1'].reset_index(drop=True)
+    assert gcm.loc[gcm['amplitude'].idxmax(), 'wavelength'] == pytest.approx(73.)
+
+    top = evl.spectral.get_top_peaks(awap['amplitude'].values, 2)
+    np.testing.assert_allclose(awap['wavelength'].values[top], [365., 10.])
+    assert awap['amplitude'].values[top[1]] == pytest.approx(1. * n / 2)
+
+
+def test_spectra_with_gaps():
+    dataframe = get_sinusoids()
+
+    spectra = evl.spectral.get_spectra(dataframe, 'pr')['spectra']
+
+    gcm = spectra.loc[spectra['type'] == 'GCM1'].reset_index(drop=True)
+    assert np.isfinite(gcm['amplitude']).all()
+    top = evl.spectral.get_top_peaks(gcm['amplitude'].values, 3)
+    assert gcm['wavelength'].values[top[0]] == pytest.approx(73.)
+    # the gaps (31 of 730 days) take a share of the amplitude of the sinusoid
+    assert 0.9 * 2. * 730 / 2 < gcm['amplitude'].values[top[0]] < 2. * 730 / 2
+
+
+def test_top_peaks_are_sorted_and_ignore_nan():
+    amplitudes = np.array([1., np.nan, 5., 3., np.nan, 4., 0.5])
+
+    np.testing.assert_array_equal(evl.spectral.get_top_peaks(amplitudes, 3), [2, 5, 3])
+    np.testing.assert_array_equal(evl.spectral.get_top_peaks(amplitudes, 10), [2, 5, 3, 0, 6])
+    assert len(evl.spectral.get_top_peaks(np.full(4, np.nan), 2)) == 0
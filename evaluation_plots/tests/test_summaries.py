@@ -0,0 +1,117 @@
+# Tests of the summary statistics of the box plots and climatology plots (evaluation.summaries).
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import evaluation as evl
+
+
+def get_values(seed=0):
+    rng = np.random.RandomState(seed)
+    values = np.full((4, 300), np.nan)
+    values[0] = rng.randn(300)
+    values[1, :120] = rng.standard_t(2, 120)
+    values[2, :1] = 3.
+    return values # the last row has no values
+
+
+def test_box_statistics_match_matplotlib():
+    from matplotlib import cbook
+    values = get_values()
+
+    statistics = evl.summaries.get_box_statistics(values, max_fliers=1000)
+
+    for i in range(3):
+        expected = cbook.boxplot_stats(values[i][np.isfinite(values[i])], whis=1.5)[0]
+        assert statistics['n'][i] == np.isfinite(values[i]).sum()
+        for key in ['whislo', 'q1', 'med', 'q3', 'whishi']:
+            assert statistics[key][i] == pytest.approx(expected[key])
+        np.testing.assert_allclose(np.sort(statistics['fliers'][i]), np.sort(expected['fliers']))
+
+    assert statistics['n'][3] == 0
+    assert np.isnan([statistics[key][3] for key in ['whislo', 'q1', 'med', 'q3', 'whishi']]).all()
+    assert len(statistics['fliers'][3]) == 0
+
+
+def test_box_statistics_keep_the_most_extreme_fliers():
+    values = get_values()[1:2]
+
+    all_fliers = evl.summaries.get_box_statistics(values, max_fliers=1000)['fliers'][0]
+    fliers = evl.summaries.get_box_statistics(values, max_fliers=5)['fliers'][0]
+
+    assert len(all_fliers) > 5 and len(fliers) == 5
+    assert fliers.min() == all_fliers.min() and fliers.max() == all_fliers.max()
+
+
+def test_box_statistics_table_of_a_long_data_frame():
+    values = get_values()
+    df = pd.DataFrame(dict(value=values[:3].ravel(), type=np.repeat(['AWAP', 'GCM1', 'GCM2'], values.shape[1])))
+
+    table = evl.summaries.get_box_statistics_table(df, 'value', ['type'])
+
+    assert list(table['type']) == ['AWAP', 'GCM1', 'GCM2']
+    for name, group in df.dropna().groupby('type'):
+        row = table.loc[table['type'] == name].iloc[0]
+        assert row['n'] == len(group)
+        assert row['med'] == pytest.approx(group['value'].median())
+        assert row['q1'] == pytest.approx(group['value'].quantile(0.25))
+
+
+def get_climatology_data(seed=0):
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame(dict(month=np.tile(np.arange(1, 13), 30 * 2),
+                           type=np.repeat(['AWAP', 'GCM1'], 12 * 30)))
+    df['value'] = 10 + 5 * np.sin(df['month'] / 2.) + rng.randn(len(df))
+    df.loc[::7, 'value'] = np.nan
+    return df
+
+
+@pytest.mark.parametrize('band', ['ci', 'sd', 'pi'])
+def test_climatology_summary_matches_pandas(band):
+    scipy_stats = pytest.importorskip('scipy.stats')
+    df = get_climatology_data()
+
+    summary = evl.summaries.get_climatology_summary(df, 'month', 'value', ['type'], band=band, level=0.9)
+
+    grouped = df.dropna().groupby(['type', 'month'])['value']
+    expected = pd.DataFrame(dict(n=grouped.count(), mean=grouped.mean(), std=grouped.std(),
+                                 q_lo=grouped.quantile(0.05), q_hi=grouped.quantile(0.95))).reset_index()
+    summary = summary.merge(expected, on=['type', 'month'])
+    assert len(summary) == 24
+
+    np.testing.assert_array_equal(summary['n_x'], summary['n_y'])
+    np.testing.assert_allclose(summary['value'], summary['mean'])
+    np.testing.assert_allclose(summary['std_x'], summary['std_y'])
+    if band == 'ci':
+        half_width = scipy_stats.norm.ppf(0.95) * summary['std_y'] / np.sqrt(summary['n_y'])
+        np.testing.assert_allclose(summary['upper'], summary['mean'] + half_width)
+        np.testing.assert_allclose(summary['lower'], summary['mean'] - half_width)
+    elif band == 'sd':
+        np.testing.assert_allclose(summary['upper'] - summary['lower'], 2 * summary['std_y'])
+    else:
+        np.testing.assert_allclose(summary['lower'], summary['q_lo'])
+        np.testing.assert_allclose(summary['upper'], summary['q_hi'])
+
+
+def test_bootstrap_interval_of_the_mean():
+    values = np.random.RandomState(0).randn(2, 400)
+    values[1, 200:] = np.nan
+
+    lower, upper = evl.summaries.get_bootstrap_interval(values, level=0.95, n_boot=2000)
+
+    # close to the normal approximation of the confidence interval of the mean
+    for i, n in enumerate([400, 200]):
+        mean = np.nanmean(values[i])
+        half_width = 1.96 * np.nanstd(values[i], ddof=1) / np.sqrt(n)
+        assert lower[i] == pytest.approx(mean - half_width, abs=0.2 * half_width)
+        assert upper[i] == pytest.approx(mean + half_width, abs=0.2 * half_width)
+
+    # the same interval in every run
+    assert np.array_equal(evl.summaries.get_bootstrap_interval(values, n_boot=2000)[0], lower)
+
+
+def test_normal_quantile():
+    scipy_stats = pytest.importorskip('scipy.stats')
+    for probability in [0.5, 0.9, 0.975, 0.995]:
+        assert evl.summaries.get_normal_quantile(probability) == pytest.approx(scipy_stats.norm.ppf(probability))
@@ -0,0 +1,75 @@
+# Tests of Sen's slope and the Mann-Kendall test (evaluation.trends).
+
+import math
+
+import numpy as np
+import pytest
+
+import evaluation as evl
+
+
+def get_mann_kendall_p_value(x):
+    # reference: loops over all pairs, variance corrected for each group of ties, continuity correction
+    n = len(x)
+    s = sum(np.sign(x[j] - x[i]) for i in range(n) for j in range(i + 1, n))
+    counts = np.unique(x, return_counts=True)[1]
+    variance = (n * (n - 1) * (2 * n + 5) - sum(t * (t - 1) * (2 * t + 5) for t in counts)) / 18.
+    z = (s - np.sign(s)) / math.sqrt(variance) if variance > 0 else 0.
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def get_values(seed=0):
+    rng = np.random.RandomState(seed)
+    times = np.arange(1980, 2010)
+    values = rng.randn(30, 6) + 0.05 * (times - 1980)[:, np.newaxis] * np.arange(6)
+    values[:, 4] = np.round(values[:, 4]) # ties
+    values[:, 5] = 1. # constant
+    values[7, 3] = np.nan
+    return values, times
+
+
+def test_sen_slope_matches_scipy():
+    stats = pytest.importorskip('scipy.stats')
+    values, times = get_values()
+
+    slopes, p_values = evl.trends.get_trends(values, times)
+
+    for k in [0, 1, 2, 4, 5]:
+        assert slopes[k] == pytest.approx(stats.theilslopes(values[:, k], times)[0])
+    assert np.isnan(slopes[3]) and np.isnan(p_values[3])
+
+
+def test_mann_kendall_p_values_with_ties():
+    values, times = get_values()
+
+    slopes, p_values = evl.trends.get_trends(values, times)
+
+    for k in [0, 1, 2, 4, 5]:
+        assert p_values[k] == pytest.approx(get_mann_kendall_p_value(values[:, k]))
+    assert p_values[5] == 1.
+    assert p_values[2] < 0.01
+
+
+def test_mann_kendall_without_ties_close_to_scipy():
+    stats = pytest.importorskip('scipy.stats')
+    values, times = get_values(1)
+
+    slopes, p_values = evl.trends.get_trends(values[:, :3], times)
+
+    # scipy has no continuity correction
+    for k in range(3):
+        expected = stats.kendalltau(times, values[:, k], method='asymptotic').pvalue
+        assert p_values[k] == pytest.approx(expected, abs=0.02)
+
+
+def test_trends_do_not_depend_on_the_tiling():
+    rng = np.random.RandomState(3)
+    values = rng.randn(12, 50)
+    times = np.arange(12.)
+
+    expected = evl.trends.get_trends(values, times)
+    tiled = evl.trends.get_trends(values, times, max_memory=8 * (3 * 66 + 24) * 7)
+
+    assert evl.trends.get_tile_size(12, 8 * (3 * 66 + 24) * 7) == 7
+    np.testing.assert_array_equal(expected[0], tiled[0])
+    np.testing.assert_array_equal(expected[1], tiled[1])